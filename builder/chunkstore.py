@@ -0,0 +1,144 @@
+"""Content-defined chunk store shared by every published version.
+
+With --asset-store chunks, publish splits each initrd image into chunks and
+writes every chunk once, as chunks/<aa>/<sha256> under the output root. The
+version's manifest lists the chunks in order instead of a file being copied
+into place, and the server reassembles the stream when the initrd is
+downloaded.
+
+Chunks are cut where the content says so, not at fixed offsets. Builds that
+differ only in the answer URL or certificate fingerprint have a few bytes
+changed and the data after them shifted; the cut points fall back into
+step within a chunk or two, so every other chunk is shared between the
+versions, on disk and in the server's page cache.
+
+A cut candidate is any ANCHOR byte at least MIN_CHUNK into the chunk. It
+is a cut if the CRC32 of the WINDOW bytes before it has its low MASK bits
+clear. bytes.find() keeps the scan near C speed, a few seconds per GB,
+where a per-byte rolling hash in Python would take minutes. A chunk never
+exceeds MAX_CHUNK, which also bounds runs of zeros with no anchor in them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+logger = logging.getLogger("pxe-pilot-builder")
+
+CHUNK_DIR = "chunks"
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+WINDOW = 48
+ANCHOR = b"\x9d"
+# Candidates come every 256 bytes of random data; 1 in 4096 cuts, about 1 MiB past MIN_CHUNK
+MASK = (1 << 12) - 1
+READ_SIZE = 16 * 1024 * 1024
+# When each unreferenced chunk was first found unreferenced, for collect's grace period
+UNREFERENCED = ".unreferenced.json"
+
+
+def find_cut(buf: bytes, start: int, end: int) -> int:
+    """End of the chunk starting at start; end if no cut point comes first."""
+    i = buf.find(ANCHOR, start + MIN_CHUNK, end)
+    while i != -1:
+        if zlib.crc32(buf[i - WINDOW : i]) & MASK == 0:
+            return i
+        i = buf.find(ANCHOR, i + 1, end)
+    return end
+
+
+def split(src: BinaryIO) -> Iterator[bytes]:
+    """Chunks of src in order. Cut points do not depend on how reads fall."""
+    buf, pos, eof = b"", 0, False
+    while True:
+        if not eof and len(buf) - pos < MAX_CHUNK:
+            block = src.read(READ_SIZE)
+            if block:
+                buf = buf[pos:] + block
+                pos = 0
+                continue
+            eof = True
+        if pos >= len(buf):
+            return
+        cut = find_cut(buf, pos, min(len(buf), pos + MAX_CHUNK))
+        yield buf[pos:cut]
+        pos = cut
+
+
+def chunk_path(store: Path, sha256: str) -> Path:
+    return store / sha256[:2] / sha256
+
+
+def store_file(src: Path, store: Path) -> dict:
+    """Split src into the store. Returns its size, sha256 and (sha256, size) per chunk.
+
+    Chunks already in the store are not written again.
+    """
+    digest = hashlib.sha256()
+    chunks = []
+    written = 0
+    with open(src, "rb") as f:
+        for chunk in split(f):
+            digest.update(chunk)
+            sha = hashlib.sha256(chunk).hexdigest()
+            chunks.append([sha, len(chunk)])
+            path = chunk_path(store, sha)
+            if path.exists():
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Builds run in threads and may hold the same new chunk
+            tmp = path.with_name(f".{sha}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(chunk)
+            os.replace(tmp, path)
+            written += len(chunk)
+    size = sum(length for _, length in chunks)
+    logger.info(
+        "%s: %d chunks, %.1f of %.1f MiB new to the store",
+        src.name,
+        len(chunks),
+        written / (1 << 20),
+        size / (1 << 20),
+    )
+    return {"size": size, "sha256": digest.hexdigest(), "store": chunks}
+
+
+def collect(store: Path, referenced: set[str], grace: float = 0) -> tuple[int, int]:
+    """Delete chunks no manifest references. Returns (chunks, bytes) removed.
+
+    A chunk is only deleted once it has gone unreferenced for grace seconds,
+    so a client still downloading the version that used it can finish. Only
+    safe while no build is publishing into the store.
+    """
+    removed = freed = 0
+    if not store.is_dir():
+        return removed, freed
+    record = store / UNREFERENCED
+    try:
+        seen = json.loads(record.read_text())
+    except (OSError, ValueError):
+        seen = {}
+    now = time.time()
+    pending = {}
+    for path in store.glob("*/*"):
+        if path.name in referenced or not path.is_file():
+            continue
+        since = seen.get(path.name, now)
+        if now - since < grace:
+            pending[path.name] = since
+            continue
+        freed += path.stat().st_size
+        path.unlink()
+        removed += 1
+    if pending:
+        record.write_text(json.dumps(pending, sort_keys=True))
+        logger.info("Keeping %d unused chunks for the grace period", len(pending))
+    else:
+        record.unlink(missing_ok=True)
+    return removed, freed
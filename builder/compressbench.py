@@ -0,0 +1,392 @@
+"""Compression-profile benchmark: which zstd settings boot a fleet fastest.
+
+A higher zstd level makes a smaller initrd, which is quicker to send, but
+every node still has to decompress it on one core before the installer
+starts, and the build takes far longer. This repacks one uncompressed cpio
+at every combination of level, long-distance matching window and thread
+count, and records:
+
+    build_seconds       wall time of the compression, as the repack stage runs it
+    size                compressed size
+    decompress_mbps     single-core decompression speed, in MiB/s of cpio
+    fleet_boot_seconds  estimated time until the last node has unpacked it
+
+The estimate sends the initrd to --nodes machines at once over a
+--link-mbps server uplink, each node capped at --client-mbps, and then adds
+one node's decompression time. The recommended profile is the one with the
+lowest estimate; profiles within --tolerance of it are considered equal and
+the quickest to build wins.
+
+Runs offline: without --initrd it generates a synthetic cpio that mixes
+text, binaries, duplicated files and incompressible squashfs-like data in
+proportions similar to a repacked Proxmox initrd.
+
+    python3 compressbench.py --size 256 --link-mbps 10000 --nodes 32
+    python3 compressbench.py --initrd /output/proxmox-ve/9.1-1/initrd --output bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from initrd import Entry, write_trailer
+
+logger = logging.getLogger("pxe-pilot-builder")
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+MIB = 1 << 20
+# Share of the synthetic archive taken by each kind of content. A Proxmox
+# initrd is dominated by the embedded ISO's squashfs, which zstd cannot shrink.
+MIX = {"text": 0.08, "binary": 0.14, "duplicate": 0.04, "squashfs": 0.74}
+WORDS = [
+    b"the", b"module", b"kernel", b"config", b"install", b"proxmox", b"network",
+    b"device", b"firmware", b"return", b"if", b"then", b"else", b"fi", b"echo",
+    b"export", b"path", b"usr", b"lib", b"bin", b"share", b"sbin", b"etc", b"local",
+    b"error", b"value", b"name", b"version", b"default", b"0", b"1", b"=",
+]  # fmt: skip
+# Zipf-like: the first words are by far the most common, as in real scripts
+_CUM_WEIGHTS = [sum(1 / (i + 1) for i in range(n + 1)) for n in range(len(WORDS))]
+
+
+@dataclass
+class Profile:
+    level: int
+    long: int
+    threads: int
+
+    @property
+    def flags(self) -> list[str]:
+        """zstd command-line options for this profile."""
+        flags = [f"-{self.level}", f"-T{self.threads}"]
+        if self.long:
+            flags.append(f"--long={self.long}")
+        return flags
+
+
+@dataclass
+class Result:
+    level: int
+    long: int
+    threads: int
+    build_seconds: float
+    size: int
+    ratio: float
+    decompress_mbps: float
+    transfer_seconds: float
+    decompress_seconds: float
+    fleet_boot_seconds: float
+
+
+@dataclass
+class Fleet:
+    """Nodes booting at once, and the links between them and the server."""
+
+    nodes: int = 16
+    link_mbps: float = 10_000
+    client_mbps: float = 1_000
+
+    def transfer_seconds(self, size: int) -> float:
+        """Time for every node to receive size bytes."""
+        shared = self.nodes * size * 8 / (self.link_mbps * 1e6)
+        per_client = size * 8 / (self.client_mbps * 1e6)
+        return max(shared, per_client)
+
+
+def _text(rng: random.Random, size: int) -> bytes:
+    picks = rng.choices(range(len(WORDS)), cum_weights=_CUM_WEIGHTS, k=size // 5 + 1)
+    line = b" ".join(map(WORDS.__getitem__, picks)).replace(b"= ", b"=\n")
+    return line[:size]
+
+
+def _binary(rng: random.Random, size: int) -> bytes:
+    # Low-entropy bytes with repeated runs: compresses about 2:1, like ELF and .ko files
+    alphabet = bytes(rng.randrange(256) for _ in range(48))
+    table = bytes(alphabet[b % len(alphabet)] if b < 192 else 0 for b in range(256))
+    data = bytearray(rng.randbytes(size).translate(table))
+    for _ in range(size // 4096):
+        start = rng.randrange(size)
+        length = rng.randrange(16, 256)
+        source = rng.randrange(max(1, start - 65536), start + 1)
+        data[start : start + length] = data[source : source + length]
+    return bytes(data[:size])
+
+
+def _write_entry(dst: BinaryIO, ino: int, name: str, data: bytes) -> None:
+    entry = Entry(name=name, ino=ino, mode=0o100644, filesize=len(data))
+    dst.write(entry.encode())
+    dst.write(data)
+    dst.write(b"\0" * (-len(data) % 4))
+
+
+def synthetic_cpio(out_file: Path, size: int, seed: int = 0) -> int:
+    """Write a newc archive of about size bytes standing in for a repacked initrd.
+
+    Files come in the order the repack produces them: the stock initrd's
+    scripts and modules, copies of some of those modules further on (which
+    only long-distance matching finds), and the ISO last. Returns the entry
+    count.
+    """
+    rng = random.Random(seed)
+    entries = []
+    budget = {kind: int(size * share) for kind, share in MIX.items()}
+    with open(out_file, "wb") as out:
+        written = 0
+        while written < budget["text"]:
+            data = _text(rng, min(rng.randrange(4096, 65536), budget["text"] - written))
+            entries.append((f"usr/share/pve/{len(entries)}.conf", data))
+            _write_entry(out, len(entries), entries[-1][0], data)
+            written += len(data)
+        modules = []
+        written = 0
+        while written < budget["binary"]:
+            data = _binary(rng, min(rng.randrange(65536, 4 * MIB), budget["binary"] - written))
+            modules.append(data)
+            entries.append((f"lib/modules/drivers/{len(entries)}.ko", data))
+            _write_entry(out, len(entries), entries[-1][0], data)
+            written += len(data)
+        written = 0
+        for data in modules:
+            if written >= budget["duplicate"]:
+                break
+            data = data[: budget["duplicate"] - written]
+            entries.append((f"lib/firmware/{len(entries)}.bin", data))
+            _write_entry(out, len(entries), entries[-1][0], data)
+            written += len(data)
+        iso = budget["squashfs"]
+        entry = Entry(name="proxmox.iso", ino=len(entries) + 1, mode=0o100644, filesize=iso)
+        out.write(entry.encode())
+        for offset in range(0, iso, 8 * MIB):
+            out.write(rng.randbytes(min(8 * MIB, iso - offset)))
+        out.write(b"\0" * (-iso % 4))
+        write_trailer(out)
+    return len(entries) + 2
+
+
+def uncompressed_cpio(initrd: Path, out_file: Path) -> None:
+    """Copy initrd to out_file, decompressing it if it is zstd-compressed."""
+    with open(initrd, "rb") as f:
+        compressed = f.read(4) == ZSTD_MAGIC
+    if not compressed:
+        shutil.copyfile(initrd, out_file)
+        return
+    with open(out_file, "wb") as out:
+        subprocess.run(["zstd", "-dcq", str(initrd)], stdout=out, check=True)
+
+
+def _single_core() -> None:
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+
+def compress(src: Path, out_file: Path, profile: Profile) -> float:
+    """Compress src to out_file with profile's settings; returns the wall time."""
+    start = time.perf_counter()
+    with open(src, "rb") as f, open(out_file, "wb") as out:
+        subprocess.run(["zstd", "-q", *profile.flags], stdin=f, stdout=out, check=True)
+    return time.perf_counter() - start
+
+
+def decompress(path: Path, long: int) -> float:
+    """Decompress path on one core, discarding the output; returns the wall time."""
+    # Windows past 128 MiB need the decompressor's permission, as they do in the kernel
+    args = ["zstd", "-dcq", *([f"--long={long}"] if long else []), str(path)]
+    start = time.perf_counter()
+    subprocess.run(args, stdout=subprocess.DEVNULL, check=True, preexec_fn=_single_core)
+    return time.perf_counter() - start
+
+
+def run_matrix(
+    src: Path, workdir: Path, profiles: list[Profile], fleet: Fleet, repeat: int = 1
+) -> list[Result]:
+    """Benchmark every profile against the uncompressed cpio src."""
+    raw = src.stat().st_size
+    results = []
+    out = workdir / "initrd.zst"
+    for profile in profiles:
+        build = min(compress(src, out, profile) for _ in range(repeat))
+        size = out.stat().st_size
+        unpack = max(min(decompress(out, profile.long) for _ in range(repeat)), 1e-6)
+        transfer = fleet.transfer_seconds(size)
+        result = Result(
+            **asdict(profile),
+            build_seconds=round(build, 3),
+            size=size,
+            ratio=round(raw / size, 3),
+            decompress_mbps=round(raw / MIB / unpack, 1),
+            transfer_seconds=round(transfer, 3),
+            decompress_seconds=round(unpack, 3),
+            fleet_boot_seconds=round(transfer + unpack, 3),
+        )
+        results.append(result)
+        logger.info(
+            "level %2d long %2s threads %2d: %7.2fs build, %8.1f MiB (%.3fx), "
+            "%7.1f MiB/s unpack, %7.2fs fleet boot",
+            profile.level,
+            profile.long or "-",
+            profile.threads,
+            build,
+            size / MIB,
+            raw / size,
+            result.decompress_mbps,
+            result.fleet_boot_seconds,
+        )
+    out.unlink(missing_ok=True)
+    return results
+
+
+def recommend(results: list[Result], tolerance: float = 0.01) -> Result:
+    """Fastest fleet boot; within tolerance of it, the quickest build."""
+    best = min(r.fleet_boot_seconds for r in results)
+    close = [r for r in results if r.fleet_boot_seconds <= best * (1 + tolerance)]
+    return min(close, key=lambda r: (r.build_seconds, r.fleet_boot_seconds))
+
+
+def _ints(text: str) -> list[int]:
+    try:
+        return sorted({int(v) for v in text.split(",") if v.strip()})
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected comma-separated integers, got {text!r}"
+        ) from None
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(
+        prog="pxe-pilot-builder benchmark",
+        description="Find the zstd profile that boots a fleet fastest.",
+    )
+    parser.add_argument(
+        "--initrd",
+        type=Path,
+        help="initrd to repack, zstd-compressed or plain cpio (default: synthetic)",
+    )
+    parser.add_argument(
+        "--size", type=int, default=256, metavar="MIB", help="synthetic cpio size (default: 256)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="synthetic cpio seed (default: 0)")
+    parser.add_argument(
+        "--levels", type=_ints, default=[3, 9, 15, 19], help="zstd levels (default: 3,9,15,19)"
+    )
+    parser.add_argument(
+        "--long",
+        type=_ints,
+        default=[0, 27],
+        help="long-distance matching window logs, 0 for off (default: 0,27)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=_ints,
+        default=sorted({1, cpus}),
+        help=f"zstd thread counts (default: 1,{cpus})",
+    )
+    parser.add_argument("--nodes", type=int, default=16, help="nodes booting at once (default: 16)")
+    parser.add_argument(
+        "--link-mbps",
+        type=float,
+        default=10_000,
+        help="server uplink in Mbit/s (default: 10000)",
+    )
+    parser.add_argument(
+        "--client-mbps",
+        type=float,
+        default=1_000,
+        help="per-node link in Mbit/s (default: 1000)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.0,
+        metavar="PERCENT",
+        help="fleet boot times this close to the best count as equal (default: 1)",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="runs per profile, best kept")
+    parser.add_argument("--workdir", type=Path, help="scratch directory (default: a temp dir)")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    if any(not 1 <= level <= 19 for level in args.levels):
+        parser.error("--levels must be between 1 and 19")
+    if any(w and not 10 <= w <= 31 for w in args.long):
+        parser.error("--long window logs must be 0 or between 10 and 31")
+    if any(t < 1 for t in args.threads) or args.nodes < 1 or args.repeat < 1:
+        parser.error("--threads, --nodes and --repeat must be at least 1")
+    if args.link_mbps <= 0 or args.client_mbps <= 0:
+        parser.error("--link-mbps and --client-mbps must be positive")
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="==> %(message)s", stream=sys.stderr)
+    args = parse_args(argv)
+    if shutil.which("zstd") is None:
+        logger.error("zstd is not installed")
+        return 1
+
+    fleet = Fleet(args.nodes, args.link_mbps, args.client_mbps)
+    profiles = [
+        Profile(level, long, threads)
+        for level in args.levels
+        for long in args.long
+        for threads in args.threads
+    ]
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        src = Path(tmp) / "initrd.cpio"
+        if args.initrd:
+            logger.info("Decompressing %s", args.initrd)
+            try:
+                uncompressed_cpio(args.initrd, src)
+            except (OSError, subprocess.CalledProcessError) as exc:
+                logger.error("Cannot read %s: %s", args.initrd, exc)
+                return 1
+        else:
+            count = synthetic_cpio(src, args.size * MIB, args.seed)
+            logger.info("Generated a %d MiB synthetic cpio (%d entries)", args.size, count)
+        logger.info(
+            "%d profiles, %d nodes on %g Mbit/s (%g Mbit/s each)",
+            len(profiles),
+            fleet.nodes,
+            fleet.link_mbps,
+            fleet.client_mbps,
+        )
+        results = run_matrix(src, Path(tmp), profiles, fleet, args.repeat)
+        raw = src.stat().st_size
+
+    best = recommend(results, args.tolerance / 100)
+    flags = f"--zstd-level {best.level}" + (f" --zstd-long {best.long}" if best.long else "")
+    logger.info(
+        "Recommended: %s (%.2fs fleet boot, %.2fs build at %d threads, %.1f MiB)",
+        flags,
+        best.fleet_boot_seconds,
+        best.build_seconds,
+        best.threads,
+        best.size / MIB,
+    )
+    if args.output:
+        report = {
+            "input": {
+                "initrd": str(args.initrd) if args.initrd else None,
+                "synthetic": args.initrd is None,
+                "size": raw,
+            },
+            "fleet": asdict(fleet),
+            "results": [asdict(r) for r in results],
+            "recommended": {**asdict(best), "flags": flags},
+        }
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        logger.info("Results written to %s", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Streaming initrd repack.
+
+The stock initrd is a zstd-compressed newc cpio archive. Rather than
+unpacking it to disk and copying the ISO into the tree, the repack reads
+the decompressed archive entry by entry, passes every entry straight
+through, appends the prepared ISO as /proxmox.iso in a second archive, and
+pipes the result into a multithreaded zstd. The kernel unpacks
+concatenated archives in order, so the result is equivalent to repacking
+the tree, with no scratch space beyond the output file.
+
+The fast-rebuild alternative skips recompression entirely: the stock
+initrd ships unchanged and the ISO goes in a separate uncompressed segment
+(ISO_SEGMENT) that iPXE loads as a second initrd.
+"""
+
+import os
+import shutil
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+MAGIC = b"070701"
+HEADER_SIZE = 110
+TRAILER = "TRAILER!!!"
+MAX_FILE_SIZE = 0xFFFFFFFF  # newc sizes are 8 hex digits
+CHUNK_SIZE = 1024 * 1024
+
+# Published next to the stock initrd in segments mode; the server menu loads it second
+ISO_SEGMENT = "iso.cpio"
+
+FIELDS = (
+    "ino", "mode", "uid", "gid", "nlink", "mtime", "filesize",
+    "devmajor", "devminor", "rdevmajor", "rdevminor", "namesize", "check",
+)  # fmt: skip
+
+
+class CpioError(ValueError):
+    """The input is not a well-formed newc archive."""
+
+
+@dataclass
+class Entry:
+    """A newc header. Field values are the decoded integers."""
+
+    name: str
+    ino: int = 0
+    mode: int = 0
+    uid: int = 0
+    gid: int = 0
+    nlink: int = 1
+    mtime: int = 0
+    filesize: int = 0
+    devmajor: int = 0
+    devminor: int = 0
+    rdevmajor: int = 0
+    rdevminor: int = 0
+    check: int = 0
+
+    def encode(self) -> bytes:
+        name = self.name.encode(errors="surrogateescape") + b"\0"
+        if self.filesize > MAX_FILE_SIZE:
+            raise CpioError(f"{self.name} is too large for a newc archive")
+        values = [len(name) if f == "namesize" else getattr(self, f) for f in FIELDS]
+        header = MAGIC + b"".join(b"%08X" % v for v in values)
+        return header + name + _padding(HEADER_SIZE + len(name))
+
+
+def _padding(length: int) -> bytes:
+    return b"\0" * (-length % 4)
+
+
+def _read_exact(src: BinaryIO, size: int) -> bytes:
+    data = src.read(size)
+    if len(data) != size:
+        raise CpioError("truncated archive")
+    return data
+
+
+def _read_magic(src: BinaryIO) -> bytes | None:
+    """Read the next header's magic, skipping zero padding between archives."""
+    while True:
+        word = src.read(2)
+        if not word:
+            return None
+        if word != b"\0\0":
+            break
+    magic = word + _read_exact(src, 4)
+    if magic != MAGIC:
+        raise CpioError(f"bad magic {magic!r}, only newc archives are supported")
+    return magic
+
+
+def read_header(src: BinaryIO) -> Entry | None:
+    """Read one header and its name; None at end of input."""
+    if _read_magic(src) is None:
+        return None
+    raw = _read_exact(src, HEADER_SIZE - len(MAGIC))
+    try:
+        values = {f: int(raw[i * 8 : i * 8 + 8], 16) for i, f in enumerate(FIELDS)}
+    except ValueError as exc:
+        raise CpioError("malformed header") from exc
+    namesize = values.pop("namesize")
+    name = _read_exact(src, namesize)
+    _read_exact(src, len(_padding(HEADER_SIZE + namesize)))
+    return Entry(name=name.rstrip(b"\0").decode(errors="surrogateescape"), **values)
+
+
+def _copy(src: BinaryIO, dst: BinaryIO, size: int) -> None:
+    while size:
+        chunk = src.read(min(size, CHUNK_SIZE))
+        if not chunk:
+            raise CpioError("truncated archive")
+        dst.write(chunk)
+        size -= len(chunk)
+
+
+def copy_archive(src: BinaryIO, dst: BinaryIO) -> int:
+    """Copy newc archives from src to dst entry by entry, trailers included.
+
+    Data is streamed in chunks, never held in memory whole. Zero padding
+    between concatenated archives is dropped. Returns the entry count.
+    """
+    count = 0
+    while (entry := read_header(src)) is not None:
+        dst.write(entry.encode())
+        _copy(src, dst, entry.filesize)
+        padding = _padding(entry.filesize)
+        _read_exact(src, len(padding))
+        dst.write(padding)
+        count += 1
+    return count
+
+
+def append_file(dst: BinaryIO, name: str, path: Path) -> None:
+    """Write path as a regular file entry named name, streamed from disk."""
+    st = os.stat(path)
+    entry = Entry(name=name, mode=0o100644, mtime=int(st.st_mtime), filesize=st.st_size, ino=1)
+    dst.write(entry.encode())
+    with open(path, "rb") as f:
+        shutil.copyfileobj(f, dst, CHUNK_SIZE)
+    dst.write(_padding(st.st_size))
+
+
+def write_trailer(dst: BinaryIO) -> None:
+    dst.write(Entry(name=TRAILER, nlink=1).encode())
+
+
+def write_segment(iso: Path, out_file: Path) -> None:
+    """Write an uncompressed archive holding only iso, as /proxmox.iso.
+
+    The ISO is mostly squashfs already, so compressing it again buys little.
+    """
+    with open(out_file, "wb") as out:
+        append_file(out, "proxmox.iso", iso)
+        write_trailer(out)
+
+
+def repack(initrd: Path, iso: Path, out_file: Path, level: int, threads: int, long: int = 0) -> int:
+    """Stream initrd plus iso (as /proxmox.iso) into a zstd-compressed out_file.
+
+    long is the long-distance matching window log, 0 for off. Returns the
+    number of entries passed through from the stock initrd.
+    """
+    flags = [f"-{level}", f"-T{threads}", *([f"--long={long}"] if long else [])]
+    with open(out_file, "wb") as out:
+        decompress = subprocess.Popen(["zstd", "-dcq", str(initrd)], stdout=subprocess.PIPE)
+        compress = subprocess.Popen(["zstd", "-q", *flags], stdin=subprocess.PIPE, stdout=out)
+        try:
+            count = copy_archive(decompress.stdout, compress.stdin)
+            if not count:
+                raise CpioError(f"{initrd} contains no cpio entries")
+            append_file(compress.stdin, "proxmox.iso", iso)
+            write_trailer(compress.stdin)
+        finally:
+            compress.stdin.close()
+            decompress.stdout.close()
+            compress.wait()
+            decompress.wait()
+
+    for proc in (decompress, compress):
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    return count
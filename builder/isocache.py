@@ -0,0 +1,314 @@
+"""Local ISO mirror: parallel ranged downloads into a content-addressed cache.
+
+ISOs are stored as <root>/<sha256>.iso, and urls.json records which
+checksum each URL last produced. A fetch looks up the checksum Proxmox
+publishes in SHA256SUMS next to the ISO, so an ISO replaced upstream is
+fetched again while a rebuild of the same one is served from disk. Files
+are touched whenever they are used, and the least recently used are evicted
+once the cache grows past its budget.
+
+Downloads split the file into ranges fetched over parallel connections and
+written in place with pwrite. The hash follows behind the first unfinished
+range, reading back what has just landed, so the sha256 is ready when the
+last byte is, without another pass over the ISO.
+"""
+
+import hashlib
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger("pxe-pilot-builder")
+
+USER_AGENT = "pxe-pilot-builder"
+TIMEOUT = 30
+READ_CHUNK = 1024 * 1024
+HASH_CHUNK = 8 * 1024 * 1024
+# Smaller ranges are not worth another connection
+MIN_PART = 64 * 1024 * 1024
+RETRIES = 3
+
+
+class FetchError(OSError):
+    """A download failed or did not match its published checksum."""
+
+
+def _open(url: str, method: str = "GET", start: int | None = None, end: int | None = None):
+    request = urllib.request.Request(url, method=method, headers={"User-Agent": USER_AGENT})
+    if start is not None:
+        request.add_header("Range", f"bytes={start}-{end}")
+    return urllib.request.urlopen(request, timeout=TIMEOUT)
+
+
+def published_sha256(url: str) -> str | None:
+    """The checksum for url listed in SHA256SUMS next to it, if there is one."""
+    directory, filename = url.rsplit("/", 1)
+    try:
+        with _open(f"{directory}/SHA256SUMS") as resp:
+            text = resp.read().decode()
+    except (OSError, UnicodeDecodeError, http.client.HTTPException):
+        return None
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1].lstrip("*") == filename:
+            return fields[0].lower()
+    return None
+
+
+@dataclass
+class _Part:
+    """One byte range of a download; pos is how far it has been written."""
+
+    start: int
+    end: int
+    pos: int = 0
+
+    def __post_init__(self):
+        self.pos = self.start
+
+
+class Downloader:
+    """Fetches a URL to a file over parallel range requests, hashing as it goes."""
+
+    def __init__(self, connections: int = 4, min_part: int = MIN_PART, retries: int = RETRIES):
+        self.connections = connections
+        self.min_part = min_part
+        self.retries = retries
+
+    def fetch(self, url: str, dest: Path) -> str:
+        """Download url to dest and return its sha256."""
+        size, ranged = self._probe(url)
+        parts = min(self.connections, size // self.min_part) if size else 0
+        if ranged and parts > 1:
+            logger.info("Downloading %s (%.1f MiB, %d connections)", url, size / (1 << 20), parts)
+            return self._fetch_ranges(url, dest, size, parts)
+        logger.info("Downloading %s", url)
+        return self._fetch_stream(url, dest, size)
+
+    def _probe(self, url: str) -> tuple[int | None, bool]:
+        try:
+            with _open(url, method="HEAD") as resp:
+                length = resp.headers.get("Content-Length")
+                ranged = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+        except (OSError, http.client.HTTPException):
+            # Some mirrors refuse HEAD; a plain GET still works
+            return None, False
+        return (int(length) if length and length.isdigit() else None), ranged
+
+    def _fetch_stream(self, url: str, dest: Path, size: int | None) -> str:
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with _open(url) as resp, open(dest, "wb") as f:
+                while chunk := resp.read(READ_CHUNK):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+        except http.client.HTTPException as exc:
+            raise FetchError(f"{url}: {exc!r}") from exc
+        if size is not None and written != size:
+            raise FetchError(f"{url}: got {written} of {size} bytes")
+        return digest.hexdigest()
+
+    def _fetch_ranges(self, url: str, dest: Path, size: int, count: int) -> str:
+        bounds = [size * i // count for i in range(count + 1)]
+        parts = [_Part(bounds[i], bounds[i + 1]) for i in range(count)]
+        progress = threading.Condition()
+        failures: list[BaseException] = []
+
+        fd = os.open(dest, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+
+            def fetch_part(part: _Part) -> None:
+                try:
+                    self._fetch_part(url, fd, part, progress, failures)
+                except BaseException as exc:
+                    with progress:
+                        failures.append(exc)
+                        progress.notify_all()
+
+            with ThreadPoolExecutor(count, thread_name_prefix="iso-fetch") as pool:
+                for part in parts:
+                    pool.submit(fetch_part, part)
+                digest = self._hash_behind(fd, parts, progress, failures)
+            if failures:
+                raise failures[0]
+        finally:
+            os.close(fd)
+        return digest
+
+    def _fetch_part(
+        self,
+        url: str,
+        fd: int,
+        part: _Part,
+        progress: threading.Condition,
+        failures: list[BaseException],
+    ) -> None:
+        attempt = 0
+        while part.pos < part.end:
+            try:
+                with _open(url, start=part.pos, end=part.end - 1) as resp:
+                    if resp.status != 206:
+                        raise FetchError(f"{url}: server ignored the range request")
+                    while part.pos < part.end:
+                        if failures:
+                            return
+                        chunk = resp.read(min(READ_CHUNK, part.end - part.pos))
+                        if not chunk:
+                            raise ConnectionError("connection closed early")
+                        os.pwrite(fd, chunk, part.pos)
+                        with progress:
+                            part.pos += len(chunk)
+                            progress.notify_all()
+            except FetchError:
+                raise
+            except (OSError, http.client.HTTPException) as exc:
+                attempt += 1
+                if attempt > self.retries:
+                    raise FetchError(f"{url}: bytes {part.pos}-{part.end - 1}: {exc}") from exc
+                logger.warning("%s: %s, resuming from byte %d", url, exc, part.pos)
+
+    def _hash_behind(
+        self,
+        fd: int,
+        parts: list[_Part],
+        progress: threading.Condition,
+        failures: list[BaseException],
+    ) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            offset = part.start
+            while offset < part.end:
+                with progress:
+                    progress.wait_for(lambda p=part, o=offset: p.pos > o or failures)
+                    if failures:
+                        return ""
+                    ready = part.pos
+                while offset < ready:
+                    chunk = os.pread(fd, min(HASH_CHUNK, ready - offset), offset)
+                    digest.update(chunk)
+                    offset += len(chunk)
+        return digest.hexdigest()
+
+
+class IsoCache:
+    """Directory of downloaded ISOs named by sha256, evicted least recently used.
+
+    budget is in bytes; 0 keeps everything. ISOs used during this run are
+    never evicted, even if they alone are over budget.
+    """
+
+    def __init__(self, root: Path, budget: int = 0, downloader: Downloader | None = None):
+        self.root = root
+        self.budget = budget
+        self.downloader = downloader or Downloader()
+        self.hits = 0
+        self.downloads = 0
+        self._in_use: set[str] = set()
+        self._index_lock = threading.Lock()
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def path(self, sha: str) -> Path:
+        return self.root / f"{sha}.iso"
+
+    def fetch(self, url: str, verify: bool = True) -> tuple[Path, str]:
+        """Return the cached ISO for url and its sha256, downloading it on a miss."""
+        with self._lock(url):
+            expected = published_sha256(url) if verify else None
+            known = self._urls().get(url)
+            sha = expected or known
+            if sha and self.path(sha).is_file():
+                self.hits += 1
+                logger.info("download: cache hit (%s)", sha[:12])
+                self._use(sha)
+                return self.path(sha), sha
+
+            if expected and known and expected != known:
+                logger.info("%s changed upstream", url)
+            if verify and not expected:
+                logger.info("No SHA256SUMS entry for %s, skipping verification", url)
+            self.downloads += 1
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.root / f".tmp-{uuid.uuid4().hex}.iso"
+            try:
+                sha = self.downloader.fetch(url, tmp)
+                if expected and sha != expected:
+                    raise FetchError(f"{url}: sha256 {sha} does not match SHA256SUMS ({expected})")
+                if expected:
+                    logger.info("SHA256 verified (%s)", sha[:12])
+                os.replace(tmp, self.path(sha))
+            finally:
+                tmp.unlink(missing_ok=True)
+            self._record(url, sha)
+            self._use(sha)
+            self.evict()
+            return self.path(sha), sha
+
+    def evict(self) -> list[str]:
+        """Remove the least recently used ISOs until the cache fits its budget."""
+        if not self.budget:
+            return []
+        with self._index_lock:
+            isos = sorted(self.root.glob("*.iso"), key=lambda p: p.stat().st_mtime_ns)
+            total = sum(p.stat().st_size for p in isos)
+            evicted = []
+            for iso in isos:
+                if total <= self.budget:
+                    break
+                if iso.stem in self._in_use:
+                    continue
+                total -= iso.stat().st_size
+                iso.unlink()
+                evicted.append(iso.stem)
+                logger.info("Evicted ISO %s from the cache", iso.stem[:12])
+            if evicted:
+                urls = {u: s for u, s in self._read_urls().items() if s not in evicted}
+                self._write_urls(urls)
+            if total > self.budget:
+                logger.warning(
+                    "ISO cache holds %.1f GiB, over its %.1f GiB budget",
+                    total / (1 << 30),
+                    self.budget / (1 << 30),
+                )
+            return evicted
+
+    def _use(self, sha: str) -> None:
+        with self._index_lock:
+            self._in_use.add(sha)
+            # File timestamps are only as fine as the kernel tick; order uses exactly
+            now = time.time_ns()
+            os.utime(self.path(sha), ns=(now, now))
+
+    def _urls(self) -> dict[str, str]:
+        with self._index_lock:
+            return self._read_urls()
+
+    def _record(self, url: str, sha: str) -> None:
+        with self._index_lock:
+            self._write_urls({**self._read_urls(), url: sha})
+
+    def _read_urls(self) -> dict[str, str]:
+        try:
+            return json.loads((self.root / "urls.json").read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _write_urls(self, urls: dict[str, str]) -> None:
+        tmp = self.root / f".urls-{uuid.uuid4().hex}.json"
+        tmp.write_text(json.dumps(urls, indent=2, sort_keys=True) + "\n")
+        os.replace(tmp, self.root / "urls.json")
+
+    def _lock(self, url: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(url, threading.Lock())
@@ -0,0 +1,135 @@
+"""Integrity manifests and the asset catalog written at publish time.
+
+Each published version gets a manifest.json listing every file's size,
+mtime, sha256 and per-chunk sha256s, hashed while the file is copied into
+place. The output root gets a catalog.json listing every bootable version,
+newest first, with the same checksums minus the chunks. The server loads
+the catalog instead of walking the tree and uses the checksums for strong
+ETags; cluster replication uses the chunk hashes to verify resumed files.
+
+Files kept in the chunk store (see chunkstore.py) have no copy in the
+version directory. Their manifest entry lists the stored chunks under
+"store" instead, and their catalog entry is marked "stored".
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from initrd import ISO_SEGMENT
+
+MANIFEST = "manifest.json"
+CATALOG = "catalog.json"
+FORMAT = 1
+CHUNK_SIZE = 16 * 1024 * 1024
+
+_catalog_lock = threading.Lock()
+
+
+def copy_hashed(src: Path, dst: Path) -> dict:
+    """Copy src to dst, returning its size, sha256 and chunk sha256s."""
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        while chunk := fin.read(CHUNK_SIZE):
+            fout.write(chunk)
+            digest.update(chunk)
+            chunks.append(hashlib.sha256(chunk).hexdigest())
+            size += len(chunk)
+    return {"size": size, "sha256": digest.hexdigest(), "chunks": chunks}
+
+
+def write_json(path: Path, doc: dict) -> None:
+    """Replace path atomically with doc as JSON."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(doc, indent=2, sort_keys=True) + "\n")
+    os.replace(tmp, path)
+
+
+def write_manifest(version_dir: Path, product: str, version: str, files: dict[str, dict]) -> None:
+    write_json(
+        version_dir / MANIFEST,
+        {
+            "format": FORMAT,
+            "product": product,
+            "version": version,
+            "chunk_size": CHUNK_SIZE,
+            "files": files,
+        },
+    )
+
+
+def read_manifest(version_dir: Path) -> dict:
+    """File entries from a version's manifest; empty if missing or unreadable."""
+    try:
+        doc = json.loads((version_dir / MANIFEST).read_text())
+        return dict(doc["files"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def has_file(version_dir: Path, name: str, files: dict) -> bool:
+    """Whether the version holds name, as a file or in the chunk store."""
+    return (version_dir / name).is_file() or "store" in files.get(name, {})
+
+
+def referenced_chunks(output_dir: Path) -> set[str]:
+    """sha256 of every chunk some version's manifest uses."""
+    return {
+        sha
+        for manifest_path in output_dir.glob(f"*/*/{MANIFEST}")
+        for entry in read_manifest(manifest_path.parent).values()
+        for sha, _ in entry.get("store", [])
+    }
+
+
+def version_key(version: str) -> list[int]:
+    return [int(x) for x in version.replace("-", ".").split(".") if x.isdigit()]
+
+
+def _catalog_entry(version_dir: Path) -> dict:
+    """Catalog entry for one version, with checksums the manifest still vouches for."""
+    manifest = read_manifest(version_dir)
+    initrds = ["initrd"] + [n for n in (ISO_SEGMENT,) if has_file(version_dir, n, manifest)]
+    files = {}
+    for name in ["vmlinuz", *initrds]:
+        known = manifest.get(name, {})
+        if "store" in known:
+            files[name] = {
+                "size": known["size"],
+                "mtime_ns": known["mtime_ns"],
+                "sha256": known["sha256"],
+                "stored": True,
+            }
+            continue
+        st = (version_dir / name).stat()
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if (known.get("size"), known.get("mtime_ns")) == (st.st_size, st.st_mtime_ns):
+            entry["sha256"] = known["sha256"]
+        files[name] = entry
+    return {"version": version_dir.name, "initrds": initrds, "files": files}
+
+
+def write_catalog(output_dir: Path) -> dict:
+    """Regenerate catalog.json from every bootable version under output_dir.
+
+    Versions published by older builders have no manifest; they are still
+    listed, just without checksums.
+    """
+    with _catalog_lock:
+        products = {}
+        for product_dir in sorted(p for p in output_dir.iterdir() if p.is_dir()):
+            versions = [
+                d
+                for d in product_dir.iterdir()
+                if (d / "vmlinuz").is_file() and has_file(d, "initrd", read_manifest(d))
+            ]
+            versions.sort(key=lambda d: version_key(d.name), reverse=True)
+            if versions:
+                products[product_dir.name] = [_catalog_entry(d) for d in versions]
+        catalog = {"format": FORMAT, "products": products}
+        write_json(output_dir / CATALOG, catalog)
+    return catalog
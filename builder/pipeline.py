@@ -0,0 +1,485 @@
+"""pxe-pilot-builder: turn Proxmox ISOs into versioned PXE boot assets.
+
+Runs the build as cached stages so a rebuild only redoes what changed:
+
+    download  ISO URL, published sha256              -> ISO (see isocache.py)
+    prepare   ISO sha256, answer URL, cert FP        -> prepared proxmox.iso
+    boot      prepared ISO                           -> vmlinuz, stock initrd.img
+    repack    initrd.img sha256, prepared ISO, zstd  -> initrd
+    segment   prepared ISO                           -> iso.cpio
+
+Only one of the last two runs, depending on --initrd-mode. The repack
+streams the stock initrd and the ISO into zstd (see initrd.py), so nothing
+is unpacked on disk. The segment mode skips compression altogether and
+publishes the stock initrd unchanged next to an ISO segment, so rebuilds
+take seconds. Several ISOs build concurrently, sharing a CPU budget.
+With --asset-store chunks the initrd images are published into a chunk
+store shared by every version (see chunkstore.py) rather than copied.
+"""
+
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import chunkstore
+import initrd
+import manifest
+from isocache import Downloader, IsoCache
+from stagecache import StageCache
+
+SCRIPTS_DIR = Path(os.getenv("PXE_BUILDER_SCRIPTS_DIR", "/scripts"))
+
+PRODUCTS = {
+    "proxmox-ve": "proxmox-ve",
+    "proxmox-backup-server": "proxmox-bs",
+    "proxmox-mail-gateway": "proxmox-mg",
+}
+
+# Published into the chunk store with --asset-store chunks; vmlinuz stays a file
+STORED_FILES = ("initrd", initrd.ISO_SEGMENT)
+
+logger = logging.getLogger("pxe-pilot-builder")
+
+
+def detect_product(filename: str) -> str:
+    """Product name from a Proxmox ISO filename, e.g. proxmox-ve_9.1-1.iso."""
+    for prefix, product in PRODUCTS.items():
+        if filename.startswith(prefix):
+            return product
+    return "unknown"
+
+
+def detect_version(filename: str) -> str:
+    """Version from a Proxmox ISO filename: everything between _ and .iso."""
+    match = re.match(r".*_([0-9].*)\.iso$", filename)
+    return match.group(1) if match else "unknown"
+
+
+class CpuBudget:
+    """Counting semaphore over CPU cores shared by concurrent builds."""
+
+    def __init__(self, cpus: int):
+        self.cpus = cpus
+        self._free = cpus
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, cpus: int):
+        cpus = min(cpus, self.cpus)
+        with self._cond:
+            self._cond.wait_for(lambda: self._free >= cpus)
+            self._free -= cpus
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._free += cpus
+                self._cond.notify_all()
+
+
+class ShellTools:
+    """Runs the stage work: shell functions from builder/scripts and the repack."""
+
+    def __init__(self, scripts_dir: Path = SCRIPTS_DIR):
+        self.scripts_dir = scripts_dir
+
+    def _call(self, script: str, function: str, *args: str | Path) -> str:
+        result = subprocess.run(
+            ["bash", "-c", f'source "$0" && {function} "$@"', self.scripts_dir / script, *args],
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        return result.stdout.strip()
+
+    def prepare_iso(self, iso: Path, answer_url: str, cert_fp: str, out_dir: Path) -> Path:
+        return Path(self._call("prepare-iso.sh", "prepare_iso", iso, answer_url, cert_fp, out_dir))
+
+    def extract_boot_files(self, iso: Path, out_dir: Path) -> None:
+        self._call("extract-pxe.sh", "extract_boot_files", iso, out_dir)
+
+    def repack_initrd(
+        self, image: Path, iso: Path, out_file: Path, level: int, threads: int, long: int = 0
+    ) -> None:
+        window = f", long window 2^{long}" if long else ""
+        logger.info("Repacking initrd (zstd level %d%s, %d threads)...", level, window, threads)
+        entries = initrd.repack(image, iso, out_file, level, threads, long)
+        logger.info("Initrd: %d entries + proxmox.iso", entries)
+
+    def write_iso_segment(self, iso: Path, out_file: Path) -> None:
+        logger.info("Writing ISO segment...")
+        initrd.write_segment(iso, out_file)
+
+
+@dataclass
+class Job:
+    """One ISO to build: a local path or a URL."""
+
+    iso: str
+    product: str | None = None
+    version: str | None = None
+
+    @property
+    def is_url(self) -> bool:
+        return "://" in self.iso
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.iso.rstrip("/"))
+
+
+@dataclass
+class Settings:
+    answer_url: str
+    output_dir: Path
+    zstd_level: int = 19
+    zstd_long: int = 0
+    initrd_mode: str = "repack"
+    asset_store: str = "files"
+    cert_fp: str = ""
+    skip_verify: bool = False
+
+
+class Builder:
+    """Runs jobs through the cached stages."""
+
+    def __init__(
+        self,
+        cache: StageCache,
+        tools: ShellTools,
+        budget: CpuBudget,
+        settings: Settings,
+        threads_per_job: int,
+        isos: IsoCache,
+    ):
+        self.cache = cache
+        self.isos = isos
+        self.tools = tools
+        self.budget = budget
+        self.settings = settings
+        self.threads_per_job = threads_per_job
+
+    def build(self, job: Job) -> Path:
+        """Build one ISO and publish it. Returns the published directory."""
+        s = self.settings
+        product = job.product or detect_product(job.filename)
+        version = job.version or detect_version(job.filename)
+        logger.info("%s/%s: building from %s", product, version, job.iso)
+
+        iso, iso_sha = self._source(job)
+
+        def prepare(out: Path) -> None:
+            with self.budget.reserve(1):
+                prepared = self.tools.prepare_iso(iso, s.answer_url, s.cert_fp, out)
+            prepared.rename(out / "proxmox.iso")
+
+        prepared = self.cache.build(
+            "prepare",
+            {"iso_sha256": iso_sha, "answer_url": s.answer_url, "cert_fingerprint": s.cert_fp},
+            prepare,
+        )
+
+        def boot_files(out: Path) -> None:
+            with self.budget.reserve(1):
+                self.tools.extract_boot_files(prepared / "proxmox.iso", out)
+
+        boot = self.cache.build("boot", {"prepared": prepared.name}, boot_files)
+        dest = s.output_dir / product / version
+        store = s.output_dir / chunkstore.CHUNK_DIR if s.asset_store == "chunks" else None
+
+        if s.initrd_mode == "segments":
+
+            def segment(out: Path) -> None:
+                self.tools.write_iso_segment(prepared / "proxmox.iso", out / initrd.ISO_SEGMENT)
+
+            iso_segment = self.cache.build("segment", {"prepared": prepared.name}, segment)
+            publish(
+                dest,
+                [boot / "vmlinuz", iso_segment / initrd.ISO_SEGMENT],
+                {"initrd": boot / "initrd.img"},
+                store=store,
+            )
+            return dest
+
+        def repack(out: Path) -> None:
+            threads = self.threads_per_job
+            with self.budget.reserve(threads):
+                self.tools.repack_initrd(
+                    boot / "initrd.img",
+                    prepared / "proxmox.iso",
+                    out / "initrd",
+                    s.zstd_level,
+                    threads,
+                    s.zstd_long,
+                )
+
+        initrd_sha = self.cache.file_sha256(boot / "initrd.img")
+        key = {"initrd_sha256": initrd_sha, "prepared": prepared.name, "zstd_level": s.zstd_level}
+        if s.zstd_long:
+            # Only when set, so caches from before the option still match
+            key["zstd_long"] = s.zstd_long
+        repacked = self.cache.build("repack", key, repack)
+
+        publish(
+            dest, [boot / "vmlinuz", repacked / "initrd"], stale=[initrd.ISO_SEGMENT], store=store
+        )
+        return dest
+
+    def _source(self, job: Job) -> tuple[Path, str]:
+        """The ISO to build from and its sha256."""
+        if job.is_url:
+            return self.isos.fetch(job.iso, verify=not self.settings.skip_verify)
+        iso = Path(job.iso)
+        if not iso.is_file():
+            raise FileNotFoundError(f"ISO not found at {iso}")
+        return iso, self.cache.file_sha256(iso)
+
+
+def publish(
+    dest: Path,
+    files: list[Path],
+    renamed: dict[str, Path] | None = None,
+    stale: list[str] | None = None,
+    store: Path | None = None,
+) -> None:
+    """Copy assets into place atomically so the server never sees half a file.
+
+    files keep their names, renamed maps published name -> source, and stale
+    names left over from the other initrd mode are removed afterwards. Files
+    are hashed while they are copied; the version's manifest and the output
+    catalog are rewritten once everything is in place. With a store, the
+    initrd images go into the chunk store instead, and copies left by an
+    earlier publish are removed once the manifest points at the chunks.
+    """
+    dest.mkdir(parents=True, exist_ok=True)
+    logger.info("Publishing to %s", dest)
+    targets = {src.name: src for src in files} | (renamed or {})
+    entries = {}
+    for name, src in targets.items():
+        if store is not None and name in STORED_FILES:
+            entries[name] = {**chunkstore.store_file(src, store), "mtime_ns": time.time_ns()}
+            continue
+        tmp = dest / f".{name}.tmp"
+        entry = manifest.copy_hashed(src, tmp)
+        os.replace(tmp, dest / name)
+        entries[name] = {**entry, "mtime_ns": (dest / name).stat().st_mtime_ns}
+    for name in stale or []:
+        (dest / name).unlink(missing_ok=True)
+    manifest.write_manifest(dest, dest.parent.name, dest.name, entries)
+    for name, entry in entries.items():
+        if "store" in entry:
+            (dest / name).unlink(missing_ok=True)
+    manifest.write_catalog(dest.parent.parent)
+
+
+class BuildError(Exception):
+    """One or more jobs failed; each failure was logged with its ISO."""
+
+
+def build_all(builder: Builder, jobs: list[Job], parallel: int) -> list[Path]:
+    """Build jobs concurrently; raises BuildError after all finish if any failed."""
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        futures = [pool.submit(builder.build, job) for job in jobs]
+    published, failed = [], 0
+    for job, future in zip(jobs, futures, strict=True):
+        try:
+            published.append(future.result())
+        except Exception as exc:
+            failed += 1
+            # A traceback only for failures that are not a tool or a file giving up
+            expected = isinstance(exc, (OSError, subprocess.CalledProcessError, initrd.CpioError))
+            logger.error("%s: build failed: %s", job.iso, exc, exc_info=not expected)
+    if failed:
+        raise BuildError(f"{failed} of {len(jobs)} ISO(s) failed to build")
+    return published
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="pxe-pilot-builder", description="Prepare Proxmox ISOs for PXE boot."
+    )
+    parser.add_argument(
+        "--iso",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="path to a local Proxmox ISO (repeatable)",
+    )
+    parser.add_argument(
+        "--iso-url",
+        action="append",
+        default=[],
+        metavar="URL",
+        help="URL to download a Proxmox ISO from (repeatable)",
+    )
+    parser.add_argument("--product", help="product name (auto-detected from the ISO name)")
+    parser.add_argument("--version", help="version string (auto-detected from the ISO name)")
+    parser.add_argument("--answer-url", required=True, help="URL the installer will POST to")
+    parser.add_argument("--output", type=Path, default=Path("/output"), help="output directory")
+    parser.add_argument(
+        "--zstd-level",
+        type=int,
+        default=19,
+        choices=range(1, 20),
+        metavar="N",
+        help="compression level 1-19 (default: 19)",
+    )
+    parser.add_argument(
+        "--zstd-long",
+        type=int,
+        default=0,
+        choices=[0, *range(10, 32)],
+        metavar="WLOG",
+        help="long-distance matching window log 10-31, 0 for off (default: 0); "
+        "see the benchmark mode for whether it pays off",
+    )
+    parser.add_argument(
+        "--initrd-mode",
+        choices=("repack", "segments"),
+        default="repack",
+        help="repack: one recompressed initrd; segments: stock initrd plus a separate "
+        "ISO segment, no recompression (default: repack)",
+    )
+    parser.add_argument(
+        "--asset-store",
+        choices=("files", "chunks"),
+        default="files",
+        help="files: a full copy of each initrd per version; chunks: initrds split into "
+        "a chunk store shared by every version, needs a server that reads it "
+        "(default: files)",
+    )
+    parser.add_argument(
+        "--chunk-grace",
+        type=float,
+        default=24,
+        metavar="HOURS",
+        help="keep chunks no version uses any more this long, so downloads in "
+        "progress can finish; 0 deletes them at the end of the run (default: 24)",
+    )
+    parser.add_argument("--cert-fingerprint", default="", help="TLS cert fingerprint")
+    parser.add_argument("--skip-verify", action="store_true", help="skip ISO checksum check")
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path("/cache"),
+        help="stage cache directory; mount a volume to reuse it",
+    )
+    parser.add_argument(
+        "--iso-cache-size",
+        type=float,
+        default=20,
+        metavar="GIB",
+        help="disk budget for downloaded ISOs kept in the cache, least recently "
+        "used evicted first; 0 keeps them all (default: 20)",
+    )
+    parser.add_argument(
+        "--stage-cache-size",
+        type=float,
+        default=50,
+        metavar="GIB",
+        help="disk budget for cached stage outputs, least recently used evicted "
+        "first; 0 keeps them all (default: 50)",
+    )
+    parser.add_argument(
+        "--download-connections",
+        type=int,
+        default=4,
+        metavar="N",
+        help="parallel range requests per ISO download (default: 4)",
+    )
+    parser.add_argument(
+        "--cpus",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="CPU budget shared by all builds (default: all cores)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="ISOs to build at once (default: one per ISO, within --cpus)",
+    )
+    args = parser.parse_args(argv)
+
+    if not args.iso and not args.iso_url:
+        parser.error("either --iso or --iso-url is required")
+    if (args.product or args.version) and len(args.iso) + len(args.iso_url) > 1:
+        parser.error("--product/--version can only be used with a single ISO")
+    if args.cpus < 1:
+        parser.error("--cpus must be at least 1")
+    if args.jobs < 0:
+        parser.error("--jobs cannot be negative")
+    return args
+
+
+def main(argv: list[str] | None = None, tools: ShellTools | None = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="==> %(message)s", stream=sys.stderr)
+    args = parse_args(argv)
+
+    jobs = [Job(iso, args.product, args.version) for iso in args.iso + args.iso_url]
+    cpus = args.cpus
+    parallel = max(1, args.jobs or min(len(jobs), cpus))
+    builder = Builder(
+        StageCache(args.cache_dir, budget=int(args.stage_cache_size * (1 << 30))),
+        tools or ShellTools(),
+        CpuBudget(cpus),
+        Settings(
+            answer_url=args.answer_url,
+            output_dir=args.output,
+            zstd_level=args.zstd_level,
+            zstd_long=args.zstd_long,
+            initrd_mode=args.initrd_mode,
+            asset_store=args.asset_store,
+            cert_fp=args.cert_fingerprint,
+            skip_verify=args.skip_verify,
+        ),
+        threads_per_job=max(1, cpus // parallel),
+        isos=IsoCache(
+            args.cache_dir / "isos",
+            budget=int(args.iso_cache_size * (1 << 30)),
+            downloader=Downloader(connections=max(1, args.download_connections)),
+        ),
+    )
+
+    try:
+        published = build_all(builder, jobs, parallel)
+    except BuildError as exc:
+        logger.error("Build failed: %s", exc)
+        return 1
+    builder.cache.evict()
+
+    store = args.output / chunkstore.CHUNK_DIR
+    if store.is_dir():
+        removed, freed = chunkstore.collect(
+            store, manifest.referenced_chunks(args.output), grace=args.chunk_grace * 3600
+        )
+        if removed:
+            logger.info("Removed %d unused chunks (%.1f MiB)", removed, freed / (1 << 20))
+
+    logger.info(
+        "Done! %d stage(s) reused from cache, %d built, %d ISO(s) downloaded",
+        builder.cache.hits + builder.isos.hits,
+        builder.cache.misses,
+        builder.isos.downloads,
+    )
+    for dest in published:
+        files = manifest.read_manifest(dest)
+        for name in ("vmlinuz", "initrd", initrd.ISO_SEGMENT):
+            if name in files:
+                size = files[name]["size"] / (1 << 20)
+                stored = " (chunk store)" if "store" in files[name] else ""
+                logger.info("    %s: %.1f MiB%s", dest / name, size, stored)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
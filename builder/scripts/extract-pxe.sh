@@ -1,16 +1,15 @@
 #!/usr/bin/env bash
-# Extracts kernel and repacks initrd with ISO embedded.
-# This is the core logic from morph027/pve-iso-2-pxe adapted for our use.
+# Extracts the kernel and stock initrd from a prepared ISO.
+# Adapted from morph027/pve-iso-2-pxe; the initrd repack that embeds the ISO
+# is done by the builder's streaming repack (initrd.py).
 
-extract_pxe() {
+# Copies the kernel and the stock compressed initrd out of an ISO.
+extract_boot_files() {
     local iso_path="$1"
-    local work_dir="$2"
-    local zstd_level="$3"
+    local out_dir="$2"
 
-    local mount_dir="$work_dir/iso-mount"
-    local initrd_dir="$work_dir/initrd-work"
-
-    mkdir -p "$mount_dir" "$initrd_dir"
+    local mount_dir
+    mount_dir=$(mktemp -d)
 
     # Mount the prepared ISO
     echo "==> Mounting ISO..." >&2
@@ -18,31 +17,16 @@ extract_pxe() {
 
     # Extract kernel
     echo "==> Extracting kernel..." >&2
-    cp "$mount_dir/boot/linux26" "$work_dir/vmlinuz"
+    cp "$mount_dir/boot/linux26" "$out_dir/vmlinuz"
 
-    # Extract and decompress initrd
-    echo "==> Extracting initrd..." >&2
+    # Copy the compressed initrd as-is
     local initrd_src="$mount_dir/boot/initrd.img"
     if [[ ! -f "$initrd_src" ]]; then
         initrd_src="$mount_dir/boot/initrd"
     fi
-
-    (cd "$initrd_dir" && zstdcat "$initrd_src" | cpio -idm 2>/dev/null)
+    cp "$initrd_src" "$out_dir/initrd.img"
 
     # Unmount ISO
     umount "$mount_dir"
-
-    # Embed the prepared ISO into initrd as /proxmox.iso
-    echo "==> Embedding ISO into initrd..." >&2
-    cp "$iso_path" "$initrd_dir/proxmox.iso"
-
-    # Repack initrd with zstd compression
-    echo "==> Repacking initrd (zstd level $zstd_level, this may take a while)..." >&2
-    (cd "$initrd_dir" && find . | cpio -o -H newc 2>/dev/null | zstd -"$zstd_level" -T0 > "$work_dir/initrd")
-
-    echo "==> Kernel: $(du -h "$work_dir/vmlinuz" | cut -f1)" >&2
-    echo "==> Initrd: $(du -h "$work_dir/initrd" | cut -f1)" >&2
-
-    # Cleanup
-    rm -rf "$mount_dir" "$initrd_dir"
+    rmdir "$mount_dir"
 }
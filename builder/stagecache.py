@@ -0,0 +1,143 @@
+"""Content-addressed cache for builder stage outputs.
+
+Each stage's output lives in <root>/<stage>/<key>/, where key is the sha256
+of the stage's inputs (ISO hashes, answer URL, compression level, ...).
+Outputs are built in a temporary directory and renamed into place, so a
+directory that exists is always complete. Concurrent builds of the same key
+wait for each other instead of doing the work twice. Outputs are touched on
+every use, so a size budget can evict the least recently used ones.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+logger = logging.getLogger("pxe-pilot-builder")
+
+HASH_CHUNK = 8 * 1024 * 1024
+STAGES = ("prepare", "boot", "segment", "repack")
+
+
+def stage_key(inputs: dict) -> str:
+    """Stable hash of a stage's inputs."""
+    canonical = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class StageCache:
+    """Directory of completed stage outputs keyed by input hash.
+
+    budget is in bytes; 0 keeps everything. Outputs used during this run are
+    never evicted, even if they alone are over budget.
+    """
+
+    def __init__(self, root: Path, budget: int = 0):
+        self.root = root
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._in_use: set[Path] = set()
+        self._locks: dict[tuple[str, str], threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def path(self, stage: str, key: str) -> Path:
+        return self.root / stage / key
+
+    def build(self, stage: str, inputs: dict, produce: Callable[[Path], None]) -> Path:
+        """Return the output directory for inputs, running produce(dir) on a miss."""
+        key = stage_key(inputs)
+        final = self.path(stage, key)
+        with self._lock(stage, key):
+            if final.is_dir():
+                self.hits += 1
+                logger.info("%s: cache hit (%s)", stage, key[:12])
+                self._use(final)
+                return final
+
+            self.misses += 1
+            logger.info("%s: building (%s)", stage, key[:12])
+            tmp = final.with_name(f".tmp-{key}-{os.getpid()}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+            try:
+                produce(tmp)
+                (tmp / ".inputs.json").write_text(json.dumps(inputs, indent=2, sort_keys=True))
+                tmp.rename(final)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+            self._use(final)
+        return final
+
+    def evict(self) -> list[Path]:
+        """Remove the least recently used outputs until the cache fits its budget."""
+        if not self.budget:
+            return []
+        outputs = [
+            d
+            for stage in STAGES
+            if (self.root / stage).is_dir()
+            for d in (self.root / stage).iterdir()
+            if d.is_dir() and not d.name.startswith(".")
+        ]
+        outputs.sort(key=lambda d: d.stat().st_mtime_ns)
+        sizes = {d: _tree_size(d) for d in outputs}
+        total = sum(sizes.values())
+        evicted = []
+        for output in outputs:
+            if total <= self.budget:
+                break
+            with self._locks_guard:
+                if output in self._in_use:
+                    continue
+            total -= sizes[output]
+            shutil.rmtree(output, ignore_errors=True)
+            evicted.append(output)
+            logger.info("Evicted %s/%s from the cache", output.parent.name, output.name[:12])
+        if total > self.budget:
+            logger.warning(
+                "Stage cache holds %.1f GiB, over its %.1f GiB budget",
+                total / (1 << 30),
+                self.budget / (1 << 30),
+            )
+        return evicted
+
+    def file_sha256(self, path: Path) -> str:
+        """sha256 of a file, memoized by path, size and mtime."""
+        st = path.stat()
+        memo_key = stage_key(
+            {"path": str(path.resolve()), "size": st.st_size, "mtime": st.st_mtime_ns}
+        )
+        memo = self.root / "hashes" / memo_key
+        if memo.is_file():
+            return memo.read_text().strip()
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        memo.parent.mkdir(parents=True, exist_ok=True)
+        memo.write_text(value + "\n")
+        return value
+
+    def _use(self, output: Path) -> None:
+        with self._locks_guard:
+            self._in_use.add(output)
+        # File timestamps are only as fine as the kernel tick; order uses exactly
+        now = time.time_ns()
+        os.utime(output, ns=(now, now))
+
+    def _lock(self, stage: str, key: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault((stage, key), threading.Lock())
+
+
+def _tree_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
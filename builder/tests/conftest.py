@@ -0,0 +1,87 @@
+"""Shared fixtures for builder tests."""
+
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class Mirror:
+    """A local stand-in for an ISO mirror, serving files from memory with Range support."""
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+        self.requests: list[tuple[str, str, str | None]] = []
+        self.ranges = True
+        # Ranged GETs that send half their body, then drop the connection
+        self.drop_ranges = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.01,), daemon=True
+        )
+        self._thread.start()
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/iso/{name}"
+
+    def count(self, method: str, name: str) -> int:
+        return sum(1 for m, path, _ in self.requests if m == method and path == f"/iso/{name}")
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._serve(body=False)
+
+            def do_GET(self):
+                self._serve(body=True)
+
+            def _serve(self, body):
+                header = self.headers.get("Range")
+                with mirror._lock:
+                    mirror.requests.append((self.command, self.path, header))
+                data = mirror.files.get(self.path.removeprefix("/iso/"))
+                if data is None:
+                    self.send_error(404)
+                    return
+                match = re.fullmatch(r"bytes=(\d+)-(\d+)", header or "")
+                if mirror.ranges and match and body:
+                    start, end = int(match[1]), int(match[2])
+                    chunk = data[start : end + 1]
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                    self.send_header("Content-Length", str(len(chunk)))
+                    self.end_headers()
+                    with mirror._lock:
+                        drop = mirror.drop_ranges > 0
+                        mirror.drop_ranges -= drop
+                    self.wfile.write(chunk[: len(chunk) // 2] if drop else chunk)
+                    if drop:
+                        self.close_connection = True
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                if mirror.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                if body:
+                    self.wfile.write(data)
+
+        return Handler
+
+
+@pytest.fixture()
+def mirror():
+    server = Mirror()
+    yield server
+    server.close()
@@ -0,0 +1,103 @@
+"""Tests for content-defined chunking and the shared chunk store."""
+
+import io
+import json
+import random
+import time
+
+import chunkstore
+
+
+def _data(size: int, seed: int = 1) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+class TestSplit:
+    """Cut points."""
+
+    def test_reassembles_within_bounds(self):
+        data = _data(12 << 20)
+        chunks = list(chunkstore.split(io.BytesIO(data)))
+        assert b"".join(chunks) == data
+        assert all(len(c) <= chunkstore.MAX_CHUNK for c in chunks)
+        assert all(len(c) >= chunkstore.MIN_CHUNK for c in chunks[:-1])
+
+    def test_independent_of_read_size(self, monkeypatch):
+        data = _data(8 << 20)
+        first = list(chunkstore.split(io.BytesIO(data)))
+        monkeypatch.setattr(chunkstore, "READ_SIZE", 4_999_999)
+        assert list(chunkstore.split(io.BytesIO(data))) == first
+
+    def test_resynchronizes_after_edit(self):
+        data = _data(16 << 20)
+        edited = data[:5_000_000] + b"http://other:8080/answer" + data[5_000_010:]
+        before = set(chunkstore.split(io.BytesIO(data)))
+        after = list(chunkstore.split(io.BytesIO(edited)))
+        assert sum(chunk not in before for chunk in after) <= 2
+
+    def test_zeros_cut_at_max(self):
+        chunks = list(chunkstore.split(io.BytesIO(bytes(9 << 20))))
+        assert [len(c) for c in chunks] == [4 << 20, 4 << 20, 1 << 20]
+
+    def test_empty(self):
+        assert list(chunkstore.split(io.BytesIO(b""))) == []
+
+
+class TestStore:
+    """Writing into the store and collecting unused chunks."""
+
+    def test_store_file(self, tmp_path):
+        src = tmp_path / "initrd"
+        src.write_bytes(_data(6 << 20))
+        entry = chunkstore.store_file(src, tmp_path / "chunks")
+        assert entry["size"] == 6 << 20
+        stored = b"".join(
+            chunkstore.chunk_path(tmp_path / "chunks", sha).read_bytes()
+            for sha, _ in entry["store"]
+        )
+        assert stored == src.read_bytes()
+
+    def test_shared_chunks_written_once(self, tmp_path):
+        store = tmp_path / "chunks"
+        data = _data(8 << 20)
+        (tmp_path / "a").write_bytes(data)
+        (tmp_path / "b").write_bytes(data[:6_000_000] + b"fingerprint" + data[6_000_000:])
+        a = chunkstore.store_file(tmp_path / "a", store)
+        b = chunkstore.store_file(tmp_path / "b", store)
+        files = list(store.glob("*/*"))
+        assert len(files) < len(a["store"]) + len(b["store"])
+        assert sum(f.stat().st_size for f in files) < 12 << 20
+
+    def test_collect(self, tmp_path):
+        store = tmp_path / "chunks"
+        (tmp_path / "a").write_bytes(_data(1 << 20, seed=2))
+        entry = chunkstore.store_file(tmp_path / "a", store)
+        (store / "ff").mkdir(exist_ok=True)
+        (store / "ff" / ("f" * 64)).write_bytes(b"orphan")
+        keep = {sha for sha, _ in entry["store"]}
+        assert chunkstore.collect(store, keep) == (1, 6)
+        assert {p.name for p in store.glob("*/*")} == keep
+
+    def test_collect_grace_period(self, tmp_path):
+        store = tmp_path / "chunks"
+        orphan = store / "ff" / ("f" * 64)
+        orphan.parent.mkdir(parents=True)
+        orphan.write_bytes(b"orphan")
+        assert chunkstore.collect(store, set(), grace=3600) == (0, 0)
+        assert chunkstore.collect(store, set(), grace=3600) == (0, 0)
+        assert orphan.is_file()
+
+        # Counted from when it was first found unused, not from its mtime
+        record = store / chunkstore.UNREFERENCED
+        record.write_text(json.dumps({orphan.name: time.time() - 7200}))
+        assert chunkstore.collect(store, set(), grace=3600) == (1, 6)
+        assert not record.exists()
+
+    def test_collect_forgets_chunks_used_again(self, tmp_path):
+        store = tmp_path / "chunks"
+        chunk = store / "ff" / ("f" * 64)
+        chunk.parent.mkdir(parents=True)
+        chunk.write_bytes(b"chunk")
+        chunkstore.collect(store, set(), grace=3600)
+        chunkstore.collect(store, {chunk.name}, grace=3600)
+        assert not (store / chunkstore.UNREFERENCED).exists()
@@ -0,0 +1,122 @@
+"""Tests for the zstd compression-profile benchmark."""
+
+import io
+import json
+import shutil
+import subprocess
+
+import compressbench
+import initrd
+import pytest
+from compressbench import Fleet, Profile, Result
+
+needs_zstd = pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd not installed")
+
+
+def _result(level, build, boot) -> Result:
+    return Result(level, 0, 1, build, 100, 1.0, 100.0, boot, 0.0, boot)
+
+
+class TestSynthetic:
+    """The generated stand-in for a repacked initrd."""
+
+    def test_is_a_valid_archive(self, tmp_path):
+        out = tmp_path / "initrd.cpio"
+        count = compressbench.synthetic_cpio(out, 2 * compressbench.MIB)
+        assert initrd.copy_archive(io.BytesIO(out.read_bytes()), io.BytesIO()) == count
+        assert out.stat().st_size == pytest.approx(2 * compressbench.MIB, rel=0.1)
+
+    def test_reproducible(self, tmp_path):
+        first, second = tmp_path / "a.cpio", tmp_path / "b.cpio"
+        compressbench.synthetic_cpio(first, 1 << 18, seed=7)
+        compressbench.synthetic_cpio(second, 1 << 18, seed=7)
+        assert first.read_bytes() == second.read_bytes()
+
+    def test_ends_with_the_iso(self, tmp_path):
+        out = tmp_path / "initrd.cpio"
+        compressbench.synthetic_cpio(out, 1 << 18)
+        src = io.BytesIO(out.read_bytes())
+        names = []
+        while (entry := initrd.read_header(src)) is not None:
+            names.append(entry.name)
+            src.read(entry.filesize + (-entry.filesize % 4))
+        assert names[-2:] == ["proxmox.iso", "TRAILER!!!"]
+        assert any(name.startswith("lib/firmware/") for name in names)
+
+
+class TestModel:
+    """Fleet transfer estimate and the recommendation."""
+
+    def test_shared_uplink_bound(self):
+        fleet = Fleet(nodes=20, link_mbps=10_000, client_mbps=1_000)
+        # 20 nodes x 100 MB over 10 Gbit/s
+        assert fleet.transfer_seconds(100_000_000) == pytest.approx(1.6)
+
+    def test_client_link_bound(self):
+        fleet = Fleet(nodes=2, link_mbps=10_000, client_mbps=1_000)
+        assert fleet.transfer_seconds(100_000_000) == pytest.approx(0.8)
+
+    def test_fastest_boot_wins(self):
+        results = [_result(3, 1.0, 20.0), _result(19, 60.0, 10.0)]
+        assert compressbench.recommend(results).level == 19
+
+    def test_cheaper_build_within_tolerance(self):
+        results = [_result(3, 1.0, 10.05), _result(19, 60.0, 10.0)]
+        assert compressbench.recommend(results, tolerance=0.01).level == 3
+        assert compressbench.recommend(results, tolerance=0.0).level == 19
+
+    def test_profile_flags(self):
+        assert Profile(19, 0, 4).flags == ["-19", "-T4"]
+        assert Profile(3, 27, 1).flags == ["-3", "-T1", "--long=27"]
+
+
+class TestArgs:
+    """Command-line validation."""
+
+    def test_lists(self):
+        args = compressbench.parse_args(["--levels", "19,3,3", "--long", "0,27"])
+        assert (args.levels, args.long) == ([3, 19], [0, 27])
+
+    @pytest.mark.parametrize(
+        "argv", [["--levels", "22"], ["--long", "5"], ["--threads", "0"], ["--levels", "x"]]
+    )
+    def test_rejected(self, argv):
+        with pytest.raises(SystemExit):
+            compressbench.parse_args(argv)
+
+
+@needs_zstd
+class TestRun:
+    """The benchmark end to end, on small inputs."""
+
+    def test_synthetic(self, tmp_path):
+        out = tmp_path / "bench.json"
+        argv = ["--size", "1", "--levels", "1,3", "--long", "0,27", "--threads", "1"]
+        assert compressbench.main([*argv, "--output", str(out)]) == 0
+        report = json.loads(out.read_text())
+        assert report["input"]["synthetic"] is True
+        assert len(report["results"]) == 4
+        for row in report["results"]:
+            assert 0 < row["size"] < report["input"]["size"]
+            assert row["decompress_mbps"] > 0
+            assert row["fleet_boot_seconds"] == pytest.approx(
+                row["transfer_seconds"] + row["decompress_seconds"], abs=0.002
+            )
+        assert report["recommended"]["flags"].startswith("--zstd-level ")
+
+    def test_compressed_initrd(self, tmp_path):
+        raw = tmp_path / "raw.cpio"
+        compressbench.synthetic_cpio(raw, 1 << 18)
+        stock = tmp_path / "initrd.img"
+        stock.write_bytes(
+            subprocess.run(
+                ["zstd", "-q", "-c", str(raw)], stdout=subprocess.PIPE, check=True
+            ).stdout
+        )
+        out = tmp_path / "bench.json"
+        argv = ["--initrd", str(stock), "--levels", "1", "--long", "0", "--threads", "1"]
+        assert compressbench.main([*argv, "--output", str(out)]) == 0
+        assert json.loads(out.read_text())["input"]["size"] == raw.stat().st_size
+
+    def test_unreadable_initrd(self, tmp_path):
+        assert compressbench.main(["--initrd", str(tmp_path / "missing")]) == 1
@@ -0,0 +1,106 @@
+"""Tests for the streaming newc repack."""
+
+import io
+import shutil
+import subprocess
+
+import initrd
+import pytest
+from initrd import CpioError, Entry
+
+
+def _archive(files: dict[str, bytes]) -> bytes:
+    out = io.BytesIO()
+    for ino, (name, data) in enumerate(files.items(), start=1):
+        out.write(Entry(name=name, ino=ino, mode=0o100644, filesize=len(data)).encode())
+        out.write(data + b"\0" * (-len(data) % 4))
+    initrd.write_trailer(out)
+    return out.getvalue()
+
+
+def _entries(data: bytes) -> dict[str, bytes]:
+    src = io.BytesIO(data)
+    files = {}
+    while (entry := initrd.read_header(src)) is not None:
+        files[entry.name] = src.read(entry.filesize)
+        src.read(-entry.filesize % 4)
+    return files
+
+
+class TestNewc:
+    """Reading and writing newc archives."""
+
+    def test_copy_round_trips(self):
+        data = _archive({"init": b"#!/bin/sh\n", "etc/odd": b"abc", "empty": b""})
+        out = io.BytesIO()
+        assert initrd.copy_archive(io.BytesIO(data), out) == 4
+        assert out.getvalue() == data
+
+    def test_concatenated_archives_with_padding(self):
+        first = _archive({"a": b"1"})
+        second = _archive({"b": b"22"})
+        out = io.BytesIO()
+        initrd.copy_archive(io.BytesIO(first + b"\0" * 512 + second), out)
+        assert out.getvalue() == first + second
+
+    def test_append_file(self, tmp_path):
+        iso = tmp_path / "proxmox.iso"
+        iso.write_bytes(b"x" * 4099)
+        out = io.BytesIO()
+        initrd.append_file(out, "proxmox.iso", iso)
+        initrd.write_trailer(out)
+        assert len(out.getvalue()) % 4 == 0
+        assert _entries(out.getvalue())["proxmox.iso"] == b"x" * 4099
+
+    def test_write_segment(self, tmp_path):
+        iso = tmp_path / "source.iso"
+        iso.write_bytes(b"iso" * 1000)
+        segment = tmp_path / "iso.cpio"
+        initrd.write_segment(iso, segment)
+        assert _entries(segment.read_bytes()) == {"proxmox.iso": b"iso" * 1000, "TRAILER!!!": b""}
+
+    def test_rejects_other_formats(self):
+        with pytest.raises(CpioError):
+            initrd.copy_archive(io.BytesIO(b"070707" + b"0" * 200), io.BytesIO())
+
+    def test_rejects_truncated(self):
+        data = _archive({"init": b"0123456789"})
+        with pytest.raises(CpioError):
+            initrd.copy_archive(io.BytesIO(data[:120]), io.BytesIO())
+
+
+@pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd not installed")
+class TestRepack:
+    """The full decompress -> append -> compress stream."""
+
+    def test_repack(self, tmp_path):
+        stock = tmp_path / "initrd.img"
+        stock.write_bytes(
+            subprocess.run(
+                ["zstd", "-q", "-c"],
+                input=_archive({"init": b"#!/bin/sh\n", "bin/busybox": b"\x7fELF" * 1000}),
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+        )
+        iso = tmp_path / "proxmox.iso"
+        iso.write_bytes(bytes(range(256)) * 5000)
+        out = tmp_path / "initrd"
+
+        assert initrd.repack(stock, iso, out, 3, 2, long=27) == 3
+
+        raw = subprocess.run(["zstd", "-dcq", str(out)], stdout=subprocess.PIPE, check=True).stdout
+        files = _entries(raw)
+        assert files["init"] == b"#!/bin/sh\n"
+        assert files["proxmox.iso"] == iso.read_bytes()
+        assert raw.count(b"TRAILER!!!") == 2
+
+    def test_not_an_initrd(self, tmp_path):
+        stock = tmp_path / "initrd.img"
+        stock.write_bytes(
+            subprocess.run(["zstd", "-q", "-c"], input=b"nope", stdout=subprocess.PIPE).stdout
+        )
+        iso = tmp_path / "proxmox.iso"
+        iso.write_bytes(b"iso")
+        with pytest.raises(CpioError):
+            initrd.repack(stock, iso, tmp_path / "initrd", 3, 1)
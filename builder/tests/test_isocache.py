@@ -0,0 +1,161 @@
+"""Tests for the ranged ISO downloader and the content-addressed ISO cache."""
+
+import hashlib
+import os
+
+import pytest
+from isocache import Downloader, FetchError, IsoCache, published_sha256
+
+ISO = "proxmox-ve_9.1-1.iso"
+
+
+def _publish(mirror, name, data, checksum=None):
+    mirror.files[name] = data
+    sums = "".join(
+        f"{checksum or hashlib.sha256(body).hexdigest()}  {file}\n"
+        for file, body in mirror.files.items()
+        if file.endswith(".iso")
+    )
+    mirror.files["SHA256SUMS"] = sums.encode()
+
+
+def _cache(tmp_path, budget=0, connections=4):
+    return IsoCache(tmp_path / "isos", budget, Downloader(connections, min_part=1024))
+
+
+class TestDownloader:
+    """Parallel range requests, hashed as they land."""
+
+    def test_ranged_download(self, mirror, tmp_path):
+        data = os.urandom(100_000)
+        mirror.files[ISO] = data
+        dest = tmp_path / "out.iso"
+        sha = Downloader(4, min_part=1024).fetch(mirror.url(ISO), dest)
+        assert dest.read_bytes() == data
+        assert sha == hashlib.sha256(data).hexdigest()
+        ranges = [r for m, _, r in mirror.requests if m == "GET"]
+        assert len(ranges) == 4 and all(r.startswith("bytes=") for r in ranges)
+
+    def test_small_file_uses_one_stream(self, mirror, tmp_path):
+        mirror.files[ISO] = b"tiny"
+        sha = Downloader(4, min_part=1024).fetch(mirror.url(ISO), tmp_path / "out.iso")
+        assert sha == hashlib.sha256(b"tiny").hexdigest()
+        assert [r for m, _, r in mirror.requests if m == "GET"] == [None]
+
+    def test_server_without_ranges(self, mirror, tmp_path):
+        data = os.urandom(50_000)
+        mirror.files[ISO] = data
+        mirror.ranges = False
+        dest = tmp_path / "out.iso"
+        assert Downloader(4, min_part=1024).fetch(mirror.url(ISO), dest) == (
+            hashlib.sha256(data).hexdigest()
+        )
+        assert dest.read_bytes() == data
+
+    def test_dropped_range_resumes(self, mirror, tmp_path):
+        data = os.urandom(80_000)
+        mirror.files[ISO] = data
+        mirror.drop_ranges = 2
+        dest = tmp_path / "out.iso"
+        sha = Downloader(2, min_part=1024).fetch(mirror.url(ISO), dest)
+        assert sha == hashlib.sha256(data).hexdigest()
+        assert dest.read_bytes() == data
+        assert mirror.count("GET", ISO) == 4
+
+    def test_gives_up_after_retries(self, mirror, tmp_path):
+        mirror.files[ISO] = os.urandom(80_000)
+        mirror.drop_ranges = 100
+        with pytest.raises(FetchError, match="closed early"):
+            Downloader(2, min_part=1024, retries=1).fetch(mirror.url(ISO), tmp_path / "out.iso")
+
+    def test_missing_file(self, mirror, tmp_path):
+        with pytest.raises(OSError):
+            Downloader().fetch(mirror.url(ISO), tmp_path / "out.iso")
+
+
+class TestPublishedSha256:
+    """Checksums from SHA256SUMS next to the ISO."""
+
+    def test_found(self, mirror):
+        _publish(mirror, ISO, b"iso")
+        assert published_sha256(mirror.url(ISO)) == hashlib.sha256(b"iso").hexdigest()
+
+    def test_binary_mode_marker(self, mirror):
+        mirror.files["SHA256SUMS"] = b"ABCDEF *proxmox-ve_9.1-1.iso\n"
+        assert published_sha256(mirror.url(ISO)) == "abcdef"
+
+    def test_missing(self, mirror):
+        assert published_sha256(mirror.url(ISO)) is None
+        mirror.files["SHA256SUMS"] = b"abc  other.iso\n"
+        assert published_sha256(mirror.url(ISO)) is None
+
+
+class TestIsoCache:
+    """Content-addressed ISOs keyed by URL and published checksum."""
+
+    def test_download_then_hit(self, mirror, tmp_path):
+        data = os.urandom(10_000)
+        _publish(mirror, ISO, data)
+        path, sha = _cache(tmp_path).fetch(mirror.url(ISO))
+        assert path == tmp_path / "isos" / f"{sha}.iso"
+        assert path.read_bytes() == data
+
+        cache = _cache(tmp_path)
+        assert cache.fetch(mirror.url(ISO)) == (path, sha)
+        assert (cache.hits, cache.downloads) == (1, 0)
+        assert mirror.count("GET", ISO) == 4
+
+    def test_checksum_mismatch(self, mirror, tmp_path):
+        _publish(mirror, ISO, b"corrupt" * 1000, checksum="0" * 64)
+        with pytest.raises(FetchError, match="does not match"):
+            _cache(tmp_path).fetch(mirror.url(ISO))
+        assert list((tmp_path / "isos").glob("*.iso")) == []
+
+    def test_skip_verify(self, mirror, tmp_path):
+        _publish(mirror, ISO, b"corrupt", checksum="0" * 64)
+        _, sha = _cache(tmp_path).fetch(mirror.url(ISO), verify=False)
+        assert sha == hashlib.sha256(b"corrupt").hexdigest()
+        assert mirror.count("GET", "SHA256SUMS") == 0
+
+    def test_changed_upstream_refetched(self, mirror, tmp_path):
+        _publish(mirror, ISO, b"first")
+        _, first = _cache(tmp_path).fetch(mirror.url(ISO))
+        _publish(mirror, ISO, b"second")
+        cache = _cache(tmp_path)
+        _, second = cache.fetch(mirror.url(ISO))
+        assert second != first
+        assert cache.downloads == 1
+
+    def test_mirrors_share_content(self, mirror, tmp_path):
+        _publish(mirror, ISO, b"same")
+        _publish(mirror, "copy/" + ISO, b"same")
+        cache = _cache(tmp_path)
+        cache.fetch(mirror.url(ISO))
+        mirror.files["copy/SHA256SUMS"] = mirror.files["SHA256SUMS"]
+        cache.fetch(mirror.url("copy/" + ISO))
+        assert (cache.downloads, cache.hits) == (1, 1)
+
+    def test_without_checksums_uses_url(self, mirror, tmp_path):
+        mirror.files[ISO] = b"unsigned"
+        _cache(tmp_path).fetch(mirror.url(ISO))
+        cache = _cache(tmp_path)
+        cache.fetch(mirror.url(ISO))
+        assert cache.hits == 1
+
+    def test_evicts_least_recently_used(self, mirror, tmp_path):
+        names = [f"proxmox-ve_9.{i}-1.iso" for i in range(3)]
+        for name in names:
+            _publish(mirror, name, os.urandom(4000))
+        for name in names[:2]:
+            _cache(tmp_path).fetch(mirror.url(name))
+        # Using the first again leaves the second least recently used
+        _, kept = _cache(tmp_path).fetch(mirror.url(names[0]))
+        cache = _cache(tmp_path, budget=9000)
+        _, newest = cache.fetch(mirror.url(names[2]))
+        assert sorted(p.stem for p in (tmp_path / "isos").glob("*.iso")) == sorted([kept, newest])
+        assert mirror.url(names[1]) not in cache._urls()
+
+    def test_in_use_never_evicted(self, mirror, tmp_path):
+        _publish(mirror, ISO, os.urandom(4000))
+        path, _ = _cache(tmp_path, budget=100).fetch(mirror.url(ISO))
+        assert path.is_file()
@@ -0,0 +1,411 @@
+"""Tests for the cached builder pipeline, with the shell stages faked out."""
+
+import hashlib
+import json
+import threading
+import time
+
+import manifest
+import pipeline
+import pytest
+from stagecache import StageCache, stage_key
+
+
+class FakeTools:
+    """Stands in for ShellTools, writing marker files instead of real images."""
+
+    def __init__(self):
+        self.calls: list[str] = []
+        self._lock = threading.Lock()
+
+    def _record(self, name):
+        with self._lock:
+            self.calls.append(name)
+
+    def prepare_iso(self, iso, answer_url, cert_fp, out_dir):
+        self._record("prepare_iso")
+        prepared = out_dir / "prepared.iso"
+        prepared.write_bytes(iso.read_bytes() + f"|{answer_url}|{cert_fp}".encode())
+        return prepared
+
+    def extract_boot_files(self, iso, out_dir):
+        self._record("extract_boot_files")
+        (out_dir / "vmlinuz").write_bytes(b"kernel")
+        # The stock initrd is identical whatever answer URL was baked in
+        (out_dir / "initrd.img").write_bytes(b"stock-initrd:" + iso.read_bytes().split(b"|")[0])
+
+    def repack_initrd(self, image, iso, out_file, level, threads, long=0):
+        self._record("repack_initrd")
+        out_file.write_bytes(image.read_bytes() + iso.read_bytes())
+
+    def write_iso_segment(self, iso, out_file):
+        self._record("write_iso_segment")
+        out_file.write_bytes(iso.read_bytes())
+
+
+def _run(tmp_path, tools, *args):
+    argv = [
+        "--output", str(tmp_path / "output"),
+        "--cache-dir", str(tmp_path / "cache"),
+        "--answer-url", "http://10.0.0.5:8080/answer",
+        *args,
+    ]  # fmt: skip
+    return pipeline.main(argv, tools=tools)
+
+
+@pytest.fixture()
+def iso(tmp_path):
+    path = tmp_path / "proxmox-ve_9.1-1.iso"
+    path.write_bytes(b"proxmox-ve-9.1")
+    return path
+
+
+class TestDetection:
+    """Product and version from ISO filenames."""
+
+    def test_products(self):
+        assert pipeline.detect_product("proxmox-ve_9.1-1.iso") == "proxmox-ve"
+        assert pipeline.detect_product("proxmox-backup-server_3.3-1.iso") == "proxmox-bs"
+        assert pipeline.detect_product("proxmox-mail-gateway_8.1-1.iso") == "proxmox-mg"
+        assert pipeline.detect_product("debian.iso") == "unknown"
+
+    def test_versions(self):
+        assert pipeline.detect_version("proxmox-ve_9.1-1.iso") == "9.1-1"
+        assert pipeline.detect_version("proxmox-ve.iso") == "unknown"
+
+
+class TestPipeline:
+    """Stage caching across runs."""
+
+    def test_builds_and_publishes(self, tmp_path, iso):
+        tools = FakeTools()
+        assert _run(tmp_path, tools, "--iso", str(iso)) == 0
+
+        dest = tmp_path / "output" / "proxmox-ve" / "9.1-1"
+        assert (dest / "vmlinuz").read_bytes() == b"kernel"
+        assert (dest / "initrd").read_bytes().startswith(b"stock-initrd:proxmox-ve-9.1")
+        assert sorted(p.name for p in dest.iterdir()) == ["initrd", "manifest.json", "vmlinuz"]
+
+    def test_rebuild_is_fully_cached(self, tmp_path, iso):
+        _run(tmp_path, FakeTools(), "--iso", str(iso))
+        tools = FakeTools()
+        assert _run(tmp_path, tools, "--iso", str(iso)) == 0
+        assert tools.calls == []
+
+    def test_answer_url_change_reprepares(self, tmp_path, iso):
+        _run(tmp_path, FakeTools(), "--iso", str(iso))
+        tools = FakeTools()
+        _run(tmp_path, tools, "--iso", str(iso), "--answer-url", "http://other/answer")
+
+        assert tools.calls.count("prepare_iso") == 1
+        assert tools.calls.count("repack_initrd") == 1
+        initrd = tmp_path / "output" / "proxmox-ve" / "9.1-1" / "initrd"
+        assert b"http://other/answer" in initrd.read_bytes()
+
+    def test_zstd_level_change_only_repacks(self, tmp_path, iso):
+        _run(tmp_path, FakeTools(), "--iso", str(iso))
+        tools = FakeTools()
+        _run(tmp_path, tools, "--iso", str(iso), "--zstd-level", "3")
+        assert tools.calls == ["repack_initrd"]
+
+    def test_zstd_long_change_only_repacks(self, tmp_path, iso):
+        _run(tmp_path, FakeTools(), "--iso", str(iso))
+        tools = FakeTools()
+        _run(tmp_path, tools, "--iso", str(iso), "--zstd-long", "0")
+        assert tools.calls == []
+        _run(tmp_path, tools, "--iso", str(iso), "--zstd-long", "27")
+        assert tools.calls == ["repack_initrd"]
+
+    def test_segments_mode(self, tmp_path, iso):
+        tools = FakeTools()
+        assert _run(tmp_path, tools, "--iso", str(iso), "--initrd-mode", "segments") == 0
+        assert "repack_initrd" not in tools.calls
+
+        dest = tmp_path / "output" / "proxmox-ve" / "9.1-1"
+        assert (dest / "initrd").read_bytes() == b"stock-initrd:proxmox-ve-9.1"
+        assert (dest / "iso.cpio").read_bytes().startswith(b"proxmox-ve-9.1|")
+
+    def test_switching_back_to_repack_drops_segment(self, tmp_path, iso):
+        _run(tmp_path, FakeTools(), "--iso", str(iso), "--initrd-mode", "segments")
+        _run(tmp_path, FakeTools(), "--iso", str(iso))
+        dest = tmp_path / "output" / "proxmox-ve" / "9.1-1"
+        assert sorted(p.name for p in dest.iterdir()) == ["initrd", "manifest.json", "vmlinuz"]
+
+    def test_downloads_cached_by_url(self, tmp_path, mirror):
+        name = "proxmox-backup-server_3.3-1.iso"
+        mirror.files[name] = b"proxmox-bs-3.3"
+        assert _run(tmp_path, FakeTools(), "--iso-url", mirror.url(name)) == 0
+        tools = FakeTools()
+        _run(tmp_path, tools, "--iso-url", mirror.url(name))
+        assert tools.calls == []
+        assert mirror.count("GET", name) == 1
+        assert (tmp_path / "output" / "proxmox-bs" / "3.3-1" / "initrd").is_file()
+
+    def test_new_answer_url_reuses_download(self, tmp_path, mirror):
+        name = "proxmox-ve_9.1-1.iso"
+        mirror.files[name] = b"proxmox-ve-9.1"
+        mirror.files["SHA256SUMS"] = (
+            f"{hashlib.sha256(b'proxmox-ve-9.1').hexdigest()}  {name}\n".encode()
+        )
+        _run(tmp_path, FakeTools(), "--iso-url", mirror.url(name))
+        tools = FakeTools()
+        _run(
+            tmp_path, tools, "--iso-url", mirror.url(name), "--answer-url", "http://10.0.0.6/answer"
+        )
+        assert mirror.count("GET", name) == 1
+        assert "prepare_iso" in tools.calls
+
+    def test_checksum_mismatch_fails(self, tmp_path, mirror):
+        name = "proxmox-ve_9.1-1.iso"
+        mirror.files[name] = b"proxmox-ve-9.1"
+        mirror.files["SHA256SUMS"] = f"{'0' * 64}  {name}\n".encode()
+        assert _run(tmp_path, FakeTools(), "--iso-url", mirror.url(name)) == 1
+
+    def test_multiple_isos(self, tmp_path, iso):
+        other = tmp_path / "proxmox-ve_8.4-1.iso"
+        other.write_bytes(b"proxmox-ve-8.4")
+        tools = FakeTools()
+        assert _run(tmp_path, tools, "--iso", str(iso), "--iso", str(other), "--cpus", "4") == 0
+        assert (tmp_path / "output" / "proxmox-ve" / "9.1-1" / "initrd").is_file()
+        assert (tmp_path / "output" / "proxmox-ve" / "8.4-1" / "initrd").is_file()
+        assert tools.calls.count("repack_initrd") == 2
+
+    def test_missing_iso_fails(self, tmp_path):
+        assert _run(tmp_path, FakeTools(), "--iso", str(tmp_path / "nope.iso")) == 1
+
+    def test_failed_stage_leaves_no_cache_entry(self, tmp_path, iso):
+        class Failing(FakeTools):
+            def repack_initrd(self, *args):
+                raise OSError("disk full")
+
+        assert _run(tmp_path, Failing(), "--iso", str(iso)) == 1
+        tools = FakeTools()
+        assert _run(tmp_path, tools, "--iso", str(iso)) == 0
+        assert tools.calls == ["repack_initrd"]
+
+    def test_unexpected_error_reported_per_job(self, tmp_path, iso, caplog):
+        other = tmp_path / "proxmox-ve_8.4-1.iso"
+        other.write_bytes(b"proxmox-ve-8.4")
+
+        class Broken(FakeTools):
+            def repack_initrd(self, image, *args):
+                if b"8.4" in image.read_bytes():
+                    raise KeyError("zstd_level")
+                super().repack_initrd(image, *args)
+
+        assert _run(tmp_path, Broken(), "--iso", str(iso), "--iso", str(other)) == 1
+        assert f"{other}: build failed: 'zstd_level'" in caplog.text
+        assert "1 of 2 ISO(s) failed to build" in caplog.text
+        assert (tmp_path / "output" / "proxmox-ve" / "9.1-1" / "initrd").is_file()
+
+    @pytest.mark.parametrize("option", [["--cpus", "0"], ["--jobs", "-1"]])
+    def test_invalid_parallelism_rejected(self, tmp_path, iso, option):
+        with pytest.raises(SystemExit):
+            _run(tmp_path, FakeTools(), "--iso", str(iso), *option)
+
+    def test_product_override_needs_single_iso(self, tmp_path, iso):
+        with pytest.raises(SystemExit):
+            _run(tmp_path, FakeTools(), "--iso", str(iso), "--iso", str(iso), "--version", "x")
+
+
+class TestManifest:
+    """Per-version manifests and the output catalog."""
+
+    def test_manifest_matches_published_files(self, tmp_path, iso, monkeypatch):
+        monkeypatch.setattr(manifest, "CHUNK_SIZE", 8)
+        _run(tmp_path, FakeTools(), "--iso", str(iso), "--initrd-mode", "segments")
+        dest = tmp_path / "output" / "proxmox-ve" / "9.1-1"
+
+        files = manifest.read_manifest(dest)
+        assert sorted(files) == ["initrd", "iso.cpio", "vmlinuz"]
+        for name, entry in files.items():
+            data = (dest / name).read_bytes()
+            assert entry["size"] == len(data)
+            assert entry["sha256"] == hashlib.sha256(data).hexdigest()
+            assert entry["mtime_ns"] == (dest / name).stat().st_mtime_ns
+            assert entry["chunks"] == [
+                hashlib.sha256(data[i : i + 8]).hexdigest() for i in range(0, len(data), 8)
+            ]
+
+    def test_catalog_lists_versions_newest_first(self, tmp_path, iso):
+        other = tmp_path / "proxmox-ve_8.4-1.iso"
+        other.write_bytes(b"proxmox-ve-8.4")
+        _run(tmp_path, FakeTools(), "--iso", str(other))
+        _run(tmp_path, FakeTools(), "--iso", str(iso), "--initrd-mode", "segments")
+
+        catalog = json.loads((tmp_path / "output" / "catalog.json").read_text())
+        versions = catalog["products"]["proxmox-ve"]
+        assert [v["version"] for v in versions] == ["9.1-1", "8.4-1"]
+        assert versions[0]["initrds"] == ["initrd", "iso.cpio"]
+        assert versions[1]["initrds"] == ["initrd"]
+        assert "sha256" in versions[1]["files"]["initrd"]
+
+    def test_catalog_keeps_unmanifested_versions(self, tmp_path):
+        legacy = tmp_path / "pve" / "8.0-1"
+        legacy.mkdir(parents=True)
+        (legacy / "vmlinuz").write_bytes(b"k")
+        (legacy / "initrd").write_bytes(b"i")
+        (tmp_path / "pve" / "broken").mkdir()
+
+        catalog = manifest.write_catalog(tmp_path)
+        [entry] = catalog["products"]["pve"]
+        assert entry["files"]["initrd"] == {
+            "size": 1,
+            "mtime_ns": (legacy / "initrd").stat().st_mtime_ns,
+        }
+
+    def test_modified_file_loses_checksum(self, tmp_path, iso):
+        _run(tmp_path, FakeTools(), "--iso", str(iso))
+        dest = tmp_path / "output" / "proxmox-ve" / "9.1-1"
+        (dest / "vmlinuz").write_bytes(b"patched by hand")
+        entry = manifest.write_catalog(tmp_path / "output")["products"]["proxmox-ve"][0]
+        assert "sha256" not in entry["files"]["vmlinuz"]
+        assert "sha256" in entry["files"]["initrd"]
+
+
+class TestChunkStore:
+    """--asset-store chunks: initrds published into the shared chunk store."""
+
+    @pytest.mark.parametrize("mode", ["repack", "segments"])
+    def test_initrds_stored(self, tmp_path, iso, mode):
+        args = ["--iso", str(iso), "--asset-store", "chunks", "--initrd-mode", mode]
+        assert _run(tmp_path, FakeTools(), *args) == 0
+        output = tmp_path / "output"
+        dest = output / "proxmox-ve" / "9.1-1"
+        assert sorted(p.name for p in dest.iterdir()) == ["manifest.json", "vmlinuz"]
+        files = manifest.read_manifest(dest)
+        for name in ("initrd", "iso.cpio") if mode == "segments" else ("initrd",):
+            assert "store" in files[name]
+        catalog = json.loads((output / "catalog.json").read_text())
+        [entry] = catalog["products"]["proxmox-ve"]
+        assert entry["files"]["initrd"]["stored"] is True
+        assert entry["initrds"] == (["initrd", "iso.cpio"] if mode == "segments" else ["initrd"])
+
+    def test_switching_formats(self, tmp_path, iso):
+        _run(tmp_path, FakeTools(), "--iso", str(iso))
+        _run(tmp_path, FakeTools(), "--iso", str(iso), "--asset-store", "chunks")
+        output = tmp_path / "output"
+        assert not (output / "proxmox-ve" / "9.1-1" / "initrd").exists()
+        assert list((output / "chunks").glob("*/*"))
+
+        _run(tmp_path, FakeTools(), "--iso", str(iso), "--chunk-grace", "0")
+        assert (output / "proxmox-ve" / "9.1-1" / "initrd").is_file()
+        # Nothing references the chunks any more
+        assert list((output / "chunks").glob("*/*")) == []
+
+    def test_rebuild_collects_replaced_chunks(self, tmp_path, iso):
+        args = ["--iso", str(iso), "--asset-store", "chunks"]
+        _run(tmp_path, FakeTools(), *args)
+        _run(
+            tmp_path,
+            FakeTools(),
+            *args,
+            "--answer-url",
+            "http://other/answer",
+            "--chunk-grace",
+            "0",
+        )
+        output = tmp_path / "output"
+        referenced = manifest.referenced_chunks(output)
+        assert {p.name for p in (output / "chunks").glob("*/*")} == referenced
+
+    def test_replaced_chunks_kept_for_grace_period(self, tmp_path, iso):
+        args = ["--iso", str(iso), "--asset-store", "chunks"]
+        _run(tmp_path, FakeTools(), *args)
+        output = tmp_path / "output"
+        before = {p.name for p in (output / "chunks").glob("*/*")}
+        _run(tmp_path, FakeTools(), *args, "--answer-url", "http://other/answer")
+        after = {p.name for p in (output / "chunks").glob("*/*")}
+        assert before <= after
+        assert after - manifest.referenced_chunks(output)
+
+
+class TestStageCache:
+    """Keys, hashing and concurrent access."""
+
+    def test_key_ignores_dict_order(self):
+        assert stage_key({"a": 1, "b": 2}) == stage_key({"b": 2, "a": 1})
+
+    def test_file_hash_memoized(self, tmp_path):
+        cache = StageCache(tmp_path / "cache")
+        path = tmp_path / "file"
+        path.write_bytes(b"abc")
+        first = cache.file_sha256(path)
+        assert first == cache.file_sha256(path)
+        assert len(list((tmp_path / "cache" / "hashes").iterdir())) == 1
+
+    def test_concurrent_builds_of_one_key_run_once(self, tmp_path):
+        cache = StageCache(tmp_path)
+        runs = []
+
+        def produce(out):
+            runs.append(out)
+            time.sleep(0.05)
+
+        threads = [
+            threading.Thread(target=cache.build, args=("s", {"k": 1}, produce)) for _ in range(4)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(runs) == 1
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        old = StageCache(tmp_path)
+        first = old.build("boot", {"k": 1}, lambda out: (out / "f").write_bytes(b"x" * 4000))
+        second = old.build("repack", {"k": 2}, lambda out: (out / "f").write_bytes(b"x" * 4000))
+        old.build("boot", {"k": 1}, lambda out: None)
+
+        cache = StageCache(tmp_path, budget=6000)
+        assert cache.evict() == [second]
+        assert first.is_dir()
+
+    def test_outputs_used_this_run_kept(self, tmp_path):
+        cache = StageCache(tmp_path, budget=100)
+        out = cache.build("boot", {"k": 1}, lambda out: (out / "f").write_bytes(b"x" * 4000))
+        assert cache.evict() == []
+        assert out.is_dir()
+
+    def test_build_evicts_over_budget(self, tmp_path, iso):
+        assert _run(tmp_path, FakeTools(), "--iso", str(iso)) == 0
+        other = tmp_path / "proxmox-ve_9.2-1.iso"
+        other.write_bytes(b"proxmox-ve-9.2")
+        assert (
+            _run(tmp_path, FakeTools(), "--iso", str(other), "--stage-cache-size", "0.000001") == 0
+        )
+        prepared = list((tmp_path / "cache" / "prepare").iterdir())
+        assert len(prepared) == 1
+        assert b"9.2" in (prepared[0] / "proxmox.iso").read_bytes()
+
+
+class TestCpuBudget:
+    """Sharing cores between concurrent jobs."""
+
+    def test_never_oversubscribed(self):
+        budget = pipeline.CpuBudget(4)
+        in_use = []
+        current = 0
+        lock = threading.Lock()
+
+        def work():
+            nonlocal current
+            with budget.reserve(3):
+                with lock:
+                    current += 3
+                    in_use.append(current)
+                time.sleep(0.02)
+                with lock:
+                    current -= 3
+
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert max(in_use) <= 4
+
+    def test_oversized_request_is_clamped(self):
+        with pipeline.CpuBudget(2).reserve(8):
+            pass
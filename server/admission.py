@@ -0,0 +1,210 @@
+"""Boot-wave admission: meters how many clients download boot assets at once.
+
+When a rack powers on together, every node asks for its multi-GB initrd at
+the same moment. Each transfer slows down, iPXE times out, and the retries
+add to the load. Admission hands out a fixed number of download slots in
+/menu.ipxe. A client without one is sent a script that sleeps and chains
+back, and the queue is served first come, first served. Clients near the
+front retry at the base interval; those further back back off
+exponentially, with jitter, so polling stays cheap.
+
+A slot is a lease on the client's IP address. Asset requests renew it, and
+it is released when the client finishes its last initrd. If the client
+goes quiet with no download in flight, the lease expires. Queued clients
+that stop asking drop out of line. Like sessions, this all runs on the
+event loop, so nothing is locked. Under the multi-worker supervisor each
+worker holds a share of the slots and its own queue.
+"""
+
+import logging
+import random
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+logger = logging.getLogger("pxe-pilot")
+
+
+def admission_slots(slots: int, bandwidth_mbps: float, client_mbps: float) -> int:
+    """Slots to hand out: the configured count, capped by what the link can carry.
+
+    With a bandwidth limit and a per-client rate, the link fits
+    bandwidth_mbps // client_mbps downloads. 0 means admission is off.
+    """
+    if bandwidth_mbps > 0 and client_mbps > 0:
+        fits = max(1, int(bandwidth_mbps // client_mbps))
+        return min(slots, fits) if slots else fits
+    return slots
+
+
+class Lease:
+    """A download slot held by one client."""
+
+    __slots__ = ("granted", "seen")
+
+    def __init__(self, now: float):
+        self.granted = now
+        self.seen = now
+
+
+class Waiter:
+    """A client queued for a slot."""
+
+    __slots__ = ("arrived", "due", "attempts")
+
+    def __init__(self, now: float):
+        self.arrived = now
+        self.due = now
+        self.attempts = 0
+
+
+class AdmissionControl:
+    """Download slots for booting clients, with a FIFO queue for the rest.
+
+    busy(client) reports whether a client still has a download in flight;
+    its lease is not expired while it does. observe is called with each
+    admitted client's time in the queue.
+    """
+
+    def __init__(
+        self,
+        slots: int = 0,
+        *,
+        lease: float = 120.0,
+        retry: float = 5.0,
+        max_retry: float = 60.0,
+        busy: Callable[[str], bool] | None = None,
+        observe: Callable[[float], None] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        jitter: Callable[[], float] = random.random,
+    ):
+        self.slots = slots
+        self.lease = lease
+        self.retry = retry
+        self.max_retry = max_retry
+        self.busy = busy or (lambda client: False)
+        self.observe = observe
+        self.clock = clock
+        self.jitter = jitter
+        self.admitted = 0
+        self.expired = 0
+        self.max_wait = 0.0
+        self._leases: dict[str, Lease] = {}
+        # Arrival order, so the front of the line is the front of the dict
+        self._queue: OrderedDict[str, Waiter] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.slots > 0
+
+    @property
+    def in_use(self) -> int:
+        return len(self._leases)
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def admit(self, client: str) -> tuple[float, int] | None:
+        """None if client may download now, else (seconds to wait, queue position).
+
+        Positions count from 1.
+        """
+        if not self.enabled:
+            return None
+        now = self.clock()
+        self._expire(now)
+        lease = self._leases.get(client)
+        if lease is not None:
+            lease.seen = now
+            return None
+
+        free = self.slots - len(self._leases)
+        ahead = self._ahead(client, now)
+        if ahead < free:
+            waiter = self._queue.pop(client, None)
+            waited = now - waiter.arrived if waiter else 0.0
+            self._leases[client] = Lease(now)
+            self.admitted += 1
+            self.max_wait = max(self.max_wait, waited)
+            if self.observe is not None:
+                self.observe(waited)
+            if waiter is not None:
+                logger.info("Admitted %s after %.0fs in the queue", client, waited)
+            return None
+
+        waiter = self._queue.get(client)
+        if waiter is None:
+            waiter = self._queue[client] = Waiter(now)
+        waiter.attempts += 1
+        if ahead < self.slots:
+            delay = self.retry
+        else:
+            delay = min(self.max_retry, self.retry * 2 ** (waiter.attempts - 1))
+        # Up to a quarter either way, so a wave that arrived together spreads out
+        delay *= 0.75 + self.jitter() / 2
+        waiter.due = now + delay
+        return delay, ahead + 1
+
+    def touch(self, client: str) -> None:
+        """Renew client's lease, if it holds one."""
+        lease = self._leases.get(client)
+        if lease is not None:
+            lease.seen = self.clock()
+
+    def release(self, client: str) -> None:
+        """Give client's slot, or its place in the queue, to the next in line."""
+        self._queue.pop(client, None)
+        if self._leases.pop(client, None) is not None:
+            logger.debug("Released download slot of %s", client)
+
+    def status(self) -> dict:
+        """Slots in use and the queue in order, for the API."""
+        now = self.clock()
+        self._expire(now)
+        return {
+            "enabled": self.enabled,
+            "slots": self.slots,
+            "in_use": self.in_use,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "expired": self.expired,
+            "max_wait": self.max_wait,
+            "active": [
+                {"client": client, "held_for": now - lease.granted, "idle_for": now - lease.seen}
+                for client, lease in self._leases.items()
+            ],
+            "queue": [
+                {
+                    "client": client,
+                    "position": position,
+                    "waiting_for": now - waiter.arrived,
+                    "attempts": waiter.attempts,
+                    "retry_in": max(0.0, waiter.due - now),
+                }
+                for position, (client, waiter) in enumerate(self._queue.items(), 1)
+            ],
+        }
+
+    def _ahead(self, client: str, now: float) -> int:
+        """Waiters in line before client that are still coming back."""
+        ahead = 0
+        for other, waiter in self._queue.items():
+            if other == client:
+                break
+            # Late by more than a retry: likely gone, so it does not hold up the line
+            if now <= waiter.due + self.retry:
+                ahead += 1
+        return ahead
+
+    def _expire(self, now: float) -> None:
+        for client, lease in list(self._leases.items()):
+            if now - lease.seen > self.lease and not self.busy(client):
+                del self._leases[client]
+                self.expired += 1
+                logger.info(
+                    "Download slot of %s expired after %.0fs idle", client, now - lease.seen
+                )
+        for client, waiter in list(self._queue.items()):
+            if now - waiter.due > self.max_retry:
+                del self._queue[client]
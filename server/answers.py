@@ -0,0 +1,511 @@
+"""In-memory answer file index keyed by normalized MAC address."""
+
+import logging
+import re
+import secrets
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import Iterable
+from pathlib import Path
+
+from boottargets import BootTargets, parse_boot_targets
+from matcher import HostMatcher, Identity, parse_matcher
+from templates import Template, TemplateError, parse_inventory
+from validation import validate_answer, validate_many
+
+logger = logging.getLogger("pxe-pilot")
+
+MAC_RE = re.compile(r"[0-9a-f]{2}(?:-[0-9a-f]{2}){5}")
+
+# Hosts remembered by the change feed; older changes need a full listing
+MAX_CHANGES = 100_000
+
+
+def normalize_mac(mac: str) -> str:
+    """Normalize MAC address to aa-bb-cc-dd-ee-ff format."""
+    mac = mac.lower().strip()
+    if ":" in mac:
+        mac = mac.replace(":", "-")
+    if len(mac) == 12 and "-" not in mac:
+        mac = "-".join(mac[i : i + 2] for i in range(0, 12, 2))
+    return mac
+
+
+def normalize_mac_prefix(prefix: str) -> str:
+    """Normalize a MAC prefix such as an OUI ("AA:BB:CC", "aabbcc") to "aa-bb-cc"."""
+    prefix = prefix.lower().strip().replace(":", "-")
+    if "-" not in prefix:
+        prefix = "-".join(prefix[i : i + 2] for i in range(0, len(prefix), 2))
+    return prefix
+
+
+class AnswerStore:
+    """Holds default.toml, every hosts/<mac>.toml, the answer template, boot.toml
+    and match.toml in memory.
+
+    Lookups are plain dict reads and never touch the filesystem. The store is
+    filled by load() and kept current by apply_changes(), which a TreeWatcher
+    calls with the paths it saw change. Templated answers are rendered on
+    first lookup and memoized until the template or inventory changes.
+
+    Every answer is validated when it is read or rendered, so lookups serve
+    bytes whose errors are already known. load() validates in a process pool
+    of the given size (0 for one per CPU) when there are many files.
+
+    The host listing is a sorted list kept in step with every change, and
+    each host that changes is logged with the generation it changed at, so
+    listings page with a bisect and pollers can ask for only what changed.
+    Generations carry a random tag in their high bits, so one from another
+    run is recognised as foreign. Standalone the store counts its own
+    generations. Under the multi-worker supervisor, load() and
+    apply_changes() are given the supervisor's stamp for each batch, so
+    every worker numbers the same content the same way.
+    """
+
+    def __init__(self, answers_dir: Path, processes: int = 0):
+        self.answers_dir = answers_dir
+        self.processes = processes
+        self.hosts_dir = answers_dir / "hosts"
+        self.default_file = answers_dir / "default.toml"
+        self.template_file = answers_dir / "template.toml"
+        self.inventory_files = (answers_dir / "inventory.toml", answers_dir / "inventory.csv")
+        self.boot_file = answers_dir / "boot.toml"
+        self.match_file = answers_dir / "match.toml"
+        self._hosts: dict[str, bytes] = {}
+        self._default: bytes | None = None
+        self._template: Template | None = None
+        self._inventory: dict[str, dict[str, str]] = {}
+        self._rendered: dict[str, bytes] = {}
+        # "default.toml" and "hosts/<name>.toml" -> errors, invalid files only
+        self._errors: dict[str, list[str]] = {}
+        # MAC -> errors in its rendered answer, invalid renderings only
+        self._render_errors: dict[str, list[str]] = {}
+        self._index: list[str] = []
+        # MAC -> (generation, "updated" or "removed"), oldest change first
+        self._changes: OrderedDict[str, tuple[int, str]] = OrderedDict()
+        self._boot = BootTargets()
+        self._matcher = HostMatcher()
+        self._lock = threading.Lock()
+        self.generation = secrets.randbits(20) << 32
+        # The change log is complete for every generation from here on
+        self._changes_floor = self.generation
+
+    # ── Loading ──
+
+    def load(self, generation: int | None = None) -> None:
+        """Read every answer file from disk, replacing the current index.
+
+        generation is the supervisor's stamp for this state, if any.
+        """
+        hosts = {}
+        if self.hosts_dir.is_dir():
+            for host_file in self.hosts_dir.glob("*.toml"):
+                content = _read(host_file)
+                if content is not None:
+                    hosts[host_file.stem] = content
+        default = _read(self.default_file)
+        files = {f"hosts/{name}.toml": content for name, content in hosts.items()}
+        if default is not None:
+            files["default.toml"] = default
+        errors = validate_many(files, self.processes)
+
+        with self._lock:
+            old = self._hosts
+            changed = {m for m in old.keys() | hosts.keys() if old.get(m) != hosts.get(m)}
+            if changed or default != self._default or generation is not None:
+                # An unchanged reload keeps the generation, so listings still revalidate
+                self._advance(generation)
+            self._hosts = hosts
+            self._default = default
+            self._errors = errors
+            self._rebuild_index()
+            self._log_changes(changed)
+        logger.info(
+            "Loaded %d host answer files (default.toml %s)",
+            len(hosts),
+            "present" if default is not None else "missing",
+        )
+        for name in sorted(errors):
+            _log_invalid(name, errors[name])
+        if errors:
+            logger.warning("%d of %d answer files are invalid", len(errors), len(files))
+        self.load_template(generation)
+        self.load_boot_targets()
+        self.load_matcher()
+
+    def load_template(self, generation: int | None = None) -> None:
+        """Read template.toml and the inventory, dropping every memoized rendering."""
+        template = None
+        content = _read(self.template_file)
+        if content is not None:
+            try:
+                template = Template(content.decode())
+            except UnicodeDecodeError as exc:
+                logger.error("Failed to read %s: %s", self.template_file, exc)
+
+        inventory = {}
+        path = self.inventory_file
+        content = _read(path) if path is not None else None
+        if content is not None:
+            try:
+                raw = parse_inventory(path, content)
+            except ValueError as exc:  # includes TOML and decode errors
+                logger.error("Failed to load inventory %s: %s", path, exc)
+            else:
+                for mac, values in raw.items():
+                    mac = normalize_mac(mac)
+                    inventory[mac] = {"mac": mac, **values}
+
+        if template is not None:
+            for mac, values in inventory.items():
+                if missing := template.variables - values.keys():
+                    logger.warning(
+                        "Inventory host %s lacks template variables: %s",
+                        mac,
+                        ", ".join(sorted(missing)),
+                    )
+
+        with self._lock:
+            old_template, old_inventory = self._template, self._inventory
+            self._template = template
+            self._inventory = inventory
+            self._rendered = {}
+            self._render_errors = {}
+            self._rebuild_index()
+            if _parts(old_template) != _parts(template):
+                changed = old_inventory.keys() | inventory.keys()
+            else:
+                changed = {
+                    mac
+                    for mac in old_inventory.keys() | inventory.keys()
+                    if old_inventory.get(mac) != inventory.get(mac)
+                }
+            if changed or _parts(old_template) != _parts(template) or generation is not None:
+                self._advance(generation)
+            self._log_changes(changed)
+        if template is not None or inventory:
+            logger.info(
+                "Loaded answer template (%s) with %d inventory hosts",
+                "present" if template is not None else "missing",
+                len(inventory),
+            )
+
+    def load_boot_targets(self) -> None:
+        """Read boot.toml; an invalid file keeps the previous targets."""
+        content = _read(self.boot_file)
+        if content is None:
+            boot = BootTargets()
+        else:
+            try:
+                raw = parse_boot_targets(content)
+            except ValueError as exc:  # includes TOML and decode errors
+                logger.error("Failed to load boot targets %s: %s", self.boot_file, exc)
+                return
+            boot = BootTargets(
+                default=raw.default,
+                by_mac={normalize_mac(mac): target for mac, target in raw.by_mac.items()},
+                by_uuid=raw.by_uuid,
+            )
+            logger.info(
+                "Loaded boot targets for %d MACs and %d UUIDs (default %s)",
+                len(boot.by_mac),
+                len(boot.by_uuid),
+                boot.default or "menu",
+            )
+        self._boot = boot
+
+    def load_matcher(self) -> None:
+        """Read match.toml; an invalid file keeps the previous index."""
+        content = _read(self.match_file)
+        if content is None:
+            self._matcher = HostMatcher()
+            return
+        try:
+            matcher = parse_matcher(content, mac_key=normalize_mac)
+        except ValueError as exc:  # includes TOML and decode errors
+            logger.error("Failed to load host matches %s: %s", self.match_file, exc)
+            return
+        logger.info(
+            "Loaded host matches: %d MACs, %d UUIDs, %d serials, %d rules",
+            len(matcher.by_mac),
+            len(matcher.by_uuid),
+            len(matcher.by_serial),
+            len(matcher.rules),
+        )
+        self._matcher = matcher
+
+    def apply_changes(self, paths: set[Path], generation: int | None = None) -> None:
+        """Re-read the answer files behind a batch of changed paths.
+
+        generation is the supervisor's stamp for the batch, if any.
+        """
+        if generation is not None:
+            with self._lock:
+                self._advance(generation)
+        if any(path in (self.answers_dir, self.hosts_dir) for path in paths):
+            # The directory itself came or went; per-file events are unreliable.
+            self.load(generation)
+            return
+        if any(path == self.template_file or path in self.inventory_files for path in paths):
+            self.load_template(generation)
+        if self.boot_file in paths:
+            self.load_boot_targets()
+        if self.match_file in paths:
+            self.load_matcher()
+
+        paths = [
+            path
+            for path in paths
+            if path == self.default_file
+            or (path.parent == self.hosts_dir and path.suffix == ".toml")
+        ]
+        if not paths:
+            return
+        with self._lock:
+            self._advance(generation)
+            for path in paths:
+                if path == self.default_file:
+                    name = "default.toml"
+                    content = self._default = _read(path)
+                else:
+                    name = f"hosts/{path.name}"
+                    content = _read(path)
+                    if content is None:
+                        self._hosts.pop(path.stem, None)
+                    else:
+                        self._hosts[path.stem] = content
+                    self._update_index(path.stem)
+                    self._log_changes([path.stem])
+                logger.debug("Reloaded answer file %s", path)
+                errors = validate_answer(content) if content is not None else []
+                if errors:
+                    self._errors[name] = errors
+                    _log_invalid(name, errors)
+                else:
+                    self._errors.pop(name, None)
+
+    # ── Host index ──
+    # These run with the lock held.
+
+    def _listed(self, mac: str) -> bool:
+        return mac in self._hosts or (self._template is not None and mac in self._inventory)
+
+    def _rebuild_index(self) -> None:
+        templated = self._inventory if self._template is not None else {}
+        self._index = sorted(self._hosts.keys() | templated.keys())
+
+    def _update_index(self, mac: str) -> None:
+        i = bisect_left(self._index, mac)
+        present = i < len(self._index) and self._index[i] == mac
+        if self._listed(mac) and not present:
+            self._index.insert(i, mac)
+        elif present and not self._listed(mac):
+            del self._index[i]
+
+    def _advance(self, generation: int | None) -> None:
+        """Move to the next generation, or to the supervisor's stamp."""
+        if generation is None:
+            self.generation += 1
+            return
+        if generation >> 32 != self.generation >> 32:
+            # The first stamp; nothing logged under this process's own tag carries over
+            self._changes.clear()
+            self._changes_floor = generation
+        self.generation = generation
+
+    def _log_changes(self, macs: Iterable[str]) -> None:
+        """Log macs as changed at the current generation."""
+        changes = self._changes
+        for mac in macs:
+            changes.pop(mac, None)
+            changes[mac] = (self.generation, "updated" if self._listed(mac) else "removed")
+        while len(changes) > MAX_CHANGES:
+            _, (generation, _) = changes.popitem(last=False)
+            self._changes_floor = generation
+
+    # ── Lookups ──
+
+    @property
+    def default(self) -> bytes | None:
+        return self._default
+
+    @property
+    def inventory_file(self) -> Path | None:
+        """The inventory in use: inventory.toml, else inventory.csv."""
+        for path in self.inventory_files:
+            if path.is_file():
+                return path
+        return None
+
+    @property
+    def host_count(self) -> int:
+        return len(self._index)
+
+    def hosts(self) -> list[str]:
+        """Sorted list of host MACs with a host file or a templated answer."""
+        return self._index
+
+    def page(
+        self, prefix: str = "", after: str = "", limit: int | None = None
+    ) -> tuple[list[str], str | None, int]:
+        """One page of the sorted host listing.
+
+        Returns hosts starting with prefix that sort after the cursor, at most
+        limit of them, the cursor for the next page (None on the last page)
+        and the generation the page was taken at.
+        """
+        with self._lock:
+            index, generation = self._index, self.generation
+            start = bisect_right(index, after) if after else 0
+            stop = len(index)
+            if prefix:
+                start = max(start, bisect_left(index, prefix))
+                stop = bisect_left(index, prefix + "\U0010ffff")
+            if limit is not None and stop - start > limit:
+                hosts = index[start : start + limit]
+                return hosts, hosts[-1], generation
+            return index[start:stop], None, generation
+
+    def changes_since(self, generation: int) -> tuple[list[tuple[str, str]], int] | None:
+        """Hosts changed after a generation, as (mac, "updated" or "removed").
+
+        Each host appears once, oldest change first. Returns None when the
+        generation is from another run or older than the change log, and
+        the caller needs a full listing instead.
+        """
+        with self._lock:
+            current = self.generation
+            if generation >> 32 != current >> 32 or not (
+                self._changes_floor <= generation <= current
+            ):
+                return None
+            changes = []
+            for mac, (changed_at, change) in reversed(self._changes.items()):
+                if changed_at <= generation:
+                    break
+                changes.append((mac, change))
+        changes.reverse()
+        return changes, current
+
+    def get_host(self, mac: str) -> bytes | None:
+        """Host-specific answer for an already normalized MAC."""
+        return self._hosts.get(mac)
+
+    def render(self, mac: str) -> bytes | None:
+        """Templated answer for an already normalized MAC, if it is in the inventory."""
+        content = self._rendered.get(mac)
+        if content is not None:
+            return content
+
+        with self._lock:
+            template, inventory = self._template, self._inventory
+            rendered, render_errors = self._rendered, self._render_errors
+        values = inventory.get(mac)
+        if template is None or values is None:
+            return None
+        try:
+            content = template.render(values)
+        except TemplateError as exc:
+            logger.error("Cannot render answer template for %s: %s", mac, exc)
+            return None
+        errors = validate_answer(content)
+        # load_template() swaps in fresh dicts, so a render racing a reload is dropped
+        if errors:
+            render_errors[mac] = errors
+            _log_invalid(f"template.toml ({mac})", errors)
+        rendered[mac] = content
+        return content
+
+    def render_all(self) -> None:
+        """Render and validate the answer of every inventory host."""
+        for mac in list(self._inventory):
+            self.render(mac)
+
+    def lookup(
+        self, macs: list[str], identity: Identity | None = None
+    ) -> tuple[bytes | None, str | None, str]:
+        """Find the answer for given MAC addresses and where it came from.
+
+        In order: a host file named after one of the MACs; a host file
+        match.toml gives another of the MACs, the system UUID or the serial;
+        the template; a match.toml rule for the vendor and product; and
+        default.toml. Returns (content, matched, source) with source one of
+        "host", "match", "template", "rule", "default" or "not_found".
+        matched is the MAC, or for "match" and "rule" the host file name.
+        """
+        normalized = [normalize_mac(mac) for mac in macs]
+        for mac in normalized:
+            content = self._hosts.get(mac)
+            if content is not None:
+                return content, mac, "host"
+        matcher = self._matcher
+        if identity is None:
+            identity = Identity(macs=tuple(normalized))
+        for name, key in matcher.match(identity):
+            content = self._hosts.get(name)
+            if content is not None:
+                logger.debug("Matched host file %s by %s", name, key)
+                return content, name, "match"
+            logger.warning("match.toml maps %s to missing hosts/%s.toml", key, name)
+        for mac in normalized:
+            content = self.render(mac)
+            if content is not None:
+                return content, mac, "template"
+        rule = matcher.rule(identity.vendor, identity.product)
+        if rule is not None:
+            content = self._hosts.get(rule.answer)
+            if content is not None:
+                return content, rule.answer, "rule"
+            logger.warning("match.toml rule points at missing hosts/%s.toml", rule.answer)
+        if self._default is not None:
+            return self._default, None, "default"
+        return None, None, "not_found"
+
+    def boot_target(self, mac: str | None, uuid: str | None) -> str | None:
+        """Boot target from boot.toml for a normalized MAC or SMBIOS UUID.
+
+        A MAC entry wins over a UUID entry, which wins over the default.
+        Returns "<product>" or "<product>/<version>", or None for the menu.
+        """
+        return self._boot.resolve(mac, uuid)
+
+    def errors(self, source: str, mac: str | None) -> list[str]:
+        """Validation errors of the answer lookup() returned for source and match."""
+        if source in ("host", "match", "rule"):
+            return self._errors.get(f"hosts/{mac}.toml", [])
+        if source == "template":
+            return self._render_errors.get(mac, [])
+        if source == "default":
+            return self._errors.get("default.toml", [])
+        return []
+
+    @property
+    def answer_count(self) -> int:
+        """Answer files plus templated answers rendered so far."""
+        return len(self._hosts) + (self._default is not None) + len(self._rendered)
+
+    def invalid_answers(self) -> dict[str, list[str]]:
+        """Errors of every invalid answer file and templated answer rendered so far."""
+        return {
+            **self._errors,
+            **{f"template.toml ({mac})": e for mac, e in self._render_errors.items()},
+        }
+
+
+def _parts(template: Template | None) -> list[str] | None:
+    return template.parts if template is not None else None
+
+
+def _log_invalid(name: str, errors: list[str]) -> None:
+    logger.warning("Invalid answer %s: %s", name, "; ".join(errors))
+
+
+def _read(path: Path) -> bytes | None:
+    try:
+        return path.read_bytes()
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+    except OSError as exc:
+        logger.error("Failed to read answer file %s: %s", path, exc)
+        return None
@@ -0,0 +1,567 @@
+"""Boot asset catalogue with cached menu and boot script rendering.
+
+The builder writes a catalog.json at the top of the assets tree listing
+every version newest first, with a manifest.json per version holding file
+sizes, mtimes and sha256s. When the catalog is present it is the asset
+index; otherwise the tree is scanned.
+
+A version's initrd images may live in the chunk store instead of its
+directory: chunks/<aa>/<sha256> files shared by every version, listed in
+order under "store" in the manifest. Such a version is only offered while
+every chunk it needs is present.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass
+from pathlib import Path
+
+from ipxe import render_boot_target, render_menu
+
+logger = logging.getLogger("pxe-pilot")
+
+# Base URLs come from the Host header, so bound how many renderings we keep.
+MAX_CACHED_MENUS = 64
+
+# Extra initrd segments a fast-rebuild build publishes next to the stock
+# initrd, in the order iPXE should load them after it.
+INITRD_SEGMENTS = ("iso.cpio",)
+
+CATALOG = "catalog.json"
+MANIFEST = "manifest.json"
+CATALOG_FORMAT = 1
+CHUNK_DIR = "chunks"
+SHA256_RE = re.compile(r"[0-9a-f]{64}")
+
+
+@dataclass(frozen=True)
+class StoredFile:
+    """An asset kept in the chunk store, reassembled from its chunks when served."""
+
+    size: int
+    sha256: str
+    mtime_ns: int
+    chunks: tuple[Path, ...]
+    # Offset of each chunk within the file
+    offsets: tuple[int, ...]
+
+    def extents(self, offset: int, length: int) -> list[tuple[Path, int, int]]:
+        """(chunk, offset in chunk, length) covering length bytes from offset."""
+        extents = []
+        i = bisect_right(self.offsets, offset) - 1
+        while length > 0:
+            end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+            count = min(end - offset, length)
+            extents.append((self.chunks[i], offset - self.offsets[i], count))
+            offset += count
+            length -= count
+            i += 1
+        return extents
+
+
+def chunk_path(assets_dir: Path, sha256: str) -> Path:
+    return assets_dir / CHUNK_DIR / sha256[:2] / sha256
+
+
+def stored_files(assets_dir: Path, version_dir: Path) -> dict[str, StoredFile]:
+    """A version's files kept in the chunk store, by name.
+
+    Files whose manifest entry is malformed or whose chunks are not all
+    present are left out.
+    """
+    stored = {}
+    for name, entry in read_manifest(version_dir).get("files", {}).items():
+        if not isinstance(entry, dict) or "store" not in entry:
+            continue
+        try:
+            chunks, offsets, offset = [], [], 0
+            for sha, size in entry["store"]:
+                if not SHA256_RE.fullmatch(sha) or size <= 0:
+                    raise ValueError(f"bad chunk {sha!r}")
+                chunks.append(chunk_path(assets_dir, sha))
+                offsets.append(offset)
+                offset += size
+            if offset != entry["size"] or not chunks:
+                raise ValueError("chunk sizes do not add up")
+            stored_file = StoredFile(
+                offset, entry["sha256"], entry["mtime_ns"], tuple(chunks), tuple(offsets)
+            )
+        except (KeyError, TypeError, ValueError) as exc:
+            logger.warning("Ignoring stored %s in %s: %s", name, version_dir, exc)
+            continue
+        missing = sum(1 for path in set(chunks) if not path.is_file())
+        if missing:
+            logger.warning("%s/%s is missing %d chunks", version_dir, name, missing)
+            continue
+        stored[name] = stored_file
+    return stored
+
+
+def known_checksum(path: Path, st: os.stat_result) -> str | None:
+    """sha256 of a chunk (its name) or of a file its version manifest vouches for."""
+    if path.parent.parent.name == CHUNK_DIR and SHA256_RE.fullmatch(path.name):
+        return path.name
+    return manifest_checksum(path, st)
+
+
+def version_key(version: str) -> list[int]:
+    return [int(x) for x in version.replace("-", ".").split(".") if x.isdigit()]
+
+
+def scan_assets(assets_dir: Path) -> dict[str, list[str]]:
+    """Scan assets directory for available products and versions.
+
+    Returns dict of product -> sorted list of versions (newest first).
+    """
+    products = {}
+    if not assets_dir.is_dir():
+        return products
+
+    for product_dir in sorted(assets_dir.iterdir()):
+        if not product_dir.is_dir():
+            continue
+        versions = []
+        for version_dir in product_dir.iterdir():
+            if not version_dir.is_dir():
+                continue
+            # Must have both vmlinuz and initrd, the initrd possibly in the chunk store
+            if (version_dir / "vmlinuz").is_file() and (
+                (version_dir / "initrd").is_file()
+                or "initrd" in stored_files(assets_dir, version_dir)
+            ):
+                versions.append(version_dir.name)
+        if versions:
+            # Sort versions descending (newest first)
+            versions.sort(key=version_key, reverse=True)
+            products[product_dir.name] = versions
+
+    return products
+
+
+def initrd_files(version_dir: Path, stored: dict[str, StoredFile] | None = None) -> list[str]:
+    """Initrd images to load for a version, in order."""
+    stored = stored or {}
+    return ["initrd"] + [
+        name for name in INITRD_SEGMENTS if name in stored or (version_dir / name).is_file()
+    ]
+
+
+def read_manifest(version_dir: Path) -> dict:
+    """A version's manifest.json; empty if missing or invalid."""
+    try:
+        manifest = json.loads((version_dir / MANIFEST).read_text())
+        manifest["files"] = dict(manifest["files"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+    return manifest
+
+
+def manifest_chunks(path: Path, sha256: str) -> tuple[int, list[str]] | None:
+    """(chunk size, chunk sha256s) the manifest records for this content of path."""
+    manifest = read_manifest(path.parent)
+    entry = manifest.get("files", {}).get(path.name, {})
+    if entry.get("sha256") != sha256 or "chunks" not in entry:
+        return None
+    return manifest["chunk_size"], entry["chunks"]
+
+
+def manifest_checksum(path: Path, st: os.stat_result) -> str | None:
+    """sha256 of path from its version manifest, if size and mtime still match."""
+    entry = read_manifest(path.parent).get("files", {}).get(path.name, {})
+    if (entry.get("size"), entry.get("mtime_ns")) != (st.st_size, st.st_mtime_ns):
+        return None
+    return entry.get("sha256")
+
+
+def read_catalog(assets_dir: Path) -> dict | None:
+    """The builder's catalog.json, or None if absent or unusable."""
+    path = assets_dir / CATALOG
+    try:
+        catalog = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring %s: %s", path, exc)
+        return None
+    if not isinstance(catalog, dict) or catalog.get("format") != CATALOG_FORMAT:
+        logger.warning("Ignoring %s: unsupported format", path)
+        return None
+    return catalog
+
+
+def write_catalog(assets_dir: Path) -> None:
+    """Regenerate catalog.json from the tree, as the builder does after publishing.
+
+    Used after cluster replication brings in versions built on another node.
+    """
+    products = {}
+    for product, versions in scan_assets(assets_dir).items():
+        entries = []
+        for version in versions:
+            version_dir = assets_dir / product / version
+            stored = stored_files(assets_dir, version_dir)
+            initrds = initrd_files(version_dir, stored)
+            files = {}
+            for name in ["vmlinuz", *initrds]:
+                if name in stored:
+                    sf = stored[name]
+                    files[name] = {
+                        "size": sf.size,
+                        "mtime_ns": sf.mtime_ns,
+                        "sha256": sf.sha256,
+                        "stored": True,
+                    }
+                    continue
+                st = (version_dir / name).stat()
+                files[name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                if sha := manifest_checksum(version_dir / name, st):
+                    files[name]["sha256"] = sha
+            entries.append({"version": version, "initrds": initrds, "files": files})
+        products[product] = entries
+    path = assets_dir / CATALOG
+    tmp = path.with_name(f".{path.name}.tmp")
+    doc = {"format": CATALOG_FORMAT, "products": products}
+    tmp.write_text(json.dumps(doc, indent=2, sort_keys=True) + "\n")
+    os.replace(tmp, path)
+
+
+# (initrds, catalogued files, stored files) of a version that can boot
+VersionIndex = tuple[list[str], dict[str, dict], dict[str, StoredFile]]
+
+
+def _catalog_entries(catalog: dict) -> dict[tuple[str, str], dict]:
+    """Each version's catalog entry by (product, version), in catalog order."""
+    entries = {}
+    for product, versions in catalog["products"].items():
+        for entry in versions:
+            version, names, files = entry["version"], entry["initrds"], entry["files"]
+            if not isinstance(version, str) or not isinstance(names, list):
+                raise TypeError(f"bad entry for {product}")
+            if not all(isinstance(meta, dict) for meta in files.values()):
+                raise TypeError(f"bad files for {product}/{version}")
+            entries[(product, version)] = entry
+    return entries
+
+
+def _version_dirs(assets_dir: Path) -> list[tuple[str, str]]:
+    """Every <product>/<version> directory that might hold a version."""
+    if not assets_dir.is_dir():
+        return []
+    return [
+        (product_dir.name, version_dir.name)
+        for product_dir in assets_dir.iterdir()
+        if product_dir.is_dir() and product_dir.name != CHUNK_DIR
+        for version_dir in product_dir.iterdir()
+        if version_dir.is_dir()
+    ]
+
+
+def _index_version(
+    assets_dir: Path, product: str, version: str, entry: dict | None = None
+) -> VersionIndex | None:
+    """Index one version; None if it cannot boot.
+
+    With its catalog entry, the version is skipped if files have gone
+    missing since the catalog was written, so the menu never offers a
+    target that would 404, and stored files are only read from the manifest
+    when the catalog says there are some. Without one, the directory is
+    scanned.
+    """
+    version_dir = assets_dir / product / version
+    if entry is None:
+        if not (version_dir / "vmlinuz").is_file():
+            return None
+        in_store = stored_files(assets_dir, version_dir)
+        if not ((version_dir / "initrd").is_file() or "initrd" in in_store):
+            return None
+        return initrd_files(version_dir, in_store), {}, in_store
+    names = entry["initrds"]
+    in_store = {}
+    if any(meta.get("stored") for meta in entry["files"].values()):
+        in_store = stored_files(assets_dir, version_dir)
+    if not all(name in in_store or (version_dir / name).is_file() for name in ["vmlinuz", *names]):
+        return None
+    return list(names), dict(entry["files"]), in_store
+
+
+class AssetCatalog:
+    """Product/version catalogue plus rendered menus, cached per base URL.
+
+    The catalogue is loaded by load() and kept current by apply_changes(),
+    which a TreeWatcher on the assets directory calls with the paths it saw
+    change.
+    """
+
+    def __init__(self, assets_dir: Path):
+        self.assets_dir = assets_dir
+        self._products: dict[str, list[str]] | None = None
+        self._initrds: dict[tuple[str, str], list[str]] = {}
+        # "<product>/<version>/<name>" -> size, mtime_ns and sha256 from the catalog
+        self._files: dict[str, dict] = {}
+        # "<product>/<version>/<name>" -> the file's chunks, for files in the chunk store
+        self._stored: dict[str, StoredFile] = {}
+        # (product, version) -> its index, None for one on disk or catalogued that cannot boot
+        self._versions: dict[tuple[str, str], VersionIndex | None] = {}
+        # (product, version) -> catalog entry; None while the tree is scanned instead
+        self._entries: dict[tuple[str, str], dict] | None = None
+        self.source = "scan"
+        # "<product>" and "<product>/<version>" -> (product, version) to boot
+        self._targets: dict[str, tuple[str, str]] = {}
+        self._menus: dict[str, tuple[bytes, str]] = {}
+        self._boot_scripts: dict[tuple[str, str, str], tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def load(self) -> None:
+        """Reload catalog.json, or rescan without one, and drop every cached menu."""
+        catalog = read_catalog(self.assets_dir)
+        entries = None
+        if catalog is not None:
+            try:
+                entries = _catalog_entries(catalog)
+                versions = {
+                    pv: _index_version(self.assets_dir, *pv, entry) for pv, entry in entries.items()
+                }
+            except (KeyError, TypeError, AttributeError) as exc:
+                logger.warning("Ignoring malformed %s: %r", CATALOG, exc)
+                entries = None
+        if entries is None:
+            versions = {
+                pv: _index_version(self.assets_dir, *pv) for pv in _version_dirs(self.assets_dir)
+            }
+        self._swap(versions, entries)
+        logger.info(
+            "Loaded %d boot targets from %s (%s)",
+            sum(len(v) for v in self._products.values()),
+            self.assets_dir,
+            self.source,
+        )
+
+    def apply_changes(self, paths: set[Path]) -> None:
+        """Re-index only the versions behind a batch of changes.
+
+        A version is re-read when a file in its directory, one of its chunks
+        or its catalog entry changes, so publishing or replicating a version
+        does not stat every chunk of every other one. Changes to the top of
+        the tree, or the catalog coming or going, reload everything.
+        """
+        if self._products is None:
+            self.load()
+            return
+        entries = self._entries
+        dirty: set[tuple[str, str]] = set()
+        shas: set[str] = set()
+        shards: set[str] = set()
+        catalog_changed = False
+        for path in paths:
+            try:
+                parts = path.relative_to(self.assets_dir).parts
+            except ValueError:
+                continue
+            if any(part.startswith(".") for part in parts):
+                # Temporary files; the rename into place shows up under the real name
+                continue
+            if parts == (CATALOG,):
+                catalog_changed = True
+            elif len(parts) <= 1:
+                self.load()
+                return
+            elif parts[0] == CHUNK_DIR:
+                (shas if len(parts) > 2 else shards).add(parts[-1])
+            else:
+                dirty.add((parts[0], parts[1]))
+
+        if catalog_changed:
+            catalog = read_catalog(self.assets_dir)
+            try:
+                new_entries = _catalog_entries(catalog) if catalog is not None else None
+            except (KeyError, TypeError, AttributeError):
+                new_entries = None
+            if (new_entries is None) != (entries is None):
+                self.load()
+                return
+            if new_entries is not None:
+                changed = entries.keys() | new_entries.keys()
+                dirty |= {pv for pv in changed if entries.get(pv) != new_entries.get(pv)}
+                entries = new_entries
+
+        if shas or shards:
+            for pv, index in self._versions.items():
+                # A version that cannot boot may have been waiting for this chunk
+                if index is None or any(
+                    chunk.name in shas or chunk.parent.name in shards
+                    for stored_file in index[2].values()
+                    for chunk in stored_file.chunks
+                ):
+                    dirty.add(pv)
+
+        if not dirty and entries is self._entries:
+            return
+        versions = dict(self._versions)
+        for pv in dirty:
+            if entries is not None:
+                if pv in entries:
+                    versions[pv] = _index_version(self.assets_dir, *pv, entries[pv])
+                else:
+                    versions.pop(pv, None)
+            elif (self.assets_dir / pv[0] / pv[1]).is_dir() and pv[0] != CHUNK_DIR:
+                versions[pv] = _index_version(self.assets_dir, *pv)
+            else:
+                versions.pop(pv, None)
+        self._swap(versions, entries)
+        logger.info(
+            "Re-indexed %d of %d versions in %s", len(dirty), len(versions), self.assets_dir
+        )
+
+    def _swap(
+        self,
+        versions: dict[tuple[str, str], VersionIndex | None],
+        entries: dict[tuple[str, str], dict] | None,
+    ) -> None:
+        """Install a new index and drop every cached menu."""
+        if entries is not None:
+            order = [pv for pv in entries if pv in versions]
+        else:
+            by_product: dict[str, list[str]] = {}
+            for product, version in versions:
+                by_product.setdefault(product, []).append(version)
+            order = [
+                (product, version)
+                for product in sorted(by_product)
+                for version in sorted(by_product[product], key=version_key, reverse=True)
+            ]
+        products: dict[str, list[str]] = {}
+        initrds: dict[tuple[str, str], list[str]] = {}
+        files: dict[str, dict] = {}
+        stored: dict[str, StoredFile] = {}
+        for product, version in order:
+            index = versions[(product, version)]
+            if index is None:
+                continue
+            names, catalogued, in_store = index
+            products.setdefault(product, []).append(version)
+            initrds[(product, version)] = names
+            for name, meta in catalogued.items():
+                files[f"{product}/{version}/{name}"] = meta
+            for name, stored_file in in_store.items():
+                stored[f"{product}/{version}/{name}"] = stored_file
+        targets = {}
+        for product, product_versions in products.items():
+            for version in product_versions:
+                targets[f"{product}/{version}"] = (product, version)
+            # Both orders list the newest version first
+            targets[product] = (product, product_versions[0])
+        with self._lock:
+            self._products, self._initrds = products, initrds
+            self._files, self._stored = files, stored
+            self._versions, self._entries = versions, entries
+            self._targets = targets
+            self._menus = {}
+            self._boot_scripts = {}
+            self.source = "catalog" if entries is not None else "scan"
+            self.generation += 1
+
+    @property
+    def products(self) -> dict[str, list[str]]:
+        if self._products is None:
+            self.load()
+        return self._products
+
+    def warm(self) -> list[str]:
+        """Stat every kernel and initrd the menu offers, priming the inode cache.
+
+        Returns the ones that are missing.
+        """
+        missing = []
+        for product, versions in self.products.items():
+            for version in versions:
+                for name in ("vmlinuz", *self._initrds.get((product, version), ["initrd"])):
+                    if f"{product}/{version}/{name}" in self._stored:
+                        # Chunks were checked when the version was indexed
+                        continue
+                    try:
+                        os.stat(self.assets_dir / product / version / name)
+                    except OSError:
+                        missing.append(f"{product}/{version}/{name}")
+        return missing
+
+    def last_initrd(self, product: str, version: str) -> str:
+        """The initrd file a client loads last when booting product/version."""
+        return self._initrds.get((product, version), ["initrd"])[-1]
+
+    def stored(self, rel: str) -> StoredFile | None:
+        """The chunks of "<product>/<version>/<name>", if it is in the chunk store."""
+        return self._stored.get(rel)
+
+    def checksum(self, path: Path, st: os.stat_result) -> str | None:
+        """Catalogued sha256 of an asset file, if it still matches size and mtime."""
+        try:
+            rel = path.relative_to(self.assets_dir).as_posix()
+        except ValueError:
+            return None
+        entry = self._files.get(rel)
+        if entry is None or (entry.get("size"), entry.get("mtime_ns")) != (
+            st.st_size,
+            st.st_mtime_ns,
+        ):
+            return None
+        return entry.get("sha256")
+
+    def menu(self, base_url: str) -> tuple[bytes, str]:
+        """Rendered menu script and its ETag for the given asset base URL."""
+        cached = self._menus.get(base_url)
+        if cached is not None:
+            return cached
+
+        if self._products is None:
+            self.load()
+        with self._lock:
+            # load() swaps in a fresh dict, so a render racing a rescan is dropped
+            products, initrds, menus = self._products, self._initrds, self._menus
+        body = render_menu(products, base_url, initrds).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        with self._lock:
+            if len(menus) >= MAX_CACHED_MENUS:
+                menus.clear()
+            menus[base_url] = (body, etag)
+        return body, etag
+
+    def boot_script(self, target: str, base_url: str) -> tuple[bytes, str] | None:
+        """Menu-less script and its ETag for a boot target, None if it is not available.
+
+        target is "<product>" for the newest version or "<product>/<version>".
+        """
+        if self._products is None:
+            self.load()
+        with self._lock:
+            resolved = self._targets.get(target)
+            initrds, scripts = self._initrds, self._boot_scripts
+        if resolved is None:
+            return None
+        key = (base_url, *resolved)
+        cached = scripts.get(key)
+        if cached is not None:
+            return cached
+
+        body = render_boot_target(*resolved, base_url, initrds.get(resolved)).encode()
+        rendered = body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        with self._lock:
+            if len(scripts) >= MAX_CACHED_MENUS:
+                scripts.clear()
+            scripts[key] = rendered
+        return rendered
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header value matches the given ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
@@ -0,0 +1,491 @@
+"""Mass-install load test for pxe-pilot.
+
+Simulates a fleet of machines walking the full boot chain concurrently:
+
+    GET /boot.ipxe -> GET /menu.ipxe -> GET kernel + initrd -> POST /answer
+
+By default it builds a synthetic answers tree (thousands of host files) and
+sparse multi-GB assets in a temp directory, starts server.py against them on
+a free port and tears everything down afterwards. Use --url to point it at a
+server that is already running instead.
+
+With admission on (PXE_PILOT_ADMIT_SLOTS), machines follow the wait
+script /menu.ipxe hands out: sleep, then chain back. Admission tells
+clients apart by IP, so --source-ips binds each machine to its own
+127.x.y.z address. --download-timeout models iPXE giving up on a slow
+initrd, which sends the machine back to /boot.ipxe.
+
+Results are written as JSON (one entry per endpoint with p50/p90/p99 latency,
+request rate and bytes/sec) so runs can be diffed between releases:
+
+    python benchmarks/mass_boot.py --machines 200 --output results.json
+    python benchmarks/mass_boot.py --compare baseline.json --output results.json
+    python benchmarks/mass_boot.py --source-ips --download-timeout 60 \\
+        --server-env PXE_PILOT_ASSET_BANDWIDTH_MBPS=8000 --server-env PXE_PILOT_ADMIT_SLOTS=16
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+
+ANSWER_TEMPLATE = """\
+[global]
+keyboard = "en-us"
+country = "us"
+fqdn = "{hostname}.bench.local"
+mailto = "admin@example.com"
+timezone = "UTC"
+root-password = "benchmark"
+
+[network]
+source = "from-answer"
+cidr = "{ip}/16"
+dns = "10.0.0.1"
+gateway = "10.0.0.1"
+filter.ID_NET_NAME_MAC = "*{mac_bare}"
+
+[disk-setup]
+filesystem = "zfs"
+zfs.raid = "raid1"
+disk_list = ["nvme0n1", "nvme1n1"]
+"""
+
+ENDPOINTS = ("boot.ipxe", "menu.ipxe", "kernel", "initrd", "answer")
+# Boot chain restarts after a timed-out download before a machine counts as failed
+MAX_RESTARTS = 5
+
+
+# ── Synthetic data ─────────────────────────────────────────────
+
+
+def host_mac(index: int) -> str:
+    """Deterministic MAC for synthetic host number index."""
+    return "52-54-" + "-".join(f"{b:02x}" for b in index.to_bytes(4, "big"))
+
+
+def parse_size(value: str) -> int:
+    """Parse sizes like 512M or 2G (binary units) into bytes."""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def build_tree(root: Path, hosts: int, asset_size: int, kernel_size: int) -> tuple[Path, Path]:
+    """Create answers/ and assets/ under root. Returns (answers_dir, assets_dir)."""
+    answers = root / "answers"
+    hosts_dir = answers / "hosts"
+    hosts_dir.mkdir(parents=True, exist_ok=True)
+    (answers / "default.toml").write_text(
+        ANSWER_TEMPLATE.format(hostname="default", ip="10.0.0.2", mac_bare="")
+    )
+    for i in range(hosts):
+        mac = host_mac(i)
+        (hosts_dir / f"{mac}.toml").write_text(
+            ANSWER_TEMPLATE.format(
+                hostname=f"pve{i:05d}",
+                ip=f"10.{(i >> 16) & 0xFF}.{(i >> 8) & 0xFF}.{i & 0xFF}",
+                mac_bare=mac.replace("-", ""),
+            )
+        )
+
+    assets = root / "assets"
+    version_dir = assets / "proxmox-ve" / "9.1-1"
+    version_dir.mkdir(parents=True, exist_ok=True)
+    # Sparse files: realistic sizes without the disk usage.
+    for name, size in (("vmlinuz", kernel_size), ("initrd", asset_size)):
+        with open(version_dir / name, "wb") as f:
+            f.truncate(size)
+    return answers, assets
+
+
+def installer_payload(mac: str, rng: random.Random) -> dict:
+    """Body shaped like what proxmox-fetch-answer POSTs to /answer."""
+    nics = [mac] + [
+        ":".join(f"{rng.randrange(256):02x}" for _ in range(6)) for _ in range(rng.randrange(1, 4))
+    ]
+    rng.shuffle(nics)
+    return {
+        "product": {"fullname": "Proxmox VE", "product": "pve", "enable_btrfs": True},
+        "iso": {"release": "9.1", "isorelease": "1"},
+        "boot_type": "efi",
+        "dmi": {
+            "system": {"serial": f"SN{rng.randrange(10**8):08d}", "uuid": "", "sku": ""},
+            "product": {"name": "R650", "vendor": "Dell Inc."},
+        },
+        "network_interfaces": [
+            {"link": "up", "mac": nic.replace("-", ":"), "name": f"eno{n}"}
+            for n, nic in enumerate(nics, 1)
+        ],
+        "disks": [
+            {"path": f"/dev/nvme{n}n1", "size": 960197124096, "model": "SAMSUNG MZQL2960"}
+            for n in range(2)
+        ],
+    }
+
+
+# ── Measurement ────────────────────────────────────────────────
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    bytes: int = 0
+    errors: int = 0
+
+    def summary(self, wall: float) -> dict:
+        lat = sorted(self.latencies)
+        return {
+            "requests": len(lat),
+            "errors": self.errors,
+            "latency_ms": {
+                "p50": _ms(percentile(lat, 50)),
+                "p90": _ms(percentile(lat, 90)),
+                "p99": _ms(percentile(lat, 99)),
+                "max": _ms(lat[-1] if lat else 0.0),
+                "mean": _ms(sum(lat) / len(lat) if lat else 0.0),
+            },
+            "requests_per_sec": round(len(lat) / wall, 2) if wall else 0.0,
+            "bytes": self.bytes,
+            "bytes_per_sec": round(self.bytes / wall) if wall else 0,
+        }
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def source_ip(n: int) -> str:
+    """Loopback address for machine n, so the server sees distinct clients."""
+    return f"127.{1 + (n >> 16)}.{(n >> 8) & 0xFF}.{n & 0xFF}"
+
+
+class Fleet:
+    """Drives N simulated machines through the boot chain."""
+
+    def __init__(
+        self,
+        base_url: str,
+        machines: int,
+        hosts: int,
+        concurrency: int,
+        ramp: float,
+        *,
+        source_ips: bool = False,
+        download_timeout: float = 0.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.machines = machines
+        self.hosts = hosts
+        self.ramp = ramp
+        self.source_ips = source_ips
+        self.download_timeout = download_timeout
+        self.gate = asyncio.Semaphore(concurrency)
+        self.stats = {name: EndpointStats() for name in ENDPOINTS}
+        self.failed_machines = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.restarts = 0
+        self.install_seconds: list[float] = []
+
+    async def run(self) -> float:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(limits=limits, timeout=self._timeout()) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(self._machine(client, n) for n in range(self.machines)))
+            return time.perf_counter() - start
+
+    def _timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(600.0, connect=30.0)
+
+    async def _machine(self, shared: httpx.AsyncClient, n: int) -> None:
+        rng = random.Random(n)
+        if self.ramp:
+            await asyncio.sleep(self.ramp * n / self.machines)
+        async with self.gate, contextlib.AsyncExitStack() as stack:
+            client = shared
+            if self.source_ips:
+                transport = httpx.AsyncHTTPTransport(local_address=source_ip(n))
+                client = await stack.enter_async_context(
+                    httpx.AsyncClient(transport=transport, timeout=self._timeout())
+                )
+            started = time.perf_counter()
+            try:
+                for _ in range(MAX_RESTARTS + 1):
+                    if await self._boot(client, n, rng):
+                        self.install_seconds.append(time.perf_counter() - started)
+                        return
+                    self.restarts += 1
+                raise ValueError(f"gave up after {MAX_RESTARTS} restarts")
+            except (httpx.HTTPError, ValueError) as exc:
+                self.failed_machines += 1
+                print(f"machine {n}: {exc}", file=sys.stderr)
+
+    async def _boot(self, client: httpx.AsyncClient, n: int, rng: random.Random) -> bool:
+        """One pass through the boot chain; False if a download timed out."""
+        await self._get(client, "boot.ipxe", f"{self.base_url}/boot.ipxe")
+        menu = await self._get(client, "menu.ipxe", f"{self.base_url}/menu.ipxe")
+        # Queued for a download slot: sleep and chain back, as iPXE would
+        while (sleep := re.search(r"^sleep (\d+)", menu, re.M)) is not None:
+            chain = re.search(r"^chain (\S+)", menu, re.M)
+            self.waits += 1
+            self.wait_seconds += int(sleep.group(1))
+            await asyncio.sleep(int(sleep.group(1)))
+            menu = await self._get(client, "menu.ipxe", f"{self.base_url}{chain.group(1)}")
+        kernel = re.search(r"^kernel (\S+)", menu, re.M)
+        initrd = re.search(r"^initrd (\S+)", menu, re.M)
+        if not kernel or not initrd:
+            raise ValueError("menu has no boot target")
+        for name, url in (("kernel", kernel.group(1)), ("initrd", initrd.group(1))):
+            try:
+                await asyncio.wait_for(
+                    self._download(client, name, url), self.download_timeout or None
+                )
+            except TimeoutError:
+                self.stats[name].errors += 1
+                return False
+
+        # A tenth of the fleet has no host file and falls back to default.toml.
+        mac = host_mac(n % self.hosts) if self.hosts and n % 10 else "02-00-00-00-00-00"
+        started = time.perf_counter()
+        resp = await client.post(f"{self.base_url}/answer", json=installer_payload(mac, rng))
+        self._record("answer", started, len(resp.content), resp.status_code)
+        return True
+
+    async def _get(self, client: httpx.AsyncClient, name: str, url: str) -> str:
+        started = time.perf_counter()
+        resp = await client.get(url)
+        self._record(name, started, len(resp.content), resp.status_code)
+        resp.raise_for_status()
+        return resp.text
+
+    async def _download(self, client: httpx.AsyncClient, name: str, url: str) -> None:
+        started = time.perf_counter()
+        received = 0
+        async with client.stream("GET", url) as resp:
+            async for chunk in resp.aiter_raw(1 << 20):
+                received += len(chunk)
+            self._record(name, started, received, resp.status_code)
+            resp.raise_for_status()
+
+    def _record(self, name: str, started: float, size: int, status: int) -> None:
+        stats = self.stats[name]
+        if status >= 400:
+            stats.errors += 1
+            return
+        stats.latencies.append(time.perf_counter() - started)
+        stats.bytes += size
+
+
+# ── Server lifecycle ───────────────────────────────────────────
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(answers: Path, assets: Path, port: int, env: dict[str, str]) -> subprocess.Popen:
+    server_env = {
+        **os.environ,
+        "PXE_PILOT_ANSWERS_DIR": str(answers),
+        "PXE_PILOT_ASSETS_DIR": str(assets),
+        "PXE_PILOT_PORT": str(port),
+        "PXE_PILOT_LOG_LEVEL": "warning",
+        "PXE_PILOT_ASSET_MAX_STREAMS_PER_CLIENT": "0",
+        **env,
+    }
+    proc = subprocess.Popen([sys.executable, "server.py"], cwd=SERVER_DIR, env=server_env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with status {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("server did not become healthy within 60s")
+
+
+# ── Reporting ──────────────────────────────────────────────────
+
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SERVER_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return out.stdout.strip()
+
+
+def build_report(fleet: Fleet, wall: float, params: dict) -> dict:
+    installs = sorted(fleet.install_seconds)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": params,
+        "wall_seconds": round(wall, 3),
+        "machines_completed": fleet.machines - fleet.failed_machines,
+        "machines_failed": fleet.failed_machines,
+        "installs_per_minute": round((fleet.machines - fleet.failed_machines) / wall * 60, 2),
+        "install_seconds": {
+            "p50": round(percentile(installs, 50), 3),
+            "p99": round(percentile(installs, 99), 3),
+            "mean": round(sum(installs) / len(installs), 3) if installs else 0.0,
+        },
+        "restarts": fleet.restarts,
+        "admission_waits": fleet.waits,
+        "admission_wait_seconds": fleet.wait_seconds,
+        "endpoints": {name: stats.summary(wall) for name, stats in fleet.stats.items()},
+    }
+
+
+def print_report(report: dict, baseline: dict | None = None) -> None:
+    print(
+        f"\n{report['machines_completed']} machines in {report['wall_seconds']}s "
+        f"({report['installs_per_minute']} installs/min, {report['machines_failed']} failed)"
+    )
+    installs = report["install_seconds"]
+    print(
+        f"per machine: p50 {installs['p50']}s, p99 {installs['p99']}s; "
+        f"{report['restarts']} restarts, {report['admission_waits']} admission waits"
+    )
+    header = f"{'endpoint':<10} {'reqs':>6} {'err':>4} {'p50 ms':>9} {'p99 ms':>9} {'MB/s':>9}"
+    print(header + ("   p99 vs baseline" if baseline else ""))
+    for name, ep in report["endpoints"].items():
+        line = (
+            f"{name:<10} {ep['requests']:>6} {ep['errors']:>4} "
+            f"{ep['latency_ms']['p50']:>9.2f} {ep['latency_ms']['p99']:>9.2f} "
+            f"{ep['bytes_per_sec'] / 1e6:>9.1f}"
+        )
+        if baseline and name in baseline.get("endpoints", {}):
+            old = baseline["endpoints"][name]["latency_ms"]["p99"]
+            new = ep["latency_ms"]["p99"]
+            line += f"   {(new - old) / old * 100:+.1f}%" if old else "   n/a"
+        print(line)
+
+
+# ── CLI ────────────────────────────────────────────────────────
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--machines", type=int, default=100, help="simulated machines")
+    parser.add_argument("--concurrency", type=int, default=0, help="max machines booting at once")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds to spread boot starts")
+    parser.add_argument("--hosts", type=int, default=10_000, help="synthetic host answer files")
+    parser.add_argument("--asset-size", default="2G", help="sparse initrd size, e.g. 2G")
+    parser.add_argument("--kernel-size", default="12M", help="sparse vmlinuz size")
+    parser.add_argument(
+        "--source-ips",
+        action="store_true",
+        help="give each machine its own 127.x.y.z source address (local servers only)",
+    )
+    parser.add_argument(
+        "--download-timeout",
+        type=float,
+        default=0.0,
+        help="seconds before a machine abandons a download and reboots (default: never)",
+    )
+    parser.add_argument("--url", help="benchmark a running server instead of starting one")
+    parser.add_argument("--workdir", type=Path, help="reuse/keep the synthetic tree here")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--output", type=Path, help="write JSON results to this file")
+    parser.add_argument("--compare", type=Path, help="baseline JSON to compare p99 against")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    params = {
+        "machines": args.machines,
+        "concurrency": args.concurrency or args.machines,
+        "ramp": args.ramp,
+        "hosts": args.hosts,
+        "asset_size": parse_size(args.asset_size),
+        "kernel_size": parse_size(args.kernel_size),
+        "server_env": args.server_env,
+        "source_ips": args.source_ips,
+        "download_timeout": args.download_timeout,
+    }
+
+    proc = None
+    tmp = None
+    try:
+        base_url = args.url
+        if base_url is None:
+            if args.workdir:
+                root = args.workdir
+            else:
+                tmp = tempfile.TemporaryDirectory(prefix="pxe-pilot-bench-")
+                root = Path(tmp.name)
+            print(f"Building synthetic tree in {root} ({args.hosts} hosts)...", file=sys.stderr)
+            answers, assets = build_tree(
+                root, args.hosts, params["asset_size"], params["kernel_size"]
+            )
+            port = free_port()
+            env = dict(item.split("=", 1) for item in args.server_env)
+            proc = start_server(answers, assets, port, env)
+            base_url = f"http://127.0.0.1:{port}"
+
+        fleet = Fleet(
+            base_url,
+            args.machines,
+            args.hosts,
+            params["concurrency"],
+            args.ramp,
+            source_ips=args.source_ips,
+            download_timeout=args.download_timeout,
+        )
+        wall = asyncio.run(fleet.run())
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if tmp is not None:
+            tmp.cleanup()
+
+    report = build_report(fleet, wall, params)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(report, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    return 1 if fleet.failed_machines else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
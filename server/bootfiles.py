@@ -0,0 +1,57 @@
+"""iPXE binaries served over HTTP, for UEFI HTTP Boot.
+
+UEFI firmware with HTTP Boot gets a URL instead of a TFTP filename from
+DHCP and downloads the network boot program itself, so ipxe.efi can come
+from /ipxe/ipxe.efi and TFTP is not needed at all. The binaries are read
+into memory once at startup. Firmware checks the Content-Type and sends a
+HEAD first to learn the size, so both come from the in-memory copy.
+"""
+
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger("pxe-pilot")
+
+CONTENT_TYPES = {".efi": "application/efi"}
+# Architectures iPXE reports as ${buildarch} that can run the Proxmox installers
+SUPPORTED_ARCHES = frozenset({"x86_64", "i386"})
+ARCH_RE = re.compile(r"[a-z0-9_]{1,16}")
+
+
+@dataclass(frozen=True)
+class BootFile:
+    data: bytes
+    etag: str
+    content_type: str
+
+
+class BootFiles:
+    """Every file in the iPXE directory, by name, held in memory."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.files: dict[str, BootFile] = {}
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def load(self) -> None:
+        """Read the directory. A missing directory leaves nothing to serve."""
+        files = {}
+        if self.root.is_dir():
+            for path in sorted(self.root.iterdir()):
+                if path.is_file():
+                    data = path.read_bytes()
+                    files[path.name] = BootFile(
+                        data,
+                        f'"{hashlib.sha256(data).hexdigest()[:32]}"',
+                        CONTENT_TYPES.get(path.suffix, "application/octet-stream"),
+                    )
+        self.files = files
+        logger.info("Serving %d iPXE binaries from %s over HTTP", len(files), self.root)
+
+    def get(self, name: str) -> BootFile | None:
+        return self.files.get(name)
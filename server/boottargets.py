@@ -0,0 +1,51 @@
+"""Per-host boot targets: what a machine boots without showing the menu.
+
+boot.toml in the answers directory maps MACs and SMBIOS UUIDs to a target:
+"<product>" for its newest version, "<product>/<version>", or "menu" for
+the interactive menu. Machines not listed get the default, if there is one.
+"""
+
+import tomllib
+from dataclasses import dataclass, field
+
+MENU = "menu"
+
+
+@dataclass(frozen=True)
+class BootTargets:
+    """Boot targets indexed by MAC and lowercase UUID."""
+
+    default: str | None = None
+    by_mac: dict[str, str] = field(default_factory=dict)
+    by_uuid: dict[str, str] = field(default_factory=dict)
+
+    def resolve(self, mac: str | None, uuid: str | None) -> str | None:
+        """Target for a machine; None means show the menu."""
+        target = (
+            (mac and self.by_mac.get(mac))
+            or (uuid and self.by_uuid.get(uuid.lower()))
+            or self.default
+        )
+        return None if target in (None, MENU) else target
+
+
+def parse_boot_targets(data: bytes) -> BootTargets:
+    """Parse boot.toml. Raises ValueError on invalid TOML or entries.
+
+    MAC keys are returned as written; the caller normalizes them.
+    """
+    doc = tomllib.loads(data.decode())
+    default = doc.get("default")
+    if default is not None and not isinstance(default, str):
+        raise ValueError("default must be a string")
+    tables = {}
+    for table in ("hosts", "uuids"):
+        entries = doc.get(table, {})
+        if not isinstance(entries, dict) or not all(isinstance(v, str) for v in entries.values()):
+            raise ValueError(f"[{table}] must map keys to target strings")
+        tables[table] = entries
+    return BootTargets(
+        default=default,
+        by_mac=dict(tables["hosts"]),
+        by_uuid={uuid.lower(): target for uuid, target in tables["uuids"].items()},
+    )
@@ -0,0 +1,527 @@
+"""Multi-node mode: peer discovery, replication and load-aware asset URLs.
+
+Every node serves GET /cluster/state: its current load, a checksummed
+index of its answer files, and one digest per asset version plus one over
+its whole asset tree. The full asset index, chunk store included, is at
+GET /cluster/assets and is only fetched when that tree digest changes.
+Each node polls the static peer list and pulls files it lacks, or holds
+older copies of, with resumable ranged downloads verified against the
+peer's sha256. Pulled files keep the peer's mtime, so nodes converge
+instead of ping-ponging.
+Version manifests are pulled first: their chunk hashes let a resumed
+download check what it already has, and their checksums spare the asset
+index from hashing multi-GB images at startup. The chunk store is
+replicated like any other asset directory; chunks are named by their
+sha256, so they are never hashed either.
+
+/menu.ipxe asks pick_asset_url() for the node with the fewest active
+asset streams among those holding every version this node would offer,
+comparing version digests once per poll rather than files per request.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.request
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from assets import (
+    CHUNK_DIR,
+    MANIFEST,
+    known_checksum,
+    manifest_chunks,
+    read_manifest,
+    write_catalog,
+)
+
+logger = logging.getLogger("pxe-pilot")
+
+CHUNK_SIZE = 1024 * 1024
+ANSWER_FILES = (
+    "default.toml",
+    "template.toml",
+    "inventory.toml",
+    "inventory.csv",
+    "boot.toml",
+    "match.toml",
+)
+
+FileEntries = dict[str, dict[str, int | str]]
+
+
+class ReplicationError(Exception):
+    """A file pulled from a peer failed verification."""
+
+
+def asset_files(assets_dir: Path) -> list[Path]:
+    """Published asset files: <product>/<version>/<name>, skipping dotfiles."""
+    if not assets_dir.is_dir():
+        return []
+    return [
+        path
+        for path in assets_dir.glob("*/*/*")
+        if path.is_file() and not any(p.startswith(".") for p in path.parts[-3:])
+    ]
+
+
+def answer_files(answers_dir: Path) -> list[Path]:
+    """Every file the answer store reads."""
+    files = [answers_dir / name for name in ANSWER_FILES if (answers_dir / name).is_file()]
+    hosts_dir = answers_dir / "hosts"
+    if hosts_dir.is_dir():
+        files += [p for p in hosts_dir.glob("*.toml") if p.is_file() and not p.name.startswith(".")]
+    return files
+
+
+def _safe_part(part: str) -> bool:
+    return bool(part) and not part.startswith(".") and "\\" not in part and "\0" not in part
+
+
+def is_asset_path(rel: str) -> bool:
+    """Whether a peer's path has the <product>/<version>/<name> shape asset_files() lists."""
+    parts = rel.split("/")
+    return len(parts) == 3 and all(_safe_part(p) for p in parts)
+
+
+def is_answer_path(rel: str) -> bool:
+    """Whether a peer's path names a file answer_files() lists."""
+    if rel in ANSWER_FILES:
+        return True
+    folder, _, name = rel.partition("/")
+    return folder == "hosts" and _safe_part(name) and "/" not in name and name.endswith(".toml")
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileIndex:
+    """size, mtime and sha256 of a file tree, re-hashing only files that changed.
+
+    known(path, stat) may supply a trusted sha256 so the file is not read.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        lister: Callable[[Path], list[Path]],
+        known: Callable[[Path, os.stat_result], str | None] | None = None,
+    ):
+        self.root = root
+        self.lister = lister
+        self.known = known
+        self.entries: FileEntries = {}
+        # One hash over every path and checksum, for comparing whole trees
+        self.digest = tree_digest({})
+
+    def refresh(self) -> FileEntries:
+        """Rescan the tree. Blocking; run it in a thread."""
+        entries = {}
+        for path in self.lister(self.root):
+            try:
+                st = path.stat()
+                rel = path.relative_to(self.root).as_posix()
+                cached = self.entries.get(rel)
+                if cached and (cached["size"], cached["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+                    entries[rel] = cached
+                else:
+                    sha = (self.known and self.known(path, st)) or sha256_file(path)
+                    entries[rel] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha}
+            except FileNotFoundError:
+                continue
+        self.entries = entries
+        self.digest = tree_digest(entries)
+        return entries
+
+
+def tree_digest(entries: FileEntries) -> str:
+    digest = hashlib.sha256()
+    for rel in sorted(entries):
+        digest.update(f"{rel}\0{entries[rel]['sha256']}\n".encode())
+    return digest.hexdigest()
+
+
+def version_digests(assets_dir: Path, entries: FileEntries) -> dict[str, str]:
+    """One digest per <product>/<version>, over its files' names and checksums.
+
+    A version whose manifest lists chunks missing from entries is left out,
+    as it cannot be served yet.
+    """
+    versions: dict[str, FileEntries] = {}
+    for rel, entry in entries.items():
+        product, version, name = rel.split("/")
+        if product != CHUNK_DIR:
+            versions.setdefault(f"{product}/{version}", {})[name] = entry
+    digests = {}
+    for key, files in versions.items():
+        if MANIFEST in files:
+            stored = read_manifest(assets_dir / key).get("files", {}).values()
+            chunks = [
+                f"{CHUNK_DIR}/{sha[:2]}/{sha}"
+                for entry in stored
+                if isinstance(entry, dict) and isinstance(entry.get("store"), list)
+                for sha, _ in entry["store"]
+            ]
+            if not all(chunk in entries for chunk in chunks):
+                continue
+        digests[key] = tree_digest(files)
+    return digests
+
+
+def plan_pulls(local: FileEntries, remote: FileEntries) -> list[str]:
+    """Files to pull: missing here, or different and newer on the peer.
+
+    Within a version the manifest is pulled first, for its chunk hashes, and
+    the initrd last, so the catalogue only lists the version once the rest of
+    its files are in place. The chunk store sorts before the proxmox-*
+    products, so a stored initrd's chunks arrive before its manifest.
+    """
+    wanted = []
+    for rel, theirs in remote.items():
+        ours = local.get(rel)
+        if ours is None or (
+            ours["sha256"] != theirs["sha256"] and theirs["mtime_ns"] > ours["mtime_ns"]
+        ):
+            wanted.append(rel)
+
+    def order(rel: str):
+        folder, _, name = rel.rpartition("/")
+        return folder, {MANIFEST: 0, "initrd": 2}.get(name, 1), name
+
+    wanted.sort(key=order)
+    return wanted
+
+
+def verified_prefix(part: Path, chunk_size: int, chunks: list[str], size: int, digest) -> int:
+    """Length of part's leading chunks that match chunks, feeding them to digest.
+
+    Anything after the first mismatch is truncated away.
+    """
+    good = 0
+    with open(part, "r+b") as f:
+        for expected in chunks:
+            block = f.read(chunk_size)
+            if not block or (len(block) < chunk_size and good + len(block) != size):
+                break
+            if hashlib.sha256(block).hexdigest() != expected:
+                break
+            digest.update(block)
+            good += len(block)
+        f.truncate(good)
+    return good
+
+
+def download(
+    url: str,
+    dest: Path,
+    expected: dict,
+    *,
+    timeout: float,
+    chunks: tuple[int, list[str]] | None = None,
+) -> int:
+    """Fetch url into dest, resuming a partial .part file. Returns bytes fetched.
+
+    The result must match expected's size and sha256 or it is discarded.
+    With chunks, (chunk size, chunk sha256s), a partial file is checked chunk
+    by chunk and resumed from the first bad one instead of failing at the end.
+    Blocking; run it in a thread.
+    """
+    part = dest.with_name(f".{dest.name}.part")
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    offset = part.stat().st_size if part.exists() else 0
+    if offset > expected["size"]:
+        offset = 0
+
+    digest = hashlib.sha256()
+    if offset and chunks:
+        offset = verified_prefix(part, *chunks, expected["size"], digest)
+    elif offset:
+        with open(part, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+
+    fetched = 0
+    if offset < expected["size"] or not part.exists():
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request, timeout=timeout) as resp:
+            if offset and resp.status != 206:
+                # Peer ignored the range; start over
+                offset = 0
+                digest = hashlib.sha256()
+            with open(part, "ab" if offset else "wb") as f:
+                while chunk := resp.read(CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    fetched += len(chunk)
+
+    size = part.stat().st_size
+    if size != expected["size"] or digest.hexdigest() != expected["sha256"]:
+        part.unlink(missing_ok=True)
+        raise ReplicationError(f"{url}: checksum mismatch, discarded")
+    os.utime(part, ns=(expected["mtime_ns"], expected["mtime_ns"]))
+    os.replace(part, dest)
+    return fetched
+
+
+def fetch_json(url: str, *, timeout: float) -> dict:
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return json.load(resp)
+
+
+@dataclass
+class Peer:
+    """Last known state of one peer."""
+
+    url: str
+    healthy: bool = False
+    load: int = 0
+    # Fetched from /cluster/assets only when assets_digest changes
+    assets: FileEntries = field(default_factory=dict)
+    assets_digest: str = ""
+    versions: dict[str, str] = field(default_factory=dict)
+    answers: FileEntries = field(default_factory=dict)
+    last_seen: float = 0.0
+    error: str | None = None
+    # Clients sent here since the last poll, on top of the reported load
+    assigned: int = 0
+    # has_assets() result and the (local, peer) version digest maps it was computed for
+    holds: bool = False
+    holds_checked: tuple[dict, dict] | None = None
+
+
+class Cluster:
+    """Peer polling, replication and asset URL selection for one node."""
+
+    def __init__(
+        self,
+        node_url: str,
+        peers: list[str],
+        assets_dir: Path,
+        answers_dir: Path,
+        *,
+        load: Callable[[], int],
+        interval: float = 5.0,
+        timeout: float = 5.0,
+        replicate: bool = True,
+    ):
+        self.node_url = node_url.rstrip("/")
+        self.peers = {
+            url: Peer(url) for url in (p.rstrip("/") for p in peers) if url != self.node_url
+        }
+        self.assets = FileIndex(assets_dir, asset_files, known_checksum)
+        self.answers = FileIndex(answers_dir, answer_files)
+        self.versions: dict[str, str] = {}
+        self.load = load
+        self.interval = interval
+        self.timeout = timeout
+        self.replicate = replicate
+        self.bytes_replicated = 0
+        self.files_replicated = 0
+        self._assigned_self = 0
+        self._errors: dict[str, str] = {}
+        self._task: asyncio.Task | None = None
+        self._replication: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.peers)
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self._run(), name="cluster")
+        return self._task
+
+    async def stop(self) -> None:
+        for task in (self._task, self._replication):
+            if task is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+        self._task = self._replication = None
+
+    async def _run(self) -> None:
+        logger.info("Cluster mode: %d peers, polling every %.1fs", len(self.peers), self.interval)
+        while True:
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Cluster sync failed")
+            # Multi-GB pulls run alongside polling so peer loads stay fresh
+            if self.replicate and (self._replication is None or self._replication.done()):
+                self._replication = asyncio.create_task(self.pull(), name="cluster-pull")
+            await asyncio.sleep(self.interval)
+
+    async def sync(self) -> None:
+        """Rescan local files and poll every peer."""
+        await asyncio.to_thread(self.refresh_assets)
+        await asyncio.to_thread(self.answers.refresh)
+        await asyncio.gather(*(self._poll(peer) for peer in self.peers.values()))
+        self._assigned_self = 0
+
+    async def pull(self) -> None:
+        """Pull newer or missing files from healthy peers."""
+        try:
+            await asyncio.to_thread(self._replicate)
+        except Exception:
+            logger.exception("Cluster replication failed")
+
+    def refresh_assets(self) -> None:
+        """Rescan the asset tree and its version digests. Blocking; run it in a thread."""
+        self.assets.refresh()
+        self.versions = version_digests(self.assets.root, self.assets.entries)
+
+    async def _poll(self, peer: Peer) -> None:
+        try:
+            state = await asyncio.to_thread(
+                fetch_json, f"{peer.url}/cluster/state", timeout=self.timeout
+            )
+            assets = peer.assets
+            if state.get("assets_digest") != peer.assets_digest:
+                assets = await asyncio.to_thread(
+                    fetch_json, f"{peer.url}/cluster/assets", timeout=self.timeout
+                )
+        except (OSError, ValueError) as exc:
+            if peer.healthy or peer.error is None:
+                logger.warning("Peer %s unreachable: %s", peer.url, exc)
+            peer.healthy, peer.error = False, str(exc)
+            return
+        if not peer.healthy:
+            logger.info("Peer %s is up", peer.url)
+        peer.healthy, peer.error = True, None
+        peer.load = int(state.get("load", 0))
+        peer.assets, peer.assets_digest = assets, state.get("assets_digest", "")
+        peer.versions = state.get("versions", {})
+        peer.answers = state.get("answers", {})
+        peer.last_seen = time.time()
+        peer.assigned = 0
+
+    def state(self) -> dict:
+        """What peers poll from /cluster/state."""
+        return {
+            "node": self.node_url,
+            "load": self.load(),
+            "assets_digest": self.assets.digest,
+            "versions": self.versions,
+            "answers": self.answers.entries,
+        }
+
+    # ── Replication ──
+
+    def _replicate(self) -> None:
+        for kind, index, url_path, valid in (
+            ("answers", self.answers, "cluster/answers", is_answer_path),
+            ("assets", self.assets, "assets", is_asset_path),
+        ):
+            pulled = 0
+            for peer in self.peers.values():
+                if not peer.healthy:
+                    continue
+                remote = getattr(peer, kind)
+                for rel in plan_pulls(index.entries, remote):
+                    # The path comes from the peer; never let it lead out of the tree
+                    if not valid(rel):
+                        self._refuse(peer, f"{url_path}/{rel}")
+                        continue
+                    pulled += self._pull(peer, f"{url_path}/{rel}", index.root / rel, remote[rel])
+                if kind == "assets":
+                    self.refresh_assets()
+                else:
+                    index.refresh()
+            if kind == "assets" and pulled:
+                # New versions only reach the menu through the catalog
+                write_catalog(index.root)
+
+    def _refuse(self, peer: Peer, url_path: str) -> None:
+        message = "not a path this node replicates"
+        if self._errors.get(url_path) != message:
+            logger.warning("Refusing to replicate %r from %s: %s", url_path, peer.url, message)
+        self._errors[url_path] = message
+
+    def _pull(self, peer: Peer, url_path: str, dest: Path, expected: dict) -> bool:
+        chunks = manifest_chunks(dest, expected["sha256"]) if dest.name != MANIFEST else None
+        try:
+            fetched = download(
+                f"{peer.url}/{url_path}", dest, expected, timeout=self.timeout, chunks=chunks
+            )
+        except (OSError, ReplicationError) as exc:
+            message = str(exc)
+            if self._errors.get(url_path) != message:
+                logger.warning("Replicating %s from %s failed: %s", url_path, peer.url, message)
+            self._errors[url_path] = message
+            return False
+        self._errors.pop(url_path, None)
+        self.bytes_replicated += fetched
+        self.files_replicated += 1
+        logger.info("Replicated %s from %s (%d bytes)", url_path, peer.url, fetched)
+        return True
+
+    # ── Status and selection ──
+
+    @property
+    def consistent(self) -> bool:
+        """Whether every healthy peer holds the same answer files as this node."""
+        local = {rel: e["sha256"] for rel, e in self.answers.entries.items()}
+        return all(
+            {rel: e["sha256"] for rel, e in peer.answers.items()} == local
+            for peer in self.peers.values()
+            if peer.healthy
+        )
+
+    def has_assets(self, peer: Peer) -> bool:
+        """Whether peer holds every version this node would put in its menu."""
+        # Both digest maps are replaced, never mutated, on each rescan and poll
+        mine, theirs = peer.holds_checked or (None, None)
+        if mine is not self.versions or theirs is not peer.versions:
+            peer.holds = all(
+                peer.versions.get(key) == digest for key, digest in self.versions.items()
+            )
+            peer.holds_checked = (self.versions, peer.versions)
+        return peer.holds
+
+    def pick_asset_url(self, own_url: str) -> str:
+        """Base URL of the least-loaded node able to serve this node's assets."""
+        best_url = self.node_url or own_url
+        best_load = self.load() + self._assigned_self
+        best_peer = None
+        for peer in self.peers.values():
+            if not peer.healthy or not self.has_assets(peer):
+                continue
+            load = peer.load + peer.assigned
+            if load < best_load:
+                best_url, best_load, best_peer = peer.url, load, peer
+        if best_peer is None:
+            self._assigned_self += 1
+        else:
+            best_peer.assigned += 1
+        return best_url
+
+    def status(self) -> dict:
+        return {
+            "node": self.node_url,
+            "load": self.load(),
+            "answers_digest": self.answers.digest,
+            "answers_consistent": self.consistent,
+            "files_replicated": self.files_replicated,
+            "bytes_replicated": self.bytes_replicated,
+            "peers": [
+                {
+                    "url": peer.url,
+                    "healthy": peer.healthy,
+                    "load": peer.load,
+                    "has_assets": self.has_assets(peer),
+                    "last_seen": peer.last_seen or None,
+                    "error": peer.error,
+                }
+                for peer in self.peers.values()
+            ],
+        }
@@ -0,0 +1,305 @@
+"""Structured event log, and logging that stays off the request path.
+
+Every request to the boot endpoints, and every TFTP transfer, is recorded
+as one event: a flat dict with a timestamp, a sequence number, the kind
+and fields such as client, MAC, status, latency and bytes. The newest
+events are kept in a ring buffer that GET /events searches by MAC, kind
+and time. When a sink is configured, events are also written as JSON
+lines by a background thread, in batches of up to BATCH_SIZE per write.
+
+Recording only appends to the ring buffer and a queue, so a flood of
+installers never waits on disk or a slow log collector. Past
+MAX_PENDING unwritten events, new ones are dropped from the sink (not
+from the buffer) and counted.
+
+configure_logging() does the same for ordinary log records: they are
+queued by a QueueHandler and formatted and written by a QueueListener
+thread, as text or as JSON lines.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import TextIO
+from urllib.parse import parse_qs
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger("pxe-pilot")
+
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 1.0
+MAX_PENDING = 100_000
+TEXT_FORMAT = logging.BASIC_FORMAT
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger and message."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(level: str, json_lines: bool = False) -> None:
+    """Send log records through a queue to a stderr writer thread.
+
+    Replaces the handlers an earlier call installed, so it is safe to call
+    again (the tests reload the server module).
+    """
+    global _listener
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+
+
+def stop_logging() -> None:
+    """Write out queued log records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def open_sink(target: str) -> TextIO | None:
+    """The stream events are written to: "" for none, "-" for stdout, else a file."""
+    if not target:
+        return None
+    if target == "-":
+        return sys.stdout
+    # Open for the life of the process; every batch is flushed
+    return open(target, "a", encoding="utf-8")  # noqa: SIM115
+
+
+class EventLog:
+    """Ring buffer of recent events, written to an optional sink in batches.
+
+    record() and query() run on the event loop; only the writer thread
+    touches the sink. With forward set, as in a worker under the
+    multi-worker supervisor, events are handed to it as (kind, fields)
+    instead of being kept; the supervisor's log numbers, buffers and
+    writes them.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 10_000,
+        sink: TextIO | None = None,
+        *,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_pending: int = MAX_PENDING,
+        clock: Callable[[], float] = time.time,
+        forward: Callable[[str, dict], None] | None = None,
+    ):
+        self.capacity = capacity
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.forward = forward
+        self.seq = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self._buffer: deque[dict] = deque(maxlen=capacity or None)
+        self._pending: queue.Queue = queue.Queue(max_pending)
+        self._writer: threading.Thread | None = None
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def pending(self) -> int:
+        return self._pending.qsize()
+
+    def record(self, kind: str, **fields) -> dict:
+        """Add an event; fields must be JSON-serializable."""
+        ts = round(self.clock(), 6)
+        if self.forward is not None:
+            self.forward(kind, {"ts": ts, **fields})
+            return {"ts": ts, "kind": kind, **fields}
+        self.seq += 1
+        # A forwarded event keeps the ts it was recorded with
+        event = {"ts": ts, "seq": self.seq, "kind": kind, **fields}
+        if self.capacity:
+            self._buffer.append(event)
+        if self.sink is not None:
+            try:
+                self._pending.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+        return event
+
+    def query(
+        self,
+        *,
+        mac: str | None = None,
+        client: str | None = None,
+        kind: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        after: int | None = None,
+        limit: int = 100,
+    ) -> list[dict]:
+        """The newest matching events, oldest first.
+
+        since and until are Unix times; after is a sequence number, for
+        polling with the last seq seen.
+        """
+        found = []
+        for event in reversed(self._buffer):
+            if (since is not None and event["ts"] < since) or (
+                after is not None and event["seq"] <= after
+            ):
+                break
+            if until is not None and event["ts"] > until:
+                continue
+            if kind is not None and event["kind"] != kind:
+                continue
+            if client is not None and event.get("client") != client:
+                continue
+            if mac is not None and event.get("mac") != mac and mac not in event.get("macs", ()):
+                continue
+            found.append(event)
+            if len(found) >= limit:
+                break
+        found.reverse()
+        return found
+
+    def start(self) -> None:
+        """Start the writer thread, if there is a sink."""
+        if self.sink is None or self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._write_loop, name="event-log", daemon=True)
+        self._writer.start()
+
+    def stop(self) -> None:
+        """Write out every pending event and stop the writer."""
+        if self._writer is not None:
+            self._pending.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._pending.get()]
+            # Wait a little for more, so a busy second costs a few writes, not thousands
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(
+                        self._pending.get(timeout=remaining)
+                        if remaining > 0
+                        else self._pending.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+            done = batch[-1] is None
+            events = [event for event in batch if event is not None]
+            if events:
+                self._write(events)
+            if done:
+                return
+
+    def _write(self, events: list[dict]) -> None:
+        try:
+            self.sink.write("".join(json.dumps(event) + "\n" for event in events))
+            self.sink.flush()
+        except (OSError, ValueError) as exc:
+            self.dropped += len(events)
+            logger.error("Failed to write %d events: %s", len(events), exc)
+            return
+        self.written += len(events)
+        self.batches += 1
+
+
+class EventMiddleware:
+    """Records an event per HTTP request: client, path, status, latency and bytes.
+
+    Handlers add fields, such as the answer source, by setting
+    request.state.event to a dict. A ?mac= query parameter is recorded
+    normalized. Paths in skip (exact match) are not recorded.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        log: EventLog,
+        normalize_mac: Callable[[str], str],
+        skip: frozenset[str] = frozenset(),
+    ):
+        self.app = app
+        self.log = log
+        self.normalize_mac = normalize_mac
+        self.skip = skip
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.skip:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        sent = 0
+
+        async def send_wrapper(message) -> None:
+            nonlocal status, sent
+            kind = message["type"]
+            if kind == "http.response.start":
+                status = message["status"]
+            elif kind == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif kind == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        state = scope.setdefault("state", {})
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            fields = {
+                "client": scope["client"][0] if scope.get("client") else "unknown",
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "ms": round((time.perf_counter() - started) * 1000, 3),
+                "bytes": sent,
+            }
+            mac = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("mac")
+            if mac and mac[0]:
+                fields["mac"] = self.normalize_mac(mac[0])
+            # Handler fields win, e.g. the MAC an asset lease was matched to
+            self.log.record("http", **{**fields, **state.get("event", {})})
+
+
+atexit.register(stop_logging)
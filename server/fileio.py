@@ -0,0 +1,103 @@
+"""Blocking filesystem calls kept off the event loop, and a watch on the loop.
+
+FileIO runs blocking calls in its own bounded thread pool with a timeout.
+A hung mount can then tie up at most that pool: callers get TimeoutError
+(an OSError) instead of the event loop, and with it every asset stream and
+TFTP transfer, stalling. LoopLag measures how late the loop wakes from a
+short sleep, which is how anything still blocking it would show up.
+"""
+
+import asyncio
+import contextlib
+import logging
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+logger = logging.getLogger("pxe-pilot")
+
+T = TypeVar("T")
+
+# Passed as timeout to use the pool's own
+DEFAULT = object()
+
+
+class FileIO:
+    """Bounded thread pool for blocking file calls, each with a timeout."""
+
+    def __init__(self, threads: int = 32, timeout: float = 10.0):
+        self.threads = threads
+        self.timeout = timeout
+        self.pending = 0
+        self.timeouts = 0
+        self._pool: ThreadPoolExecutor | None = None
+
+    async def run(self, func: Callable[..., T], *args, timeout=DEFAULT) -> T:
+        """Run func(*args) in the pool and return its result.
+
+        timeout defaults to the pool's; None waits as long as it takes, for
+        jobs like reloading an index. A call still queued when it times out
+        never runs; one already running finishes in its thread, unawaited.
+        """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="pxe-io")
+        timeout = self.timeout if timeout is DEFAULT else timeout
+        self.pending += 1
+        try:
+            future = asyncio.wrap_future(self._pool.submit(func, *args))
+            return await asyncio.wait_for(future, timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            name = getattr(func, "__qualname__", repr(func))
+            raise TimeoutError(f"{name}{args!r} did not finish in {timeout}s") from None
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        """Drop queued calls; threads stuck in a call are left to finish."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class LoopLag:
+    """Samples how late the event loop wakes up from a short sleep."""
+
+    def __init__(
+        self,
+        interval: float = 0.5,
+        *,
+        warn_after: float = 1.0,
+        observe: Callable[[float], None] | None = None,
+    ):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.observe = observe
+        self.last = 0.0
+        self.max = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self._run(), name="loop-lag")
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            if self.observe is not None:
+                self.observe(lag)
+            if lag >= self.warn_after:
+                logger.warning("Event loop was blocked for %.2fs", lag)
@@ -0,0 +1,135 @@
+"""iPXE script generation."""
+
+PRODUCT_NAMES = {
+    "proxmox-ve": "Proxmox VE",
+    "proxmox-bs": "Proxmox BS",
+    "proxmox-mg": "Proxmox MG",
+}
+KERNEL_OPTS = (
+    "vga=791 video=vesafb:ywrap,mtrr ramdisk_size=2147483648 "
+    "rw quiet splash=silent proxmox-start-auto-installer"
+)
+# What boot.ipxe passes to /menu.ipxe, expanded by iPXE on the client
+CLIENT_QUERY = "mac=${mac:hexhyp}&uuid=${uuid}&arch=${buildarch}&platform=${platform}"
+
+
+def render_menu(
+    products: dict[str, list[str]],
+    base_url: str,
+    initrds: dict[tuple[str, str], list[str]] | None = None,
+) -> str:
+    """Interactive menu listing every product/version with its boot target.
+
+    initrds maps (product, version) to the initrd files to load, in order;
+    versions not listed load the single "initrd".
+    """
+    initrds = initrds or {}
+    lines = ["#!ipxe", "", "menu pxe-pilot: Select Installation"]
+
+    if not products:
+        lines.append("item --gap -- No boot assets found.")
+        lines.append("item --gap -- Run pxe-pilot-builder to create assets.")
+        lines.append("item exit Exit to iPXE shell")
+        lines.append("choose selected || goto exit")
+        lines.append("")
+        lines.append(":exit")
+        lines.append("shell")
+        return "\n".join(lines) + "\n"
+
+    # Menu items
+    for product, versions in products.items():
+        display_name = PRODUCT_NAMES.get(product, product)
+        lines.append(f"item --gap -- === {display_name} ===")
+        for version in versions:
+            item_id = f"{product}-{version}"
+            lines.append(f"item {item_id} {display_name} {version}")
+
+    lines.append("item --gap --")
+    lines.append("item exit Exit to iPXE shell")
+    lines.append("choose selected && goto ${selected} || goto exit")
+    lines.append("")
+
+    # Boot targets
+    for product, versions in products.items():
+        for version in versions:
+            item_id = f"{product}-{version}"
+            lines.append(f":{item_id}")
+            lines.append(f"kernel {base_url}/assets/{product}/{version}/vmlinuz {KERNEL_OPTS}")
+            for name in initrds.get((product, version), ["initrd"]):
+                lines.append(f"initrd {base_url}/assets/{product}/{version}/{name}")
+            lines.append("boot || goto menu")
+            lines.append("")
+
+    lines.append(":exit")
+    lines.append("shell")
+
+    return "\n".join(lines) + "\n"
+
+
+def render_boot_target(
+    product: str,
+    version: str,
+    base_url: str,
+    initrds: list[str] | None = None,
+) -> str:
+    """Script that boots one product/version straight away, without a menu.
+
+    If a download or the boot fails, the client falls back to the interactive
+    menu, passing on its MAC, UUID and architecture as boot.ipxe does.
+    """
+    lines = [
+        "#!ipxe",
+        "",
+        f"echo pxe-pilot: booting {PRODUCT_NAMES.get(product, product)} {version}",
+        f"kernel {base_url}/assets/{product}/{version}/vmlinuz {KERNEL_OPTS} || goto menu",
+    ]
+    for name in initrds or ["initrd"]:
+        lines.append(f"initrd {base_url}/assets/{product}/{version}/{name} || goto menu")
+    lines.append("boot || goto menu")
+    lines.append("")
+    lines.append(":menu")
+    lines.append(f"chain /menu.ipxe?menu=1&{CLIENT_QUERY}")
+    return "\n".join(lines) + "\n"
+
+
+def render_wait(seconds: float, position: int, queued: int, url: str) -> str:
+    """Script for a client queued for a download slot: sleep, then ask again.
+
+    A failed chain sleeps and retries too, so a busy server never leaves the
+    client at the iPXE shell.
+    """
+    delay = max(1, round(seconds))
+    return (
+        "\n".join(
+            [
+                "#!ipxe",
+                "",
+                f"echo pxe-pilot: waiting for a download slot, {position} of {queued} in line",
+                ":retry",
+                f"echo pxe-pilot: retrying in {delay}s",
+                f"sleep {delay}",
+                f"chain {url} || goto retry",
+            ]
+        )
+        + "\n"
+    )
+
+
+def render_unsupported(arch: str) -> str:
+    """Script for a client whose iPXE build cannot boot the installers.
+
+    It hands control back to the firmware, which moves on to the next boot
+    device, instead of downloading a kernel it cannot run.
+    """
+    return (
+        "\n".join(
+            [
+                "#!ipxe",
+                "",
+                f"echo pxe-pilot: {arch} clients cannot run the Proxmox installers (x86_64 only)",
+                "sleep 10",
+                "exit 1",
+            ]
+        )
+        + "\n"
+    )
@@ -0,0 +1,218 @@
+"""Host matching by more than the MAC a host file is named after.
+
+match.toml in the answers directory gives host answer files further
+identities: extra NIC MACs, SMBIOS system UUIDs and DMI serial numbers. It
+can also hold vendor/product rules that pick an answer for a whole model.
+Everything is compiled into hash maps when the file is loaded, so matching
+an installer costs one lookup per identity it reports. Rules are tried in
+file order, once per distinct vendor and product; the result is remembered.
+
+    [hosts.pve01]                 # answers from hosts/pve01.toml
+    macs = ["aa:bb:cc:dd:ee:01"]
+    uuids = ["4c4c4544-0035-4810-8056-b4c04f4e3332"]
+    serials = ["CZ20310ABC"]
+
+    [[rules]]
+    vendor = "Dell Inc."
+    product = "PowerEdge R6*"     # fnmatch glob, case-insensitive
+    answer = "dell-r6xx"          # hosts/dell-r6xx.toml
+"""
+
+import fnmatch
+import tomllib
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+# DMI values firmware fills in when the real one is unset; never identities
+PLACEHOLDERS = frozenset(
+    {
+        "",
+        "0",
+        "none",
+        "n/a",
+        "na",
+        "not specified",
+        "not applicable",
+        "default string",
+        "to be filled by o.e.m.",
+        "system serial number",
+        "0123456789",
+        "00000000-0000-0000-0000-000000000000",
+        "ffffffff-ffff-ffff-ffff-ffffffffffff",
+        "03000200-0400-0500-0006-000700080009",
+    }
+)
+# Distinct vendor/product pairs whose rule result is remembered
+MAX_MEMO = 4096
+
+
+def identity_value(value) -> str | None:
+    """Case-folded DMI value, or None for missing and placeholder values."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower()
+    return None if value in PLACEHOLDERS else value
+
+
+@dataclass(frozen=True)
+class Identity:
+    """What an installer reports about its machine, normalized for matching."""
+
+    macs: tuple[str, ...] = ()
+    uuid: str | None = None
+    serial: str | None = None
+    vendor: str | None = None
+    product: str | None = None
+
+    @classmethod
+    def from_payload(cls, body: dict, macs: list[str]) -> "Identity":
+        """Identity from the JSON proxmox-fetch-answer POSTs to /answer.
+
+        macs are the already normalized NIC MACs. Both kebab-case and
+        snake_case DMI keys are read.
+        """
+        dmi = body.get("dmi")
+        dmi = dmi if isinstance(dmi, dict) else {}
+        system = _table(dmi, "system")
+        product = _table(dmi, "product")
+        return cls(
+            macs=tuple(macs),
+            uuid=identity_value(_field(system, "uuid")),
+            serial=identity_value(_field(system, "serial", "serial-number")),
+            vendor=identity_value(
+                _field(system, "vendor", "manufacturer") or _field(product, "vendor")
+            ),
+            product=identity_value(
+                _field(system, "name", "product-name") or _field(product, "name")
+            ),
+        )
+
+
+def _table(dmi: dict, name: str) -> dict:
+    table = dmi.get(name)
+    return table if isinstance(table, dict) else {}
+
+
+def _field(table: dict, *names: str):
+    for name in names:
+        for key in (name, name.replace("-", "_")):
+            if table.get(key):
+                return table[key]
+    return None
+
+
+@dataclass(frozen=True)
+class Rule:
+    """Answer for every machine whose vendor and product match the globs."""
+
+    answer: str
+    vendor: str | None = None
+    product: str | None = None
+
+    def matches(self, vendor: str | None, product: str | None) -> bool:
+        return _glob(self.vendor, vendor) and _glob(self.product, product)
+
+
+def _glob(pattern: str | None, value: str | None) -> bool:
+    if pattern is None:
+        return True
+    return value is not None and fnmatch.fnmatchcase(value, pattern)
+
+
+@dataclass(frozen=True)
+class HostMatcher:
+    """Identity keys indexed to host answer names, and the model rules in order."""
+
+    by_mac: dict[str, str] = field(default_factory=dict)
+    by_uuid: dict[str, str] = field(default_factory=dict)
+    by_serial: dict[str, str] = field(default_factory=dict)
+    rules: tuple[Rule, ...] = ()
+    _memo: dict[tuple[str | None, str | None], Rule | None] = field(
+        default_factory=dict, compare=False, repr=False
+    )
+
+    def __len__(self) -> int:
+        return len(self.by_mac) + len(self.by_uuid) + len(self.by_serial) + len(self.rules)
+
+    def match(self, identity: Identity) -> list[tuple[str, str]]:
+        """Host answer names for an identity, best first, as (name, matched key).
+
+        Precedence: MAC, then system UUID, then serial. Callers take the
+        first name that still has a file. Rules are separate; see rule().
+        """
+        found = [(self.by_mac[mac], f"mac {mac}") for mac in identity.macs if mac in self.by_mac]
+        if identity.uuid in self.by_uuid:
+            found.append((self.by_uuid[identity.uuid], f"uuid {identity.uuid}"))
+        if identity.serial in self.by_serial:
+            found.append((self.by_serial[identity.serial], f"serial {identity.serial}"))
+        return found
+
+    def rule(self, vendor: str | None, product: str | None) -> Rule | None:
+        """First rule matching a vendor and product."""
+        if not self.rules or (vendor is None and product is None):
+            return None
+        key = (vendor, product)
+        if key in self._memo:
+            return self._memo[key]
+        rule = next((r for r in self.rules if r.matches(vendor, product)), None)
+        if len(self._memo) >= MAX_MEMO:
+            self._memo.clear()
+        self._memo[key] = rule
+        return rule
+
+
+def parse_matcher(data: bytes, mac_key: Callable[[str], str] = str.strip) -> HostMatcher:
+    """Parse match.toml. Raises ValueError on invalid TOML or entries.
+
+    mac_key normalizes MACs the way lookups will. An identity claimed by
+    two hosts is an error, so which host it selects never depends on file
+    order.
+    """
+    doc = tomllib.loads(data.decode())
+    hosts = doc.get("hosts", {})
+    if not isinstance(hosts, dict):
+        raise ValueError("[hosts] must be a table of host tables")
+    by_key: dict[str, dict[str, str]] = {"macs": {}, "uuids": {}, "serials": {}}
+    for name, entry in hosts.items():
+        if not isinstance(entry, dict):
+            raise ValueError(f"hosts.{name} must be a table")
+        if unknown := entry.keys() - by_key.keys():
+            raise ValueError(f"hosts.{name}: unknown keys {', '.join(sorted(unknown))}")
+        for kind, index in by_key.items():
+            values = entry.get(kind, [])
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"hosts.{name}.{kind} must be a list of strings")
+            for value in values:
+                key = mac_key(value) if kind == "macs" else identity_value(value)
+                if key is None:
+                    raise ValueError(f"hosts.{name}.{kind}: {value!r} is a placeholder value")
+                if (other := index.get(key, name)) != name:
+                    raise ValueError(f"{kind} entry {value!r} is claimed by {other} and {name}")
+                index[key] = name
+
+    rules = []
+    entries = doc.get("rules", [])
+    if not isinstance(entries, list):
+        raise ValueError("rules must be an array of tables ([[rules]])")
+    for n, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not isinstance(entry.get("answer"), str):
+            raise ValueError(f"rule {n} needs an answer")
+        if unknown := entry.keys() - {"answer", "vendor", "product"}:
+            raise ValueError(f"rule {n}: unknown keys {', '.join(sorted(unknown))}")
+        patterns = {k: entry.get(k) for k in ("vendor", "product")}
+        if not any(patterns.values()):
+            raise ValueError(f"rule {n} needs a vendor or product")
+        if not all(p is None or isinstance(p, str) for p in patterns.values()):
+            raise ValueError(f"rule {n}: vendor and product must be strings")
+        rules.append(
+            Rule(
+                answer=entry["answer"],
+                **{k: p.strip().lower() for k, p in patterns.items() if p},
+            )
+        )
+    return HostMatcher(
+        by_mac=by_key["macs"],
+        by_uuid=by_key["uuids"],
+        by_serial=by_key["serials"],
+        rules=tuple(rules),
+    )
@@ -0,0 +1,179 @@
+"""Minimal Prometheus instrumentation.
+
+In-memory counters, gauges and histograms rendered in the Prometheus text
+exposition format. Updates are plain dict arithmetic on the event loop;
+values owned elsewhere (TFTP stats, stream counts) are read through
+callbacks only when /metrics is scraped.
+"""
+
+import time
+from bisect import bisect_left
+from collections.abc import Callable
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+)  # fmt: skip
+
+Samples = dict[tuple[str, ...], float]
+
+
+class Metric:
+    """A named metric family with a fixed set of label names."""
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        function: Callable[[], Samples | float] | None = None,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.function = function
+        self._values: Samples = {}
+
+    def samples(self) -> Samples:
+        if self.function is None:
+            return self._values
+        values = self.function()
+        return values if isinstance(values, dict) else {(): values}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, value in sorted(self.samples().items()):
+            lines.append(f"{self.name}{_labels(self.labels, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        self._values[labelvalues] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        bounds = [_number(b) for b in self.buckets] + ["+Inf"]
+        for labelvalues, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, series[:-1], strict=True):
+                cumulative += count
+                labels = _labels((*self.labels, "le"), (*labelvalues, bound))
+                lines.append(f"{self.name}_bucket{labels} {_number(cumulative)}")
+            labels = _labels(self.labels, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {_number(cumulative)}")
+        return lines
+
+
+class Registry:
+    """Ordered collection of metric families."""
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Times every HTTP request and counts responses by endpoint and status.
+
+    A plain ASGI middleware rather than a BaseHTTPMiddleware so streamed
+    asset bodies pass straight through and are timed to the last byte.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        duration: Histogram,
+        requests: Counter,
+        endpoint: Callable[[str], str],
+    ):
+        self.app = app
+        self.duration = duration
+        self.requests = requests
+        self.endpoint = endpoint
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        endpoint = self.endpoint(scope["path"])
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.duration.observe(time.perf_counter() - started, endpoint)
+            self.requests.inc(endpoint, str(status))
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values, strict=True))
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
@@ -1,104 +1,582 @@
 """pxe-pilot: HTTP answer file server for Proxmox automated installations."""
 
+import asyncio
 import logging
 import os
-import subprocess
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI, Request, Response
+from admission import AdmissionControl, admission_slots
+from answers import MAC_RE, AnswerStore, normalize_mac, normalize_mac_prefix
+from assets import INITRD_SEGMENTS, AssetCatalog, etag_matches
+from bootfiles import ARCH_RE, SUPPORTED_ARCHES, BootFiles
+from cluster import Cluster
+from events import EventLog, EventMiddleware, configure_logging, open_sink
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fileio import FileIO, LoopLag
+from ipxe import CLIENT_QUERY, render_unsupported, render_wait
+from matcher import Identity
+from metrics import CONTENT_TYPE, Counter, Gauge, Histogram, MetricsMiddleware, Registry
+from sessions import STAGES, InstallNotifier, SessionTracker
+from streaming import AssetStreamer
+from tftp import TftpServer
+from watch import TreeWatcher
 
 # ── Configuration ──────────────────────────────────────────────
 ANSWERS_DIR = Path(os.getenv("PXE_PILOT_ANSWERS_DIR", "/answers"))
 ASSETS_DIR = Path(os.getenv("PXE_PILOT_ASSETS_DIR", "/assets"))
 ASSET_URL = os.getenv("PXE_PILOT_ASSET_URL", "")
+ASSET_MAX_STREAMS_PER_CLIENT = int(os.getenv("PXE_PILOT_ASSET_MAX_STREAMS_PER_CLIENT", "4"))
+ASSET_BANDWIDTH_MBPS = float(os.getenv("PXE_PILOT_ASSET_BANDWIDTH_MBPS", "0"))
 LOG_LEVEL = os.getenv("PXE_PILOT_LOG_LEVEL", "info").upper()
+LOG_FORMAT = os.getenv("PXE_PILOT_LOG_FORMAT", "text").lower()
+EVENT_LOG = os.getenv("PXE_PILOT_EVENT_LOG", "-")
+EVENT_BUFFER = int(os.getenv("PXE_PILOT_EVENT_BUFFER", "10000"))
 BOOT_ENABLED = os.getenv("PXE_PILOT_BOOT_ENABLED", "false").lower() == "true"
+TFTP_ENABLED = os.getenv("PXE_PILOT_TFTP_ENABLED", "true").lower() == "true"
 TFTP_PORT = int(os.getenv("PXE_PILOT_TFTP_PORT", "69"))
+TFTP_TIMEOUT = float(os.getenv("PXE_PILOT_TFTP_TIMEOUT", "2"))
+TFTP_RETRIES = int(os.getenv("PXE_PILOT_TFTP_RETRIES", "5"))
+TFTP_MAX_TRANSFERS = int(os.getenv("PXE_PILOT_TFTP_MAX_TRANSFERS", "512"))
 IPXE_DIR = Path("/app/ipxe")
 PORT = int(os.getenv("PXE_PILOT_PORT", "8080"))
+WATCH_POLLING = os.getenv("PXE_PILOT_WATCH_POLLING", "false").lower() == "true"
+WATCH_INTERVAL = float(os.getenv("PXE_PILOT_WATCH_INTERVAL", "2"))
+NODE_URL = os.getenv("PXE_PILOT_NODE_URL", "")
+PEERS = [p.strip() for p in os.getenv("PXE_PILOT_PEERS", "").split(",") if p.strip()]
+PEER_INTERVAL = float(os.getenv("PXE_PILOT_PEER_INTERVAL", "5"))
+REPLICATE = os.getenv("PXE_PILOT_REPLICATE", "true").lower() == "true"
+WORKERS = int(os.getenv("PXE_PILOT_WORKERS", "1"))
+BACKLOG = int(os.getenv("PXE_PILOT_BACKLOG", "2048"))
+KEEPALIVE_TIMEOUT = float(os.getenv("PXE_PILOT_KEEPALIVE_TIMEOUT", "30"))
+LIMIT_CONCURRENCY = int(os.getenv("PXE_PILOT_LIMIT_CONCURRENCY", "0"))
+SESSION_TTL = float(os.getenv("PXE_PILOT_SESSION_TTL", "3600"))
+INSTALL_WEBHOOK_URL = os.getenv("PXE_PILOT_INSTALL_WEBHOOK_URL", "")
+INSTALL_WEBHOOK_INTERVAL = float(os.getenv("PXE_PILOT_INSTALL_WEBHOOK_INTERVAL", "5"))
+IO_THREADS = int(os.getenv("PXE_PILOT_IO_THREADS", "32"))
+IO_TIMEOUT = float(os.getenv("PXE_PILOT_IO_TIMEOUT", "10"))
+STRICT_ANSWERS = os.getenv("PXE_PILOT_STRICT_ANSWERS", "false").lower() == "true"
+VALIDATE_PROCESSES = int(os.getenv("PXE_PILOT_VALIDATE_PROCESSES", "0"))
+ADMIT_SLOTS = int(os.getenv("PXE_PILOT_ADMIT_SLOTS", "0"))
+ADMIT_CLIENT_MBPS = float(os.getenv("PXE_PILOT_ADMIT_CLIENT_MBPS", "0"))
+ADMIT_LEASE = float(os.getenv("PXE_PILOT_ADMIT_LEASE", "120"))
+ADMIT_RETRY = float(os.getenv("PXE_PILOT_ADMIT_RETRY", "5"))
+ADMIT_MAX_RETRY = float(os.getenv("PXE_PILOT_ADMIT_MAX_RETRY", "60"))
+
+configure_logging(LOG_LEVEL, json_lines=LOG_FORMAT == "json")
+logger = logging.getLogger("pxe-pilot")
 
-PRODUCT_NAMES = {
-    "proxmox-ve": "Proxmox VE",
-    "proxmox-bs": "Proxmox BS",
-    "proxmox-mg": "Proxmox MG",
-}
-KERNEL_OPTS = (
-    "vga=791 video=vesafb:ywrap,mtrr ramdisk_size=2147483648 "
-    "rw quiet splash=silent proxmox-start-auto-installer"
+events = EventLog(EVENT_BUFFER, open_sink(EVENT_LOG))
+
+file_io = FileIO(IO_THREADS, IO_TIMEOUT)
+answer_store = AnswerStore(ANSWERS_DIR, processes=VALIDATE_PROCESSES)
+asset_catalog = AssetCatalog(ASSETS_DIR)
+boot_files = BootFiles(IPXE_DIR)
+asset_streamer = AssetStreamer(
+    ASSETS_DIR,
+    max_streams_per_client=ASSET_MAX_STREAMS_PER_CLIENT,
+    bandwidth_mbps=ASSET_BANDWIDTH_MBPS,
+    checksum=asset_catalog.checksum,
+    stored=asset_catalog.stored,
+    io=file_io,
+    on_complete=lambda client, path: asset_finished(client, path),
+)
+admission = AdmissionControl(
+    admission_slots(ADMIT_SLOTS, ASSET_BANDWIDTH_MBPS, ADMIT_CLIENT_MBPS),
+    lease=ADMIT_LEASE,
+    retry=ADMIT_RETRY,
+    max_retry=ADMIT_MAX_RETRY,
+    busy=lambda client: client in asset_streamer.streams,
+    observe=lambda waited: admission_wait_seconds.observe(waited),
+)
+tftp_server = TftpServer(
+    IPXE_DIR,
+    timeout=TFTP_TIMEOUT,
+    retries=TFTP_RETRIES,
+    max_transfers=TFTP_MAX_TRANSFERS,
+    on_transfer=lambda **fields: events.record("tftp", **fields),
+    io=file_io,
 )
+cluster = Cluster(
+    NODE_URL,
+    PEERS,
+    ASSETS_DIR,
+    ANSWERS_DIR,
+    load=lambda: asset_streamer.active_streams,
+    interval=PEER_INTERVAL,
+    replicate=REPLICATE,
+)
+install_notifier = InstallNotifier(INSTALL_WEBHOOK_URL, interval=INSTALL_WEBHOOK_INTERVAL)
+sessions = SessionTracker(SESSION_TTL, on_installed=install_notifier.notify)
 
-logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO))
-logger = logging.getLogger("pxe-pilot")
 
-app = FastAPI(title="pxe-pilot", docs_url=None, redoc_url=None)
+# Set in worker processes started by the multi-worker supervisor
+supervisor = None
 
 
-# ── Helper functions ───────────────────────────────────────────
+def attach_supervisor(link) -> None:
+    """Run as a worker: take index changes, TFTP state and shared limits from the supervisor.
 
+    Sessions and events are passed on to the supervisor, which keeps them
+    for every worker and sends the install notifications.
+    """
+    global supervisor, tftp_server
+    supervisor = link
+    tftp_server = link.tftp
+    asset_streamer.limiter.timeline = link.bandwidth
+    if admission.enabled:
+        admission.slots = max(1, admission.slots // link.workers)
+    sessions.on_installed = None
+    sessions.forward = lambda ip, stage, kwargs: link.report("session", ip, stage, kwargs)
+    events.forward = lambda kind, fields: link.report("event", kind, fields)
+
+
+# ── Host-wide sessions and events ─────────────────────────────
+# Under the supervisor these live in the supervisor process: workers report
+# to it, ask it for listings and read its counts from shared memory.
+
+HOST_COUNTERS = (
+    *(f"sessions_{stage}" for stage in STAGES),
+    "installs_sent",
+    "events",
+    "events_buffered",
+    "events_pending",
+    "events_dropped",
+    "event_batches",
+)
 
-def normalize_mac(mac: str) -> str:
-    """Normalize MAC address to aa-bb-cc-dd-ee-ff format."""
-    mac = mac.lower().strip()
-    if ":" in mac:
-        mac = mac.replace(":", "-")
-    if len(mac) == 12 and "-" not in mac:
-        mac = "-".join(mac[i : i + 2] for i in range(0, 12, 2))
-    return mac
 
+def host_counters() -> dict[str, int]:
+    """This process's session and event counts, as published to workers."""
+    return {
+        **{f"sessions_{stage}": n for stage, n in sessions.stage_counts().items()},
+        "installs_sent": install_notifier.sent,
+        "events": events.seq,
+        "events_buffered": events.buffered,
+        "events_pending": events.pending,
+        "events_dropped": events.dropped,
+        "event_batches": events.batches,
+    }
 
-def find_answer(macs: list[str]) -> tuple[str | None, str | None]:
-    """Find answer file for given MAC addresses.
 
-    Returns (toml_content, matched_mac) or (default_content, None) or (None, None).
-    """
-    hosts_dir = ANSWERS_DIR / "hosts"
+def shared_counters() -> dict[str, int]:
+    """Host-wide session and event counts, from the supervisor in a worker."""
+    return supervisor.counters.as_dict() if supervisor is not None else host_counters()
 
-    for mac in macs:
-        normalized = normalize_mac(mac)
-        host_file = hosts_dir / f"{normalized}.toml"
-        if host_file.is_file():
-            logger.info("Matched host file for MAC %s", normalized)
-            return host_file.read_text(), normalized
 
-    default_file = ANSWERS_DIR / "default.toml"
-    if default_file.is_file():
-        logger.info("No host match for MACs %s, serving default", macs)
-        return default_file.read_text(), None
+def record_event(kind: str, fields: dict) -> None:
+    """Record an event reported by a worker."""
+    if "mac" not in fields and fields.get("path", "").startswith("/assets/"):
+        # The worker serving the download may not have seen the menu request
+        session = sessions.get(fields["client"])
+        if session is not None and session.mac:
+            fields["mac"] = session.mac
+    events.record(kind, **fields)
+
+
+def session_listing(stage: str | None = None) -> dict:
+    found = sessions.sessions(stage)
+    return {
+        "count": len(found),
+        "stages": sessions.stage_counts(),
+        "sessions": [s.as_dict() for s in found],
+    }
+
+
+def session_detail(key: str) -> dict | None:
+    session = sessions.get(key)
+    return session.as_dict() if session is not None else None
+
+
+def event_listing(**filters) -> dict:
+    found = events.query(**filters)
+    return {"count": len(found), "seq": events.seq, "events": found}
+
+
+HOST_REPORTS = {
+    "session": lambda ip, stage, kwargs: sessions.record(ip, stage, **kwargs),
+    "event": record_event,
+}
+HOST_QUERIES = {
+    "sessions": session_listing,
+    "session": session_detail,
+    "events": event_listing,
+}
+
 
-    logger.warning("No answer file found for MACs %s and no default.toml", macs)
-    return None, None
+async def host_query(name: str, **kwargs):
+    """HOST_QUERIES[name](**kwargs), answered by the supervisor in a worker."""
+    if supervisor is None:
+        return HOST_QUERIES[name](**kwargs)
+    return await asyncio.to_thread(supervisor.ask, name, **kwargs)
 
 
-def scan_assets() -> dict[str, list[str]]:
-    """Scan assets directory for available products and versions.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the in-memory indexes and keep them in sync.
 
-    Returns dict of product -> sorted list of versions (newest first).
+    Standalone, this process also runs the host services. Under the
+    supervisor, changes arrive from the supervisor's watchers instead.
     """
-    products = {}
-    if not ASSETS_DIR.is_dir():
-        return products
-
-    for product_dir in sorted(ASSETS_DIR.iterdir()):
-        if not product_dir.is_dir():
-            continue
-        versions = []
-        for version_dir in product_dir.iterdir():
-            if not version_dir.is_dir():
-                continue
-            # Must have both vmlinuz and initrd
-            if (version_dir / "vmlinuz").is_file() and (version_dir / "initrd").is_file():
-                versions.append(version_dir.name)
-        if versions:
-            # Sort versions descending (newest first)
-            versions.sort(
-                key=lambda v: [int(x) for x in v.replace("-", ".").split(".") if x.isdigit()],
-                reverse=True,
+    await warmup()
+    events.start()
+    loop_lag.start()
+    if install_notifier.enabled and supervisor is None:
+        install_notifier.start()
+    try:
+        if supervisor is not None:
+            supervisor.start_reports()
+            supervisor.follow(
+                {
+                    "answers": answer_store.apply_changes,
+                    "assets": lambda paths, _: asset_catalog.apply_changes(paths),
+                }
             )
-            products[product_dir.name] = versions
+            yield
+            return
+        async with host_services(answer_store.apply_changes, asset_catalog.apply_changes):
+            yield
+    finally:
+        await install_notifier.stop()
+        await loop_lag.stop()
+        file_io.shutdown()
+        events.stop()
+
+
+async def warmup() -> None:
+    """Fill the in-memory indexes and caches before the first request.
+
+    Everything runs in the file I/O pool, so a slow disk delays startup
+    rather than blocking the event loop.
+    """
+    started = time.monotonic()
+    # A worker numbers its first load with the supervisor's stamp from its spawn
+    generation = supervisor.generation if supervisor is not None else None
+    await file_io.run(answer_store.load, generation, timeout=None)
+    await file_io.run(asset_catalog.load, timeout=None)
+    # Templated answers are rendered and validated now rather than on first boot
+    await file_io.run(answer_store.render_all, timeout=None)
+    missing = await file_io.run(asset_catalog.warm, timeout=None)
+    if missing:
+        logger.warning("Catalogued asset files missing: %s", ", ".join(missing))
+    if ASSET_URL:
+        asset_catalog.menu(ASSET_URL.rstrip("/"))
+    if BOOT_ENABLED:
+        await file_io.run(boot_files.load, timeout=None)
+    logger.info("Warmed up in %.2fs", time.monotonic() - started)
+
+
+@asynccontextmanager
+async def host_services(on_answers, on_assets):
+    """Directory watchers, TFTP and peering: things that run once per host."""
+    watchers = [
+        TreeWatcher(ANSWERS_DIR, on_answers, io=file_io, **_watch_opts()),
+        TreeWatcher(ASSETS_DIR, on_assets, io=file_io, **_watch_opts()),
+    ]
+    for watcher in watchers:
+        watcher.start()
+
+    if BOOT_ENABLED and TFTP_ENABLED:
+        logger.info("Boot mode enabled — starting TFTP server")
+        await start_tftp()
+    elif BOOT_ENABLED:
+        logger.info("Boot mode enabled without TFTP — iPXE binaries over HTTP only")
+    else:
+        logger.info("Boot mode disabled (set PXE_PILOT_BOOT_ENABLED=true to enable)")
+
+    if cluster.enabled:
+        cluster.start()
+
+    try:
+        yield
+    finally:
+        await cluster.stop()
+        if tftp_server.running:
+            logger.info("Shutting down TFTP server")
+            await tftp_server.stop()
+        for watcher in watchers:
+            await watcher.stop()
+
+
+@asynccontextmanager
+async def supervisor_services(on_answers, on_assets):
+    """host_services() for the multi-worker supervisor, which has no lifespan.
+
+    The supervisor keeps every worker's sessions and events, so it runs the
+    event writer, stopped only after every service has shut down, and sends
+    the install notifications.
+    """
+    events.start()
+    if install_notifier.enabled:
+        install_notifier.start()
+    try:
+        async with host_services(on_answers, on_assets):
+            yield
+    finally:
+        await install_notifier.stop()
+        events.stop()
+
 
-    return products
+def _watch_opts() -> dict:
+    return {"polling": WATCH_POLLING, "interval": WATCH_INTERVAL}
+
+
+app = FastAPI(title="pxe-pilot", docs_url=None, redoc_url=None, lifespan=lifespan)
+
+# ── Metrics ────────────────────────────────────────────────────
+
+ENDPOINTS = {
+    "/answer", "/boot.ipxe", "/menu.ipxe", "/hosts", "/health", "/metrics",
+    "/cluster", "/cluster/state", "/sessions", "/installed", "/validation", "/admission",
+    "/events",
+}  # fmt: skip
+# Scraped and polled constantly; recording them would push boot traffic out of /events
+QUIET_PATHS = frozenset({"/health", "/metrics", "/events"})
+
+registry = Registry()
+request_duration = registry.register(
+    Histogram(
+        "pxe_pilot_request_duration_seconds",
+        "HTTP request latency, including streamed bodies.",
+        ("endpoint",),
+    )
+)
+loop_lag_seconds = registry.register(
+    Histogram(
+        "pxe_pilot_event_loop_lag_seconds",
+        "How late the event loop woke from a 0.5s sleep.",
+    )
+)
+loop_lag = LoopLag(0.5, observe=loop_lag_seconds.observe)
+registry.register(
+    Gauge(
+        "pxe_pilot_file_io_pending",
+        "Blocking file calls queued or running in the I/O pool.",
+        function=lambda: file_io.pending,
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_file_io_timeouts_total",
+        "Blocking file calls that exceeded PXE_PILOT_IO_TIMEOUT.",
+        function=lambda: file_io.timeouts,
+    )
+)
+admission_wait_seconds = registry.register(
+    Histogram(
+        "pxe_pilot_admission_wait_seconds",
+        "Time clients spent queued for a download slot before admission.",
+    )
+)
+registry.register(
+    Gauge(
+        "pxe_pilot_admission_slots",
+        "Download slots by state.",
+        ("state",),
+        function=lambda: {
+            ("in_use",): admission.in_use,
+            ("free",): max(0, admission.slots - admission.in_use),
+        },
+    )
+)
+registry.register(
+    Gauge(
+        "pxe_pilot_admission_queue_depth",
+        "Clients queued for a download slot.",
+        function=lambda: admission.queued,
+    )
+)
+requests_total = registry.register(
+    Counter("pxe_pilot_requests_total", "HTTP requests by response status.", ("endpoint", "status"))
+)
+answer_lookups = registry.register(
+    Counter("pxe_pilot_answer_lookups_total", "Answer lookups by outcome.", ("result",))
+)
+registry.register(
+    Gauge(
+        "pxe_pilot_answer_hosts",
+        "Host answer files in the index.",
+        function=lambda: answer_store.host_count,
+    )
+)
+registry.register(
+    Gauge(
+        "pxe_pilot_answers_invalid",
+        "Answer files and rendered templated answers failing validation.",
+        function=lambda: len(answer_store.invalid_answers()),
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_asset_bytes_total",
+        "Asset bytes streamed.",
+        ("product", "version"),
+        function=lambda: dict(asset_streamer.bytes_sent),
+    )
+)
+registry.register(
+    Gauge(
+        "pxe_pilot_asset_streams_active",
+        "Asset downloads in flight.",
+        function=lambda: asset_streamer.active_streams,
+    )
+)
+registry.register(
+    Gauge(
+        "pxe_pilot_tftp_transfers_active",
+        "TFTP transfers in flight.",
+        function=lambda: tftp_server.stats.active,
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_tftp_transfers_total",
+        "TFTP transfers by outcome.",
+        ("result",),
+        function=lambda: {
+            (result,): getattr(tftp_server.stats, result)
+            for result in ("completed", "failed", "aborted", "rejected")
+        },
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_tftp_bytes_total",
+        "TFTP payload bytes sent.",
+        function=lambda: tftp_server.stats.bytes_sent,
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_tftp_retransmits_total",
+        "TFTP packets retransmitted.",
+        function=lambda: tftp_server.stats.retransmits,
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_tftp_timeouts_total",
+        "TFTP ACK timeouts.",
+        function=lambda: tftp_server.stats.timeouts,
+    )
+)
+registry.register(
+    Gauge(
+        "pxe_pilot_boot_sessions",
+        "Tracked boot sessions by last stage reached.",
+        ("stage",),
+        function=lambda: {(stage,): shared_counters()[f"sessions_{stage}"] for stage in STAGES},
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_install_notifications_total",
+        "Completed installs delivered to the install webhook.",
+        function=lambda: shared_counters()["installs_sent"],
+    )
+)
+registry.register(
+    Gauge(
+        "pxe_pilot_cluster_peers_healthy",
+        "Peers answering state polls.",
+        function=lambda: sum(peer.healthy for peer in cluster.peers.values()),
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_cluster_replicated_bytes_total",
+        "Bytes pulled from peers.",
+        function=lambda: cluster.bytes_replicated,
+    )
+)
+
+
+def endpoint_label(path: str) -> str:
+    """Collapse a request path into a bounded endpoint label."""
+    if path.startswith("/assets/"):
+        return "/assets"
+    if path.startswith("/hosts/"):
+        return "/hosts/{mac}"
+    if path.startswith("/cluster/answers/"):
+        return "/cluster/answers"
+    if path.startswith("/sessions/"):
+        return "/sessions/{key}"
+    if path.startswith("/ipxe/"):
+        return "/ipxe/{name}"
+    return path if path in ENDPOINTS else "other"
+
+
+registry.register(
+    Counter(
+        "pxe_pilot_events_total",
+        "Events recorded (HTTP requests and TFTP transfers).",
+        function=lambda: shared_counters()["events"],
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_events_dropped_total",
+        "Events not written to PXE_PILOT_EVENT_LOG because the writer fell behind or failed.",
+        function=lambda: shared_counters()["events_dropped"],
+    )
+)
+registry.register(
+    Counter(
+        "pxe_pilot_event_batches_total",
+        "Batched writes to PXE_PILOT_EVENT_LOG.",
+        function=lambda: shared_counters()["event_batches"],
+    )
+)
+
+app.add_middleware(EventMiddleware, log=events, normalize_mac=normalize_mac, skip=QUIET_PATHS)
+app.add_middleware(
+    MetricsMiddleware,
+    duration=request_duration,
+    requests=requests_total,
+    endpoint=endpoint_label,
+)
+
+
+# ── Helper functions ───────────────────────────────────────────
+
+
+def find_answer(
+    macs: list[str], identity: Identity | None = None
+) -> tuple[bytes | None, str | None, str]:
+    """Find answer file for given MAC addresses and DMI identity in the in-memory index.
+
+    Returns (toml_content, matched, source), where source is "host",
+    "match", "template", "rule", "default" or "not_found".
+    """
+    content, matched_mac, source = answer_store.lookup(macs, identity)
+    answer_lookups.inc(source)
+
+    if source == "host":
+        logger.info("Matched host file for MAC %s", matched_mac)
+    elif source == "match":
+        logger.info("Matched host file %s through match.toml", matched_mac)
+    elif source == "rule":
+        logger.info("Matched host file %s by model rule", matched_mac)
+    elif source == "template":
+        logger.info("Rendered answer template for MAC %s", matched_mac)
+    elif source == "default":
+        logger.info("No host match for MACs %s, serving default", macs)
+    else:
+        logger.warning("No answer file found for MACs %s and no default.toml", macs)
+    return content, matched_mac, source
+
+
+def asset_finished(client: str, path: str) -> None:
+    """Free the client's download slot once it has its last initrd."""
+    parts = path.split("/")
+    if len(parts) == 3 and parts[2] == asset_catalog.last_initrd(parts[0], parts[1]):
+        admission.release(client)
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
 
 
 def get_asset_base_url(request: Request) -> str:
@@ -135,7 +613,16 @@ async def answer(request: Request) -> Response:
 
     logger.debug("Received answer request with MACs: %s", macs)
 
-    content, matched_mac = find_answer(macs)
+    normalized = [normalize_mac(m) for m in macs]
+    content, matched_mac, source = find_answer(macs, Identity.from_payload(body, normalized))
+    request.state.event = {"macs": normalized, "source": source, "matched": matched_mac}
+    sessions.record(
+        client_ip(request),
+        "answer",
+        macs=normalized,
+        detail=source,
+        details={"answer": source},
+    )
 
     if content is None:
         return JSONResponse(
@@ -143,60 +630,125 @@ async def answer(request: Request) -> Response:
             content={"error": "No answer file found for provided MACs"},
         )
 
+    errors = answer_store.errors(source, matched_mac)
+    if errors and STRICT_ANSWERS:
+        logger.error("Refusing invalid %s answer for MACs %s: %s", source, macs, "; ".join(errors))
+        return JSONResponse(
+            status_code=422,
+            content={"error": "Answer file failed validation", "errors": errors},
+        )
+    if errors:
+        logger.warning("Serving invalid %s answer for MACs %s", source, macs)
+
     return Response(content=content, media_type="application/toml")
 
 
 @app.get("/health")
 async def health() -> dict:
     """Health check endpoint."""
-    default_exists = (ANSWERS_DIR / "default.toml").is_file()
-    hosts_dir = ANSWERS_DIR / "hosts"
-    host_count = len(list(hosts_dir.glob("*.toml"))) if hosts_dir.is_dir() else 0
-
+    counts = shared_counters()
     return {
         "status": "ok",
+        "pid": os.getpid(),
         "answers_dir": str(ANSWERS_DIR),
-        "default_exists": default_exists,
-        "host_count": host_count,
+        "default_exists": answer_store.default is not None,
+        "host_count": answer_store.host_count,
         "boot_enabled": BOOT_ENABLED,
+        "ipxe_files": len(boot_files),
+        "asset_streams": asset_streamer.active_streams,
+        "event_loop_lag": {"last": loop_lag.last, "max": loop_lag.max},
+        "file_io": {"pending": file_io.pending, "timeouts": file_io.timeouts},
+        "admission": {"in_use": admission.in_use, "queued": admission.queued},
+        "events": {
+            "buffered": counts["events_buffered"],
+            "pending": counts["events_pending"],
+            "dropped": counts["events_dropped"],
+        },
+        "tftp": {"running": tftp_server.running, **tftp_server.stats.as_dict()},
     }
 
 
-@app.get("/hosts")
-async def list_hosts() -> dict:
-    """List all configured hosts and default status."""
-    hosts_dir = ANSWERS_DIR / "hosts"
-    default_exists = (ANSWERS_DIR / "default.toml").is_file()
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Prometheus metrics."""
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
 
-    hosts = []
-    if hosts_dir.is_dir():
-        for f in sorted(hosts_dir.glob("*.toml")):
-            hosts.append(f.stem)  # aa-bb-cc-dd-ee-ff
 
-    return {
-        "default_exists": default_exists,
-        "host_count": len(hosts),
-        "hosts": hosts,
-    }
+@app.get("/hosts")
+async def list_hosts(
+    request: Request,
+    prefix: str = "",
+    cursor: str = "",
+    limit: int | None = Query(None, ge=1),
+    since: int | None = None,
+) -> Response:
+    """Configured hosts in MAC order, paged and filtered, or the changes since a generation.
+
+    The ETag is the store generation, so an unchanged listing revalidates
+    with 304. ?since=<generation> answers with only the hosts changed after
+    it, or 410 when the generation is too old or from another run.
+    """
+    if etag_matches(request.headers.get("if-none-match"), f'"{answer_store.generation}"'):
+        return Response(status_code=304, headers={"ETag": f'"{answer_store.generation}"'})
+
+    if since is not None:
+        result = answer_store.changes_since(since)
+        if result is None:
+            return JSONResponse(
+                status_code=410,
+                content={
+                    "error": "Generation unknown or expired, fetch the full listing",
+                    "generation": answer_store.generation,
+                },
+            )
+        changes, generation = result
+        return JSONResponse(
+            content={
+                "generation": generation,
+                "changes": [{"mac": mac, "change": change} for mac, change in changes],
+            },
+            headers={"ETag": f'"{generation}"', "Cache-Control": "no-cache"},
+        )
+
+    hosts, next_cursor, generation = answer_store.page(
+        normalize_mac_prefix(prefix), normalize_mac(cursor), limit
+    )
+    return JSONResponse(
+        content={
+            "default_exists": answer_store.default is not None,
+            "host_count": answer_store.host_count,
+            "generation": generation,
+            "hosts": hosts,  # aa-bb-cc-dd-ee-ff
+            "next_cursor": next_cursor,
+        },
+        headers={"ETag": f'"{generation}"', "Cache-Control": "no-cache"},
+    )
 
 
 @app.get("/hosts/{mac}")
 async def get_host(mac: str) -> Response:
     """View the TOML that a specific MAC would receive."""
     normalized = normalize_mac(mac)
-    host_file = ANSWERS_DIR / "hosts" / f"{normalized}.toml"
+    content = answer_store.get_host(normalized)
 
-    if host_file.is_file():
+    if content is not None:
         return Response(
-            content=host_file.read_text(),
+            content=content,
             media_type="application/toml",
             headers={"X-PXE-Pilot-Source": f"hosts/{normalized}.toml"},
         )
 
-    default_file = ANSWERS_DIR / "default.toml"
-    if default_file.is_file():
+    content = answer_store.render(normalized)
+    if content is not None:
         return Response(
-            content=default_file.read_text(),
+            content=content,
+            media_type="application/toml",
+            headers={"X-PXE-Pilot-Source": "template.toml"},
+        )
+
+    if answer_store.default is not None:
+        return Response(
+            content=answer_store.default,
             media_type="application/toml",
             headers={"X-PXE-Pilot-Source": "default.toml"},
         )
@@ -207,97 +759,296 @@ async def get_host(mac: str) -> Response:
     )
 
 
+@app.get("/validation")
+async def validation() -> dict:
+    """Answer files, and templated answers rendered so far, that fail validation."""
+    invalid = answer_store.invalid_answers()
+    return {
+        "valid": not invalid,
+        "checked": answer_store.answer_count,
+        "strict": STRICT_ANSWERS,
+        "invalid": invalid,
+    }
+
+
 @app.get("/boot.ipxe")
-async def boot_ipxe() -> Response:
-    """Initial iPXE bootstrap script. Chains to /menu.ipxe."""
-    script = "#!ipxe\nchain /menu.ipxe\n"
+async def boot_ipxe(request: Request) -> Response:
+    """Initial iPXE bootstrap script.
+
+    Chains to /menu.ipxe, passing the MAC, UUID and iPXE's architecture. The
+    path is relative to wherever this script came from, so it works whether
+    iPXE found the server through ${next-server} or an HTTP Boot URL.
+    """
+    sessions.record(client_ip(request), "boot")
+    script = f"#!ipxe\nchain /menu.ipxe?{CLIENT_QUERY}\n"
     return Response(content=script, media_type="text/plain")
 
 
 @app.get("/menu.ipxe")
 async def menu_ipxe(request: Request) -> Response:
-    """Dynamic iPXE menu generated from available assets."""
-    products = scan_assets()
+    """Boot script for the client: its boot target from boot.toml, else the menu.
+
+    Both are rendered once per asset base URL and served from cache until the
+    assets tree changes. Clients and proxies can revalidate with If-None-Match.
+    ?menu=1 always shows the menu; boot target scripts fall back to it.
+    With admission on, a client without a download slot gets a script that
+    waits and chains back here instead. A client sent to a peer for its
+    assets needs no slot here.
+    """
+    mac = normalize_mac(request.query_params.get("mac", ""))
+    mac = mac if MAC_RE.fullmatch(mac) else None
+    ip = client_ip(request)
+    arch = request.query_params.get("arch", "")
+    if ARCH_RE.fullmatch(arch) and arch not in SUPPORTED_ARCHES:
+        logger.warning("Turning away %s client %s", arch, mac or ip)
+        sessions.record(ip, "menu", macs=[mac] if mac else [], detail=f"unsupported {arch}")
+        request.state.event = {"arch": arch}
+        return Response(
+            content=render_unsupported(arch),
+            media_type="text/plain",
+            headers={"Cache-Control": "no-store"},
+        )
     base_url = get_asset_base_url(request)
+    if cluster.enabled:
+        base_url = cluster.pick_asset_url(base_url)
+    if base_url in cluster.peers:
+        # The peer serves the downloads, so they take none of this node's slots
+        admission.release(ip)
+        wait = None
+    else:
+        wait = admission.admit(ip)
+    if wait is not None:
+        seconds, position = wait
+        sessions.record(ip, "menu", macs=[mac] if mac else [], detail=f"queued #{position}")
+        request.state.event = {"queued": position}
+        query = request.url.query
+        script = render_wait(
+            seconds, position, admission.queued, "/menu.ipxe" + (f"?{query}" if query else "")
+        )
+        return Response(
+            content=script, media_type="text/plain", headers={"Cache-Control": "no-store"}
+        )
+
+    rendered, target = None, None
+    if "menu" not in request.query_params:
+        target = answer_store.boot_target(mac, request.query_params.get("uuid") or None)
+        if target is not None:
+            rendered = asset_catalog.boot_script(target, base_url)
+            if rendered is None:
+                logger.warning("Boot target %s for %s is not available", target, mac or "client")
+                target = None
+    sessions.record(ip, "menu", macs=[mac] if mac else [], detail=target)
+    if target is not None:
+        request.state.event = {"target": target}
+    body, etag = rendered or asset_catalog.menu(base_url)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="text/plain", headers=headers)
+
+
+# ── Asset serving ─────────────────────────────────────────────
+
+
+@app.api_route("/assets/{path:path}", methods=["GET", "HEAD"])
+async def serve_asset(request: Request, path: str) -> Response:
+    """Boot assets (vmlinuz, initrd) with Range/If-Range support."""
+    name = path.rpartition("/")[2]
+    if name in ("vmlinuz", "initrd", *INITRD_SEGMENTS):
+        # Peers replicating and other non-booting clients are not tracked
+        stage = "kernel" if name == "vmlinuz" else "initrd"
+        admission.touch(client_ip(request))
+        session = sessions.record(
+            client_ip(request),
+            stage,
+            detail=path,
+            details={"target": path.rpartition("/")[0]},
+            create=False,
+        )
+        if session is not None and session.mac:
+            request.state.event = {"mac": session.mac}
+    return await asset_streamer.serve(request, path)
+
+
+# ── Boot sessions ─────────────────────────────────────────────
+
+
+@app.get("/events")
+async def list_events(
+    mac: str | None = None,
+    client: str | None = None,
+    kind: str | None = None,
+    since: float | None = None,
+    until: float | None = None,
+    after: int | None = None,
+    limit: int = Query(100, ge=1),
+) -> dict:
+    """Recent requests and TFTP transfers from the in-memory ring buffer, oldest first.
+
+    Filter by MAC (any format), client IP, kind ("http" or "tftp") and Unix
+    time. Poll with ?after=<seq> to get only what is new since the last call.
+    """
+    return await host_query(
+        "events",
+        mac=normalize_mac(mac) if mac else None,
+        client=client,
+        kind=kind,
+        since=since,
+        until=until,
+        after=after,
+        limit=limit,
+    )
+
+
+@app.get("/admission")
+async def admission_status() -> dict:
+    """Download slots in use and the queue of clients waiting for one."""
+    return admission.status()
 
-    lines = ["#!ipxe", "", "menu pxe-pilot: Select Installation"]
 
-    if not products:
-        lines.append("item --gap -- No boot assets found.")
-        lines.append("item --gap -- Run pxe-pilot-builder to create assets.")
-        lines.append("item exit Exit to iPXE shell")
-        lines.append("choose selected || goto exit")
-        lines.append("")
-        lines.append(":exit")
-        lines.append("shell")
-        return Response(content="\n".join(lines) + "\n", media_type="text/plain")
+@app.get("/sessions")
+async def list_sessions(stage: str | None = None) -> dict:
+    """Machines seen recently, most recent first, optionally filtered by stage."""
+    return await host_query("sessions", stage=stage)
 
-    # Menu items
-    for product, versions in products.items():
-        display_name = PRODUCT_NAMES.get(product, product)
-        lines.append(f"item --gap -- === {display_name} ===")
-        for version in versions:
-            item_id = f"{product}-{version}"
-            lines.append(f"item {item_id} {display_name} {version}")
 
-    lines.append("item --gap --")
-    lines.append("item exit Exit to iPXE shell")
-    lines.append("choose selected && goto ${selected} || goto exit")
-    lines.append("")
+@app.get("/sessions/{key}")
+async def get_session(key: str) -> Response:
+    """One machine's session, by MAC or IP address."""
+    mac = normalize_mac(key)
+    session = await host_query("session", key=mac if MAC_RE.fullmatch(mac) else key)
+    if session is None:
+        return JSONResponse(status_code=404, content={"error": f"No session for {key}"})
+    return JSONResponse(content=session)
 
-    # Boot targets
-    for product, versions in products.items():
-        for version in versions:
-            item_id = f"{product}-{version}"
-            lines.append(f":{item_id}")
-            lines.append(f"kernel {base_url}/assets/{product}/{version}/vmlinuz {KERNEL_OPTS}")
-            lines.append(f"initrd {base_url}/assets/{product}/{version}/initrd")
-            lines.append("boot || goto menu")
-            lines.append("")
 
-    lines.append(":exit")
-    lines.append("shell")
+@app.post("/installed")
+async def installed(request: Request) -> Response:
+    """Target for the answer file's [post-installation-webhook].
+
+    Marks the machine's session as installed and queues the install
+    notification, if one is configured.
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON in request body"})
+    if not isinstance(body, dict):
+        return JSONResponse(status_code=400, content={"error": "Expected a JSON object"})
+    interfaces = body.get("network-interfaces") or body.get("network_interfaces") or []
+    if not isinstance(interfaces, list):
+        interfaces = []
+    macs = [normalize_mac(i["mac"]) for i in interfaces if isinstance(i, dict) and i.get("mac")]
+    details = {"fqdn": body["fqdn"]} if isinstance(body.get("fqdn"), str) else {}
+    session = sessions.record(
+        client_ip(request), "installed", macs=macs, detail=details.get("fqdn"), details=details
+    )
+    logger.info("Install finished on %s (%s)", session.mac or session.ip, details.get("fqdn", "?"))
+    return JSONResponse(content={"status": "ok"})
 
-    return Response(content="\n".join(lines) + "\n", media_type="text/plain")
 
+# ── Cluster ───────────────────────────────────────────────────
 
-# ── Static file serving ───────────────────────────────────────
 
-if ASSETS_DIR.is_dir():
-    app.mount("/assets", StaticFiles(directory=str(ASSETS_DIR)), name="assets")
+@app.get("/cluster")
+async def cluster_status() -> dict:
+    """This node's view of its peers."""
+    return {"enabled": cluster.enabled, **cluster.status()}
+
+
+@app.get("/cluster/state")
+async def cluster_state() -> dict:
+    """Load, version digests and answer file checksums, polled by peers."""
+    return cluster.state()
+
+
+@app.get("/cluster/assets")
+async def cluster_assets() -> dict:
+    """Every asset file's checksum, fetched by peers when the asset digest changes."""
+    return cluster.assets.entries
+
+
+@app.get("/cluster/answers/{path:path}")
+async def cluster_answer_file(path: str) -> Response:
+    """Raw answer file for peers to replicate. Only indexed files are served."""
+    if path not in cluster.answers.entries:
+        return JSONResponse(status_code=404, content={"error": "Not found"})
+    try:
+        content = await file_io.run((ANSWERS_DIR / path).read_bytes)
+    except OSError:  # includes TimeoutError
+        return JSONResponse(status_code=404, content={"error": "Not found"})
+    return Response(content=content, media_type="application/octet-stream")
+
+
+# ── iPXE binaries (UEFI HTTP Boot) ────────────────────────────
+
+
+@app.api_route("/ipxe/{name}", methods=["GET", "HEAD"])
+async def serve_ipxe(request: Request, name: str) -> Response:
+    """iPXE binaries from memory, for firmware that boots from a URL instead of TFTP."""
+    boot_file = boot_files.get(name)
+    if boot_file is None:
+        return JSONResponse(status_code=404, content={"error": "Not found"})
+    sessions.record(client_ip(request), "boot", detail=f"ipxe/{name}")
+    headers = {"ETag": boot_file.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), boot_file.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=boot_file.data, media_type=boot_file.content_type, headers=headers)
+
 
 # ── TFTP + Startup ────────────────────────────────────────────
 
 
-def start_tftp():
-    """Start py3tftp as a subprocess serving iPXE binaries."""
-    if not IPXE_DIR.is_dir():
+async def start_tftp() -> bool:
+    """Start the built-in TFTP server serving iPXE binaries from memory."""
+    if not await file_io.run(IPXE_DIR.is_dir):
         logger.error("iPXE directory not found at %s", IPXE_DIR)
-        return None
-    logger.info("Starting TFTP server on port %d serving %s", TFTP_PORT, IPXE_DIR)
-    proc = subprocess.Popen(
-        ["py3tftp", "--host", "0.0.0.0", "--port", str(TFTP_PORT)],
-        cwd=str(IPXE_DIR),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    return proc
+        return False
+    try:
+        await tftp_server.start("0.0.0.0", TFTP_PORT)
+    except OSError as exc:
+        logger.error("Failed to start TFTP server on port %d: %s", TFTP_PORT, exc)
+        return False
+    return True
 
 
-if __name__ == "__main__":
+def uvicorn_options() -> dict:
+    """Listener and connection settings shared by every launch mode."""
+    return {
+        "host": "0.0.0.0",
+        "port": PORT,
+        "log_level": LOG_LEVEL.lower(),
+        # uvicorn's records go through the queue set up by configure_logging(),
+        # and the "http" events replace its per-request access log
+        "log_config": None,
+        "access_log": False,
+        "backlog": BACKLOG,
+        # iPXE keeps one connection open from boot.ipxe through the initrd
+        "timeout_keep_alive": KEEPALIVE_TIMEOUT,
+        "limit_concurrency": LIMIT_CONCURRENCY or None,
+    }
+
+
+def main() -> None:
     import uvicorn
 
-    tftp_proc = None
-    if BOOT_ENABLED:
-        logger.info("Boot mode enabled — starting TFTP server")
-        tftp_proc = start_tftp()
-    else:
-        logger.info("Boot mode disabled (set PXE_PILOT_BOOT_ENABLED=true to enable)")
+    workers = WORKERS or os.cpu_count() or 1
+    if workers == 1:
+        uvicorn.run("server:app", **uvicorn_options())
+        return
+    if cluster.enabled:
+        raise SystemExit(
+            "PXE_PILOT_WORKERS > 1 cannot be combined with PXE_PILOT_PEERS; "
+            "add nodes to the cluster instead"
+        )
 
-    try:
-        uvicorn.run("server:app", host="0.0.0.0", port=PORT, log_level=LOG_LEVEL.lower())
-    finally:
-        if tftp_proc:
-            logger.info("Shutting down TFTP server")
-            tftp_proc.terminate()
-            tftp_proc.wait()
+    from workers import Hub, Supervisor
+
+    hub = Hub(HOST_REPORTS, HOST_QUERIES, host_counters, HOST_COUNTERS)
+    Supervisor(workers, uvicorn_options(), supervisor_services, tftp_server, hub).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Boot session tracking and install-completion notifications.
+
+A session follows one machine from /boot.ipxe through the menu, the kernel
+and initrd downloads and /answer, to the installer's post-installation
+webhook. Sessions are keyed by MAC once one is known, and by client IP
+until then; iPXE passes its MAC to /menu.ipxe and the installer sends its
+MACs to /answer. Every request is handled on the event loop, so recording
+is a couple of dict operations with no locking. Sessions idle for longer
+than the TTL are evicted in least-recently-seen order.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import time
+import urllib.request
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable
+
+logger = logging.getLogger("pxe-pilot")
+
+# Stages in the order a normal install passes through them
+STAGES = ("boot", "menu", "kernel", "initrd", "answer", "installed")
+MAX_EVENTS = 32
+
+
+class Session:
+    """One machine's progress through the boot and install."""
+
+    __slots__ = ("key", "mac", "ip", "stage", "first_seen", "last_seen", "events", "details")
+
+    def __init__(self, key: str, mac: str | None, ip: str, now: float):
+        self.key = key
+        self.mac = mac
+        self.ip = ip
+        self.stage = "boot"
+        self.first_seen = now
+        self.last_seen = now
+        self.events: deque[tuple[float, str, str | None]] = deque(maxlen=MAX_EVENTS)
+        self.details: dict[str, str] = {}
+
+    def as_dict(self) -> dict:
+        return {
+            "mac": self.mac,
+            "ip": self.ip,
+            "stage": self.stage,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            **self.details,
+            "events": [
+                {"time": at, "stage": stage, "detail": detail} for at, stage, detail in self.events
+            ],
+        }
+
+
+class SessionTracker:
+    """In-memory sessions keyed by MAC, or by IP until a MAC is seen.
+
+    forward, if set, is called with the arguments of every record(), so a
+    worker under the multi-worker supervisor can pass them on to the
+    tracker the supervisor keeps for all workers.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        *,
+        max_sessions: int = 100_000,
+        clock: Callable[[], float] = time.time,
+        on_installed: Callable[[Session], None] | None = None,
+        forward: Callable[[str, str, dict], None] | None = None,
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.on_installed = on_installed
+        self.forward = forward
+        # Least recently seen first, so eviction only looks at the front
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._by_ip: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def record(
+        self,
+        ip: str,
+        stage: str,
+        *,
+        macs: Iterable[str] = (),
+        detail: str | None = None,
+        details: dict[str, str] | None = None,
+        create: bool = True,
+    ) -> Session | None:
+        """Note that the machine at ip (and any of macs) reached stage.
+
+        With create=False only machines already being tracked are updated.
+        """
+        now = self.clock()
+        self.evict(now)
+        macs = tuple(macs)
+        if self.forward is not None:
+            self.forward(
+                ip, stage, {"macs": macs, "detail": detail, "details": details, "create": create}
+            )
+        session = self._find(ip, macs)
+        if session is None:
+            if not create:
+                return None
+            mac = macs[0] if macs else None
+            session = Session(mac or f"ip:{ip}", mac, ip, now)
+            self._sessions[session.key] = session
+        elif session.mac is None and macs:
+            # First MAC for a session so far known only by IP
+            del self._sessions[session.key]
+            session.mac = session.key = macs[0]
+            self._sessions[session.key] = session
+        else:
+            self._sessions.move_to_end(session.key)
+
+        if session.ip != ip and self._by_ip.get(session.ip) == session.key:
+            del self._by_ip[session.ip]
+        session.ip = ip
+        self._by_ip[ip] = session.key
+        session.last_seen = now
+        session.stage = stage
+        session.events.append((now, stage, detail))
+        if details:
+            session.details.update(details)
+        if stage == "installed" and self.on_installed is not None:
+            self.on_installed(session)
+        return session
+
+    def _find(self, ip: str, macs: tuple[str, ...]) -> Session | None:
+        for mac in macs:
+            if (session := self._sessions.get(mac)) is not None:
+                return session
+        key = self._by_ip.get(ip)
+        session = self._sessions.get(key) if key is not None else None
+        if session is not None and session.mac is not None and macs:
+            # The address now belongs to another machine
+            return None
+        return session
+
+    def evict(self, now: float | None = None) -> int:
+        """Drop sessions idle for longer than the TTL, or beyond max_sessions."""
+        now = self.clock() if now is None else now
+        evicted = 0
+        while self._sessions:
+            key, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_seen <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[key]
+            if self._by_ip.get(oldest.ip) == key:
+                del self._by_ip[oldest.ip]
+            evicted += 1
+        return evicted
+
+    def get(self, key: str) -> Session | None:
+        """Session for a normalized MAC, or for a client IP."""
+        session = self._sessions.get(key)
+        if session is None and (by_ip := self._by_ip.get(key)) is not None:
+            session = self._sessions.get(by_ip)
+        return session
+
+    def sessions(self, stage: str | None = None) -> list[Session]:
+        """Live sessions, most recently seen first."""
+        self.evict()
+        return [s for s in reversed(self._sessions.values()) if stage in (None, s.stage)]
+
+    def stage_counts(self) -> dict[str, int]:
+        counts = dict.fromkeys(STAGES, 0)
+        for session in self._sessions.values():
+            counts[session.stage] = counts.get(session.stage, 0) + 1
+        return counts
+
+
+class InstallNotifier:
+    """Batches completed installs and POSTs them to a webhook in the background.
+
+    Notifications wait in a bounded queue and go out as one JSON array per
+    interval, so a wave of finished installs costs one request. A failed
+    batch stays queued and is retried on the next interval.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        interval: float = 5.0,
+        batch_size: int = 100,
+        max_queued: int = 10_000,
+        timeout: float = 10.0,
+    ):
+        self.url = url
+        self.interval = interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.queue: deque[dict] = deque(maxlen=max_queued)
+        self.sent = 0
+        self.failed_batches = 0
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.url)
+
+    def notify(self, session: Session) -> None:
+        """Queue a completed session; never blocks the caller."""
+        if self.enabled:
+            self.queue.append(session.as_dict())
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self._run(), name="install-notifier")
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        # Last chance for installs that finished since the final interval
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Send everything queued, one batch at a time, stopping at the first failure."""
+        while self.queue:
+            batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            try:
+                await asyncio.to_thread(self._post, batch)
+            except asyncio.CancelledError:
+                self.queue.extendleft(reversed(batch))
+                raise
+            except (OSError, ValueError) as exc:
+                self.failed_batches += 1
+                logger.warning("Install notification to %s failed: %s", self.url, exc)
+                self.queue.extendleft(reversed(batch))
+                return
+            self.sent += len(batch)
+
+    def _post(self, batch: list[dict]) -> None:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"installs": batch}).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+            resp.read()
@@ -0,0 +1,364 @@
+"""High-throughput boot asset delivery.
+
+Serves files below the assets directory with single-range HTTP Range and
+If-Range support so interrupted iPXE downloads can resume. ETags are the
+file's sha256 when the asset catalog vouches for it, so they stay stable
+across nodes and re-copies of the same content. Bodies go out
+through the ASGI zero-copy extension (sendfile) when the server offers it,
+otherwise as large pread() chunks read in the file I/O thread pool. A per-client
+stream cap and an optional global bandwidth limit keep a boot storm from
+starving the event loop or the link. Assets kept in the chunk store are
+served the same way, one chunk file after another.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import stat
+import time
+from collections.abc import Callable
+from email.utils import formatdate
+from pathlib import Path
+
+from assets import CHUNK_DIR, StoredFile, etag_matches
+from fastapi import Request, Response
+from fileio import FileIO
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger("pxe-pilot")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range lies outside the file."""
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parse a Range header into an inclusive (start, end) byte range.
+
+    Returns None when the header should be ignored (malformed, non-byte
+    units or several ranges) and the whole file served instead.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+class BandwidthLimiter:
+    """Global token bucket shared by every asset stream.
+
+    Each chunk reserves its transmit slot on a shared timeline, so streams
+    take turns fairly and the aggregate never exceeds the configured rate.
+    Under the multi-worker supervisor, timeline is a multiprocessing.Value
+    every worker reserves on, so the rate holds for the whole host.
+    """
+
+    def __init__(self, bytes_per_second: float, timeline=None):
+        self.rate = bytes_per_second
+        self.timeline = timeline
+        self._next = 0.0
+
+    async def acquire(self, size: int) -> None:
+        if self.rate <= 0:
+            return
+        # time.monotonic() reads the same clock in every worker process
+        now = time.monotonic()
+        if self.timeline is None:
+            start = max(now, self._next)
+            self._next = start + size / self.rate
+        else:
+            with self.timeline.get_lock():
+                start = max(now, self.timeline.value)
+                self.timeline.value = start + size / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class AssetStreamer:
+    """Resolves asset paths and hands out streaming responses."""
+
+    def __init__(
+        self,
+        assets_dir: Path,
+        *,
+        max_streams_per_client: int = 4,
+        bandwidth_mbps: float = 0,
+        checksum: Callable[[Path, os.stat_result], str | None] | None = None,
+        stored: Callable[[str], StoredFile | None] | None = None,
+        io: FileIO | None = None,
+        on_complete: Callable[[str, str], None] | None = None,
+    ):
+        self.assets_dir = assets_dir
+        # Called with (client, "<product>/<version>/<name>") when a download reaches the end
+        self.on_complete = on_complete
+        self.checksum = checksum
+        # "<product>/<version>/<name>" -> its chunks, for assets in the chunk store
+        self.stored = stored
+        self.io = io or FileIO()
+        self.max_streams_per_client = max_streams_per_client
+        self.limiter = BandwidthLimiter(bandwidth_mbps * 1_000_000 / 8)
+        self.streams: dict[str, int] = {}
+        # (product, version) -> bytes sent, for /metrics
+        self.bytes_sent: dict[tuple[str, str], int] = {}
+
+    @property
+    def active_streams(self) -> int:
+        return sum(self.streams.values())
+
+    def resolve(self, path: str) -> Path | None:
+        """Map a request path onto a file inside the assets directory."""
+        parts = [p for p in path.split("/") if p]
+        if not parts or any(p in (".", "..") or p.startswith(".") for p in parts):
+            return None
+        return self.assets_dir.joinpath(*parts)
+
+    async def serve(self, request: Request, path: str) -> Response:
+        """Response for GET/HEAD /assets/{path}."""
+        file_path = self.resolve(path)
+        rel = file_path.relative_to(self.assets_dir).as_posix() if file_path else ""
+        stored = self.stored(rel) if file_path and self.stored else None
+        st = None
+        if stored is None:
+            try:
+                st = await self.io.run(_stat_file, file_path) if file_path else None
+            except TimeoutError as exc:
+                logger.error("Asset storage not responding: %s", exc)
+                return Response(
+                    status_code=503,
+                    content="Asset storage not responding",
+                    media_type="text/plain",
+                    headers={"Retry-After": "5"},
+                )
+            if st is None:
+                return Response(status_code=404, content="Not Found", media_type="text/plain")
+
+        client = request.client.host if request.client else "unknown"
+        if self.max_streams_per_client and self.streams.get(client, 0) >= (
+            self.max_streams_per_client
+        ):
+            logger.warning("Client %s exceeded %d asset streams", client, self.streams[client])
+            return Response(
+                status_code=429,
+                content="Too many concurrent downloads",
+                media_type="text/plain",
+                headers={"Retry-After": "5"},
+            )
+
+        if stored is not None:
+            size, etag, mtime = stored.size, f'"{stored.sha256}"', stored.mtime_ns / 1e9
+        else:
+            size, mtime = st.st_size, st.st_mtime
+            sha = self.checksum(file_path, st) if self.checksum else None
+            etag = f'"{sha}"' if sha else _etag(st)
+        last_modified = formatdate(mtime, usegmt=True)
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Last-Modified": last_modified,
+        }
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        start, end, status = 0, size - 1, 200
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                return Response(
+                    status_code=416,
+                    headers={**headers, "Content-Range": f"bytes */{size}"},
+                )
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+        length = end - start + 1
+        extents = stored.extents(start, length) if stored else [(file_path, start, length)]
+        return AssetStreamResponse(
+            self, client, rel, extents, status, headers, to_end=end == size - 1
+        )
+
+    def _acquire(self, client: str) -> None:
+        self.streams[client] = self.streams.get(client, 0) + 1
+
+    def _release(self, client: str) -> None:
+        remaining = self.streams.get(client, 0) - 1
+        if remaining > 0:
+            self.streams[client] = remaining
+        else:
+            self.streams.pop(client, None)
+
+
+class AssetStreamResponse(Response):
+    """Streams one byte range of an asset, holding a per-client stream slot.
+
+    extents are the (file, offset, length) pieces making up the range: one
+    for a plain file, one per chunk for an asset in the chunk store.
+    """
+
+    def __init__(
+        self,
+        streamer: AssetStreamer,
+        client: str,
+        rel: str,
+        extents: list[tuple[Path, int, int]],
+        status_code: int,
+        headers: dict[str, str],
+        to_end: bool = True,
+    ):
+        self.length = sum(count for _, _, count in extents)
+        super().__init__(
+            status_code=status_code,
+            headers={**headers, "Content-Length": str(self.length)},
+            media_type="application/octet-stream",
+        )
+        self.streamer = streamer
+        self.client = client
+        self.rel = rel
+        self.extents = extents
+        self.sent = 0
+        self.to_end = to_end
+        parts = rel.split("/")
+        if parts[0] == CHUNK_DIR:
+            # A peer replicating the chunk store; chunks belong to no one version
+            self.product_version = (CHUNK_DIR, "")
+        else:
+            self.product_version = (parts[0], parts[1]) if len(parts) > 2 else (parts[0], "")
+        streamer._acquire(client)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            if scope["method"] == "HEAD" or self.length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            body = asyncio.create_task(self._send_body(scope, send))
+            disconnect = asyncio.create_task(_wait_disconnect(receive))
+            try:
+                await asyncio.wait({body, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if not body.done() and self.sent < self.length:
+                    logger.info(
+                        "Client %s disconnected while downloading %s", self.client, self.rel
+                    )
+                    body.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await body
+            finally:
+                # Also reached when the body failed; neither task may outlive the response
+                body.cancel()
+                disconnect.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await disconnect
+            if not body.cancelled():
+                self._completed()
+        finally:
+            self.streamer._release(self.client)
+
+    def _completed(self) -> None:
+        on_complete = self.streamer.on_complete
+        if on_complete is not None and self.to_end and self.sent == self.length:
+            on_complete(self.client, self.rel)
+
+    async def _send_body(self, scope: Scope, send: Send) -> None:
+        for path, offset, length in self.extents:
+            await self._send_extent(scope, send, path, offset, length)
+
+    async def _send_extent(
+        self, scope: Scope, send: Send, path: Path, offset: int, length: int
+    ) -> None:
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        limiter = self.streamer.limiter
+        io = self.streamer.io
+        f = await io.run(open, path, "rb")
+        try:
+            fd = f.fileno()
+            position, remaining = offset, length
+            while remaining > 0:
+                size = min(CHUNK_SIZE, remaining)
+                await limiter.acquire(size)
+                remaining -= size
+                more_body = self.sent + size < self.length
+                if zerocopy:
+                    await send(
+                        {
+                            "type": "http.response.zerocopysend",
+                            "file": f,
+                            "offset": position,
+                            "count": size,
+                            "more_body": more_body,
+                        }
+                    )
+                else:
+                    chunk = await io.run(_pread_full, fd, size, position)
+                    if len(chunk) < size:
+                        raise RuntimeError(f"{path} shrank while being served")
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": more_body}
+                    )
+                position += size
+                self.sent += size
+                bytes_sent = self.streamer.bytes_sent
+                bytes_sent[self.product_version] = bytes_sent.get(self.product_version, 0) + size
+        finally:
+            await io.run(f.close, timeout=None)
+
+
+def _pread_full(fd: int, size: int, position: int) -> bytes:
+    """Read size bytes at position; shorter only at end of file."""
+    chunk = os.pread(fd, size, position)
+    while len(chunk) < size:
+        more = os.pread(fd, size - len(chunk), position + len(chunk))
+        if not more:
+            break
+        chunk += more
+    return chunk
+
+
+async def _wait_disconnect(receive: Receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def _stat_file(path: Path) -> os.stat_result | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+
+def _etag(st: os.stat_result) -> str:
+    base = f"{st.st_mtime_ns}-{st.st_size}-{st.st_ino}"
+    return f'"{hashlib.md5(base.encode(), usedforsecurity=False).hexdigest()}"'
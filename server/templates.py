@@ -0,0 +1,88 @@
+"""Answer templates and host inventories.
+
+A template is an answer file with ${name} placeholders. It is split into
+literal and placeholder parts once, so rendering is a single join. The
+inventory (TOML or CSV) supplies each host's variables.
+"""
+
+import csv
+import io
+import json
+import re
+import tomllib
+from pathlib import Path
+
+PLACEHOLDER = re.compile(r"\$\{([A-Za-z_][A-Za-z0-9_-]*)\}")
+
+
+class TemplateError(ValueError):
+    """A template could not be rendered for a host."""
+
+
+class Template:
+    """A template split into literal text and placeholder names."""
+
+    def __init__(self, text: str):
+        # re.split with one group alternates literal, name, literal, ...
+        self.parts = PLACEHOLDER.split(text)
+        self.variables = frozenset(self.parts[1::2])
+
+    def render(self, values: dict[str, str]) -> bytes:
+        missing = self.variables - values.keys()
+        if missing:
+            raise TemplateError(f"missing variables: {', '.join(sorted(missing))}")
+        parts = self.parts.copy()
+        for i in range(1, len(parts), 2):
+            parts[i] = values[parts[i]]
+        return "".join(parts).encode()
+
+
+def format_value(value) -> str:
+    """Inventory value as template text: strings verbatim, the rest as TOML."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        # JSON strings are valid TOML basic strings
+        items = (json.dumps(v) if isinstance(v, str) else format_value(v) for v in value)
+        return "[" + ", ".join(items) + "]"
+    return str(value)
+
+
+def parse_inventory(path: Path, data: bytes) -> dict[str, dict[str, str]]:
+    """Host variables keyed by MAC as written, from a TOML or CSV inventory.
+
+    TOML inventories have a [hosts."<mac>"] table per host and an optional
+    [defaults] table shared by all of them. CSV inventories need a "mac"
+    column; empty cells are left unset.
+    """
+    text = data.decode()
+    if path.suffix == ".csv":
+        reader = csv.DictReader(io.StringIO(text))
+        try:
+            if reader.fieldnames is not None and "mac" not in reader.fieldnames:
+                raise ValueError(f"{path.name} needs a 'mac' column")
+            hosts = {}
+            for row in reader:
+                mac = row.pop("mac")
+                if not mac:
+                    raise ValueError(f"{path.name} line {reader.line_num}: no mac")
+                hosts[mac] = {k: v for k, v in row.items() if k and v}
+        except csv.Error as exc:
+            raise ValueError(f"{path.name}: {exc}") from exc
+        defaults: dict = {}
+    else:
+        doc = tomllib.loads(text)
+        defaults = doc.get("defaults", {})
+        hosts = doc.get("hosts", {})
+        for key, value in (("defaults", defaults), ("hosts", hosts)):
+            if not isinstance(value, dict):
+                raise ValueError(f"{path.name}: {key} must be a table")
+
+    inventory = {}
+    for mac, variables in hosts.items():
+        if not isinstance(variables, dict):
+            raise ValueError(f"{path.name}: hosts.{mac} must be a table")
+        inventory[mac] = {k: format_value(v) for k, v in (defaults | variables).items()}
+    return inventory
@@ -6,6 +6,23 @@ import pytest
 from fastapi.testclient import TestClient
 
 
+class SyncedClient(TestClient):
+    """TestClient that reloads the in-memory indexes before every request.
+
+    Tests write answer and asset files straight to disk and expect the next
+    request to see them; in production the directory watchers do this.
+    """
+
+    def __init__(self, srv, *args, **kwargs):
+        super().__init__(srv.app, *args, **kwargs)
+        self.srv = srv
+
+    def request(self, *args, **kwargs):
+        self.srv.answer_store.load()
+        self.srv.asset_catalog.load()
+        return super().request(*args, **kwargs)
+
+
 @pytest.fixture()
 def answers_dir(tmp_path):
     """Create a temp answers directory with hosts/ subdirectory."""
@@ -24,7 +41,7 @@ def client(answers_dir, assets_dir, monkeypatch):
 
     importlib.reload(srv)
 
-    return TestClient(srv.app)
+    return SyncedClient(srv)
 
 
 @pytest.fixture()
@@ -0,0 +1,251 @@
+"""Tests for boot-wave admission: download slots and the wait queue."""
+
+import pytest
+from admission import AdmissionControl, admission_slots
+from cluster import Cluster
+from ipxe import render_wait
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+def _control(clock, slots=2, **kwargs):
+    return AdmissionControl(slots, clock=clock, jitter=lambda: 0.5, **kwargs)
+
+
+class TestSlots:
+    """Slot counts from configuration and bandwidth."""
+
+    def test_disabled_by_default(self):
+        control = AdmissionControl()
+        assert not control.enabled
+        assert control.admit("10.0.0.1") is None
+        assert control.in_use == 0
+
+    @pytest.mark.parametrize(
+        ("slots", "bandwidth", "client", "expected"),
+        [
+            (8, 0, 0, 8),
+            (0, 10_000, 500, 20),
+            (8, 10_000, 500, 8),
+            (0, 100, 500, 1),
+            (0, 10_000, 0, 0),
+        ],
+    )
+    def test_admission_slots(self, slots, bandwidth, client, expected):
+        assert admission_slots(slots, bandwidth, client) == expected
+
+
+class TestQueue:
+    """Granting, queueing and releasing slots."""
+
+    def test_fills_slots_then_queues(self, clock):
+        control = _control(clock)
+        assert control.admit("a") is None
+        assert control.admit("b") is None
+        assert control.admit("c") == (5.0, 1)
+        assert control.admit("d") == (5.0, 2)
+        assert (control.in_use, control.queued) == (2, 2)
+
+    def test_holder_readmitted(self, clock):
+        control = _control(clock, slots=1)
+        control.admit("a")
+        assert control.admit("a") is None
+        assert control.in_use == 1
+
+    def test_first_come_first_served(self, clock):
+        control = _control(clock, slots=1)
+        control.admit("a")
+        control.admit("b")
+        control.admit("c")
+        control.release("a")
+        # c asks first, but b is ahead of it
+        assert control.admit("c") == (10.0, 2)
+        assert control.admit("b") is None
+        assert control.queued == 1
+
+    def test_backoff_grows_at_the_back(self, clock):
+        control = _control(clock, slots=1, retry=5, max_retry=30)
+        control.admit("a")
+        control.admit("b")
+        delays = [control.admit("c")[0] for _ in range(4)]
+        assert delays == [5.0, 10.0, 20.0, 30.0]
+        # Next in line keeps polling at the base interval
+        assert control.admit("b")[0] == 5.0
+
+    def test_jitter_spreads_retries(self, clock):
+        control = AdmissionControl(1, clock=clock, jitter=lambda: 0.0)
+        control.admit("a")
+        assert control.admit("b")[0] == 3.75
+
+    def test_wait_observed(self, clock):
+        waits = []
+        control = _control(clock, slots=1, observe=waits.append)
+        control.admit("a")
+        control.admit("b")
+        clock.now += 12
+        control.release("a")
+        assert control.admit("b") is None
+        assert waits == [0.0, 12.0]
+        assert control.max_wait == 12.0
+
+
+class TestExpiry:
+    """Leases and queue places that lapse."""
+
+    def test_idle_lease_expires(self, clock):
+        control = _control(clock, slots=1, lease=60)
+        control.admit("a")
+        clock.now += 61
+        assert control.admit("b") is None
+        assert control.expired == 1
+
+    def test_touch_renews_lease(self, clock):
+        control = _control(clock, slots=1, lease=60)
+        control.admit("a")
+        clock.now += 50
+        control.touch("a")
+        clock.now += 50
+        assert control.admit("b") is not None
+
+    def test_busy_lease_kept(self, clock):
+        control = _control(clock, slots=1, lease=60, busy=lambda client: client == "a")
+        control.admit("a")
+        clock.now += 600
+        assert control.admit("b") is not None
+
+    def test_gone_waiter_does_not_hold_up_line(self, clock):
+        control = _control(clock, slots=1, retry=5, max_retry=30)
+        control.admit("a")
+        control.admit("b")
+        control.admit("c")
+        control.release("a")
+        clock.now += 11
+        # b was due back after 5s and has not returned
+        assert control.admit("c") is None
+        clock.now += 31
+        control.status()
+        assert control.queued == 0
+
+    def test_release_drops_queue_place(self, clock):
+        control = _control(clock, slots=1)
+        control.admit("a")
+        control.admit("b")
+        control.release("b")
+        assert (control.in_use, control.queued) == (1, 0)
+
+    def test_status(self, clock):
+        control = _control(clock, slots=1)
+        control.admit("a")
+        control.admit("b")
+        clock.now += 3
+        status = control.status()
+        assert status["active"] == [{"client": "a", "held_for": 3.0, "idle_for": 3.0}]
+        assert status["queue"] == [
+            {"client": "b", "position": 1, "waiting_for": 3.0, "attempts": 1, "retry_in": 2.0}
+        ]
+
+
+class TestWaitScript:
+    """The iPXE script for a queued client."""
+
+    def test_sleeps_and_chains_back(self):
+        script = render_wait(7.6, 3, 12, "/menu.ipxe?mac=aa-bb-cc-dd-ee-ff")
+        assert script.startswith("#!ipxe\n")
+        assert "3 of 12 in line" in script
+        assert "sleep 8\n" in script
+        assert "chain /menu.ipxe?mac=aa-bb-cc-dd-ee-ff || goto retry\n" in script
+
+
+def _make_version(assets_dir):
+    ver_dir = assets_dir / "proxmox-ve" / "9.1-1"
+    ver_dir.mkdir(parents=True)
+    (ver_dir / "vmlinuz").write_bytes(b"k" * 100)
+    (ver_dir / "initrd").write_bytes(b"i" * 1000)
+
+
+@pytest.fixture()
+def metered(client, assets_dir, monkeypatch):
+    _make_version(assets_dir)
+    srv = client.srv
+    control = AdmissionControl(1, jitter=lambda: 0.5, observe=srv.admission_wait_seconds.observe)
+    monkeypatch.setattr(srv, "admission", control)
+    return client
+
+
+class TestEndpoints:
+    """Admission in /menu.ipxe, /assets and /admission."""
+
+    def test_menu_when_admitted(self, metered):
+        resp = metered.get("/menu.ipxe")
+        assert "kernel " in resp.text
+        assert metered.srv.admission.in_use == 1
+
+    def test_queued_client_waits(self, metered):
+        metered.srv.admission.admit("10.0.0.9")
+        resp = metered.get("/menu.ipxe", params={"mac": "aa-bb-cc-dd-ee-ff"})
+        assert resp.status_code == 200
+        assert resp.headers["cache-control"] == "no-store"
+        assert "sleep 5\n" in resp.text
+        assert "chain /menu.ipxe?mac=aa-bb-cc-dd-ee-ff || goto retry" in resp.text
+        session = metered.get("/sessions/aa-bb-cc-dd-ee-ff").json()
+        assert session["events"][-1]["detail"] == "queued #1"
+
+    def test_initrd_download_releases_slot(self, metered):
+        metered.get("/menu.ipxe")
+        metered.get("/assets/proxmox-ve/9.1-1/vmlinuz")
+        assert metered.srv.admission.in_use == 1
+        metered.get("/assets/proxmox-ve/9.1-1/initrd", headers={"Range": "bytes=0-99"})
+        assert metered.srv.admission.in_use == 1
+        metered.get("/assets/proxmox-ve/9.1-1/initrd", headers={"Range": "bytes=100-"})
+        assert metered.srv.admission.in_use == 0
+
+    def test_client_sent_to_peer_takes_no_slot(self, metered, assets_dir, monkeypatch):
+        srv = metered.srv
+        cluster = Cluster(
+            "http://a:8080", ["http://b:8080"], assets_dir, srv.ANSWERS_DIR, load=lambda: 3
+        )
+        cluster.refresh_assets()
+        peer = cluster.peers["http://b:8080"]
+        peer.healthy, peer.versions = True, dict(cluster.versions)
+        monkeypatch.setattr(srv, "cluster", cluster)
+        srv.admission.admit("10.0.0.9")
+        srv.admission.admit("testclient")
+
+        resp = metered.get("/menu.ipxe")
+        assert "http://b:8080/assets/proxmox-ve/9.1-1/initrd" in resp.text
+        assert (srv.admission.in_use, srv.admission.queued) == (1, 0)
+        assert srv.admission.admitted == 1
+
+    def test_status_endpoint(self, metered):
+        metered.srv.admission.admit("10.0.0.9")
+        metered.get("/menu.ipxe")
+        data = metered.get("/admission").json()
+        assert {k: data[k] for k in ("enabled", "slots", "in_use", "queued")} == {
+            "enabled": True,
+            "slots": 1,
+            "in_use": 1,
+            "queued": 1,
+        }
+        assert data["queue"][0]["client"] == "testclient"
+
+    def test_disabled_by_default(self, client):
+        assert client.get("/admission").json()["enabled"] is False
+        assert "sleep" not in client.get("/menu.ipxe").text
+
+    def test_metrics(self, metered):
+        metered.get("/menu.ipxe")
+        text = metered.get("/metrics").text
+        assert 'pxe_pilot_admission_slots{state="in_use"} 1' in text
+        assert "pxe_pilot_admission_queue_depth 0" in text
+        assert "pxe_pilot_admission_wait_seconds_count 1" in text
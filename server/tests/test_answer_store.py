@@ -0,0 +1,196 @@
+"""Tests for the in-memory answer index and its filesystem watcher."""
+
+import asyncio
+
+import answers
+from answers import AnswerStore
+from watch import TreeWatcher
+
+
+def _store(answers_dir) -> AnswerStore:
+    store = AnswerStore(answers_dir)
+    store.load()
+    return store
+
+
+class TestAnswerStore:
+    """Loading and looking up answer files."""
+
+    def test_lookup_served_from_memory(self, answers_dir):
+        host_file = answers_dir / "hosts" / "aa-bb-cc-dd-ee-ff.toml"
+        host_file.write_text('hostname = "node1"')
+        store = _store(answers_dir)
+        host_file.unlink()
+
+        content, matched, source = store.lookup(["AA:BB:CC:DD:EE:FF"])
+        assert content == b'hostname = "node1"'
+        assert (matched, source) == ("aa-bb-cc-dd-ee-ff", "host")
+
+    def test_default_fallback(self, answers_dir):
+        (answers_dir / "default.toml").write_text("default = true")
+        store = _store(answers_dir)
+        assert store.lookup(["ff:ff:ff:ff:ff:ff"]) == (b"default = true", None, "default")
+
+    def test_missing_hosts_dir(self, tmp_path):
+        store = _store(tmp_path)
+        assert store.host_count == 0
+        assert store.lookup(["aa:bb:cc:dd:ee:ff"])[0] is None
+
+    def test_hosts_sorted(self, answers_dir):
+        for mac in ["cc-cc-cc-cc-cc-cc", "aa-aa-aa-aa-aa-aa"]:
+            (answers_dir / "hosts" / f"{mac}.toml").write_text("")
+        assert _store(answers_dir).hosts() == ["aa-aa-aa-aa-aa-aa", "cc-cc-cc-cc-cc-cc"]
+
+
+class TestApplyChanges:
+    """Incremental updates from change notifications."""
+
+    def test_added_modified_and_removed(self, answers_dir):
+        first = answers_dir / "hosts" / "aa-aa-aa-aa-aa-aa.toml"
+        first.write_text("v = 1")
+        store = _store(answers_dir)
+        generation = store.generation
+
+        first.write_text("v = 2")
+        second = answers_dir / "hosts" / "bb-bb-bb-bb-bb-bb.toml"
+        second.write_text("v = 3")
+        store.apply_changes({first, second})
+        assert store.get_host("aa-aa-aa-aa-aa-aa") == b"v = 2"
+        assert store.hosts() == ["aa-aa-aa-aa-aa-aa", "bb-bb-bb-bb-bb-bb"]
+        assert store.generation > generation
+
+        second.unlink()
+        store.apply_changes({second})
+        assert store.hosts() == ["aa-aa-aa-aa-aa-aa"]
+
+    def test_default_changes(self, answers_dir):
+        store = _store(answers_dir)
+        default = answers_dir / "default.toml"
+        default.write_text("default = true")
+        store.apply_changes({default})
+        assert store.default == b"default = true"
+
+        default.unlink()
+        store.apply_changes({default})
+        assert store.default is None
+
+    def test_ignores_unrelated_files(self, answers_dir):
+        store = _store(answers_dir)
+        notes = answers_dir / "hosts" / "notes.txt"
+        notes.write_text("")
+        store.apply_changes({notes})
+        assert store.host_count == 0
+
+    def test_hosts_dir_removed(self, answers_dir):
+        (answers_dir / "hosts" / "aa-aa-aa-aa-aa-aa.toml").write_text("")
+        store = _store(answers_dir)
+        for f in (answers_dir / "hosts").iterdir():
+            f.unlink()
+        (answers_dir / "hosts").rmdir()
+        store.apply_changes({answers_dir / "hosts"})
+        assert store.host_count == 0
+
+
+class TestHostIndex:
+    """Paging the sorted listing and the change log behind ?since=."""
+
+    def test_page_bounds(self, answers_dir):
+        for mac in ["aa-00-00-00-00-01", "aa-00-00-00-00-02", "bb-00-00-00-00-01"]:
+            (answers_dir / "hosts" / f"{mac}.toml").write_text("")
+        store = _store(answers_dir)
+        hosts, cursor, _ = store.page(prefix="aa", limit=2)
+        assert (hosts, cursor) == (["aa-00-00-00-00-01", "aa-00-00-00-00-02"], None)
+        hosts, cursor, _ = store.page(after="aa-00-00-00-00-01", limit=1)
+        assert (hosts, cursor) == (["aa-00-00-00-00-02"], "aa-00-00-00-00-02")
+        assert store.page(prefix="cc")[0] == []
+
+    def test_incremental_index(self, answers_dir):
+        store = _store(answers_dir)
+        paths = [answers_dir / "hosts" / f"{mac}.toml" for mac in ("cc", "aa", "bb")]
+        for path in paths:
+            path.write_text("")
+            store.apply_changes({path})
+        assert store.hosts() == ["aa", "bb", "cc"]
+        paths[2].unlink()
+        store.apply_changes({paths[2]})
+        assert store.hosts() == ["aa", "cc"]
+
+    def test_changes_coalesced(self, answers_dir):
+        host = answers_dir / "hosts" / "aa-aa-aa-aa-aa-aa.toml"
+        store = _store(answers_dir)
+        start = store.generation
+        for content in ("v = 1", "v = 2"):
+            host.write_text(content)
+            store.apply_changes({host})
+        middle = store.generation
+        host.unlink()
+        store.apply_changes({host})
+        assert store.changes_since(start)[0] == [("aa-aa-aa-aa-aa-aa", "removed")]
+        assert store.changes_since(middle) == ([("aa-aa-aa-aa-aa-aa", "removed")], store.generation)
+
+    def test_template_change_touches_inventory(self, answers_dir):
+        (answers_dir / "template.toml").write_text("a = 1")
+        (answers_dir / "inventory.toml").write_text('[hosts."aa-aa-aa-aa-aa-aa"]\n')
+        store = _store(answers_dir)
+        generation = store.generation
+        (answers_dir / "template.toml").write_text("a = 2")
+        store.apply_changes({answers_dir / "template.toml"})
+        assert store.changes_since(generation)[0] == [("aa-aa-aa-aa-aa-aa", "updated")]
+
+    def test_unchanged_reload_keeps_generation(self, answers_dir):
+        (answers_dir / "hosts" / "aa-aa-aa-aa-aa-aa.toml").write_text("")
+        store = _store(answers_dir)
+        generation = store.generation
+        store.load()
+        assert store.generation == generation
+
+    def test_stamped_generations(self, answers_dir):
+        # Stores fed the same stamped batches agree, whenever they loaded
+        tag = 5 << 32
+        first = AnswerStore(answers_dir)
+        first.load(tag + 1)
+        host = answers_dir / "hosts" / "aa-aa-aa-aa-aa-aa.toml"
+        host.write_text("v = 1")
+        # The second store loads after the change but before its batch arrives
+        second = AnswerStore(answers_dir)
+        second.load(tag + 1)
+        for store in (first, second):
+            store.apply_changes({host}, tag + 2)
+            assert store.generation == tag + 2
+            assert store.changes_since(tag + 1) == ([("aa-aa-aa-aa-aa-aa", "updated")], tag + 2)
+            assert store.changes_since(tag + 2) == ([], tag + 2)
+            assert store.changes_since(tag) is None
+
+    def test_foreign_or_expired_generation(self, answers_dir, monkeypatch):
+        monkeypatch.setattr(answers, "MAX_CHANGES", 1)
+        store = _store(answers_dir)
+        start = store.generation
+        assert store.changes_since(_store(answers_dir).generation) is None
+        assert store.changes_since(start + 1) is None
+        for mac in ("aa", "bb"):
+            path = answers_dir / "hosts" / f"{mac}.toml"
+            path.write_text("")
+            store.apply_changes({path})
+        assert store.changes_since(start) is None
+        assert store.changes_since(store.generation - 1) == ([("bb", "updated")], store.generation)
+
+
+class TestTreeWatcher:
+    """Polling fallback delivers changes to the store."""
+
+    def test_polling_picks_up_new_host(self, answers_dir):
+        store = _store(answers_dir)
+
+        async def scenario():
+            watcher = TreeWatcher(answers_dir, store.apply_changes, polling=True, interval=0.05)
+            watcher.start()
+            await asyncio.sleep(0.1)
+            (answers_dir / "hosts" / "aa-bb-cc-dd-ee-ff.toml").write_text("new = true")
+            for _ in range(40):
+                await asyncio.sleep(0.05)
+                if store.host_count:
+                    break
+            await watcher.stop()
+
+        asyncio.run(scenario())
+        assert store.get_host("aa-bb-cc-dd-ee-ff") == b"new = true"
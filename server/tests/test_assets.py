@@ -0,0 +1,206 @@
+"""Tests for GET /assets/* streaming with Range support."""
+
+import asyncio
+import multiprocessing
+import os
+
+import pytest
+import streaming
+from streaming import (
+    AssetStreamer,
+    AssetStreamResponse,
+    BandwidthLimiter,
+    RangeNotSatisfiable,
+    parse_range,
+)
+
+INITRD = bytes(range(256)) * 4096  # 1 MiB
+
+
+@pytest.fixture()
+def initrd(assets_dir):
+    ver_dir = assets_dir / "proxmox-ve" / "9.1-1"
+    ver_dir.mkdir(parents=True)
+    (ver_dir / "vmlinuz").write_bytes(b"kernel")
+    (ver_dir / "initrd").write_bytes(INITRD)
+    return "/assets/proxmox-ve/9.1-1/initrd"
+
+
+class TestAssetDownload:
+    """Whole-file downloads."""
+
+    def test_full_download(self, client, initrd):
+        resp = client.get(initrd)
+        assert resp.status_code == 200
+        assert resp.content == INITRD
+        assert resp.headers["content-length"] == str(len(INITRD))
+        assert resp.headers["accept-ranges"] == "bytes"
+        assert resp.headers["content-type"] == "application/octet-stream"
+
+    def test_head(self, client, initrd):
+        resp = client.head(initrd)
+        assert resp.status_code == 200
+        assert resp.content == b""
+        assert resp.headers["content-length"] == str(len(INITRD))
+
+    def test_missing_file(self, client):
+        assert client.get("/assets/proxmox-ve/9.1-1/initrd").status_code == 404
+
+    def test_directory_not_served(self, client, initrd):
+        assert client.get("/assets/proxmox-ve/9.1-1").status_code == 404
+
+    def test_path_traversal(self, client, initrd):
+        assert client.get("/assets/proxmox-ve/..%2F..%2Fhosts").status_code == 404
+
+    def test_not_modified(self, client, initrd):
+        etag = client.head(initrd).headers["etag"]
+        resp = client.get(initrd, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+
+    @pytest.mark.parametrize("header", ["*", "W/{etag}", '"other", {etag}'])
+    def test_not_modified_forms(self, client, initrd, header):
+        etag = client.head(initrd).headers["etag"]
+        resp = client.get(initrd, headers={"If-None-Match": header.format(etag=etag)})
+        assert resp.status_code == 304
+
+    def test_slot_released_after_download(self, client, initrd):
+        import server.server as srv
+
+        client.get(initrd)
+        assert srv.asset_streamer.active_streams == 0
+
+
+class TestAssetReads:
+    """Short reads and failed streams."""
+
+    def test_short_reads_filled(self, client, initrd, monkeypatch):
+        pread = os.pread
+        monkeypatch.setattr(streaming.os, "pread", lambda fd, n, pos: pread(fd, min(n, 1000), pos))
+        resp = client.get(initrd)
+        assert resp.content == INITRD
+        assert client.srv.asset_streamer.bytes_sent[("proxmox-ve", "9.1-1")] == len(INITRD)
+
+    def test_failed_body_cancels_disconnect_watch(self, assets_dir, monkeypatch):
+        path = assets_dir / "initrd"
+        path.write_bytes(INITRD)
+
+        def fail(fd, size, position):
+            raise OSError(5, "Input/output error")
+
+        monkeypatch.setattr(streaming, "_pread_full", fail)
+        streamer = AssetStreamer(assets_dir)
+        response = AssetStreamResponse(streamer, "c", "initrd", [(path, 0, len(INITRD))], 200, {})
+
+        async def never_disconnects():
+            await asyncio.Event().wait()
+
+        async def discard(message):
+            pass
+
+        async def scenario():
+            with pytest.raises(OSError):
+                await response({"method": "GET"}, never_disconnects, discard)
+            return asyncio.all_tasks() - {asyncio.current_task()}
+
+        assert asyncio.run(scenario()) == set()
+        assert streamer.active_streams == 0
+
+
+class TestAssetRanges:
+    """Range and If-Range handling for resumed downloads."""
+
+    def test_range(self, client, initrd):
+        resp = client.get(initrd, headers={"Range": "bytes=100-199"})
+        assert resp.status_code == 206
+        assert resp.content == INITRD[100:200]
+        assert resp.headers["content-range"] == f"bytes 100-199/{len(INITRD)}"
+        assert resp.headers["content-length"] == "100"
+
+    def test_open_ended_range(self, client, initrd):
+        resp = client.get(initrd, headers={"Range": "bytes=1000-"})
+        assert resp.status_code == 206
+        assert resp.content == INITRD[1000:]
+
+    def test_suffix_range(self, client, initrd):
+        resp = client.get(initrd, headers={"Range": "bytes=-10"})
+        assert resp.content == INITRD[-10:]
+
+    def test_unsatisfiable(self, client, initrd):
+        resp = client.get(initrd, headers={"Range": f"bytes={len(INITRD)}-"})
+        assert resp.status_code == 416
+        assert resp.headers["content-range"] == f"bytes */{len(INITRD)}"
+
+    def test_if_range_matches(self, client, initrd):
+        etag = client.head(initrd).headers["etag"]
+        resp = client.get(initrd, headers={"Range": "bytes=0-9", "If-Range": etag})
+        assert resp.status_code == 206
+
+    def test_if_range_stale_serves_full_file(self, client, initrd):
+        resp = client.get(initrd, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+        assert resp.status_code == 200
+        assert resp.content == INITRD
+
+
+class TestAssetLimits:
+    """Per-client stream cap and global bandwidth limit."""
+
+    def test_per_client_cap(self, client, initrd):
+        import server.server as srv
+
+        srv.asset_streamer.streams["testclient"] = srv.asset_streamer.max_streams_per_client
+        resp = client.get(initrd)
+        assert resp.status_code == 429
+        assert resp.headers["retry-after"] == "5"
+
+    def test_bandwidth_limiter_paces_chunks(self):
+        limiter = BandwidthLimiter(bytes_per_second=1000)
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            for _ in range(3):
+                await limiter.acquire(100)
+            return loop.time() - start
+
+        assert asyncio.run(scenario()) >= 0.2
+
+    def test_shared_timeline_paces_every_limiter(self):
+        timeline = multiprocessing.Value("d", 0.0)
+        # Two workers' limiters, each sending 100 bytes at 1000 bytes/s
+        limiters = [BandwidthLimiter(1000, timeline) for _ in range(2)]
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            for limiter in limiters * 2:
+                await limiter.acquire(100)
+            return loop.time() - start
+
+        assert asyncio.run(scenario()) >= 0.3
+
+    def test_unlimited(self):
+        asyncio.run(BandwidthLimiter(0).acquire(10**12))
+
+
+class TestParseRange:
+    """Range header parsing."""
+
+    @pytest.mark.parametrize(
+        ("header", "expected"),
+        [
+            ("bytes=0-0", (0, 0)),
+            ("bytes=5-", (5, 99)),
+            ("bytes=-5", (95, 99)),
+            ("bytes=90-500", (90, 99)),
+            ("bytes=0-1,5-6", None),
+            ("items=0-1", None),
+            ("bytes=9-1", None),
+            ("bytes=abc", None),
+        ],
+    )
+    def test_parse(self, header, expected):
+        assert parse_range(header, 100) == expected
+
+    def test_past_end(self):
+        with pytest.raises(RangeNotSatisfiable):
+            parse_range("bytes=100-", 100)
@@ -0,0 +1,143 @@
+"""Tests for per-host boot targets chosen without the menu."""
+
+import pytest
+from answers import AnswerStore
+from assets import AssetCatalog
+from boottargets import parse_boot_targets
+
+MAC = "aa-bb-cc-dd-ee-ff"
+UUID = "4c4c4544-0035-4810-8056-b4c04f4e3332"
+
+BOOT_TOML = f"""
+default = "proxmox-ve"
+
+[hosts]
+"AA:BB:CC:DD:EE:FF" = "proxmox-ve/8.4-1"
+"11-22-33-44-55-66" = "menu"
+
+[uuids]
+"{UUID.upper()}" = "proxmox-bs"
+"""
+
+
+def _make_version(assets_dir, product, version):
+    ver_dir = assets_dir / product / version
+    ver_dir.mkdir(parents=True)
+    (ver_dir / "vmlinuz").write_bytes(b"k")
+    (ver_dir / "initrd").write_bytes(b"i")
+
+
+@pytest.fixture()
+def assets(assets_dir):
+    _make_version(assets_dir, "proxmox-ve", "8.4-1")
+    _make_version(assets_dir, "proxmox-ve", "9.1-1")
+    _make_version(assets_dir, "proxmox-bs", "4.0-1")
+    return assets_dir
+
+
+class TestBootTargets:
+    """Parsing boot.toml and resolving a machine's target."""
+
+    def test_precedence(self, answers_dir):
+        (answers_dir / "boot.toml").write_text(BOOT_TOML)
+        store = AnswerStore(answers_dir)
+        store.load()
+        assert store.boot_target(MAC, UUID) == "proxmox-ve/8.4-1"
+        assert store.boot_target("00-00-00-00-00-01", UUID) == "proxmox-bs"
+        assert store.boot_target(None, None) == "proxmox-ve"
+        assert store.boot_target("11-22-33-44-55-66", UUID) is None
+
+    def test_no_boot_file_means_menu(self, answers_dir):
+        store = AnswerStore(answers_dir)
+        store.load()
+        assert store.boot_target(MAC, UUID) is None
+
+    @pytest.mark.parametrize("content", ["default = 1", "hosts = 'x'", "[hosts]\na = 1", "= ="])
+    def test_invalid(self, content):
+        with pytest.raises(ValueError):
+            parse_boot_targets(content.encode())
+
+    def test_invalid_file_keeps_previous(self, answers_dir):
+        boot_file = answers_dir / "boot.toml"
+        boot_file.write_text('default = "proxmox-ve"')
+        store = AnswerStore(answers_dir)
+        store.load()
+        boot_file.write_text("default = [")
+        store.apply_changes({boot_file})
+        assert store.boot_target(None, None) == "proxmox-ve"
+
+        boot_file.unlink()
+        store.apply_changes({boot_file})
+        assert store.boot_target(None, None) is None
+
+
+class TestBootScripts:
+    """Resolving targets against the asset catalogue."""
+
+    def test_product_boots_newest(self, assets):
+        catalog = AssetCatalog(assets)
+        body, _ = catalog.boot_script("proxmox-ve", "http://x")
+        assert b"http://x/assets/proxmox-ve/9.1-1/vmlinuz" in body
+        assert b"choose" not in body
+
+    def test_pinned_version(self, assets):
+        body, _ = AssetCatalog(assets).boot_script("proxmox-ve/8.4-1", "http://x")
+        assert b"initrd http://x/assets/proxmox-ve/8.4-1/initrd" in body
+        assert b"initrd http://x/assets/proxmox-ve/8.4-1/initrd || goto menu" in body
+        assert b"boot || goto menu" in body
+        assert body.rstrip().endswith(
+            b"chain /menu.ipxe?menu=1&mac=${mac:hexhyp}&uuid=${uuid}"
+            b"&arch=${buildarch}&platform=${platform}"
+        )
+
+    def test_unknown_target(self, assets):
+        catalog = AssetCatalog(assets)
+        assert catalog.boot_script("proxmox-ve/1.0", "http://x") is None
+        assert catalog.boot_script("nope", "http://x") is None
+
+    def test_cached_until_reload(self, assets):
+        catalog = AssetCatalog(assets)
+        first = catalog.boot_script("proxmox-ve", "http://x")
+        assert catalog.boot_script("proxmox-ve", "http://x") is first
+        _make_version(assets, "proxmox-ve", "9.2-1")
+        catalog.load()
+        assert b"/9.2-1/" in catalog.boot_script("proxmox-ve", "http://x")[0]
+
+
+class TestMenuEndpoint:
+    """/menu.ipxe choosing between a boot target and the menu."""
+
+    def test_boot_script_passes_uuid(self, client):
+        assert "&uuid=${uuid}" in client.get("/boot.ipxe").text
+
+    def test_host_target(self, client, answers_dir, assets):
+        (answers_dir / "boot.toml").write_text(BOOT_TOML)
+        text = client.get("/menu.ipxe", params={"mac": MAC, "uuid": ""}).text
+        assert "/assets/proxmox-ve/8.4-1/vmlinuz" in text
+        assert "choose" not in text
+
+    def test_uuid_target(self, client, answers_dir, assets):
+        (answers_dir / "boot.toml").write_text(BOOT_TOML)
+        text = client.get("/menu.ipxe", params={"mac": "", "uuid": UUID}).text
+        assert "/assets/proxmox-bs/4.0-1/vmlinuz" in text
+
+    def test_forced_menu(self, client, answers_dir, assets):
+        (answers_dir / "boot.toml").write_text(BOOT_TOML)
+        assert "choose" in client.get("/menu.ipxe", params={"mac": MAC, "menu": "1"}).text
+
+    def test_unavailable_target_shows_menu(self, client, answers_dir, assets):
+        (answers_dir / "boot.toml").write_text('default = "proxmox-mg"')
+        assert "choose" in client.get("/menu.ipxe").text
+
+    def test_etag(self, client, answers_dir, assets):
+        (answers_dir / "boot.toml").write_text(BOOT_TOML)
+        etag = client.get("/menu.ipxe", params={"mac": MAC}).headers["etag"]
+        resp = client.get("/menu.ipxe", params={"mac": MAC}, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert client.get("/menu.ipxe").headers["etag"] != etag
+
+    def test_session_records_target(self, client, answers_dir, assets):
+        (answers_dir / "boot.toml").write_text(BOOT_TOML)
+        client.get("/menu.ipxe", params={"mac": MAC})
+        event = client.get(f"/sessions/{MAC}").json()["events"][-1]
+        assert (event["stage"], event["detail"]) == ("menu", "proxmox-ve/8.4-1")
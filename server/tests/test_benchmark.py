@@ -0,0 +1,40 @@
+"""Smoke tests for the mass-boot benchmark harness."""
+
+import json
+
+from benchmarks.mass_boot import host_mac, main, parse_size, percentile
+
+
+class TestHelpers:
+    """Pure helpers used to build and summarise a run."""
+
+    def test_percentile_nearest_rank(self):
+        values = [float(v) for v in range(1, 101)]
+        assert percentile(values, 50) == 50.0
+        assert percentile(values, 99) == 99.0
+        assert percentile([], 99) == 0.0
+
+    def test_parse_size(self):
+        assert parse_size("2G") == 2 << 30
+        assert parse_size("512m") == 512 << 20
+        assert parse_size("1000") == 1000
+
+    def test_host_macs_are_unique_and_normalized(self):
+        macs = {host_mac(i) for i in range(1000)}
+        assert len(macs) == 1000
+        assert host_mac(1) == "52-54-00-00-00-01"
+
+
+class TestEndToEnd:
+    """A tiny fleet against a real server process."""
+
+    def test_small_run(self, tmp_path):
+        output = tmp_path / "results.json"
+        args = ["--machines", "3", "--hosts", "5", "--asset-size", "1M", "--kernel-size", "64K"]
+        assert main([*args, "--workdir", str(tmp_path), "--output", str(output)]) == 0
+
+        report = json.loads(output.read_text())
+        assert report["machines_failed"] == 0
+        assert report["endpoints"]["initrd"]["bytes"] == 3 << 20
+        assert report["endpoints"]["answer"]["requests"] == 3
+        assert report["endpoints"]["menu.ipxe"]["errors"] == 0
@@ -22,3 +22,8 @@ class TestBootConfig:
         resp = client.get("/boot.ipxe")
         assert resp.status_code == 200
         assert "#!ipxe" in resp.text
+
+    def test_health_reports_tftp(self, client):
+        data = client.get("/health").json()
+        assert data["tftp"]["running"] is False
+        assert data["tftp"]["completed"] == 0
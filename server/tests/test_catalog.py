@@ -0,0 +1,156 @@
+"""Tests for the builder's catalog.json and manifests as the asset index."""
+
+import hashlib
+import json
+from pathlib import Path
+
+from assets import AssetCatalog, manifest_checksum, manifest_chunks, write_catalog
+
+
+def _publish(assets_dir: Path, product: str, version: str, files: dict[str, bytes]) -> Path:
+    """Write files plus a manifest the way the builder does."""
+    version_dir = assets_dir / product / version
+    version_dir.mkdir(parents=True)
+    entries = {}
+    for name, data in files.items():
+        (version_dir / name).write_bytes(data)
+        entries[name] = {
+            "size": len(data),
+            "mtime_ns": (version_dir / name).stat().st_mtime_ns,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "chunks": [hashlib.sha256(data).hexdigest()],
+        }
+    manifest = {"format": 1, "chunk_size": 1 << 24, "files": entries}
+    (version_dir / "manifest.json").write_text(json.dumps(manifest))
+    return version_dir
+
+
+class TestCatalogIndex:
+    """AssetCatalog loading catalog.json instead of scanning."""
+
+    def test_catalog_order_used(self, assets_dir):
+        _publish(assets_dir, "pve", "8.4-1", {"vmlinuz": b"k", "initrd": b"i"})
+        _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"i"})
+        write_catalog(assets_dir)
+        catalog_path = assets_dir / "catalog.json"
+        doc = json.loads(catalog_path.read_text())
+        doc["products"]["pve"].reverse()
+        catalog_path.write_text(json.dumps(doc))
+
+        catalog = AssetCatalog(assets_dir)
+        catalog.load()
+        assert catalog.source == "catalog"
+        assert catalog.products == {"pve": ["8.4-1", "9.1-1"]}
+
+    def test_uncatalogued_versions_hidden(self, assets_dir):
+        _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"i"})
+        write_catalog(assets_dir)
+        _publish(assets_dir, "pve", "9.2-1", {"vmlinuz": b"k", "initrd": b"i"})
+
+        catalog = AssetCatalog(assets_dir)
+        catalog.load()
+        assert catalog.products == {"pve": ["9.1-1"]}
+
+    def test_deleted_version_skipped(self, assets_dir):
+        version_dir = _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"i"})
+        write_catalog(assets_dir)
+        (version_dir / "initrd").unlink()
+
+        catalog = AssetCatalog(assets_dir)
+        catalog.load()
+        assert catalog.products == {}
+
+    def test_catalog_change_updates_versions(self, assets_dir):
+        _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"i"})
+        write_catalog(assets_dir)
+        catalog = AssetCatalog(assets_dir)
+        catalog.load()
+
+        _publish(assets_dir, "pve", "9.2-1", {"vmlinuz": b"k", "initrd": b"i"})
+        catalog.apply_changes({assets_dir / "pve" / "9.2-1" / "initrd"})
+        assert catalog.products == {"pve": ["9.1-1"]}
+
+        write_catalog(assets_dir)
+        catalog.apply_changes({assets_dir / "catalog.json"})
+        assert catalog.source == "catalog"
+        assert catalog.products == {"pve": ["9.2-1", "9.1-1"]}
+
+        (assets_dir / "catalog.json").unlink()
+        catalog.apply_changes({assets_dir / "catalog.json"})
+        assert catalog.source == "scan"
+        assert catalog.products == {"pve": ["9.2-1", "9.1-1"]}
+
+    def test_scanned_version_removed(self, assets_dir):
+        version_dir = _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"i"})
+        _publish(assets_dir, "pve", "9.2-1", {"vmlinuz": b"k", "initrd": b"i"})
+        catalog = AssetCatalog(assets_dir)
+        catalog.load()
+        for path in list(version_dir.iterdir()):
+            path.unlink()
+        version_dir.rmdir()
+        catalog.apply_changes({version_dir / "initrd", version_dir})
+        assert catalog.products == {"pve": ["9.2-1"]}
+
+    def test_invalid_catalog_falls_back_to_scan(self, assets_dir):
+        _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"i"})
+        for bad in ("{not json", '{"format": 99}', '{"format": 1, "products": {"pve": [{}]}}'):
+            (assets_dir / "catalog.json").write_text(bad)
+            catalog = AssetCatalog(assets_dir)
+            catalog.load()
+            assert catalog.source == "scan"
+            assert catalog.products == {"pve": ["9.1-1"]}
+
+    def test_segments_from_catalog(self, client, assets_dir):
+        files = {"vmlinuz": b"k", "initrd": b"i", "iso.cpio": b"c"}
+        _publish(assets_dir, "pve", "9.1-1", files)
+        write_catalog(assets_dir)
+        (assets_dir / "pve" / "9.1-1" / "iso.cpio").unlink()
+
+        # Listed segments are checked, not rediscovered: the version drops out
+        assert "pve/9.1-1" not in client.get("/menu.ipxe").text
+        (assets_dir / "pve" / "9.1-1" / "iso.cpio").write_bytes(b"c")
+        lines = client.get("/menu.ipxe").text.splitlines()
+        initrds = [line.split("/assets/")[1] for line in lines if line.startswith("initrd ")]
+        assert initrds == ["pve/9.1-1/initrd", "pve/9.1-1/iso.cpio"]
+
+
+class TestChecksums:
+    """Manifest checksums, trusted only while size and mtime match."""
+
+    def test_checksum_from_catalog(self, assets_dir):
+        version_dir = _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"i"})
+        write_catalog(assets_dir)
+        catalog = AssetCatalog(assets_dir)
+        catalog.load()
+        path = version_dir / "initrd"
+        assert catalog.checksum(path, path.stat()) == hashlib.sha256(b"i").hexdigest()
+
+        path.write_bytes(b"changed")
+        assert catalog.checksum(path, path.stat()) is None
+
+    def test_manifest_checksum_and_chunks(self, assets_dir):
+        version_dir = _publish(assets_dir, "pve", "9.1-1", {"initrd": b"i"})
+        path = version_dir / "initrd"
+        sha = hashlib.sha256(b"i").hexdigest()
+        assert manifest_checksum(path, path.stat()) == sha
+        assert manifest_chunks(path, sha) == (1 << 24, [sha])
+        assert manifest_chunks(path, "other") is None
+        assert manifest_checksum(version_dir / "vmlinuz", path.stat()) is None
+
+    def test_strong_etag(self, client, assets_dir):
+        _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"initrd"})
+        write_catalog(assets_dir)
+        resp = client.get("/assets/pve/9.1-1/initrd")
+        assert resp.headers["etag"] == f'"{hashlib.sha256(b"initrd").hexdigest()}"'
+
+        resumed = client.get(
+            "/assets/pve/9.1-1/initrd",
+            headers={"Range": "bytes=2-", "If-Range": resp.headers["etag"]},
+        )
+        assert resumed.status_code == 206
+        assert resumed.content == b"itrd"
+
+    def test_stat_etag_without_catalog(self, client, assets_dir):
+        _publish(assets_dir, "pve", "9.1-1", {"vmlinuz": b"k", "initrd": b"initrd"})
+        etag = client.get("/assets/pve/9.1-1/initrd").headers["etag"]
+        assert etag != f'"{hashlib.sha256(b"initrd").hexdigest()}"'
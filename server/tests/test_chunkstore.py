@@ -0,0 +1,230 @@
+"""Tests for assets kept in the chunk store and reassembled when served."""
+
+import hashlib
+import json
+from pathlib import Path
+
+import assets
+import pytest
+from assets import (
+    AssetCatalog,
+    StoredFile,
+    chunk_path,
+    known_checksum,
+    scan_assets,
+    stored_files,
+    write_catalog,
+)
+from cluster import asset_files
+
+PIECES = [b"a" * 300, b"b" * 500, b"c" * 200]
+INITRD = b"".join(PIECES)
+
+
+def _publish_stored(assets_dir: Path, version: str, pieces=PIECES, write_chunks=True) -> Path:
+    """A version whose initrd is in the chunk store, as the builder publishes it."""
+    version_dir = assets_dir / "proxmox-ve" / version
+    version_dir.mkdir(parents=True)
+    (version_dir / "vmlinuz").write_bytes(b"kernel")
+    store = []
+    for piece in pieces:
+        sha = hashlib.sha256(piece).hexdigest()
+        store.append([sha, len(piece)])
+        if write_chunks:
+            path = chunk_path(assets_dir, sha)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(piece)
+    data = b"".join(pieces)
+    entries = {
+        "initrd": {
+            "size": len(data),
+            "mtime_ns": 1_700_000_000_000_000_000,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "store": store,
+        }
+    }
+    manifest = {"format": 1, "chunk_size": 1 << 24, "files": entries}
+    (version_dir / "manifest.json").write_text(json.dumps(manifest))
+    return version_dir
+
+
+class TestStoredFile:
+    """Ranges mapped onto chunks."""
+
+    def _stored(self) -> StoredFile:
+        chunks = tuple(Path(f"/c/{i}") for i in range(3))
+        return StoredFile(1000, "x", 0, chunks, (0, 300, 800))
+
+    def test_whole_file(self):
+        assert self._stored().extents(0, 1000) == [
+            (Path("/c/0"), 0, 300),
+            (Path("/c/1"), 0, 500),
+            (Path("/c/2"), 0, 200),
+        ]
+
+    def test_range_across_boundary(self):
+        assert self._stored().extents(250, 100) == [(Path("/c/0"), 250, 50), (Path("/c/1"), 0, 50)]
+
+    def test_range_inside_chunk(self):
+        assert self._stored().extents(900, 100) == [(Path("/c/2"), 100, 100)]
+
+
+class TestIndex:
+    """Versions enumerated from their manifests."""
+
+    def test_scan_lists_stored_version(self, assets_dir):
+        version_dir = _publish_stored(assets_dir, "9.1-1")
+        assert scan_assets(assets_dir) == {"proxmox-ve": ["9.1-1"]}
+        stored = stored_files(assets_dir, version_dir)["initrd"]
+        assert stored.size == len(INITRD)
+        assert stored.offsets == (0, 300, 800)
+
+    def test_missing_chunk_hides_version(self, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        chunk_path(assets_dir, hashlib.sha256(PIECES[1]).hexdigest()).unlink()
+        assert scan_assets(assets_dir) == {}
+
+    @pytest.mark.parametrize(
+        "store", [[["../../etc/passwd", 10]], [["a" * 64, "10"]], [["a" * 64, 999]]]
+    )
+    def test_malformed_store_ignored(self, assets_dir, store):
+        version_dir = _publish_stored(assets_dir, "9.1-1")
+        manifest = json.loads((version_dir / "manifest.json").read_text())
+        manifest["files"]["initrd"]["store"] = store
+        (version_dir / "manifest.json").write_text(json.dumps(manifest))
+        assert stored_files(assets_dir, version_dir) == {}
+
+    def test_catalog(self, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        write_catalog(assets_dir)
+        catalog = json.loads((assets_dir / "catalog.json").read_text())
+        [entry] = catalog["products"]["proxmox-ve"]
+        assert entry["files"]["initrd"]["stored"] is True
+        assert entry["files"]["initrd"]["sha256"] == hashlib.sha256(INITRD).hexdigest()
+
+        index = AssetCatalog(assets_dir)
+        index.load()
+        assert index.source == "catalog"
+        assert index.products == {"proxmox-ve": ["9.1-1"]}
+        assert index.stored("proxmox-ve/9.1-1/initrd").size == len(INITRD)
+        assert index.warm() == []
+
+    def test_chunks_named_by_checksum(self, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        sha = hashlib.sha256(PIECES[0]).hexdigest()
+        path = chunk_path(assets_dir, sha)
+        assert known_checksum(path, path.stat()) == sha
+
+    def test_chunks_replicated(self, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        rels = {path.relative_to(assets_dir).as_posix() for path in asset_files(assets_dir)}
+        sha = hashlib.sha256(PIECES[0]).hexdigest()
+        assert f"chunks/{sha[:2]}/{sha}" in rels
+
+
+class TestApplyChanges:
+    """Only the versions behind a change are re-indexed."""
+
+    @pytest.fixture()
+    def indexed(self, assets_dir, monkeypatch):
+        """A catalogued version loaded, and the versions whose chunks are checked from now on."""
+        _publish_stored(assets_dir, "9.1-1")
+        write_catalog(assets_dir)
+        catalog = AssetCatalog(assets_dir)
+        catalog.load()
+        checked = []
+        original = assets.stored_files
+
+        def counting(assets_dir, version_dir):
+            checked.append(version_dir.name)
+            return original(assets_dir, version_dir)
+
+        monkeypatch.setattr(assets, "stored_files", counting)
+        return catalog, checked
+
+    def test_new_version_indexed_alone(self, assets_dir, indexed):
+        catalog, checked = indexed
+        other = [PIECES[0], b"d" * 500, PIECES[2]]
+        version_dir = _publish_stored(assets_dir, "9.1-2", other)
+        write_catalog(assets_dir)
+        checked.clear()
+
+        sha = hashlib.sha256(other[1]).hexdigest()
+        changed = {
+            chunk_path(assets_dir, sha),
+            version_dir / "vmlinuz",
+            version_dir / "manifest.json",
+            assets_dir / "catalog.json",
+        }
+        catalog.apply_changes(changed)
+        assert checked == ["9.1-2"]
+        assert catalog.products == {"proxmox-ve": ["9.1-2", "9.1-1"]}
+        assert catalog.stored("proxmox-ve/9.1-2/initrd").size == 1000
+
+    def test_missing_chunk_hides_version_until_restored(self, assets_dir, indexed):
+        catalog, checked = indexed
+        path = chunk_path(assets_dir, hashlib.sha256(PIECES[1]).hexdigest())
+        path.unlink()
+        catalog.apply_changes({path})
+        assert catalog.products == {}
+
+        path.write_bytes(PIECES[1])
+        catalog.apply_changes({path})
+        assert catalog.products == {"proxmox-ve": ["9.1-1"]}
+        assert checked == ["9.1-1", "9.1-1"]
+
+    def test_unrelated_chunk_ignored(self, assets_dir, indexed):
+        catalog, checked = indexed
+        generation = catalog.generation
+        catalog.apply_changes({chunk_path(assets_dir, "f" * 64), assets_dir / "chunks" / ".x.tmp"})
+        assert checked == []
+        assert catalog.generation == generation
+
+
+class TestServe:
+    """GET /assets for stored files."""
+
+    def test_reassembled(self, client, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        resp = client.get("/assets/proxmox-ve/9.1-1/initrd")
+        assert resp.status_code == 200
+        assert resp.content == INITRD
+        assert resp.headers["etag"] == f'"{hashlib.sha256(INITRD).hexdigest()}"'
+
+    def test_range_across_chunks(self, client, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        resp = client.get("/assets/proxmox-ve/9.1-1/initrd", headers={"Range": "bytes=290-809"})
+        assert resp.status_code == 206
+        assert resp.content == INITRD[290:810]
+        assert resp.headers["content-range"] == f"bytes 290-809/{len(INITRD)}"
+
+    def test_head(self, client, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        resp = client.head("/assets/proxmox-ve/9.1-1/initrd")
+        assert resp.headers["content-length"] == str(len(INITRD))
+
+    def test_versions_share_chunks(self, client, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        other = [PIECES[0], b"d" * 500, PIECES[2]]
+        _publish_stored(assets_dir, "9.1-2", other)
+        assert len(list((assets_dir / "chunks").glob("*/*"))) == 4
+        assert client.get("/assets/proxmox-ve/9.1-2/initrd").content == b"".join(other)
+        assert "proxmox-ve-9.1-2" in client.get("/menu.ipxe").text
+
+    def test_bytes_labelled_by_version(self, client, assets_dir):
+        _publish_stored(assets_dir, "9.1-1")
+        client.get("/assets/proxmox-ve/9.1-1/initrd")
+        sha = hashlib.sha256(PIECES[0]).hexdigest()
+        client.get(f"/assets/chunks/{sha[:2]}/{sha}")
+        assert client.srv.asset_streamer.bytes_sent == {
+            ("proxmox-ve", "9.1-1"): len(INITRD),
+            ("chunks", ""): len(PIECES[0]),
+        }
+
+    def test_slot_released_after_download(self, client, assets_dir, monkeypatch):
+        _publish_stored(assets_dir, "9.1-1")
+        monkeypatch.setattr(client.srv.admission, "slots", 1)
+        client.get("/menu.ipxe")
+        assert client.srv.admission.in_use == 1
+        client.get("/assets/proxmox-ve/9.1-1/initrd")
+        assert client.srv.admission.in_use == 0
@@ -0,0 +1,495 @@
+"""Tests for multi-node peering, replication and asset URL selection."""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from cluster import (
+    Cluster,
+    FileIndex,
+    ReplicationError,
+    answer_files,
+    asset_files,
+    download,
+    is_answer_path,
+    is_asset_path,
+    plan_pulls,
+    version_digests,
+)
+
+
+class PeerHandler(BaseHTTPRequestHandler):
+    """Serves a peer's /cluster/state, /assets and /cluster/answers, with Range."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        peer = self.server.peer
+        self.server.requests.append(self.path)
+        if self.path in ("/cluster/state", "/cluster/assets"):
+            data = peer.state() if self.path == "/cluster/state" else peer.assets.entries
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        prefix, _, rel = self.path.lstrip("/").partition("/")
+        if prefix == "cluster":
+            root, rel = peer.answers.root, rel.removeprefix("answers/")
+        else:
+            root = peer.assets.root
+        path = root / rel
+        if not path.is_file():
+            self.send_error(404)
+            return
+        data = path.read_bytes()
+        start = 0
+        if self.server.ranges and (header := self.headers.get("Range")):
+            start = int(header.removeprefix("bytes=").rstrip("-"))
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+@pytest.fixture()
+def peer_server():
+    """Factory starting an HTTP server in front of a Cluster; returns (cluster, url).
+
+    Each server records the paths it was asked for in .requests.
+    """
+    servers = []
+
+    def start(tmp: Path, ranges: bool = True):
+        (tmp / "assets").mkdir(parents=True, exist_ok=True)
+        (tmp / "answers").mkdir(parents=True, exist_ok=True)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), PeerHandler)
+        server.ranges = ranges
+        server.requests = []
+        url = f"http://127.0.0.1:{server.server_port}"
+        server.peer = Cluster(url, [], tmp / "assets", tmp / "answers", load=lambda: 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.peer, url
+
+    start.servers = servers
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _write(path: Path, data: bytes, mtime_ns: int | None = None) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def _sync(cluster: Cluster) -> None:
+    async def run():
+        await cluster.sync()
+        await cluster.pull()
+
+    asyncio.run(run())
+
+
+class TestFileIndex:
+    """Checksummed file listings."""
+
+    def test_lists_published_files_only(self, tmp_path):
+        _write(tmp_path / "pve" / "9.1-1" / "vmlinuz", b"k")
+        _write(tmp_path / "pve" / "9.1-1" / ".initrd.part", b"partial")
+        index = FileIndex(tmp_path, asset_files)
+        assert list(index.refresh()) == ["pve/9.1-1/vmlinuz"]
+
+    def test_rehashes_only_changed_files(self, tmp_path):
+        path = _write(tmp_path / "default.toml", b"a = 1", mtime_ns=10**18)
+        index = FileIndex(tmp_path, answer_files)
+        first = index.refresh()["default.toml"]
+        assert index.refresh()["default.toml"] is first
+
+        _write(path, b"a = 2")
+        assert index.refresh()["default.toml"]["sha256"] != first["sha256"]
+
+    def test_known_checksum_skips_hashing(self, tmp_path):
+        _write(tmp_path / "pve" / "9.1-1" / "initrd", b"big image")
+        index = FileIndex(tmp_path, asset_files, lambda path, st: "from-manifest")
+        assert index.refresh()["pve/9.1-1/initrd"]["sha256"] == "from-manifest"
+
+    def test_digest_tracks_content(self, tmp_path):
+        _write(tmp_path / "hosts" / "aa-bb-cc-dd-ee-ff.toml", b"x")
+        index = FileIndex(tmp_path, answer_files)
+        index.refresh()
+        before = index.digest
+        _write(tmp_path / "hosts" / "aa-bb-cc-dd-ee-ff.toml", b"y")
+        index.refresh()
+        assert index.digest != before
+
+
+class TestVersionDigests:
+    """One digest per servable version."""
+
+    def _stored(self, root: Path, chunk: bytes) -> str:
+        sha = hashlib.sha256(chunk).hexdigest()
+        _write(root / "chunks" / sha[:2] / sha, chunk)
+        files = {"initrd": {"size": len(chunk), "sha256": sha, "store": [[sha, len(chunk)]]}}
+        _write(root / "pve" / "9" / "manifest.json", json.dumps({"files": files}).encode())
+        return sha
+
+    def test_tracks_version_content(self, tmp_path):
+        _write(tmp_path / "pve" / "9" / "initrd", b"a")
+        index = FileIndex(tmp_path, asset_files)
+        before = version_digests(tmp_path, index.refresh())
+        _write(tmp_path / "pve" / "9" / "initrd", b"b")
+        after = version_digests(tmp_path, index.refresh())
+        assert list(before) == ["pve/9"]
+        assert before != after
+
+    def test_chunk_store_is_not_a_version(self, tmp_path):
+        self._stored(tmp_path, b"chunk")
+        index = FileIndex(tmp_path, asset_files)
+        assert list(version_digests(tmp_path, index.refresh())) == ["pve/9"]
+
+    def test_version_missing_chunks_left_out(self, tmp_path):
+        sha = self._stored(tmp_path, b"chunk")
+        (tmp_path / "chunks" / sha[:2] / sha).unlink()
+        index = FileIndex(tmp_path, asset_files)
+        assert version_digests(tmp_path, index.refresh()) == {}
+
+
+class TestPlanPulls:
+    """Choosing which files to fetch from a peer."""
+
+    def test_missing_and_newer(self):
+        local = {
+            "a": {"sha256": "1", "mtime_ns": 5},
+            "b": {"sha256": "1", "mtime_ns": 5},
+            "c": {"sha256": "1", "mtime_ns": 5},
+        }
+        remote = {
+            "a": {"sha256": "1", "mtime_ns": 9},  # same content
+            "b": {"sha256": "2", "mtime_ns": 9},  # newer
+            "c": {"sha256": "2", "mtime_ns": 1},  # older
+            "d": {"sha256": "3", "mtime_ns": 1},  # missing
+        }
+        assert plan_pulls(local, remote) == ["b", "d"]
+
+    def test_initrd_last_within_version(self):
+        entry = {"sha256": "x", "mtime_ns": 1}
+        remote = {f"pve/9.1-1/{name}": entry for name in ("initrd", "iso.cpio", "vmlinuz")}
+        assert plan_pulls({}, remote)[-1] == "pve/9.1-1/initrd"
+
+    def test_manifest_first_within_version(self):
+        entry = {"sha256": "x", "mtime_ns": 1}
+        names = ("initrd", "iso.cpio", "manifest.json", "vmlinuz")
+        remote = {f"pve/9.1-1/{name}": entry for name in names}
+        assert plan_pulls({}, remote) == [
+            "pve/9.1-1/manifest.json",
+            "pve/9.1-1/iso.cpio",
+            "pve/9.1-1/vmlinuz",
+            "pve/9.1-1/initrd",
+        ]
+
+
+class TestPeerPaths:
+    """Paths from a peer's state that may be joined onto this node's trees."""
+
+    @pytest.mark.parametrize(
+        "rel", ["pve/9.1-1/initrd", "chunks/ab/" + "ab" * 32, "pve/9.1-1/manifest.json"]
+    )
+    def test_asset_paths(self, rel):
+        assert is_asset_path(rel)
+
+    @pytest.mark.parametrize(
+        "rel",
+        ["../x/y", "/etc/x/y", "pve/../initrd", "pve/9.1-1/.initrd.part", "pve/initrd", "a/b/c/d"],
+    )
+    def test_bad_asset_paths(self, rel):
+        assert not is_asset_path(rel)
+
+    @pytest.mark.parametrize("rel", ["default.toml", "hosts/aa-bb-cc-dd-ee-ff.toml"])
+    def test_answer_paths(self, rel):
+        assert is_answer_path(rel)
+
+    @pytest.mark.parametrize(
+        "rel", ["x.toml", "../default.toml", "/etc/passwd", "hosts/../x.toml", "hosts/.a.toml"]
+    )
+    def test_bad_answer_paths(self, rel):
+        assert not is_answer_path(rel)
+
+
+class TestDownload:
+    """Verified, resumable transfers."""
+
+    def _expected(self, path: Path) -> dict:
+        index = FileIndex(path.parent, lambda root: [path])
+        return index.refresh()[path.name]
+
+    def test_resumes_partial_file(self, tmp_path, peer_server):
+        peer, url = peer_server(tmp_path / "peer")
+        source = _write(peer.assets.root / "initrd", os.urandom(100_000), mtime_ns=10**18)
+        dest = tmp_path / "local" / "initrd"
+        _write(dest.with_name(".initrd.part"), source.read_bytes()[:40_000])
+
+        fetched = download(f"{url}/assets/initrd", dest, self._expected(source), timeout=5)
+        assert fetched == 60_000
+        assert dest.read_bytes() == source.read_bytes()
+        assert dest.stat().st_mtime_ns == 10**18
+
+    def test_restarts_when_range_ignored(self, tmp_path, peer_server):
+        peer, url = peer_server(tmp_path / "peer", ranges=False)
+        source = _write(peer.assets.root / "initrd", b"abcdef" * 1000)
+        dest = tmp_path / "local" / "initrd"
+        _write(dest.with_name(".initrd.part"), b"abc")
+
+        download(f"{url}/assets/initrd", dest, self._expected(source), timeout=5)
+        assert dest.read_bytes() == source.read_bytes()
+
+    def test_corrupt_chunks_refetched(self, tmp_path, peer_server):
+        peer, url = peer_server(tmp_path / "peer")
+        data = os.urandom(40_000)
+        source = _write(peer.assets.root / "initrd", data)
+        chunks = [
+            hashlib.sha256(data[i : i + 10_000]).hexdigest() for i in range(0, 40_000, 10_000)
+        ]
+        dest = tmp_path / "local" / "initrd"
+        # First chunk intact, second corrupted, third never checked
+        _write(dest.with_name(".initrd.part"), data[:10_000] + b"\0" * 20_000)
+
+        fetched = download(
+            f"{url}/assets/initrd",
+            dest,
+            self._expected(source),
+            timeout=5,
+            chunks=(10_000, chunks),
+        )
+        assert fetched == 30_000
+        assert dest.read_bytes() == data
+
+    def test_checksum_mismatch_discarded(self, tmp_path, peer_server):
+        peer, url = peer_server(tmp_path / "peer")
+        source = _write(peer.assets.root / "initrd", b"good")
+        expected = self._expected(source)
+        source.write_bytes(b"evil")
+
+        dest = tmp_path / "local" / "initrd"
+        with pytest.raises(ReplicationError):
+            download(f"{url}/assets/initrd", dest, expected, timeout=5)
+        assert not dest.exists()
+        assert not dest.with_name(".initrd.part").exists()
+
+
+class TestReplication:
+    """Pulling assets and answers from a peer."""
+
+    def test_pulls_assets_and_answers(self, tmp_path, peer_server):
+        peer, url = peer_server(tmp_path / "peer")
+        _write(peer.assets.root / "proxmox-ve" / "9.1-1" / "vmlinuz", b"kernel")
+        _write(peer.assets.root / "proxmox-ve" / "9.1-1" / "initrd", b"initrd" * 1000)
+        _write(peer.answers.root / "hosts" / "aa-bb-cc-dd-ee-ff.toml", b'fqdn = "n1"')
+        peer.refresh_assets()
+        peer.answers.refresh()
+
+        local = Cluster(
+            "http://me", [url], tmp_path / "assets", tmp_path / "answers", load=lambda: 0
+        )
+        _sync(local)
+
+        assert (tmp_path / "assets" / "proxmox-ve" / "9.1-1" / "initrd").read_bytes() == (
+            b"initrd" * 1000
+        )
+        assert (tmp_path / "answers" / "hosts" / "aa-bb-cc-dd-ee-ff.toml").read_bytes() == (
+            b'fqdn = "n1"'
+        )
+        assert local.files_replicated == 3
+
+        _sync(local)
+        assert local.files_replicated == 3
+        assert local.consistent
+        assert local.has_assets(local.peers[url])
+
+    def test_pulled_versions_catalogued(self, tmp_path, peer_server):
+        peer, url = peer_server(tmp_path / "peer")
+        version_dir = peer.assets.root / "pve" / "9.1-1"
+        files = {}
+        for name, data in (("vmlinuz", b"k"), ("initrd", b"i" * 100)):
+            _write(version_dir / name, data, mtime_ns=10**18)
+            sha = hashlib.sha256(data).hexdigest()
+            files[name] = {"size": len(data), "mtime_ns": 10**18, "sha256": sha, "chunks": [sha]}
+        manifest = {"format": 1, "chunk_size": 1 << 24, "files": files}
+        _write(version_dir / "manifest.json", json.dumps(manifest).encode())
+        peer.refresh_assets()
+
+        local = Cluster(
+            "http://me", [url], tmp_path / "assets", tmp_path / "answers", load=lambda: 0
+        )
+        _sync(local)
+        catalog = json.loads((tmp_path / "assets" / "catalog.json").read_text())
+        [entry] = catalog["products"]["pve"]
+        assert entry["files"]["initrd"]["sha256"] == files["initrd"]["sha256"]
+        assert local.assets.entries["pve/9.1-1/initrd"]["sha256"] == files["initrd"]["sha256"]
+
+    def test_local_newer_file_kept(self, tmp_path, peer_server):
+        peer, url = peer_server(tmp_path / "peer")
+        _write(peer.answers.root / "default.toml", b"old", mtime_ns=10**18)
+        peer.answers.refresh()
+        mine = _write(tmp_path / "answers" / "default.toml", b"new", mtime_ns=2 * 10**18)
+
+        local = Cluster(
+            "http://me", [url], tmp_path / "assets", tmp_path / "answers", load=lambda: 0
+        )
+        _sync(local)
+        assert mine.read_bytes() == b"new"
+        assert not local.consistent
+
+    def test_paths_outside_the_tree_refused(self, tmp_path, peer_server, monkeypatch):
+        peer, url = peer_server(tmp_path / "peer")
+        data = b"owned"
+        entry = {"size": len(data), "mtime_ns": 10**18, "sha256": hashlib.sha256(data).hexdigest()}
+        outside = _write(tmp_path / "outside" / "x", data)
+        # The peer's handler would serve these if asked
+        _write(tmp_path / "peer" / "evil", data)
+        _write(tmp_path / "peer" / "evil.toml", data)
+        state = peer.state
+
+        def malicious_state():
+            return {
+                **state(),
+                "answers": {"../evil.toml": entry, "hosts/../../evil.toml": entry},
+            }
+
+        monkeypatch.setattr(peer, "state", malicious_state)
+        monkeypatch.setattr(
+            peer.assets,
+            "entries",
+            {"../evil": entry, str(outside): entry, "a/../../evil": entry},
+        )
+        local = Cluster(
+            "http://me", [url], tmp_path / "assets", tmp_path / "answers", load=lambda: 0
+        )
+        outside.unlink()
+        _sync(local)
+        assert local.files_replicated == 0
+        assert not outside.exists()
+        assert not (tmp_path / "evil").exists()
+        assert not (tmp_path / "evil.toml").exists()
+
+    def test_asset_index_fetched_only_when_changed(self, tmp_path, peer_server):
+        peer, url = peer_server(tmp_path / "peer")
+        _write(peer.assets.root / "pve" / "9" / "initrd", b"i")
+        peer.refresh_assets()
+        state = peer.state()
+        assert "assets" not in state
+        assert list(state["versions"]) == ["pve/9"]
+
+        local = Cluster(
+            "http://me", [url], tmp_path / "assets", tmp_path / "answers", load=lambda: 0
+        )
+        [server] = peer_server.servers
+        _sync(local)
+        _sync(local)
+        assert server.requests.count("/cluster/assets") == 1
+        _write(peer.assets.root / "pve" / "9" / "vmlinuz", b"k")
+        peer.refresh_assets()
+        _sync(local)
+        assert server.requests.count("/cluster/assets") == 2
+        assert local.has_assets(local.peers[url])
+
+    def test_unreachable_peer(self, tmp_path):
+        local = Cluster(
+            "http://me",
+            ["http://127.0.0.1:9"],
+            tmp_path / "assets",
+            tmp_path / "answers",
+            load=lambda: 0,
+            timeout=1,
+        )
+        _sync(local)
+        peer = local.peers["http://127.0.0.1:9"]
+        assert not peer.healthy
+        assert peer.error
+
+
+class TestPickAssetUrl:
+    """Least-loaded node selection for /menu.ipxe."""
+
+    def _cluster(self, tmp_path, load=0):
+        _write(tmp_path / "assets" / "pve" / "9" / "initrd", b"i")
+        cluster = Cluster(
+            "http://a",
+            ["http://a", "http://b", "http://c"],
+            tmp_path / "assets",
+            tmp_path / "answers",
+            load=lambda: load,
+        )
+        cluster.refresh_assets()
+        for peer in cluster.peers.values():
+            peer.healthy = True
+            peer.versions = dict(cluster.versions)
+        return cluster
+
+    def test_own_url_skipped_in_peer_list(self, tmp_path):
+        assert list(self._cluster(tmp_path).peers) == ["http://b", "http://c"]
+
+    def test_prefers_least_loaded(self, tmp_path):
+        cluster = self._cluster(tmp_path, load=5)
+        cluster.peers["http://b"].load = 3
+        cluster.peers["http://c"].load = 1
+        assert cluster.pick_asset_url("http://fallback") == "http://c"
+
+    def test_spreads_between_polls(self, tmp_path):
+        cluster = self._cluster(tmp_path)
+        picks = [cluster.pick_asset_url("http://a") for _ in range(6)]
+        assert sorted(picks) == ["http://a"] * 2 + ["http://b"] * 2 + ["http://c"] * 2
+
+    def test_skips_peers_missing_assets(self, tmp_path):
+        cluster = self._cluster(tmp_path, load=5)
+        cluster.peers["http://b"].versions = {}
+        cluster.peers["http://c"].healthy = False
+        assert cluster.pick_asset_url("http://a") == "http://a"
+
+
+class TestClusterEndpoints:
+    """/cluster, /cluster/state and /cluster/answers."""
+
+    def test_standalone_status(self, client):
+        resp = client.get("/cluster")
+        assert resp.json()["enabled"] is False
+
+    def test_answer_files_only_if_indexed(self, client, answers_dir):
+        import server.server as srv
+
+        (answers_dir / "default.toml").write_text("d = 1")
+        assert client.get("/cluster/answers/default.toml").status_code == 404
+        srv.cluster.answers.refresh()
+        assert client.get("/cluster/answers/default.toml").content == b"d = 1"
+        assert client.get("/cluster/answers/../etc/passwd").status_code == 404
+        state = client.get("/cluster/state").json()
+        assert "default.toml" in state["answers"]
+
+    def test_menu_uses_picked_peer(self, client, assets_dir, monkeypatch):
+        import server.server as srv
+
+        for name in ("vmlinuz", "initrd"):
+            _write(assets_dir / "proxmox-ve" / "9.1-1" / name, b"x")
+        cluster = Cluster(
+            "http://a:8080", ["http://b:8080"], assets_dir, srv.ANSWERS_DIR, load=lambda: 3
+        )
+        cluster.refresh_assets()
+        peer = cluster.peers["http://b:8080"]
+        peer.healthy, peer.versions = True, dict(cluster.versions)
+        monkeypatch.setattr(srv, "cluster", cluster)
+
+        assert "http://b:8080/assets/proxmox-ve/9.1-1/initrd" in client.get("/menu.ipxe").text
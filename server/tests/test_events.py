@@ -0,0 +1,227 @@
+"""Tests for the structured event log, its /events endpoint and queued logging."""
+
+import asyncio
+import io
+import json
+import logging
+import logging.handlers
+
+import events
+import pytest
+from events import EventLog, JsonFormatter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _filled(clock) -> EventLog:
+    log = EventLog(100, clock=clock)
+    for i in range(10):
+        clock.now = 1000.0 + i
+        log.record("http", client=f"10.0.0.{i % 2}", mac=f"aa-bb-cc-dd-ee-0{i % 3}")
+    clock.now = 1010.0
+    log.record("http", macs=["aa-bb-cc-dd-ee-09", "aa-bb-cc-dd-ee-00"])
+    log.record("tftp", client="10.0.0.1", file="ipxe.efi")
+    return log
+
+
+class TestQuery:
+    """Searching the ring buffer."""
+
+    def test_newest_last_within_limit(self):
+        log = _filled(FakeClock())
+        found = log.query(limit=3)
+        assert [e["seq"] for e in found] == [10, 11, 12]
+
+    def test_by_mac(self):
+        log = _filled(FakeClock())
+        found = log.query(mac="aa-bb-cc-dd-ee-00")
+        assert [e["seq"] for e in found] == [1, 4, 7, 10, 11]
+
+    def test_by_kind_and_client(self):
+        log = _filled(FakeClock())
+        assert [e["seq"] for e in log.query(kind="tftp")] == [12]
+        assert len(log.query(client="10.0.0.1", kind="http")) == 5
+
+    def test_by_time(self):
+        log = _filled(FakeClock())
+        found = log.query(since=1003, until=1005.5)
+        assert [e["ts"] for e in found] == [1003.0, 1004.0, 1005.0]
+
+    def test_after_seq(self):
+        log = _filled(FakeClock())
+        assert [e["seq"] for e in log.query(after=10)] == [11, 12]
+
+    def test_ring_buffer_bounded(self):
+        log = EventLog(5)
+        for _ in range(8):
+            log.record("http")
+        assert log.buffered == 5
+        assert [e["seq"] for e in log.query()] == [4, 5, 6, 7, 8]
+
+    def test_forward(self):
+        clock = FakeClock()
+        forwarded = []
+        log = EventLog(100, clock=clock, forward=lambda *args: forwarded.append(args))
+        log.record("http", client="10.0.0.1")
+        assert forwarded == [("http", {"ts": 1000.0, "client": "10.0.0.1"})]
+        assert (log.seq, log.buffered) == (0, 0)
+
+        # The receiving log numbers the event but keeps its time
+        other = EventLog(100, clock=clock)
+        clock.now = 1005.0
+        other.record(forwarded[0][0], **forwarded[0][1])
+        assert other.query() == [{"ts": 1000.0, "seq": 1, "kind": "http", "client": "10.0.0.1"}]
+
+
+class TestSink:
+    """Batched JSON lines written off the event loop."""
+
+    def test_written_in_batches(self):
+        sink = io.StringIO()
+        log = EventLog(10, sink, batch_size=50, flush_interval=5)
+        log.start()
+        for i in range(120):
+            log.record("http", n=i)
+        log.stop()
+        lines = [json.loads(line) for line in sink.getvalue().splitlines()]
+        assert [line["n"] for line in lines] == list(range(120))
+        assert log.written == 120
+        assert 3 <= log.batches <= 5
+
+    def test_full_queue_drops_from_sink_only(self):
+        log = EventLog(10, io.StringIO(), max_pending=2)
+        for _ in range(5):
+            log.record("http")
+        assert (log.pending, log.dropped, log.buffered) == (2, 3, 5)
+
+    def test_write_failure_counted(self):
+        sink = io.StringIO()
+        sink.close()
+        log = EventLog(10, sink)
+        log.start()
+        log.record("http")
+        log.stop()
+        assert log.dropped == 1
+
+    def test_no_sink(self):
+        log = EventLog(10)
+        log.start()
+        log.record("http")
+        log.stop()
+        assert log.pending == 0
+
+    def test_open_sink(self, tmp_path):
+        assert events.open_sink("") is None
+        sink = events.open_sink(str(tmp_path / "events.jsonl"))
+        log = EventLog(10, sink)
+        log.start()
+        log.record("tftp", file="ipxe.efi")
+        log.stop()
+        assert json.loads((tmp_path / "events.jsonl").read_text())["file"] == "ipxe.efi"
+
+
+class TestLogging:
+    """Log records go through a queue."""
+
+    def test_single_queue_handler(self):
+        try:
+            events.configure_logging("info")
+            events.configure_logging("debug", json_lines=True)
+            root = logging.getLogger()
+            queued = [h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]
+            assert len(queued) == 1
+            assert root.level == logging.DEBUG
+        finally:
+            events.configure_logging("info")
+
+    def test_json_format(self):
+        record = logging.LogRecord("pxe-pilot", logging.WARNING, "", 0, "hi %s", ("there",), None)
+        entry = json.loads(JsonFormatter().format(record))
+        assert entry["level"] == "warning"
+        assert entry["logger"] == "pxe-pilot"
+        assert entry["message"] == "hi there"
+
+
+def _make_version(assets_dir):
+    ver_dir = assets_dir / "proxmox-ve" / "9.1-1"
+    ver_dir.mkdir(parents=True)
+    (ver_dir / "vmlinuz").write_bytes(b"k" * 100)
+    (ver_dir / "initrd").write_bytes(b"i" * 1000)
+
+
+class TestEndpoint:
+    """Request events and GET /events."""
+
+    def test_answer_event(self, client, answers_dir):
+        (answers_dir / "hosts" / "aa-bb-cc-dd-ee-ff.toml").write_text('hostname = "node1"')
+        body = {"network_interfaces": [{"mac": "AA:BB:CC:DD:EE:FF"}]}
+        client.post("/answer", json=body)
+        found = client.get("/events", params={"mac": "aa:bb:cc:dd:ee:ff"}).json()
+        assert found["count"] == 1
+        event = found["events"][0]
+        assert event["kind"] == "http"
+        assert event["path"] == "/answer"
+        assert event["status"] == 200
+        assert event["source"] == "host"
+        assert event["macs"] == ["aa-bb-cc-dd-ee-ff"]
+        assert event["bytes"] == len('hostname = "node1"')
+        assert event["ms"] >= 0
+
+    def test_boot_chain_by_mac(self, client, assets_dir):
+        _make_version(assets_dir)
+        client.get("/menu.ipxe", params={"mac": "aa-bb-cc-dd-ee-ff"})
+        client.get("/assets/proxmox-ve/9.1-1/initrd")
+        found = client.get("/events", params={"mac": "aa-bb-cc-dd-ee-ff"}).json()["events"]
+        assert [e["path"] for e in found] == ["/menu.ipxe", "/assets/proxmox-ve/9.1-1/initrd"]
+        assert found[1]["bytes"] == 1000
+
+    def test_asset_with_mac_query(self, client, assets_dir):
+        _make_version(assets_dir)
+        client.get("/menu.ipxe", params={"mac": "aa-bb-cc-dd-ee-ff"})
+        resp = client.get("/assets/proxmox-ve/9.1-1/vmlinuz", params={"mac": "AA:BB:CC:DD:EE:FF"})
+        assert resp.status_code == 200
+        found = client.get("/events", params={"mac": "aa-bb-cc-dd-ee-ff"}).json()["events"]
+        assert found[-1]["path"] == "/assets/proxmox-ve/9.1-1/vmlinuz"
+
+    def test_host_services_leave_writer_running(self, client, monkeypatch):
+        srv = client.srv
+        monkeypatch.setattr(srv.events, "sink", io.StringIO())
+        monkeypatch.setattr(srv, "BOOT_ENABLED", False)
+
+        async def scenario():
+            srv.events.start()
+            async with srv.host_services(lambda paths: None, lambda paths: None):
+                pass
+            running = srv.events._writer is not None
+            srv.events.stop()
+            return running
+
+        assert asyncio.run(scenario())
+
+    def test_quiet_paths_skipped(self, client):
+        client.get("/health")
+        client.get("/metrics")
+        client.get("/boot.ipxe")
+        assert [e["path"] for e in client.get("/events").json()["events"]] == ["/boot.ipxe"]
+
+    def test_poll_after(self, client):
+        client.get("/boot.ipxe")
+        seq = client.get("/events").json()["seq"]
+        client.get("/menu.ipxe")
+        found = client.get("/events", params={"after": seq}).json()["events"]
+        assert [e["path"] for e in found] == ["/menu.ipxe"]
+
+    @pytest.mark.parametrize("params", [{"limit": 0}, {"since": "yesterday"}])
+    def test_invalid_params(self, client, params):
+        assert client.get("/events", params=params).status_code == 422
+
+    def test_metrics_and_health(self, client):
+        client.get("/boot.ipxe")
+        assert "pxe_pilot_events_total 1" in client.get("/metrics").text
+        assert client.get("/health").json()["events"]["buffered"] == 1
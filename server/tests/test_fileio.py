@@ -0,0 +1,103 @@
+"""Tests for the file I/O pool, loop lag monitoring and startup warmup."""
+
+import asyncio
+import importlib
+import threading
+import time
+
+import pytest
+import streaming
+from fastapi.testclient import TestClient
+from fileio import FileIO, LoopLag
+
+
+class TestFileIO:
+    """Bounded pool with per-call timeouts."""
+
+    def test_runs_in_pool(self):
+        io = FileIO(threads=2)
+        assert asyncio.run(io.run(threading.current_thread)).name.startswith("pxe-io")
+        io.shutdown()
+
+    def test_timeout(self):
+        io = FileIO(threads=1, timeout=0.05)
+        release = threading.Event()
+        ran = []
+
+        async def main():
+            with pytest.raises(OSError, match="did not finish"):
+                await io.run(release.wait)
+            # The only thread is still stuck, so this one never starts
+            with pytest.raises(TimeoutError):
+                await io.run(ran.append, 1)
+
+        asyncio.run(main())
+        release.set()
+        io.shutdown()
+        time.sleep(0.05)
+        assert (io.timeouts, io.pending, ran) == (2, 0, [])
+
+    def test_no_timeout(self):
+        io = FileIO(timeout=0.01)
+        assert asyncio.run(io.run(time.sleep, 0.05, timeout=None)) is None
+        io.shutdown()
+
+
+class TestLoopLag:
+    """Noticing a blocked event loop."""
+
+    def test_measures_blocking(self):
+        observed = []
+
+        async def main():
+            lag = LoopLag(0.01, observe=observed.append)
+            lag.start()
+            await asyncio.sleep(0.05)
+            time.sleep(0.2)  # blocks the loop
+            await asyncio.sleep(0.05)
+            await lag.stop()
+            return lag
+
+        lag = asyncio.run(main())
+        assert lag.max >= 0.15
+        assert max(observed) == lag.max
+
+
+class TestServerIO:
+    """The server's use of the pool."""
+
+    def test_stat_timeout_is_503(self, client, assets_dir, monkeypatch):
+        import server.server as srv
+
+        (assets_dir / "pve" / "9").mkdir(parents=True)
+        (assets_dir / "pve" / "9" / "vmlinuz").write_bytes(b"k")
+        monkeypatch.setattr(srv.file_io, "timeout", 0.05)
+        stat_file = streaming._stat_file
+        monkeypatch.setattr(streaming, "_stat_file", lambda p: time.sleep(0.2) or stat_file(p))
+        resp = client.get("/assets/pve/9/vmlinuz")
+        assert resp.status_code == 503
+        assert resp.headers["retry-after"] == "5"
+        assert "pxe_pilot_file_io_timeouts_total 1" in client.get("/metrics").text
+
+    def test_warmup(self, answers_dir, assets_dir, monkeypatch):
+        monkeypatch.setenv("PXE_PILOT_ANSWERS_DIR", str(answers_dir))
+        monkeypatch.setenv("PXE_PILOT_ASSETS_DIR", str(assets_dir))
+        monkeypatch.setenv("PXE_PILOT_ASSET_URL", "http://boot.example")
+        monkeypatch.setenv("PXE_PILOT_WATCH_POLLING", "true")
+        (answers_dir / "template.toml").write_text("a = ${a}")
+        (answers_dir / "inventory.toml").write_text('[hosts."aa-bb-cc-dd-ee-ff"]\na = 1\n')
+        ver_dir = assets_dir / "pve" / "9"
+        ver_dir.mkdir(parents=True)
+        (ver_dir / "vmlinuz").write_bytes(b"k")
+        (ver_dir / "initrd").write_bytes(b"i")
+
+        import server.server as srv
+
+        importlib.reload(srv)
+        with TestClient(srv.app) as client:
+            assert srv.answer_store.answer_count == 1  # rendered at startup
+            assert "http://boot.example" in srv.asset_catalog._menus
+            health = client.get("/health").json()
+            assert health["event_loop_lag"]["max"] >= 0
+            metrics = client.get("/metrics").text
+            assert "# TYPE pxe_pilot_event_loop_lag_seconds histogram" in metrics
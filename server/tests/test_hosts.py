@@ -1,6 +1,11 @@
 """Tests for GET /hosts and GET /hosts/{mac} endpoints."""
 
 
+def _add_hosts(answers_dir, *macs):
+    for mac in macs:
+        (answers_dir / "hosts" / f"{mac}.toml").write_text("")
+
+
 class TestListHosts:
     """GET /hosts endpoint."""
 
@@ -45,6 +50,68 @@ class TestListHosts:
         assert data["hosts"] == ["aa-bb-cc-dd-ee-ff"]
 
 
+class TestPaging:
+    """Cursor pages, prefix filters and revalidation."""
+
+    def test_cursor_pages(self, client, answers_dir):
+        _add_hosts(answers_dir, *(f"aa-00-00-00-00-0{i}" for i in range(5)))
+        first = client.get("/hosts", params={"limit": 2}).json()
+        assert first["hosts"] == ["aa-00-00-00-00-00", "aa-00-00-00-00-01"]
+        assert first["host_count"] == 5
+        second = client.get("/hosts", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+        assert second["hosts"] == ["aa-00-00-00-00-02", "aa-00-00-00-00-03"]
+        last = client.get("/hosts", params={"limit": 2, "cursor": second["next_cursor"]}).json()
+        assert (last["hosts"], last["next_cursor"]) == (["aa-00-00-00-00-04"], None)
+
+    def test_prefix(self, client, answers_dir):
+        _add_hosts(answers_dir, "aa-bb-cc-00-00-01", "aa-bb-cd-00-00-01", "bc-24-11-00-00-01")
+        for prefix in ("AA:BB:CC", "aabbcc", "aa-bb-cc"):
+            assert client.get("/hosts", params={"prefix": prefix}).json()["hosts"] == [
+                "aa-bb-cc-00-00-01"
+            ]
+        data = client.get("/hosts", params={"prefix": "aa-bb", "limit": 1}).json()
+        assert data["next_cursor"] == "aa-bb-cc-00-00-01"
+
+    def test_invalid_limit(self, client):
+        assert client.get("/hosts", params={"limit": 0}).status_code == 422
+
+    def test_etag_revalidation(self, client, answers_dir):
+        _add_hosts(answers_dir, "aa-bb-cc-dd-ee-ff")
+        etag = client.get("/hosts").headers["etag"]
+        assert client.get("/hosts", headers={"If-None-Match": etag}).status_code == 304
+
+        _add_hosts(answers_dir, "11-22-33-44-55-66")
+        resp = client.get("/hosts", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["etag"] != etag
+
+
+class TestChangeFeed:
+    """GET /hosts?since=<generation>."""
+
+    def test_changes_since(self, client, answers_dir):
+        _add_hosts(answers_dir, "aa-bb-cc-dd-ee-ff", "11-22-33-44-55-66")
+        generation = client.get("/hosts").json()["generation"]
+        assert client.get("/hosts", params={"since": generation}).json()["changes"] == []
+
+        (answers_dir / "hosts" / "aa-bb-cc-dd-ee-ff.toml").write_text("x = 1")
+        (answers_dir / "hosts" / "11-22-33-44-55-66.toml").unlink()
+        _add_hosts(answers_dir, "de-ad-be-ef-00-01")
+        feed = client.get("/hosts", params={"since": generation}).json()
+        assert sorted((c["mac"], c["change"]) for c in feed["changes"]) == [
+            ("11-22-33-44-55-66", "removed"),
+            ("aa-bb-cc-dd-ee-ff", "updated"),
+            ("de-ad-be-ef-00-01", "updated"),
+        ]
+        assert feed["generation"] > generation
+        assert client.get("/hosts", params={"since": feed["generation"]}).json()["changes"] == []
+
+    def test_unknown_generation(self, client):
+        resp = client.get("/hosts", params={"since": 12})
+        assert resp.status_code == 410
+        assert "generation" in resp.json()
+
+
 class TestGetHost:
     """GET /hosts/{mac} endpoint."""
 
@@ -0,0 +1,94 @@
+"""Tests for UEFI HTTP Boot: iPXE binaries over HTTP and arch-aware boot scripts."""
+
+import pytest
+from bootfiles import BootFiles
+
+
+@pytest.fixture()
+def ipxe_dir(tmp_path):
+    root = tmp_path / "ipxe"
+    root.mkdir()
+    (root / "ipxe.efi").write_bytes(b"MZ" + b"e" * 998)
+    (root / "undionly.kpxe").write_bytes(b"k" * 500)
+    return root
+
+
+@pytest.fixture()
+def boot_client(client, ipxe_dir):
+    client.srv.boot_files.root = ipxe_dir
+    client.srv.boot_files.load()
+    return client
+
+
+class TestBootFiles:
+    """Loading the iPXE directory."""
+
+    def test_load(self, ipxe_dir):
+        files = BootFiles(ipxe_dir)
+        files.load()
+        assert len(files) == 2
+        assert files.get("ipxe.efi").content_type == "application/efi"
+        assert files.get("undionly.kpxe").content_type == "application/octet-stream"
+        assert files.get("ipxe.efi").etag != files.get("undionly.kpxe").etag
+
+    def test_missing_dir(self, tmp_path):
+        files = BootFiles(tmp_path / "missing")
+        files.load()
+        assert len(files) == 0
+
+
+class TestServe:
+    """GET and HEAD /ipxe/{name}."""
+
+    def test_efi(self, boot_client):
+        resp = boot_client.get("/ipxe/ipxe.efi")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/efi"
+        assert resp.headers["content-length"] == "1000"
+        assert resp.content.startswith(b"MZ")
+
+    def test_head_reports_size(self, boot_client):
+        resp = boot_client.head("/ipxe/undionly.kpxe")
+        assert resp.status_code == 200
+        assert resp.headers["content-length"] == "500"
+        assert resp.content == b""
+
+    def test_revalidate(self, boot_client):
+        etag = boot_client.get("/ipxe/ipxe.efi").headers["etag"]
+        resp = boot_client.get("/ipxe/ipxe.efi", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+
+    @pytest.mark.parametrize("name", ["missing.efi", "..%2Fserver.py"])
+    def test_not_found(self, boot_client, name):
+        assert boot_client.get(f"/ipxe/{name}").status_code == 404
+
+    def test_nothing_loaded_without_boot_mode(self, client):
+        assert client.get("/ipxe/ipxe.efi").status_code == 404
+
+    def test_session_and_metrics(self, boot_client):
+        boot_client.get("/ipxe/ipxe.efi")
+        session = boot_client.get("/sessions").json()["sessions"][0]
+        assert session["stage"] == "boot"
+        assert 'endpoint="/ipxe/{name}"' in boot_client.get("/metrics").text
+        assert boot_client.get("/health").json()["ipxe_files"] == 2
+
+
+class TestArch:
+    """boot.ipxe passes the architecture on; the menu turns away what cannot boot."""
+
+    def test_boot_script_passes_arch(self, client):
+        text = client.get("/boot.ipxe").text
+        assert "&arch=${buildarch}&platform=${platform}" in text
+        assert "${next-server}" not in text
+
+    def test_unsupported_arch(self, client):
+        resp = client.get("/menu.ipxe", params={"mac": "aa-bb-cc-dd-ee-ff", "arch": "arm64"})
+        assert resp.status_code == 200
+        assert "arm64 clients cannot run" in resp.text
+        assert resp.text.rstrip().endswith("exit 1")
+        assert resp.headers["cache-control"] == "no-store"
+
+    @pytest.mark.parametrize("arch", ["x86_64", "i386", "", "${buildarch}"])
+    def test_menu_served(self, client, arch):
+        resp = client.get("/menu.ipxe", params={"arch": arch})
+        assert "menu pxe-pilot" in resp.text
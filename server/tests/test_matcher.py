@@ -0,0 +1,224 @@
+"""Tests for match.toml: host matching by NIC MAC, system UUID, serial and model."""
+
+import pytest
+from answers import AnswerStore, normalize_mac
+from matcher import Identity, identity_value, parse_matcher
+
+MATCH = b"""
+[hosts.pve01]
+macs = ["AA:BB:CC:DD:EE:01", "aa-bb-cc-dd-ee-02"]
+uuids = ["4C4C4544-0035-4810-8056-B4C04F4E3332"]
+serials = ["CZ20310ABC"]
+
+[hosts.pve02]
+serials = ["CZ20310XYZ"]
+
+[[rules]]
+vendor = "Dell Inc."
+product = "PowerEdge R6*"
+answer = "dell-r6xx"
+
+[[rules]]
+vendor = "Dell*"
+answer = "dell"
+"""
+
+DMI = {
+    "system": {
+        "uuid": "4c4c4544-0035-4810-8056-b4c04f4e3332",
+        "serial": "CZ20310ABC",
+        "manufacturer": "Dell Inc.",
+        "product-name": "PowerEdge R650",
+    }
+}
+
+
+def _identity(**kwargs) -> Identity:
+    return Identity(**{"macs": ("ff-ff-ff-ff-ff-ff",), **kwargs})
+
+
+def _write_hosts(answers_dir, *names):
+    for name in names:
+        (answers_dir / "hosts" / f"{name}.toml").write_text(f'hostname = "{name}"')
+
+
+def _store(answers_dir, match=MATCH) -> AnswerStore:
+    (answers_dir / "match.toml").write_bytes(match)
+    store = AnswerStore(answers_dir)
+    store.load()
+    return store
+
+
+class TestParse:
+    """Reading match.toml into its indexes."""
+
+    def test_indexes(self):
+        matcher = parse_matcher(MATCH, mac_key=normalize_mac)
+        assert matcher.by_mac == {"aa-bb-cc-dd-ee-01": "pve01", "aa-bb-cc-dd-ee-02": "pve01"}
+        assert matcher.by_uuid == {"4c4c4544-0035-4810-8056-b4c04f4e3332": "pve01"}
+        assert matcher.by_serial == {"cz20310abc": "pve01", "cz20310xyz": "pve02"}
+        assert [rule.answer for rule in matcher.rules] == ["dell-r6xx", "dell"]
+        assert matcher.rules[0].product == "poweredge r6*"
+
+    @pytest.mark.parametrize(
+        ("text", "error"),
+        [
+            (b"hosts = 1", "must be a table"),
+            (b"[hosts.a]\nmacs = 'aa-bb-cc-dd-ee-ff'", "list of strings"),
+            (b"[hosts.a]\nnics = []", "unknown keys nics"),
+            (b"[hosts.a]\nserials = ['To Be Filled By O.E.M.']", "placeholder"),
+            (b"[hosts.a]\nuuids = ['00000000-0000-0000-0000-000000000000']", "placeholder"),
+            (b"[hosts.a]\nserials = ['X1']\n[hosts.b]\nserials = ['x1']", "claimed by a and b"),
+            (b"[[rules]]\nvendor = 'Dell*'", "needs an answer"),
+            (b"[[rules]]\nanswer = 'dell'", "needs a vendor or product"),
+            (b"[[rules]]\nanswer = 'dell'\nvendor = 1", "must be strings"),
+            (b"rules = 'dell'", "array of tables"),
+        ],
+    )
+    def test_invalid(self, text, error):
+        with pytest.raises(ValueError, match=error):
+            parse_matcher(text)
+
+    def test_mac_formats_conflict(self):
+        text = b"[hosts.a]\nmacs = ['AA:BB:CC:DD:EE:FF']\n[hosts.b]\nmacs = ['aa-bb-cc-dd-ee-ff']"
+        with pytest.raises(ValueError, match="claimed"):
+            parse_matcher(text, mac_key=normalize_mac)
+
+    def test_empty(self):
+        assert len(parse_matcher(b"")) == 0
+
+
+class TestIdentity:
+    """Identities from the installer's request."""
+
+    def test_from_payload(self):
+        identity = Identity.from_payload({"dmi": DMI}, ["aa-bb-cc-dd-ee-01"])
+        assert identity == Identity(
+            macs=("aa-bb-cc-dd-ee-01",),
+            uuid="4c4c4544-0035-4810-8056-b4c04f4e3332",
+            serial="cz20310abc",
+            vendor="dell inc.",
+            product="poweredge r650",
+        )
+
+    def test_snake_case_and_product_table(self):
+        body = {"dmi": {"system": {"serial_number": "S1"}, "product": {"vendor": "HPE"}}}
+        identity = Identity.from_payload(body, [])
+        assert (identity.serial, identity.vendor) == ("s1", "hpe")
+
+    def test_placeholders_dropped(self):
+        body = {"dmi": {"system": {"serial": "System Serial Number", "uuid": "N/A"}}}
+        identity = Identity.from_payload(body, [])
+        assert (identity.serial, identity.uuid) == (None, None)
+
+    @pytest.mark.parametrize("body", [{}, {"dmi": "none"}, {"dmi": {"system": []}}])
+    def test_missing_dmi(self, body):
+        assert Identity.from_payload(body, ["aa-bb-cc-dd-ee-ff"]).uuid is None
+
+    def test_identity_value(self):
+        assert identity_value("  CZ20310ABC ") == "cz20310abc"
+        assert identity_value("Default string") is None
+        assert identity_value(42) is None
+
+
+class TestMatch:
+    """Precedence between identities, and model rules."""
+
+    def test_precedence(self):
+        matcher = parse_matcher(MATCH, mac_key=normalize_mac)
+        identity = _identity(
+            macs=("aa-bb-cc-dd-ee-02",),
+            uuid="4c4c4544-0035-4810-8056-b4c04f4e3332",
+            serial="cz20310xyz",
+        )
+        assert matcher.match(identity) == [
+            ("pve01", "mac aa-bb-cc-dd-ee-02"),
+            ("pve01", "uuid 4c4c4544-0035-4810-8056-b4c04f4e3332"),
+            ("pve02", "serial cz20310xyz"),
+        ]
+
+    def test_rules_in_order(self):
+        matcher = parse_matcher(MATCH)
+        assert matcher.rule("dell inc.", "poweredge r650").answer == "dell-r6xx"
+        assert matcher.rule("dell inc.", "poweredge r750").answer == "dell"
+        assert matcher.rule("supermicro", "x12") is None
+        assert matcher.rule(None, None) is None
+
+    def test_rule_remembered(self):
+        matcher = parse_matcher(MATCH)
+        first = matcher.rule("dell inc.", "poweredge r650")
+        assert matcher._memo == {("dell inc.", "poweredge r650"): first}
+        assert matcher.rule("dell inc.", "poweredge r650") is first
+
+
+class TestAnswerStore:
+    """match.toml in the answer lookup."""
+
+    def test_secondary_mac(self, answers_dir):
+        _write_hosts(answers_dir, "pve01")
+        store = _store(answers_dir)
+        content, matched, source = store.lookup(["ff:ff:ff:ff:ff:ff", "AA:BB:CC:DD:EE:02"])
+        assert (content, matched, source) == (b'hostname = "pve01"', "pve01", "match")
+
+    def test_serial(self, answers_dir):
+        _write_hosts(answers_dir, "pve02")
+        store = _store(answers_dir)
+        assert store.lookup(["ff:ff:ff:ff:ff:ff"], _identity(serial="cz20310xyz"))[1:] == (
+            "pve02",
+            "match",
+        )
+
+    def test_host_file_wins(self, answers_dir):
+        _write_hosts(answers_dir, "pve01", "aa-bb-cc-dd-ee-02")
+        store = _store(answers_dir)
+        assert store.lookup(["aa:bb:cc:dd:ee:02"])[1:] == ("aa-bb-cc-dd-ee-02", "host")
+
+    def test_missing_host_file_falls_through(self, answers_dir):
+        _write_hosts(answers_dir, "pve02")
+        store = _store(answers_dir)
+        # pve01 claims the UUID but has no file; the serial still matches pve02
+        identity = _identity(uuid="4c4c4544-0035-4810-8056-b4c04f4e3332", serial="cz20310xyz")
+        assert store.lookup(["ff:ff:ff:ff:ff:ff"], identity)[1:] == ("pve02", "match")
+
+    def test_template_before_rule(self, answers_dir):
+        _write_hosts(answers_dir, "dell")
+        (answers_dir / "template.toml").write_text('hostname = "${name}"')
+        (answers_dir / "inventory.toml").write_text('[hosts.ff-ff-ff-ff-ff-ff]\nname = "tpl"')
+        store = _store(answers_dir)
+        identity = _identity(vendor="dell inc.", product="poweredge r750")
+        assert store.lookup(["ff:ff:ff:ff:ff:ff"], identity)[2] == "template"
+        assert store.lookup(["ee:ee:ee:ee:ee:ee"], identity)[1:] == ("dell", "rule")
+
+    def test_invalid_file_keeps_previous(self, answers_dir):
+        _write_hosts(answers_dir, "pve01")
+        store = _store(answers_dir)
+        (answers_dir / "match.toml").write_text("[hosts.pve01]\nmacs = [")
+        store.apply_changes({answers_dir / "match.toml"})
+        assert store.lookup(["aa:bb:cc:dd:ee:01"])[2] == "match"
+
+    def test_removed_file(self, answers_dir):
+        _write_hosts(answers_dir, "pve01")
+        store = _store(answers_dir)
+        (answers_dir / "match.toml").unlink()
+        store.apply_changes({answers_dir / "match.toml"})
+        assert store.lookup(["aa:bb:cc:dd:ee:01"])[2] == "not_found"
+
+
+class TestEndpoint:
+    """POST /answer with DMI data."""
+
+    def test_matched_by_uuid(self, client, answers_dir):
+        _write_hosts(answers_dir, "pve01")
+        (answers_dir / "match.toml").write_bytes(MATCH)
+        body = {"network_interfaces": [{"mac": "ff:ff:ff:ff:ff:ff"}], "dmi": DMI}
+        resp = client.post("/answer", json=body)
+        assert resp.status_code == 200
+        assert resp.text == 'hostname = "pve01"'
+        assert 'pxe_pilot_answer_lookups_total{result="match"} 1' in client.get("/metrics").text
+
+    def test_matched_by_rule(self, client, answers_dir):
+        _write_hosts(answers_dir, "dell-r6xx")
+        (answers_dir / "match.toml").write_bytes(MATCH)
+        dmi = {"system": {"manufacturer": "Dell Inc.", "product-name": "PowerEdge R660"}}
+        body = {"network_interfaces": [{"mac": "ff:ff:ff:ff:ff:ff"}], "dmi": dmi}
+        assert client.post("/answer", json=body).text == 'hostname = "dell-r6xx"'
@@ -68,6 +68,22 @@ class TestMenuIpxe:
         resp = client.get("/menu.ipxe")
         assert "No boot assets found" in resp.text
 
+    def test_initrd_segments(self, client, assets_dir):
+        for ver in ["9.1-1", "9.0-2"]:
+            ver_dir = assets_dir / "proxmox-ve" / ver
+            ver_dir.mkdir(parents=True)
+            (ver_dir / "vmlinuz").write_text("kernel")
+            (ver_dir / "initrd").write_text("initrd")
+        (assets_dir / "proxmox-ve" / "9.1-1" / "iso.cpio").write_text("iso")
+
+        lines = client.get("/menu.ipxe").text.splitlines()
+        initrds = [line.split("/assets/")[1] for line in lines if line.startswith("initrd ")]
+        assert initrds == [
+            "proxmox-ve/9.1-1/initrd",
+            "proxmox-ve/9.1-1/iso.cpio",
+            "proxmox-ve/9.0-2/initrd",
+        ]
+
     def test_asset_url_override(self, client, assets_dir, monkeypatch):
         import server.server as srv
 
@@ -80,3 +96,53 @@ class TestMenuIpxe:
 
         resp = client.get("/menu.ipxe")
         assert "http://custom.host:9090/assets/" in resp.text
+
+
+class TestMenuCaching:
+    """ETag revalidation and cache invalidation for /menu.ipxe."""
+
+    def _add_version(self, assets_dir, product, version):
+        ver_dir = assets_dir / product / version
+        ver_dir.mkdir(parents=True)
+        (ver_dir / "vmlinuz").write_text("kernel")
+        (ver_dir / "initrd").write_text("initrd")
+
+    def test_etag_and_cache_control(self, client):
+        resp = client.get("/menu.ipxe")
+        assert resp.headers["etag"].startswith('"')
+        assert resp.headers["cache-control"] == "no-cache"
+
+    def test_not_modified(self, client):
+        etag = client.get("/menu.ipxe").headers["etag"]
+        resp = client.get("/menu.ipxe", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.headers["etag"] == etag
+        assert resp.content == b""
+
+    def test_etag_changes_with_assets(self, client, assets_dir):
+        etag = client.get("/menu.ipxe").headers["etag"]
+        self._add_version(assets_dir, "proxmox-ve", "9.1-1")
+        resp = client.get("/menu.ipxe", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["etag"] != etag
+
+    def test_etag_differs_per_base_url(self, client, assets_dir):
+        self._add_version(assets_dir, "proxmox-ve", "9.1-1")
+        first = client.get("/menu.ipxe", headers={"Host": "10.0.0.5:8080"})
+        second = client.get("/menu.ipxe", headers={"Host": "10.0.0.6:8080"})
+        assert first.headers["etag"] != second.headers["etag"]
+        assert "http://10.0.0.6:8080/assets/" in second.text
+
+    def test_catalog_not_rescanned_until_changed(self, assets_dir):
+        from assets import AssetCatalog
+
+        self._add_version(assets_dir, "proxmox-ve", "9.1-1")
+        catalog = AssetCatalog(assets_dir)
+        catalog.load()
+        body, _ = catalog.menu("http://pxe")
+
+        (assets_dir / "proxmox-ve" / "9.1-1" / "initrd").unlink()
+        assert catalog.menu("http://pxe")[0] == body
+
+        catalog.apply_changes({assets_dir / "proxmox-ve" / "9.1-1" / "initrd"})
+        assert b"No boot assets found" in catalog.menu("http://pxe")[0]
@@ -0,0 +1,74 @@
+"""Tests for GET /metrics and the metrics primitives."""
+
+from metrics import Counter, Histogram, Registry
+
+
+def _metric_value(text: str, sample: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{sample} not found")
+
+
+class TestMetricsEndpoint:
+    """Instrumented request paths."""
+
+    def test_content_type(self, client):
+        resp = client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    def test_answer_lookup_outcomes(self, client, answers_dir):
+        (answers_dir / "hosts" / "aa-bb-cc-dd-ee-ff.toml").write_text("host = true")
+        client.post("/answer", json={"network_interfaces": [{"mac": "aa:bb:cc:dd:ee:ff"}]})
+        client.post("/answer", json={"network_interfaces": [{"mac": "11:11:11:11:11:11"}]})
+        text = client.get("/metrics").text
+        assert _metric_value(text, 'pxe_pilot_answer_lookups_total{result="host"}') == 1
+        assert _metric_value(text, 'pxe_pilot_answer_lookups_total{result="not_found"}') == 1
+        assert _metric_value(text, "pxe_pilot_answer_hosts") == 1
+
+    def test_request_latency_by_endpoint(self, client):
+        client.get("/menu.ipxe")
+        client.get("/hosts/aa-bb-cc-dd-ee-ff")
+        text = client.get("/metrics").text
+        count = 'pxe_pilot_request_duration_seconds_count{endpoint="/menu.ipxe"}'
+        assert _metric_value(text, count) == 1
+        assert 'pxe_pilot_requests_total{endpoint="/hosts/{mac}",status="404"} 1' in text
+
+    def test_asset_bytes_per_version(self, client, assets_dir):
+        ver_dir = assets_dir / "proxmox-ve" / "9.1-1"
+        ver_dir.mkdir(parents=True)
+        (ver_dir / "initrd").write_bytes(b"x" * 1000)
+        client.get("/assets/proxmox-ve/9.1-1/initrd", headers={"Range": "bytes=0-99"})
+        text = client.get("/metrics").text
+        sample = 'pxe_pilot_asset_bytes_total{product="proxmox-ve",version="9.1-1"}'
+        assert _metric_value(text, sample) == 100
+        assert _metric_value(text, 'pxe_pilot_request_duration_seconds_count{endpoint="/assets"}')
+        assert _metric_value(text, "pxe_pilot_asset_streams_active") == 0
+
+    def test_tftp_counters(self, client):
+        text = client.get("/metrics").text
+        assert _metric_value(text, 'pxe_pilot_tftp_transfers_total{result="completed"}') == 0
+        assert _metric_value(text, "pxe_pilot_tftp_bytes_total") == 0
+
+
+class TestPrimitives:
+    """Text exposition rendering."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        hist = registry.register(Histogram("h", "help", ("path",), buckets=(0.1, 1.0)))
+        for value in (0.05, 0.5, 5.0):
+            hist.observe(value, "/x")
+        text = registry.render()
+        assert 'h_bucket{path="/x",le="0.1"} 1' in text
+        assert 'h_bucket{path="/x",le="1"} 2' in text
+        assert 'h_bucket{path="/x",le="+Inf"} 3' in text
+        assert 'h_count{path="/x"} 3' in text
+        assert 'h_sum{path="/x"} 5.55' in text
+
+    def test_label_escaping(self):
+        registry = Registry()
+        counter = registry.register(Counter("c", "help", ("v",)))
+        counter.inc('a"b\\c')
+        assert 'c{v="a\\"b\\\\c"} 1' in registry.render()
@@ -0,0 +1,235 @@
+"""Tests for boot session tracking and install notifications."""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sessions import InstallNotifier, SessionTracker
+
+MAC = "aa-bb-cc-dd-ee-ff"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Collects POSTed JSON bodies, failing while server.fail is set."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.fail:
+            self.send_error(500)
+            return
+        self.server.received.append(json.loads(body))
+        self.send_response(204)
+        self.end_headers()
+
+
+@pytest.fixture()
+def webhook():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WebhookHandler)
+    server.received, server.fail = [], False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestSessionTracker:
+    """Keying, progression and eviction."""
+
+    def test_ip_session_takes_mac(self):
+        tracker = SessionTracker(clock=FakeClock())
+        tracker.record("10.0.0.5", "boot")
+        assert tracker.get("10.0.0.5").key == "ip:10.0.0.5"
+
+        tracker.record("10.0.0.5", "menu", macs=[MAC])
+        session = tracker.get(MAC)
+        assert session is tracker.get("10.0.0.5")
+        assert (session.key, session.stage) == (MAC, "menu")
+        assert len(tracker) == 1
+
+    def test_answer_from_new_address_joins_by_mac(self):
+        tracker = SessionTracker(clock=FakeClock())
+        tracker.record("10.0.0.5", "menu", macs=[MAC])
+        tracker.record("10.0.0.77", "answer", macs=["11-22-33-44-55-66", MAC])
+        session = tracker.get(MAC)
+        assert session.ip == "10.0.0.77"
+        assert [e[1] for e in session.events] == ["menu", "answer"]
+        assert tracker.get("10.0.0.5") is None
+
+    def test_reused_address_starts_new_session(self):
+        tracker = SessionTracker(clock=FakeClock())
+        tracker.record("10.0.0.5", "menu", macs=[MAC])
+        tracker.record("10.0.0.5", "menu", macs=["11-22-33-44-55-66"])
+        assert len(tracker) == 2
+        assert tracker.get("10.0.0.5").mac == "11-22-33-44-55-66"
+
+    def test_create_false_only_updates(self):
+        tracker = SessionTracker(clock=FakeClock())
+        assert tracker.record("10.0.0.9", "initrd", create=False) is None
+        tracker.record("10.0.0.9", "boot")
+        assert tracker.record("10.0.0.9", "initrd", create=False).stage == "initrd"
+
+    def test_ttl_eviction(self):
+        clock = FakeClock()
+        tracker = SessionTracker(ttl=60, clock=clock)
+        tracker.record("10.0.0.1", "boot")
+        clock.now += 30
+        tracker.record("10.0.0.2", "boot")
+        clock.now += 31
+        assert [s.ip for s in tracker.sessions()] == ["10.0.0.2"]
+        assert tracker.get("10.0.0.1") is None
+
+    def test_activity_postpones_eviction(self):
+        clock = FakeClock()
+        tracker = SessionTracker(ttl=60, clock=clock)
+        tracker.record("10.0.0.1", "boot")
+        tracker.record("10.0.0.2", "boot")
+        clock.now += 50
+        tracker.record("10.0.0.1", "menu")
+        clock.now += 20
+        assert [s.ip for s in tracker.sessions()] == ["10.0.0.1"]
+
+    def test_max_sessions(self):
+        tracker = SessionTracker(max_sessions=2, clock=FakeClock())
+        for i in range(4):
+            tracker.record(f"10.0.0.{i}", "boot")
+        assert [s.ip for s in tracker.sessions()] == ["10.0.0.3", "10.0.0.2"]
+
+    def test_stage_filter_and_counts(self):
+        tracker = SessionTracker(clock=FakeClock())
+        tracker.record("10.0.0.1", "boot")
+        tracker.record("10.0.0.2", "answer")
+        assert [s.ip for s in tracker.sessions("answer")] == ["10.0.0.2"]
+        assert tracker.stage_counts()["boot"] == 1
+
+    def test_forward(self):
+        forwarded = []
+        tracker = SessionTracker(clock=FakeClock(), forward=lambda *args: forwarded.append(args))
+        tracker.record("10.0.0.9", "kernel", detail="pve/vmlinuz", create=False)
+        assert forwarded == [
+            (
+                "10.0.0.9",
+                "kernel",
+                {"macs": (), "detail": "pve/vmlinuz", "details": None, "create": False},
+            )
+        ]
+
+        # Replaying the forwarded arguments elsewhere gives the same session
+        other = SessionTracker(clock=FakeClock())
+        tracker.record("10.0.0.9", "menu", macs=[MAC])
+        for ip, stage, kwargs in forwarded:
+            other.record(ip, stage, **kwargs)
+        assert other.get(MAC).as_dict() == tracker.get(MAC).as_dict()
+
+
+class TestInstallNotifier:
+    """Batched, retried delivery."""
+
+    def _session(self, n: int):
+        tracker = SessionTracker(clock=FakeClock())
+        return tracker.record(f"10.0.0.{n}", "installed")
+
+    def test_batches(self, webhook):
+        notifier = InstallNotifier(f"http://127.0.0.1:{webhook.server_port}", batch_size=2)
+        for n in range(3):
+            notifier.notify(self._session(n))
+        asyncio.run(notifier.flush())
+        assert [len(body["installs"]) for body in webhook.received] == [2, 1]
+        assert notifier.sent == 3
+
+    def test_failed_batch_requeued(self, webhook):
+        notifier = InstallNotifier(f"http://127.0.0.1:{webhook.server_port}")
+        notifier.notify(self._session(1))
+        webhook.fail = True
+        asyncio.run(notifier.flush())
+        assert (len(notifier.queue), notifier.failed_batches) == (1, 1)
+
+        webhook.fail = False
+        asyncio.run(notifier.flush())
+        assert webhook.received[0]["installs"][0]["ip"] == "10.0.0.1"
+        assert not notifier.queue
+
+    def test_disabled_without_url(self):
+        notifier = InstallNotifier("")
+        notifier.notify(self._session(1))
+        assert not notifier.queue
+
+
+class TestSessionEndpoints:
+    """Recording from the boot endpoints and the /sessions API."""
+
+    def _boot(self, client, assets_dir):
+        ver_dir = assets_dir / "proxmox-ve" / "9.1-1"
+        ver_dir.mkdir(parents=True)
+        (ver_dir / "vmlinuz").write_bytes(b"k")
+        (ver_dir / "initrd").write_bytes(b"i")
+        client.get("/boot.ipxe")
+        client.get("/menu.ipxe", params={"mac": MAC})
+        client.get("/assets/proxmox-ve/9.1-1/vmlinuz")
+        client.get("/assets/proxmox-ve/9.1-1/initrd")
+
+    def test_boot_script_passes_mac(self, client):
+        assert "chain /menu.ipxe?mac=${mac:hexhyp}" in client.get("/boot.ipxe").text
+
+    def test_full_install(self, client, answers_dir, assets_dir):
+        (answers_dir / "default.toml").write_text("d = 1")
+        self._boot(client, assets_dir)
+        client.post("/answer", json={"network_interfaces": [{"mac": "AA:BB:CC:DD:EE:FF"}]})
+        resp = client.post(
+            "/installed",
+            json={"fqdn": "pve1.example.com", "network-interfaces": [{"mac": MAC.upper()}]},
+        )
+        assert resp.status_code == 200
+
+        session = client.get("/sessions/AA:BB:CC:DD:EE:FF").json()
+        assert session["stage"] == "installed"
+        assert session["target"] == "proxmox-ve/9.1-1"
+        assert session["answer"] == "default"
+        assert session["fqdn"] == "pve1.example.com"
+        stages = [e["stage"] for e in session["events"]]
+        assert stages == ["boot", "menu", "kernel", "initrd", "answer", "installed"]
+
+    def test_list_and_filter(self, client, assets_dir):
+        self._boot(client, assets_dir)
+        listing = client.get("/sessions").json()
+        assert listing["count"] == 1
+        assert listing["stages"]["initrd"] == 1
+        assert client.get("/sessions", params={"stage": "answer"}).json()["count"] == 0
+        assert client.get("/sessions/testclient").json()["mac"] == MAC
+
+    def test_untracked_asset_downloads(self, client, assets_dir):
+        ver_dir = assets_dir / "pve" / "9"
+        ver_dir.mkdir(parents=True)
+        (ver_dir / "initrd").write_bytes(b"i")
+        client.get("/assets/pve/9/initrd")
+        assert client.get("/sessions").json()["count"] == 0
+
+    def test_unknown_session(self, client):
+        assert client.get("/sessions/00-00-00-00-00-01").status_code == 404
+
+    def test_installed_needs_json(self, client):
+        assert client.post("/installed", content=b"nope").status_code == 400
+
+    @pytest.mark.parametrize("body", [[1, 2], "done", 7, None])
+    def test_installed_needs_object(self, client, body):
+        assert client.post("/installed", json=body).status_code == 400
+
+    def test_installed_ignores_malformed_interfaces(self, client):
+        resp = client.post("/installed", json={"network-interfaces": 5, "fqdn": "n1"})
+        assert resp.status_code == 200
+
+    def test_metrics(self, client, assets_dir):
+        self._boot(client, assets_dir)
+        assert 'pxe_pilot_boot_sessions{stage="initrd"} 1' in client.get("/metrics").text
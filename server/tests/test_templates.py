@@ -0,0 +1,183 @@
+"""Tests for templated answers rendered from an inventory."""
+
+from pathlib import Path
+
+import pytest
+from answers import AnswerStore
+from templates import Template, TemplateError, parse_inventory
+
+TEMPLATE = """[global]
+fqdn = "${hostname}.example.com"
+root-password = "pa$$word"
+
+[network]
+cidr = "${ip}"
+
+[disk-setup]
+disk_list = ${disks}
+"""
+
+INVENTORY = """[defaults]
+disks = ["sda"]
+
+[hosts."AA:BB:CC:DD:EE:FF"]
+hostname = "node1"
+ip = "10.0.0.11/24"
+disks = ["sda", "sdb"]
+
+[hosts.11-22-33-44-55-66]
+hostname = "node2"
+ip = "10.0.0.12/24"
+"""
+
+
+def _post_answer(client, macs: list[str]):
+    return client.post("/answer", json={"network_interfaces": [{"mac": m} for m in macs]})
+
+
+@pytest.fixture()
+def templated(answers_dir):
+    (answers_dir / "template.toml").write_text(TEMPLATE)
+    (answers_dir / "inventory.toml").write_text(INVENTORY)
+    return answers_dir
+
+
+class TestTemplate:
+    """Compiling and rendering."""
+
+    def test_render(self):
+        template = Template("a = ${x}, b = ${y-z}, ${x}")
+        assert template.variables == {"x", "y-z"}
+        assert template.render({"x": "1", "y-z": "2"}) == b"a = 1, b = 2, 1"
+
+    def test_missing_variable(self):
+        with pytest.raises(TemplateError, match="y"):
+            Template("${x}${y}").render({"x": "1"})
+
+    def test_plain_dollars_untouched(self):
+        assert Template("p = '$x $$ ${'").render({}) == b"p = '$x $$ ${'"
+
+
+class TestInventory:
+    """TOML and CSV inventories."""
+
+    def test_toml(self):
+        inventory = parse_inventory(Path("inventory.toml"), INVENTORY.encode())
+        assert inventory["AA:BB:CC:DD:EE:FF"]["disks"] == '["sda", "sdb"]'
+        assert inventory["11-22-33-44-55-66"]["disks"] == '["sda"]'
+
+    def test_csv(self):
+        data = b'mac,hostname,disks\naabbccddeeff,node1,"[""sda""]"\n112233445566,node2,\n'
+        inventory = parse_inventory(Path("inventory.csv"), data)
+        assert inventory["aabbccddeeff"] == {"hostname": "node1", "disks": '["sda"]'}
+        assert inventory["112233445566"] == {"hostname": "node2"}
+
+    def test_csv_needs_mac_column(self):
+        with pytest.raises(ValueError, match="mac"):
+            parse_inventory(Path("inventory.csv"), b"hostname\nnode1\n")
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            b"hostname,mac\nnode1,aa-bb-cc-dd-ee-ff\nnode2\n",
+            b"mac,hostname\naa-bb-cc-dd-ee-ff,node1\n,node2\n",
+        ],
+    )
+    def test_csv_row_without_mac(self, data):
+        with pytest.raises(ValueError, match="line 3"):
+            parse_inventory(Path("inventory.csv"), data)
+
+    @pytest.mark.parametrize(
+        "doc", ['defaults = "oops"', "hosts = [1]", 'hosts = {"aa-bb-cc-dd-ee-ff" = 1}']
+    )
+    def test_toml_needs_tables(self, doc):
+        with pytest.raises(ValueError, match="must be a table"):
+            parse_inventory(Path("inventory.toml"), doc.encode())
+
+
+class TestTemplatedStore:
+    """Lookup precedence and memoization in the answer store."""
+
+    def test_renders_for_inventory_host(self, templated):
+        store = AnswerStore(templated)
+        store.load()
+        content, matched, source = store.lookup(["aa:bb:cc:dd:ee:ff"])
+        assert (matched, source) == ("aa-bb-cc-dd-ee-ff", "template")
+        assert b'fqdn = "node1.example.com"' in content
+        assert b'disk_list = ["sda", "sdb"]' in content
+        assert b'"pa$$word"' in content
+
+    def test_host_file_wins(self, templated):
+        (templated / "hosts" / "aa-bb-cc-dd-ee-ff.toml").write_text("own = true")
+        store = AnswerStore(templated)
+        store.load()
+        assert store.lookup(["aa:bb:cc:dd:ee:ff"]) == (b"own = true", "aa-bb-cc-dd-ee-ff", "host")
+
+    def test_unknown_host_gets_default(self, templated):
+        (templated / "default.toml").write_text("default = true")
+        store = AnswerStore(templated)
+        store.load()
+        assert store.lookup(["ff:ff:ff:ff:ff:ff"]) == (b"default = true", None, "default")
+
+    def test_memoized_until_inventory_changes(self, templated):
+        store = AnswerStore(templated)
+        store.load()
+        first = store.render("11-22-33-44-55-66")
+        assert store.render("11-22-33-44-55-66") is first
+
+        inventory = templated / "inventory.toml"
+        inventory.write_text(INVENTORY.replace("node2", "node2b"))
+        store.apply_changes({inventory})
+        assert b"node2b.example.com" in store.render("11-22-33-44-55-66")
+
+    def test_missing_variable_falls_through(self, templated):
+        (templated / "template.toml").write_text("x = ${nope}")
+        (templated / "default.toml").write_text("default = true")
+        store = AnswerStore(templated)
+        store.load()
+        assert store.lookup(["aa:bb:cc:dd:ee:ff"])[2] == "default"
+
+    def test_malformed_inventory_skipped(self, answers_dir):
+        (answers_dir / "template.toml").write_text(TEMPLATE)
+        (answers_dir / "inventory.toml").write_text("hosts = [1]")
+        (answers_dir / "default.toml").write_text("default = true")
+        store = AnswerStore(answers_dir)
+        store.load()
+        assert store.lookup(["aa:bb:cc:dd:ee:ff"])[2] == "default"
+
+    def test_truncated_csv_row_skips_inventory(self, answers_dir):
+        (answers_dir / "template.toml").write_text('fqdn = "${hostname}"')
+        (answers_dir / "inventory.csv").write_text("hostname,mac\nnode1,aa-bb-cc-dd-ee-ff\nnode2\n")
+        store = AnswerStore(answers_dir)
+        store.load()
+        assert store.render("aa-bb-cc-dd-ee-ff") is None
+
+    def test_csv_inventory(self, answers_dir):
+        (answers_dir / "template.toml").write_text('fqdn = "${hostname}" # ${mac}')
+        (answers_dir / "inventory.csv").write_text("mac,hostname\nAA-BB-CC-DD-EE-FF,node1\n")
+        store = AnswerStore(answers_dir)
+        store.load()
+        assert store.render("aa-bb-cc-dd-ee-ff") == b'fqdn = "node1" # aa-bb-cc-dd-ee-ff'
+
+    def test_hosts_lists_inventory(self, templated):
+        (templated / "hosts" / "00-00-00-00-00-01.toml").write_text("")
+        store = AnswerStore(templated)
+        store.load()
+        assert store.hosts() == ["00-00-00-00-00-01", "11-22-33-44-55-66", "aa-bb-cc-dd-ee-ff"]
+
+
+class TestTemplatedEndpoints:
+    """/answer and /hosts with a template in place."""
+
+    def test_answer(self, client, templated):
+        resp = _post_answer(client, ["11:22:33:44:55:66"])
+        assert resp.status_code == 200
+        assert 'fqdn = "node2.example.com"' in resp.text
+
+    def test_host_view_source(self, client, templated):
+        resp = client.get("/hosts/aa-bb-cc-dd-ee-ff")
+        assert resp.headers["x-pxe-pilot-source"] == "template.toml"
+
+    def test_lookup_metric(self, client, templated):
+        _post_answer(client, ["11:22:33:44:55:66"])
+        assert 'pxe_pilot_answer_lookups_total{result="template"} 1' in client.get("/metrics").text
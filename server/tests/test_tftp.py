@@ -0,0 +1,208 @@
+"""Tests for the built-in asyncio TFTP server."""
+
+import asyncio
+import socket
+import struct
+
+import pytest
+from tftp import TftpError, TftpServer, parse_request
+
+PAYLOAD = bytes(range(256)) * 10  # 2560 bytes: exactly five 512-byte blocks
+
+
+def _rrq(filename: str, **options) -> bytes:
+    fields = [filename, "octet"]
+    for key, value in options.items():
+        fields += [key, str(value)]
+    return struct.pack("!H", 1) + b"".join(f.encode() + b"\0" for f in fields)
+
+
+def _ack(block: int) -> bytes:
+    return struct.pack("!HH", 4, block & 0xFFFF)
+
+
+def _download(port: int, packet: bytes, *, drop_first_ack=False) -> tuple[bytes, dict, int | None]:
+    """Minimal client: returns (data, oack options, error code or None)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(5)
+    sock.sendto(packet, ("127.0.0.1", port))
+    data, options, blksize, windowsize = b"", {}, 512, 1
+    expected = 1
+    try:
+        while True:
+            pkt, addr = sock.recvfrom(70000)
+            opcode = struct.unpack("!H", pkt[:2])[0]
+            if opcode == 5:
+                return data, options, struct.unpack("!H", pkt[2:4])[0]
+            if opcode == 6:
+                fields = pkt[2:].split(b"\0")[:-1]
+                pairs = zip(fields[::2], fields[1::2], strict=True)
+                options = {key.decode(): value.decode() for key, value in pairs}
+                blksize = int(options.get("blksize", 512))
+                windowsize = int(options.get("windowsize", 1))
+                sock.sendto(_ack(0), addr)
+                continue
+            block = struct.unpack("!H", pkt[2:4])[0]
+            if block != expected & 0xFFFF:
+                continue
+            data += pkt[4:]
+            last = len(pkt) - 4 < blksize
+            if last or expected % windowsize == 0:
+                if drop_first_ack:
+                    drop_first_ack = False
+                    expected -= windowsize - 1
+                    data = data[: (expected - 1) * blksize]
+                    continue
+                sock.sendto(_ack(expected), addr)
+            expected += 1
+            if last:
+                return data, options, None
+    finally:
+        sock.close()
+
+
+def _run(tmp_path, *requests, **server_opts):
+    (tmp_path / "ipxe.efi").write_bytes(PAYLOAD)
+    server = TftpServer(tmp_path, **server_opts)
+
+    async def scenario():
+        port = await server.start("127.0.0.1", 0)
+        try:
+            return await asyncio.gather(
+                *(asyncio.to_thread(_download, port, pkt, **kw) for pkt, kw in requests)
+            )
+        finally:
+            await server.stop()
+
+    return asyncio.run(scenario()), server.stats
+
+
+class TestTftpTransfers:
+    """Read requests with and without option negotiation."""
+
+    def test_plain_octet_transfer(self, tmp_path):
+        [(data, options, error)], stats = _run(tmp_path, (_rrq("ipxe.efi"), {}))
+        assert error is None
+        assert options == {}
+        assert data == PAYLOAD
+        assert stats.completed == 1
+        assert stats.bytes_sent == len(PAYLOAD)
+
+    def test_blksize_windowsize_tsize(self, tmp_path):
+        pkt = _rrq("ipxe.efi", blksize=1024, windowsize=4, tsize=0)
+        [(data, options, error)], _ = _run(tmp_path, (pkt, {}))
+        assert error is None
+        assert options == {"blksize": "1024", "windowsize": "4", "tsize": str(len(PAYLOAD))}
+        assert data == PAYLOAD
+
+    def test_leading_slash(self, tmp_path):
+        [(data, _, error)], _ = _run(tmp_path, (_rrq("/ipxe.efi"), {}))
+        assert error is None
+        assert data == PAYLOAD
+
+    def test_concurrent_transfers(self, tmp_path):
+        requests = [(_rrq("ipxe.efi", blksize=1468, windowsize=8), {}) for _ in range(20)]
+        results, stats = _run(tmp_path, *requests)
+        assert all(data == PAYLOAD for data, _, _ in results)
+        assert stats.completed == 20
+        assert stats.active == 0
+
+    def test_retransmits_unacked_window(self, tmp_path):
+        pkt = _rrq("ipxe.efi", windowsize=2, timeout=1)
+        [(data, _, error)], stats = _run(tmp_path, (pkt, {"drop_first_ack": True}))
+        assert error is None
+        assert data == PAYLOAD
+        assert stats.timeouts == 1
+        assert stats.retransmits == 1
+
+    def test_transfers_reported(self, tmp_path):
+        reports = []
+        requests = [(_rrq("ipxe.efi"), {}), (_rrq("missing.kpxe"), {})]
+        _run(tmp_path, *requests, on_transfer=lambda **fields: reports.append(fields))
+        by_file = {r["file"]: r for r in reports}
+        assert by_file["ipxe.efi"]["outcome"] == "completed"
+        assert by_file["ipxe.efi"]["bytes"] == len(PAYLOAD)
+        assert by_file["missing.kpxe"]["outcome"] == "rejected"
+        assert all(r["client"] == "127.0.0.1" and r["ms"] >= 0 for r in reports)
+
+
+class TestTftpErrors:
+    """Requests the server refuses."""
+
+    def test_file_not_found(self, tmp_path):
+        [(_, _, error)], stats = _run(tmp_path, (_rrq("missing.kpxe"), {}))
+        assert error == 1
+        assert stats.rejected == 1
+
+    def test_path_traversal(self, tmp_path):
+        [(_, _, error)], _ = _run(tmp_path, (_rrq("../etc/passwd"), {}))
+        assert error == 1
+
+    def test_write_request_rejected(self, tmp_path):
+        wrq = struct.pack("!H", 2) + b"ipxe.efi\0octet\0"
+        [(_, _, error)], _ = _run(tmp_path, (wrq, {}))
+        assert error == 2
+
+    def test_shutdown_counts_aborted(self, tmp_path):
+        (tmp_path / "ipxe.efi").write_bytes(PAYLOAD)
+        reports = []
+        server = TftpServer(tmp_path, on_transfer=lambda **fields: reports.append(fields))
+
+        async def scenario():
+            port = await server.start("127.0.0.1", 0)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.sendto(_rrq("ipxe.efi"), ("127.0.0.1", port))
+            # Never ACK: the transfer is still waiting when the server stops
+            while server.stats.started == 0:
+                await asyncio.sleep(0.01)
+            await server.stop()
+            sock.close()
+
+        asyncio.run(scenario())
+        assert server.stats.aborted == 1
+        assert server.stats.active == 0
+        assert reports[0]["outcome"] == "aborted"
+
+    def test_transfer_socket_error(self, tmp_path, monkeypatch):
+        (tmp_path / "ipxe.efi").write_bytes(PAYLOAD)
+        server = TftpServer(tmp_path)
+
+        async def scenario():
+            port = await server.start("127.0.0.1", 0)
+            loop = asyncio.get_running_loop()
+            create = loop.create_datagram_endpoint
+
+            async def refuse(factory, **kwargs):
+                if "remote_addr" in kwargs:
+                    raise OSError(24, "Too many open files")
+                return await create(factory, **kwargs)
+
+            monkeypatch.setattr(loop, "create_datagram_endpoint", refuse)
+            try:
+                return await asyncio.to_thread(_download, port, _rrq("ipxe.efi"))
+            finally:
+                await server.stop()
+
+        _, _, error = asyncio.run(scenario())
+        assert error == 0
+        assert server.stats.failed == 1
+
+    def test_busy(self, tmp_path):
+        [(_, _, error)], stats = _run(tmp_path, (_rrq("ipxe.efi"), {}), max_transfers=0)
+        assert error == 0
+        assert stats.rejected == 1
+
+
+class TestParseRequest:
+    """RRQ parsing."""
+
+    def test_options_lowercased(self):
+        opcode, filename, mode, options = parse_request(
+            struct.pack("!H", 1) + b"undionly.kpxe\0OCTET\0BLKSIZE\x001432\0"
+        )
+        assert (opcode, filename, mode) == (1, "undionly.kpxe", "octet")
+        assert options == {"blksize": "1432"}
+
+    def test_malformed(self):
+        with pytest.raises(TftpError):
+            parse_request(struct.pack("!H", 1) + b"no-terminator")
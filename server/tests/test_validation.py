@@ -0,0 +1,208 @@
+"""Tests for answer file validation."""
+
+import pytest
+import validation
+from answers import AnswerStore
+from validation import main, validate_answer, validate_many
+
+VALID = b"""
+[global]
+keyboard = "en-us"
+country = "us"
+fqdn = "pve1.example.com"
+mailto = "admin@example.com"
+timezone = "UTC"
+root-password = "changeme"
+
+[network]
+source = "from-dhcp"
+
+[disk-setup]
+filesystem = "ext4"
+disk-list = ["sda"]
+"""
+
+MAC = "aa-bb-cc-dd-ee-ff"
+
+
+def _with(old: bytes, new: bytes) -> bytes:
+    assert old in VALID
+    return VALID.replace(old, new)
+
+
+class TestValidateAnswer:
+    """Schema checks on a single answer."""
+
+    def test_valid(self):
+        assert validate_answer(VALID) == []
+
+    def test_snake_case_keys(self):
+        content = _with(b"root-password", b"root_password").replace(b"disk-list", b"disk_list")
+        assert validate_answer(content) == []
+
+    def test_invalid_toml(self):
+        assert validate_answer(b"[global\n")[0].startswith("invalid TOML")
+
+    def test_reports_every_error(self):
+        content = _with(b'country = "us"\n', b"").replace(b'"ext4"', b'"ntfs"')
+        errors = validate_answer(content + b"\n[extra]\n")
+        assert errors == [
+            "unknown key 'extra'",
+            "global.country is required",
+            "disk-setup.filesystem must be one of ext4, xfs, zfs, btrfs",
+        ]
+
+    def test_missing_sections(self):
+        assert validate_answer(b"") == [
+            "missing [global]",
+            "missing [network]",
+            "missing [disk-setup]",
+        ]
+
+    def test_static_network(self):
+        content = _with(b'source = "from-dhcp"', b'source = "from-answer"\ncidr = "10.0.0.300/24"')
+        assert validate_answer(content) == [
+            "network.cidr is not a valid address: '10.0.0.300/24'",
+            "network.dns is required",
+            "network.gateway is required",
+            "network.filter is required",
+        ]
+
+    def test_filter_keys_not_renamed(self):
+        content = _with(b'disk-list = ["sda"]', b'filter.ID_MODEL = "Samsung*"')
+        assert validate_answer(content) == []
+
+    @pytest.mark.parametrize(
+        ("disks", "error"),
+        [
+            (b'filesystem = "zfs"\ndisk-list = ["sda"]', "disk-setup.zfs.raid is required"),
+            (
+                b'filesystem = "zfs"\nzfs.raid = "raid5"\ndisk-list = ["sda"]',
+                "zfs.raid must be one of",
+            ),
+            (b'filesystem = "xfs"\ndisk-list = ["a"]\nfilter.ID_MODEL = "x"', "exactly one of"),
+            (b'filesystem = "ext4"\ndisk-list = []', "disk-list must be a non-empty list"),
+        ],
+    )
+    def test_disk_setup(self, disks, error):
+        errors = validate_answer(_with(b'filesystem = "ext4"\ndisk-list = ["sda"]', disks))
+        assert len(errors) == 1
+        assert error in errors[0]
+
+    def test_passwords(self):
+        both = _with(
+            b'root-password = "changeme"', b'root-password = "a"\nroot-password-hashed = "b"'
+        )
+        assert validate_answer(both) == [
+            "global.root-password and root-password-hashed are exclusive"
+        ]
+        none = _with(b'root-password = "changeme"\n', b"")
+        assert validate_answer(none) == ["global needs root-password or root-password-hashed"]
+
+    def test_types(self):
+        content = _with(b'keyboard = "en-us"', b"keyboard = 1\nreboot-on-error = 'yes'")
+        assert validate_answer(content) == [
+            "global.keyboard must be a string",
+            "global.reboot-on-error must be a boolean",
+        ]
+
+
+class TestValidateMany:
+    """Batch validation, inline and in a process pool."""
+
+    def test_only_invalid_reported(self):
+        assert validate_many({"good": VALID, "bad": b"x = ["}).keys() == {"bad"}
+
+    def test_process_pool(self, monkeypatch):
+        monkeypatch.setattr(validation, "MIN_PARALLEL", 2)
+        items = {f"{i}.toml": VALID if i % 2 else b"" for i in range(8)}
+        invalid = validate_many(items, processes=2)
+        assert sorted(invalid) == ["0.toml", "2.toml", "4.toml", "6.toml"]
+        assert invalid["0.toml"][0] == "missing [global]"
+
+
+class TestStoreValidation:
+    """Errors kept alongside the answers in the store."""
+
+    def test_load_and_reload(self, answers_dir):
+        host = answers_dir / "hosts" / f"{MAC}.toml"
+        host.write_bytes(b"[global]\n")
+        (answers_dir / "default.toml").write_bytes(VALID)
+        store = AnswerStore(answers_dir)
+        store.load()
+        assert store.invalid_answers().keys() == {f"hosts/{MAC}.toml"}
+        assert store.errors("host", MAC)[0] == "global.keyboard is required"
+        assert store.errors("default", None) == []
+
+        host.write_bytes(VALID)
+        store.apply_changes({host})
+        assert store.invalid_answers() == {}
+
+        host.unlink()
+        (answers_dir / "default.toml").write_bytes(b"nope")
+        store.apply_changes({host, answers_dir / "default.toml"})
+        assert store.invalid_answers().keys() == {"default.toml"}
+
+    def test_rendered_answers(self, answers_dir):
+        (answers_dir / "template.toml").write_bytes(_with(b'"us"', b'"${country}"'))
+        (answers_dir / "inventory.toml").write_text(
+            f'[hosts."{MAC}"]\ncountry = "de"\n[hosts."11-22-33-44-55-66"]\ncountry = "usa"\n'
+        )
+        store = AnswerStore(answers_dir)
+        store.load()
+        store.render_all()
+        assert store.invalid_answers() == {
+            "template.toml (11-22-33-44-55-66)": [
+                "global.country must be a two-letter code, not 'usa'"
+            ]
+        }
+        assert store.answer_count == 2
+
+
+class TestValidationEndpoints:
+    """Strict serving and the /validation report."""
+
+    def test_report(self, client, answers_dir):
+        (answers_dir / "default.toml").write_bytes(b"[global]\n")
+        report = client.get("/validation").json()
+        assert not report["valid"]
+        assert report["checked"] == 1
+        assert "default.toml" in report["invalid"]
+        assert "pxe_pilot_answers_invalid 1" in client.get("/metrics").text
+
+    def test_invalid_served_by_default(self, client, answers_dir):
+        (answers_dir / "default.toml").write_bytes(b"[global]\n")
+        resp = client.post("/answer", json={"network_interfaces": [{"mac": MAC}]})
+        assert resp.status_code == 200
+
+    def test_strict_refuses_invalid(self, client, answers_dir, monkeypatch):
+        import server.server as srv
+
+        monkeypatch.setattr(srv, "STRICT_ANSWERS", True)
+        (answers_dir / "default.toml").write_bytes(VALID)
+        (answers_dir / "hosts" / f"{MAC}.toml").write_bytes(b"[global]\n")
+        resp = client.post("/answer", json={"network_interfaces": [{"mac": MAC}]})
+        assert resp.status_code == 422
+        assert "global.keyboard is required" in resp.json()["errors"]
+
+        other = client.post("/answer", json={"network_interfaces": [{"mac": "11:22:33:44:55:66"}]})
+        assert other.status_code == 200
+
+
+class TestCli:
+    """python validation.py <answers_dir>."""
+
+    def test_reports_and_fails(self, answers_dir, capsys):
+        (answers_dir / "default.toml").write_bytes(VALID)
+        (answers_dir / "hosts" / f"{MAC}.toml").write_bytes(b"[global]\n")
+        assert main([str(answers_dir)]) == 1
+        out = capsys.readouterr().out
+        assert f"hosts/{MAC}.toml: missing [network]" in out
+        assert out.endswith("2 answers checked, 1 invalid\n")
+
+    def test_valid(self, answers_dir, capsys):
+        (answers_dir / "default.toml").write_bytes(VALID)
+        assert main([str(answers_dir)]) == 0
+
+    def test_missing_dir(self, tmp_path):
+        assert main([str(tmp_path / "nope")]) == 2
@@ -0,0 +1,267 @@
+"""Tests for the multi-worker launch mode."""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import pytest
+from tftp import TftpServer
+from workers import STAT_FIELDS, Hub, SharedCounters, SharedTftp, Supervisor, SupervisorLink
+
+SERVER_DIR = Path(__file__).resolve().parents[1]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get_json(url: str) -> dict:
+    with urllib.request.urlopen(url, timeout=2) as resp:
+        return json.load(resp)
+
+
+def _post_json(url: str, body: dict) -> bytes:
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=2) as resp:
+        return resp.read()
+
+
+def _wait_for(predicate, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            result = predicate()
+        except OSError:
+            result = None
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError("timed out")
+
+
+class TestSharedState:
+    """Supervisor -> worker state in shared memory and over the pipe."""
+
+    def test_tftp_stats_round_trip(self, tmp_path):
+        state = multiprocessing.RawArray("q", len(STAT_FIELDS) + 1)
+        tftp = TftpServer(tmp_path)
+        tftp.stats.completed, tftp.stats.bytes_sent = 3, 4096
+
+        SharedTftp.publish(tftp, state)
+        shared = SharedTftp(state)
+        assert not shared.running
+        assert shared.stats.completed == 3
+        assert shared.stats.as_dict() == tftp.stats.as_dict()
+        with pytest.raises(AttributeError):
+            _ = shared.stats.nope
+
+    def test_forwarded_changes_applied(self):
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        received = []
+        done = threading.Event()
+
+        def handler(paths, generation):
+            received.append((paths, generation))
+            done.set()
+
+        link = SupervisorLink(reader, multiprocessing.RawArray("q", len(STAT_FIELDS) + 1))
+        thread = link.follow({"answers": handler})
+        writer.send(("answers", ["/answers/default.toml"], 7))
+        assert done.wait(5)
+        assert received == [({Path("/answers/default.toml")}, 7)]
+
+        writer.close()
+        thread.join(5)
+        assert not thread.is_alive()
+
+    def test_counters_round_trip(self):
+        counters = SharedCounters(("events", "events_dropped"), multiprocessing.RawArray("q", 2))
+        counters.publish({"events": 12, "other": 1})
+        assert counters["events"] == 12
+        assert counters.as_dict() == {"events": 12, "events_dropped": 0}
+
+    def test_reports_and_questions(self, tmp_path):
+        totals = []
+        hub = Hub(
+            reports={"add": totals.append},
+            queries={"total": lambda scale: sum(totals) * scale},
+            counters=dict,
+            counter_names=(),
+        )
+
+        async def scenario():
+            supervisor = Supervisor(1, {}, None, TftpServer(tmp_path), hub)
+            supervisor._loop = asyncio.get_running_loop()
+            ours, theirs = multiprocessing.Pipe()
+            threading.Thread(target=supervisor._serve_reports, args=(ours,), daemon=True).start()
+            link = SupervisorLink(None, supervisor._tftp_state, reports=theirs)
+            link.report("add", 1)
+            link.report("add", 2)
+            # Asking sends the queued reports first, so the answer includes them
+            answer = await asyncio.to_thread(link.ask, "total", scale=10)
+            theirs.close()
+            return answer
+
+        assert asyncio.run(scenario()) == 30
+
+    def test_worker_reports_sessions_and_events(self, client, answers_dir):
+        srv = client.srv
+        (answers_dir / "default.toml").write_text('hostname = "node"')
+        reader, _ = multiprocessing.Pipe(duplex=False)
+        link = SupervisorLink(reader, multiprocessing.RawArray("q", len(STAT_FIELDS) + 1))
+        reports = []
+        link.report = lambda kind, *args: reports.append((kind, *args))
+        srv.attach_supervisor(link)
+
+        body = {"network_interfaces": [{"mac": "AA:BB:CC:DD:EE:FF"}]}
+        assert client.post("/answer", json=body).status_code == 200
+        assert [r[0] for r in reports] == ["session", "event"]
+        assert reports[0][1:3] == ("testclient", "answer")
+        assert reports[1][2]["path"] == "/answer"
+        # The supervisor numbers and keeps them; the worker does not
+        assert srv.events.buffered == 0
+        assert srv.sessions.on_installed is None
+
+    def test_supervisor_adds_asset_mac(self, client):
+        srv = client.srv
+        srv.sessions.record("10.0.0.5", "menu", macs=["aa-bb-cc-dd-ee-ff"])
+        # Reported by a worker that never saw the menu request
+        srv.record_event("http", {"client": "10.0.0.5", "path": "/assets/pve/9.1-1/vmlinuz"})
+        found = srv.events.query(mac="aa-bb-cc-dd-ee-ff")
+        assert [e["path"] for e in found] == ["/assets/pve/9.1-1/vmlinuz"]
+
+    def test_worker_shares_limits(self, client, monkeypatch):
+        srv = client.srv
+        monkeypatch.setattr(srv.admission, "slots", 10)
+        timeline = multiprocessing.Value("d", 0.0)
+        reader, _ = multiprocessing.Pipe(duplex=False)
+        state = multiprocessing.RawArray("q", len(STAT_FIELDS) + 1)
+        srv.attach_supervisor(SupervisorLink(reader, state, timeline, workers=4))
+        assert srv.asset_streamer.limiter.timeline is timeline
+        assert srv.admission.slots == 2
+
+
+class TestLaunch:
+    """main() choosing a launch mode."""
+
+    def test_cluster_needs_single_worker(self, client, monkeypatch):
+        import server.server as srv
+
+        monkeypatch.setattr(srv, "WORKERS", 4)
+        monkeypatch.setattr(srv.cluster, "peers", {"http://b": None})
+        with pytest.raises(SystemExit, match="PXE_PILOT_PEERS"):
+            srv.main()
+
+    def test_uvicorn_options(self, client, monkeypatch):
+        import server.server as srv
+
+        monkeypatch.setattr(srv, "LIMIT_CONCURRENCY", 0)
+        options = srv.uvicorn_options()
+        assert options["limit_concurrency"] is None
+        assert options["timeout_keep_alive"] == srv.KEEPALIVE_TIMEOUT
+
+
+class TestSupervisor:
+    """A real supervisor with two workers on one socket."""
+
+    @pytest.fixture()
+    def supervised(self, tmp_path):
+        answers = tmp_path / "answers"
+        (answers / "hosts").mkdir(parents=True)
+        (tmp_path / "assets").mkdir()
+        port = _free_port()
+        env = {
+            **os.environ,
+            "PXE_PILOT_WORKERS": "2",
+            "PXE_PILOT_PORT": str(port),
+            "PXE_PILOT_ANSWERS_DIR": str(answers),
+            "PXE_PILOT_ASSETS_DIR": str(tmp_path / "assets"),
+            "PXE_PILOT_WATCH_POLLING": "true",
+            "PXE_PILOT_WATCH_INTERVAL": "0.2",
+            "PXE_PILOT_LOG_LEVEL": "warning",
+        }
+        proc = subprocess.Popen([sys.executable, "server.py"], cwd=SERVER_DIR, env=env)
+        base = f"http://127.0.0.1:{port}"
+        try:
+            _wait_for(lambda: _get_json(f"{base}/health"))
+            yield base, answers, proc
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    def test_changes_reach_every_worker(self, supervised):
+        base, answers, _proc = supervised
+        (answers / "hosts" / "aa-bb-cc-dd-ee-ff.toml").write_text("x = 1")
+
+        def all_see_host():
+            return all(_get_json(f"{base}/hosts")["host_count"] == 1 for _ in range(10))
+
+        _wait_for(all_see_host)
+
+    def test_generations_agree_across_workers(self, supervised):
+        base, answers, _proc = supervised
+        (answers / "hosts" / "aa-bb-cc-dd-ee-ff.toml").write_text("x = 1")
+        _wait_for(lambda: all(_get_json(f"{base}/hosts")["host_count"] == 1 for _ in range(10)))
+        generation = _get_json(f"{base}/hosts")["generation"]
+
+        # Each request opens a new connection, so they spread across the workers
+        pids = set()
+        for _ in range(20):
+            assert _get_json(f"{base}/hosts")["generation"] == generation
+            assert _get_json(f"{base}/hosts?since={generation}")["changes"] == []
+            pids.add(_get_json(f"{base}/health")["pid"])
+        assert len(pids) == 2
+
+    def test_sessions_and_events_span_workers(self, supervised):
+        base, answers, _proc = supervised
+        (answers / "default.toml").write_text('hostname = "node"')
+        body = {"network_interfaces": [{"mac": "AA:BB:CC:DD:EE:FF"}]}
+        _wait_for(lambda: all(_get_json(f"{base}/health")["default_exists"] for _ in range(10)))
+
+        # Each request opens a new connection, so they spread across the workers
+        pids = set()
+        for _ in range(10):
+            _post_json(f"{base}/answer", body)
+            pids.add(_get_json(f"{base}/health")["pid"])
+        assert len(pids) == 2
+
+        def every_worker_sees_all():
+            for _ in range(10):
+                session = _get_json(f"{base}/sessions/aa:bb:cc:dd:ee:ff")
+                found = _get_json(f"{base}/events?mac=aa-bb-cc-dd-ee-ff")
+                if len(session["events"]) != 10 or found["count"] != 10:
+                    return False
+            return _get_json(f"{base}/health")["events"]["buffered"] >= 10
+
+        _wait_for(every_worker_sees_all)
+
+    def test_dead_worker_restarted(self, supervised):
+        base, _answers, proc = supervised
+        pid = _get_json(f"{base}/health")["pid"]
+        assert pid != proc.pid
+        os.kill(pid, signal.SIGKILL)
+        _wait_for(lambda: _get_json(f"{base}/health")["pid"] != pid)
+
+    def test_supervisor_stops_workers(self, supervised):
+        base, _answers, proc = supervised
+        pid = _get_json(f"{base}/health")["pid"]
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(timeout=15) == 0
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
@@ -0,0 +1,384 @@
+"""Read-only asyncio TFTP server for the iPXE binaries.
+
+Implements RFC 1350 read requests with the option extensions iPXE and PXE
+ROMs use to speed transfers up: blksize (RFC 2348), timeout and tsize
+(RFC 2349) and windowsize (RFC 7440). Files are held in memory and each
+transfer runs as a task on the server's event loop with its own socket.
+"""
+
+import asyncio
+import contextlib
+import logging
+import struct
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from fileio import FileIO
+
+logger = logging.getLogger("pxe-pilot")
+
+OP_RRQ, OP_WRQ, OP_DATA, OP_ACK, OP_ERROR, OP_OACK = range(1, 7)
+
+ERR_UNDEFINED = 0
+ERR_NOT_FOUND = 1
+ERR_ACCESS = 2
+ERR_ILLEGAL_OP = 4
+ERR_OPTION = 8
+
+DEFAULT_BLKSIZE = 512
+MIN_BLKSIZE, MAX_BLKSIZE = 8, 65464
+MAX_WINDOWSIZE = 65535
+
+
+@dataclass
+class TftpStats:
+    """Counters for TFTP transfers since startup."""
+
+    active: int = 0
+    started: int = 0
+    completed: int = 0
+    failed: int = 0
+    aborted: int = 0
+    rejected: int = 0
+    timeouts: int = 0
+    retransmits: int = 0
+    bytes_sent: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class TftpError(Exception):
+    """A transfer failed; the code and message are sent to the client."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def parse_request(packet: bytes) -> tuple[int, str, str, dict[str, str]]:
+    """Split an RRQ/WRQ into (opcode, filename, mode, options)."""
+    if len(packet) < 4:
+        raise TftpError(ERR_ILLEGAL_OP, "Malformed request")
+    (opcode,) = struct.unpack("!H", packet[:2])
+    fields = packet[2:].split(b"\0")
+    if len(fields) < 3 or fields[-1] != b"":
+        raise TftpError(ERR_ILLEGAL_OP, "Malformed request")
+    fields = [f.decode("ascii", "replace") for f in fields[:-1]]
+    filename, mode, rest = fields[0], fields[1].lower(), fields[2:]
+    options = {rest[i].lower(): rest[i + 1] for i in range(0, len(rest) - 1, 2)}
+    return opcode, filename, mode, options
+
+
+def error_packet(code: int, message: str) -> bytes:
+    return struct.pack("!HH", OP_ERROR, code) + message.encode() + b"\0"
+
+
+def oack_packet(options: dict[str, str]) -> bytes:
+    body = b"".join(f"{k}\0{v}\0".encode() for k, v in options.items())
+    return struct.pack("!H", OP_OACK) + body
+
+
+def to_netascii(data: bytes) -> bytes:
+    return data.replace(b"\r", b"\r\0").replace(b"\n", b"\r\n")
+
+
+class _TransferProtocol(asyncio.DatagramProtocol):
+    """Per-transfer socket that queues whatever the client sends back."""
+
+    def __init__(self):
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue()
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.queue.put_nowait(data)
+
+
+class _ListenerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: "TftpServer"):
+        self.server = server
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.server.handle_request(data, addr)
+
+
+class TftpServer:
+    """Serves files from a directory, loaded into memory at start().
+
+    on_transfer is called with keyword arguments client, file, outcome
+    ("completed", "failed", "aborted" or "rejected"), bytes and ms once
+    each request is done.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        *,
+        timeout: float = 2.0,
+        retries: int = 5,
+        max_transfers: int = 512,
+        on_transfer: Callable[..., None] | None = None,
+        io: FileIO | None = None,
+    ):
+        self.root = root
+        self.timeout = timeout
+        self.retries = retries
+        self.max_transfers = max_transfers
+        self.on_transfer = on_transfer
+        self.io = io or FileIO()
+        self.files: dict[str, bytes] = {}
+        self.stats = TftpStats()
+        self._transport: asyncio.DatagramTransport | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._host = "0.0.0.0"
+
+    @property
+    def running(self) -> bool:
+        return self._transport is not None
+
+    def load(self) -> None:
+        """Read every file in the root directory into memory."""
+        files = {}
+        if self.root.is_dir():
+            for path in self.root.iterdir():
+                if path.is_file():
+                    files[path.name] = path.read_bytes()
+        self.files = files
+        logger.info("TFTP holding %d files from %s in memory", len(files), self.root)
+
+    async def start(self, host: str = "0.0.0.0", port: int = 69) -> int:
+        """Bind the listening socket. Returns the bound port."""
+        await self.io.run(self.load, timeout=None)
+        self._host = host
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _ListenerProtocol(self), local_addr=(host, port)
+        )
+        bound = self._transport.get_extra_info("sockname")[1]
+        logger.info("TFTP server listening on %s:%d", host, bound)
+        return bound
+
+    async def stop(self) -> None:
+        """Close the listener and cancel in-flight transfers."""
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        for task in list(self._tasks):
+            task.cancel()
+        for task in list(self._tasks):
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    def handle_request(self, packet: bytes, addr) -> None:
+        if len(self._tasks) >= self.max_transfers:
+            self.stats.rejected += 1
+            self.report(addr[0], "", "rejected", 0, 0.0)
+            logger.warning("TFTP busy, rejecting request from %s", addr[0])
+            self._transport.sendto(error_packet(ERR_UNDEFINED, "Server busy"), addr)
+            return
+        task = asyncio.create_task(self._serve(packet, addr))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def report(self, client: str, file: str, outcome: str, sent: int, ms: float) -> None:
+        if self.on_transfer is not None:
+            self.on_transfer(client=client, file=file, outcome=outcome, bytes=sent, ms=round(ms, 3))
+
+    async def _serve(self, packet: bytes, addr) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            transport, protocol = await loop.create_datagram_endpoint(
+                _TransferProtocol, local_addr=(self._host, 0), remote_addr=addr
+            )
+        except OSError as exc:
+            self.stats.failed += 1
+            self.report(addr[0], "", "failed", 0, 0.0)
+            logger.error("TFTP cannot open a transfer socket for %s: %s", addr[0], exc)
+            if self._transport is not None:
+                self._transport.sendto(error_packet(ERR_UNDEFINED, "Server error"), addr)
+            return
+        transfer = _Transfer(self, transport, protocol.queue)
+        self.stats.active += 1
+        try:
+            await transfer.run(packet, addr)
+        finally:
+            self.stats.active -= 1
+            transport.close()
+
+
+class _Transfer:
+    """One read request: option negotiation followed by windowed DATA blocks."""
+
+    def __init__(self, server: TftpServer, transport, queue: asyncio.Queue):
+        self.server = server
+        self.transport = transport
+        self.queue = queue
+        self.timeout = server.timeout
+        self.blksize = DEFAULT_BLKSIZE
+        self.windowsize = 1
+        self.name = ""
+        self.sent = 0
+
+    async def run(self, packet: bytes, addr) -> None:
+        started = time.perf_counter()
+        # Cancelled at shutdown counts as aborted
+        outcome = "aborted"
+        try:
+            outcome = await self._run(packet, addr)
+        except asyncio.CancelledError:
+            self.server.stats.aborted += 1
+            raise
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.server.report(addr[0], self.name, outcome, self.sent, elapsed)
+
+    async def _run(self, packet: bytes, addr) -> str:
+        """Serve one request and return its outcome."""
+        stats = self.server.stats
+        try:
+            opcode, filename, mode, options = parse_request(packet)
+            if opcode == OP_WRQ:
+                raise TftpError(ERR_ACCESS, "Server is read-only")
+            if opcode != OP_RRQ:
+                raise TftpError(ERR_ILLEGAL_OP, "Expected a read request")
+        except TftpError as exc:
+            stats.rejected += 1
+            self.transport.sendto(error_packet(exc.code, exc.message))
+            return "rejected"
+
+        name = self.name = filename.lstrip("/")
+        data = self.server.files.get(name)
+        if data is None:
+            stats.rejected += 1
+            logger.warning("TFTP %s requested unknown file %s", addr[0], filename)
+            self.transport.sendto(error_packet(ERR_NOT_FOUND, "File not found"))
+            return "rejected"
+        if mode == "netascii":
+            data = to_netascii(data)
+
+        stats.started += 1
+        logger.info("TFTP %s -> %s (%d bytes)", addr[0], name, len(data))
+        try:
+            accepted = self._negotiate(options, len(data))
+            if accepted and not await self._send_oack(accepted):
+                stats.aborted += 1
+                return "aborted"
+            await self._send_data(memoryview(data))
+        except TftpError as exc:
+            stats.failed += 1
+            logger.warning("TFTP transfer of %s to %s failed: %s", name, addr[0], exc.message)
+            self.transport.sendto(error_packet(exc.code, exc.message))
+            return "failed"
+        except _ClientAborted as exc:
+            stats.aborted += 1
+            logger.debug("TFTP client %s aborted %s: %s", addr[0], name, exc)
+            return "aborted"
+        stats.completed += 1
+        return "completed"
+
+    def _negotiate(self, options: dict[str, str], size: int) -> dict[str, str]:
+        """Apply supported options and return the ones to acknowledge."""
+        accepted = {}
+        with contextlib.suppress(ValueError):
+            if "blksize" in options:
+                self.blksize = max(MIN_BLKSIZE, min(int(options["blksize"]), MAX_BLKSIZE))
+                accepted["blksize"] = str(self.blksize)
+        with contextlib.suppress(ValueError):
+            if "windowsize" in options:
+                self.windowsize = max(1, min(int(options["windowsize"]), MAX_WINDOWSIZE))
+                accepted["windowsize"] = str(self.windowsize)
+        with contextlib.suppress(ValueError):
+            if "timeout" in options and 1 <= int(options["timeout"]) <= 255:
+                self.timeout = float(options["timeout"])
+                accepted["timeout"] = options["timeout"]
+        if "tsize" in options:
+            accepted["tsize"] = str(size)
+        return accepted
+
+    async def _send_oack(self, accepted: dict[str, str]) -> bool:
+        """Send OACK until the client ACKs block 0. False if it declined."""
+        packet = oack_packet(accepted)
+        for attempt in range(self.server.retries + 1):
+            if attempt:
+                self.server.stats.retransmits += 1
+            self.transport.sendto(packet)
+            try:
+                block = await self._wait_ack()
+            except TimeoutError:
+                self.server.stats.timeouts += 1
+                continue
+            except _ClientAborted:
+                # PXE ROMs commonly probe tsize and then abort with error 8.
+                return False
+            if block == 0:
+                return True
+        raise TftpError(ERR_UNDEFINED, "Timed out waiting for OACK acknowledgement")
+
+    async def _send_data(self, data: memoryview) -> None:
+        blksize, windowsize = self.blksize, self.windowsize
+        # The final block is always shorter than blksize, possibly empty.
+        last = len(data) // blksize + 1
+        base = 1
+        attempts = 0
+        while base <= last:
+            end = min(base + windowsize, last + 1)
+            for block in range(base, end):
+                chunk = data[(block - 1) * blksize : block * blksize]
+                self.transport.sendto(struct.pack("!HH", OP_DATA, block & 0xFFFF) + chunk)
+                self.server.stats.bytes_sent += len(chunk)
+                self.sent += len(chunk)
+            acked = await self._next_window_ack(base)
+            if acked is not None and acked >= base:
+                base = acked + 1
+                attempts = 0
+                continue
+            # Timeout or a stale ACK: resend the window from the first unacked block.
+            attempts += 1
+            if attempts > self.server.retries:
+                raise TftpError(ERR_UNDEFINED, f"Timed out at block {base}")
+            self.server.stats.retransmits += 1
+
+    async def _next_window_ack(self, base: int) -> int | None:
+        """Absolute block acked for the window at base, or None to resend it."""
+        while True:
+            try:
+                acked = self._absolute_block(await self._wait_ack(), base)
+            except TimeoutError:
+                self.server.stats.timeouts += 1
+                return None
+            if acked is not None and acked >= base:
+                return acked
+            if self.windowsize > 1:
+                # RFC 7440: the receiver re-ACKs the last good block on a gap.
+                return None
+            # Lock-step duplicate ACK: ignore it (Sorcerer's Apprentice).
+
+    def _absolute_block(self, wrapped: int, base: int) -> int | None:
+        """Map a 16-bit ACK onto the window that starts at base."""
+        for block in range(base - 1, base + self.windowsize):
+            if block & 0xFFFF == wrapped:
+                return block
+        return None
+
+    async def _wait_ack(self) -> int:
+        """Wait for the next ACK and return its (16-bit) block number."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError
+            packet = await asyncio.wait_for(self.queue.get(), remaining)
+            if len(packet) < 4:
+                continue
+            opcode, value = struct.unpack("!HH", packet[:4])
+            if opcode == OP_ACK:
+                return value
+            if opcode == OP_ERROR:
+                raise _ClientAborted(packet[4:].rstrip(b"\0").decode("ascii", "replace"))
+
+
+class _ClientAborted(Exception):
+    """The client sent an ERROR packet."""
@@ -0,0 +1,249 @@
+"""Answer file validation against the Proxmox auto-installer schema.
+
+The checks are structural: TOML syntax, known sections, required keys,
+value types and the enumerations the installer accepts. Both the current
+kebab-case keys and the older snake_case spelling are accepted. Large
+batches are spread over a process pool, since parsing is CPU bound.
+
+Run as a script to check an answers directory before deploying it:
+
+    python validation.py /answers
+"""
+
+import argparse
+import ipaddress
+import logging
+import multiprocessing
+import os
+import sys
+import tomllib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+SECTIONS = ("global", "network", "disk-setup", "post-installation-webhook", "first-boot")
+FILESYSTEMS = ("ext4", "xfs", "zfs", "btrfs")
+RAID_LEVELS = {
+    "zfs": ("raid0", "raid1", "raid10", "raidz-1", "raidz-2", "raidz-3"),
+    "btrfs": ("raid0", "raid1", "raid10"),
+}
+NETWORK_SOURCES = ("from-dhcp", "from-answer")
+FIRST_BOOT_SOURCES = ("from-iso", "from-url")
+FIRST_BOOT_ORDERING = ("before-network", "network-online", "fully-up")
+
+# Below this many answers, starting worker processes costs more than it saves
+MIN_PARALLEL = 256
+
+
+def validate_answer(content: bytes) -> list[str]:
+    """Every schema error in one answer file; an empty list means it is valid."""
+    try:
+        doc = tomllib.loads(content.decode())
+    except (UnicodeDecodeError, tomllib.TOMLDecodeError) as exc:
+        return [f"invalid TOML: {exc}"]
+
+    errors = []
+    sections = {}
+    for key, value in doc.items():
+        name = _kebab(key)
+        if name not in SECTIONS:
+            errors.append(f"unknown key {key!r}")
+        elif not isinstance(value, dict):
+            errors.append(f"{key} must be a table")
+        else:
+            # Only a section's own keys are renamed; filter tables hold udev names
+            sections[name] = {_kebab(k): v for k, v in value.items()}
+
+    for name, check in (
+        ("global", _check_global),
+        ("network", _check_network),
+        ("disk-setup", _check_disk_setup),
+    ):
+        if name in sections:
+            check(sections[name], errors)
+        else:
+            errors.append(f"missing [{name}]")
+    if "post-installation-webhook" in sections:
+        _check_webhook(sections["post-installation-webhook"], errors)
+    if "first-boot" in sections:
+        _check_first_boot(sections["first-boot"], errors)
+    return errors
+
+
+def _kebab(key: str) -> str:
+    return key.replace("_", "-")
+
+
+def _check_global(section: dict, errors: list[str]) -> None:
+    for key in ("keyboard", "country", "mailto", "timezone"):
+        _require(section, "global", key, str, errors)
+    if "fqdn" not in section:
+        errors.append("global.fqdn is required")
+    elif not isinstance(section["fqdn"], str | dict):
+        errors.append("global.fqdn must be a string or a table")
+    country = section.get("country")
+    if isinstance(country, str) and not (len(country) == 2 and country.isalpha()):
+        errors.append(f"global.country must be a two-letter code, not {country!r}")
+
+    passwords = [key for key in ("root-password", "root-password-hashed") if key in section]
+    if not passwords:
+        errors.append("global needs root-password or root-password-hashed")
+    elif len(passwords) > 1:
+        errors.append("global.root-password and root-password-hashed are exclusive")
+    for key in passwords:
+        _optional(section, "global", key, str, errors)
+    _optional(section, "global", "reboot-on-error", bool, errors)
+    keys = section.get("root-ssh-keys")
+    if keys is not None and not _is_str_list(keys):
+        errors.append("global.root-ssh-keys must be a list of strings")
+
+
+def _check_network(section: dict, errors: list[str]) -> None:
+    source = _require(section, "network", "source", str, errors)
+    if source is None:
+        return
+    if source not in NETWORK_SOURCES:
+        errors.append(f"network.source must be one of {', '.join(NETWORK_SOURCES)}")
+    elif source == "from-answer":
+        cidr = _require(section, "network", "cidr", str, errors)
+        if cidr is not None:
+            _check_ip(cidr, "network.cidr", ipaddress.ip_interface, errors)
+        for key in ("dns", "gateway"):
+            address = _require(section, "network", key, str, errors)
+            if address is not None:
+                _check_ip(address, f"network.{key}", ipaddress.ip_address, errors)
+        _require(section, "network", "filter", dict, errors)
+
+
+def _check_disk_setup(section: dict, errors: list[str]) -> None:
+    filesystem = _require(section, "disk-setup", "filesystem", str, errors)
+    if filesystem is not None and filesystem not in FILESYSTEMS:
+        errors.append(f"disk-setup.filesystem must be one of {', '.join(FILESYSTEMS)}")
+
+    has_list, has_filter = "disk-list" in section, "filter" in section
+    if has_list == has_filter:
+        errors.append("disk-setup needs exactly one of disk-list and filter")
+    elif has_list and not (_is_str_list(section["disk-list"]) and section["disk-list"]):
+        errors.append("disk-setup.disk-list must be a non-empty list of strings")
+    elif has_filter and not isinstance(section["filter"], dict):
+        errors.append("disk-setup.filter must be a table")
+    match = _optional(section, "disk-setup", "filter-match", str, errors)
+    if match is not None and match not in ("any", "all"):
+        errors.append("disk-setup.filter-match must be any or all")
+
+    if filesystem in RAID_LEVELS:
+        options = section.get(filesystem)
+        raid = options.get("raid") if isinstance(options, dict) else None
+        if raid is None:
+            errors.append(f"disk-setup.{filesystem}.raid is required")
+        elif raid not in RAID_LEVELS[filesystem]:
+            levels = ", ".join(RAID_LEVELS[filesystem])
+            errors.append(f"disk-setup.{filesystem}.raid must be one of {levels}")
+
+
+def _check_webhook(section: dict, errors: list[str]) -> None:
+    url = _require(section, "post-installation-webhook", "url", str, errors)
+    if url is not None and not url.startswith(("http://", "https://")):
+        errors.append("post-installation-webhook.url must be an http(s) URL")
+    _optional(section, "post-installation-webhook", "cert-fingerprint", str, errors)
+
+
+def _check_first_boot(section: dict, errors: list[str]) -> None:
+    source = _require(section, "first-boot", "source", str, errors)
+    if source is not None and source not in FIRST_BOOT_SOURCES:
+        errors.append(f"first-boot.source must be one of {', '.join(FIRST_BOOT_SOURCES)}")
+    if source == "from-url":
+        _require(section, "first-boot", "url", str, errors)
+    ordering = _optional(section, "first-boot", "ordering", str, errors)
+    if ordering is not None and ordering not in FIRST_BOOT_ORDERING:
+        errors.append(f"first-boot.ordering must be one of {', '.join(FIRST_BOOT_ORDERING)}")
+
+
+def _require(section: dict, name: str, key: str, kind: type, errors: list[str]):
+    if key not in section:
+        errors.append(f"{name}.{key} is required")
+        return None
+    return _optional(section, name, key, kind, errors)
+
+
+def _optional(section: dict, name: str, key: str, kind: type, errors: list[str]):
+    value = section.get(key)
+    if value is not None and not isinstance(value, kind):
+        errors.append(f"{name}.{key} must be a {_TYPE_NAMES[kind]}")
+        return None
+    return value
+
+
+_TYPE_NAMES = {str: "string", bool: "boolean", dict: "table"}
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def _check_ip(value: str, name: str, parse, errors: list[str]) -> None:
+    try:
+        parse(value)
+    except ValueError:
+        errors.append(f"{name} is not a valid address: {value!r}")
+
+
+def validate_many(items: dict[str, bytes], processes: int = 0) -> dict[str, list[str]]:
+    """Validate a batch of answers, in a process pool when it is large enough.
+
+    processes=0 uses one per CPU. Returns the errors of each invalid item,
+    keyed like items; valid items are left out.
+    """
+    names = list(items)
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(names) < MIN_PARALLEL:
+        results = map(validate_answer, items.values())
+    else:
+        # Spawn, not fork: the server has threads running by the time it loads
+        context = multiprocessing.get_context("spawn")
+        chunksize = max(1, len(names) // (processes * 4))
+        with ProcessPoolExecutor(processes, mp_context=context) as pool:
+            results = list(pool.map(validate_answer, items.values(), chunksize=chunksize))
+    return {name: errors for name, errors in zip(names, results, strict=True) if errors}
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Check every answer file, including templated answers, "
+        "against the Proxmox auto-installer schema."
+    )
+    parser.add_argument(
+        "answers_dir",
+        type=Path,
+        nargs="?",
+        default=Path(os.getenv("PXE_PILOT_ANSWERS_DIR", "/answers")),
+        help="answers directory (default: $PXE_PILOT_ANSWERS_DIR or /answers)",
+    )
+    parser.add_argument(
+        "--processes", type=int, default=0, help="worker processes (default: one per CPU)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Print every invalid answer; exit status 1 if there are any."""
+    from answers import AnswerStore
+
+    args = parse_args(argv)
+    # The report below replaces the store's per-file warnings
+    logging.getLogger("pxe-pilot").setLevel(logging.ERROR)
+    if not args.answers_dir.is_dir():
+        print(f"{args.answers_dir} is not a directory", file=sys.stderr)
+        return 2
+    store = AnswerStore(args.answers_dir, processes=args.processes)
+    store.load()
+    store.render_all()
+    invalid = store.invalid_answers()
+    for name, errors in sorted(invalid.items()):
+        for error in errors:
+            print(f"{name}: {error}")
+    print(f"{store.answer_count} answers checked, {len(invalid)} invalid")
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
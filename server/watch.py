@@ -0,0 +1,115 @@
+"""Filesystem change notifications for pxe-pilot's in-memory indexes."""
+
+import asyncio
+import contextlib
+import logging
+import os
+from collections.abc import Callable
+from pathlib import Path
+
+from fileio import FileIO
+
+try:
+    from watchfiles import awatch
+except ImportError:  # watchfiles ships with uvicorn[standard]; polling covers its absence
+    awatch = None
+
+logger = logging.getLogger("pxe-pilot")
+
+
+def snapshot(root: Path) -> dict[str, tuple[int, int]]:
+    """Map every file below root to its (mtime_ns, size)."""
+    entries = {}
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries[path] = (st.st_mtime_ns, st.st_size)
+    return entries
+
+
+def diff_snapshots(old: dict[str, tuple[int, int]], new: dict[str, tuple[int, int]]) -> set[Path]:
+    """Return paths added, removed or modified between two snapshots."""
+    changed = old.keys() ^ new.keys()
+    changed |= {path for path in old.keys() & new.keys() if old[path] != new[path]}
+    return {Path(path) for path in changed}
+
+
+class TreeWatcher:
+    """Watch a directory tree and hand batches of changed paths to a callback.
+
+    Uses inotify (via watchfiles) when available and falls back to polling
+    snapshots, which is also the only reliable option on NFS mounts. The
+    callback and the snapshots run in the file I/O pool without a timeout,
+    so the callback is free to do blocking I/O for as long as it needs.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        callback: Callable[[set[Path]], None],
+        *,
+        polling: bool = False,
+        interval: float = 2.0,
+        io: FileIO | None = None,
+    ):
+        self.root = root
+        self.io = io or FileIO()
+        self.callback = callback
+        self.polling = polling or awatch is None
+        self.interval = interval
+        self._stop: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> asyncio.Task:
+        """Start watching in the running event loop."""
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name=f"watch:{self.root}")
+        return self._task
+
+    async def stop(self) -> None:
+        """Stop watching and wait for the watcher task to finish."""
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        if not self.polling and await self.io.run(self.root.is_dir, timeout=None):
+            try:
+                await self._run_notify()
+                return
+            except OSError as exc:
+                logger.warning("inotify unavailable for %s (%s), polling instead", self.root, exc)
+        await self._run_poll()
+
+    async def _run_notify(self) -> None:
+        logger.debug("Watching %s with inotify", self.root)
+        async for changes in awatch(self.root, stop_event=self._stop, debounce=200):
+            await self._dispatch({Path(path) for _change, path in changes})
+
+    async def _run_poll(self) -> None:
+        logger.debug("Polling %s every %.1fs", self.root, self.interval)
+        previous = await self.io.run(snapshot, self.root, timeout=None)
+        while True:
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._stop.wait(), timeout=self.interval)
+            if self._stop.is_set():
+                return
+            current = await self.io.run(snapshot, self.root, timeout=None)
+            changed = diff_snapshots(previous, current)
+            previous = current
+            if changed:
+                await self._dispatch(changed)
+
+    async def _dispatch(self, changed: set[Path]) -> None:
+        try:
+            await self.io.run(self.callback, changed, timeout=None)
+        except Exception:
+            logger.exception("Failed to apply changes under %s", self.root)
@@ -0,0 +1,414 @@
+"""Multi-process serving: one supervisor, several uvicorn workers on one socket.
+
+The supervisor binds the listening socket once, with the configured
+backlog, and starts worker processes that all accept on it, so the kernel
+spreads connections across cores. Work that must happen once per host runs
+only in the supervisor:
+
+- The directory watchers. Each batch of changed paths is forwarded to every
+  worker, which applies it to its own in-memory indexes exactly as the
+  single-process watcher would. Batches are stamped with a generation from
+  one supervisor-wide counter, and a worker starts at the stamp current
+  when it was spawned, so answer store generations agree across workers.
+- The TFTP responder. Its counters are copied into shared memory once a
+  second, so any worker's /health and /metrics report them.
+- The boot session tracker and the event log (the Hub). Workers report
+  their session updates and events to the supervisor as they happen, ask
+  it when /sessions or /events is requested, and read the session and
+  event counts from shared memory like the TFTP stats.
+
+The /assets bandwidth limit is shared too: every worker reserves transmit
+time on one timeline in shared memory. Admission slots are split between
+the workers, since each one leases its own.
+
+Workers that exit unexpectedly are restarted.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+import threading
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, fields
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any
+
+from tftp import TftpServer, TftpStats
+
+logger = logging.getLogger("pxe-pilot")
+
+STAT_FIELDS = tuple(f.name for f in fields(TftpStats))
+PUBLISH_INTERVAL = 1.0
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """Listening TCP socket shared by every worker."""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class SharedTftp:
+    """Read-only stand-in for TftpServer in a worker, backed by shared memory.
+
+    Slot 0 holds the running flag, the rest the TftpStats counters in
+    field order.
+    """
+
+    def __init__(self, state):
+        self._state = state
+        self.stats = _SharedStats(state)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._state[0])
+
+    @staticmethod
+    def publish(tftp: TftpServer, state) -> None:
+        state[0] = int(tftp.running)
+        for i, name in enumerate(STAT_FIELDS, start=1):
+            state[i] = getattr(tftp.stats, name)
+
+
+class _SharedStats:
+    def __init__(self, state):
+        self._state = state
+
+    def __getattr__(self, name: str) -> int:
+        try:
+            return self._state[STAT_FIELDS.index(name) + 1]
+        except ValueError:
+            raise AttributeError(name) from None
+
+    def as_dict(self) -> dict:
+        return dict(zip(STAT_FIELDS, self._state[1:], strict=True))
+
+
+class SharedCounters:
+    """Named counts the supervisor copies into shared memory for its workers."""
+
+    def __init__(self, names: tuple[str, ...], state):
+        self.names = names
+        self._state = state
+
+    def __getitem__(self, name: str) -> int:
+        return self._state[self.names.index(name)]
+
+    def as_dict(self) -> dict[str, int]:
+        return dict(zip(self.names, self._state, strict=True))
+
+    def publish(self, values: dict[str, int]) -> None:
+        for i, name in enumerate(self.names):
+            self._state[i] = values.get(name, 0)
+
+
+@dataclass
+class Hub:
+    """State the supervisor keeps once on behalf of every worker.
+
+    A worker's report(kind, *args) is applied as reports[kind](*args) and
+    its ask(name, **kwargs) answered with queries[name](**kwargs), both on
+    the supervisor's event loop in the order the worker sent them.
+    counters() is published as counter_names once a second.
+    """
+
+    reports: dict[str, Callable[..., None]]
+    queries: dict[str, Callable[..., Any]]
+    counters: Callable[[], dict[str, int]]
+    counter_names: tuple[str, ...]
+
+
+class SupervisorLink:
+    """A worker's end of the pipe its supervisor forwards changes over."""
+
+    def __init__(
+        self,
+        conn: Connection,
+        tftp_state,
+        bandwidth=None,
+        workers: int = 1,
+        generation: int | None = None,
+        reports: Connection | None = None,
+        counters: SharedCounters | None = None,
+    ):
+        self.conn = conn
+        self.tftp = SharedTftp(tftp_state)
+        # Shared BandwidthLimiter timeline, and how many workers split the limits
+        self.bandwidth = bandwidth
+        self.workers = workers
+        # The supervisor's last stamp when this worker was spawned
+        self.generation = generation
+        # Duplex pipe to the supervisor's Hub, and the counts it publishes
+        self.reports = reports
+        self.counters = counters
+        self._outbox: deque[tuple[str, tuple]] = deque()
+        self._wake = threading.Event()
+        self._send_lock = threading.Lock()
+        self._ask_lock = threading.Lock()
+
+    def follow(self, handlers: dict[str, Callable[[set[Path], int], None]]) -> threading.Thread:
+        """Apply forwarded change batches in a background thread until the pipe closes."""
+        thread = threading.Thread(target=self._follow, args=(handlers,), daemon=True)
+        thread.start()
+        return thread
+
+    def _follow(self, handlers: dict[str, Callable[[set[Path], int], None]]) -> None:
+        while True:
+            try:
+                kind, paths, generation = self.conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                handlers[kind]({Path(p) for p in paths}, generation)
+            except Exception:
+                logger.exception("Failed to apply forwarded %s changes", kind)
+
+    def report(self, kind: str, *args) -> None:
+        """Queue a report for the supervisor's Hub; never blocks the event loop."""
+        self._outbox.append((kind, args))
+        self._wake.set()
+
+    def start_reports(self) -> threading.Thread:
+        """Send queued reports from a background thread, batching those that pile up."""
+        thread = threading.Thread(target=self._report_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def ask(self, name: str, **kwargs) -> Any:
+        """The Hub's answer to queries[name](**kwargs). Blocking; run it in a thread.
+
+        Reports queued so far are sent first, so the answer includes them.
+        """
+        with self._ask_lock:
+            self._flush()
+            with self._send_lock:
+                self.reports.send(("ask", name, kwargs))
+            return self.reports.recv()
+
+    def _report_loop(self) -> None:
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self._flush()
+            except OSError:
+                return
+
+    def _flush(self) -> None:
+        # deque appends and pops are atomic, so the event loop keeps appending meanwhile
+        batch = [self._outbox.popleft() for _ in range(len(self._outbox))]
+        if batch:
+            with self._send_lock:
+                self.reports.send(("report", batch))
+
+
+def run_worker(
+    sock: socket.socket,
+    options: dict,
+    conn: Connection,
+    tftp_state,
+    bandwidth,
+    workers: int,
+    generation: int,
+    reports: Connection,
+    counter_names: tuple[str, ...],
+    counter_state,
+) -> None:
+    """Worker process entry point: serve the app on the inherited socket."""
+    import uvicorn
+
+    import server
+
+    counters = SharedCounters(counter_names, counter_state)
+    server.attach_supervisor(
+        SupervisorLink(conn, tftp_state, bandwidth, workers, generation, reports, counters)
+    )
+    config = uvicorn.Config(server.app, **options)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Starts and restarts workers and runs the once-per-host services."""
+
+    def __init__(
+        self,
+        workers: int,
+        options: dict,
+        services: Callable,
+        tftp: TftpServer,
+        hub: Hub,
+    ):
+        self.workers = workers
+        self.options = options
+        self.services = services
+        self.tftp = tftp
+        self.hub = hub
+        self._ctx = multiprocessing.get_context("spawn")
+        self._tftp_state = self._ctx.RawArray("q", len(STAT_FIELDS) + 1)
+        self._counters = SharedCounters(
+            hub.counter_names, self._ctx.RawArray("q", len(hub.counter_names))
+        )
+        self._bandwidth = self._ctx.Value("d", 0.0)
+        self._procs: list[multiprocessing.Process | None] = [None] * workers
+        self._conns: list[Connection | None] = [None] * workers
+        self._reports: list[Connection | None] = [None] * workers
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._send_lock = threading.Lock()
+        # Stamp of the last forwarded batch, under a random tag for this run
+        self._generation = secrets.randbits(20) << 32
+        self._sock: socket.socket | None = None
+
+    def run(self) -> None:
+        self._sock = bind_socket(
+            self.options["host"], self.options["port"], self.options["backlog"]
+        )
+        logger.info(
+            "Supervisor %d serving on %s:%d with %d workers",
+            os.getpid(),
+            self.options["host"],
+            self.options["port"],
+            self.workers,
+        )
+        try:
+            asyncio.run(self._supervise())
+        finally:
+            self._sock.close()
+
+    async def _supervise(self) -> None:
+        stop = asyncio.Event()
+        loop = self._loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        async with self.services(self.forward("answers"), self.forward("assets")):
+            for index in range(self.workers):
+                self._spawn(index)
+            try:
+                while not stop.is_set():
+                    SharedTftp.publish(self.tftp, self._tftp_state)
+                    self._counters.publish(self.hub.counters())
+                    self._restart_dead()
+                    with contextlib.suppress(TimeoutError):
+                        await asyncio.wait_for(stop.wait(), timeout=PUBLISH_INTERVAL)
+            finally:
+                await asyncio.to_thread(self._stop_workers)
+
+    def forward(self, kind: str) -> Callable[[set[Path]], None]:
+        """Watcher callback sending a change batch to every worker."""
+
+        def send(paths: set[Path]) -> None:
+            with self._send_lock:
+                self._generation += 1
+                message = (kind, [str(p) for p in paths], self._generation)
+                for conn in self._conns:
+                    if conn is None:
+                        continue
+                    # A dead worker's pipe is replaced when it restarts
+                    with contextlib.suppress(OSError):
+                        conn.send(message)
+
+        return send
+
+    def _spawn(self, index: int) -> None:
+        reader, writer = self._ctx.Pipe(duplex=False)
+        reports, worker_reports = self._ctx.Pipe()
+        with self._send_lock:
+            # Every batch stamped after this reaches the new pipe
+            generation = self._generation
+            self._conns[index] = writer
+        proc = self._ctx.Process(
+            target=run_worker,
+            args=(
+                self._sock,
+                self.options,
+                reader,
+                self._tftp_state,
+                self._bandwidth,
+                self.workers,
+                generation,
+                worker_reports,
+                self.hub.counter_names,
+                self._counters._state,
+            ),
+            name=f"pxe-pilot-worker-{index}",
+        )
+        proc.start()
+        reader.close()
+        worker_reports.close()
+        self._procs[index], self._reports[index] = proc, reports
+        threading.Thread(target=self._serve_reports, args=(reports,), daemon=True).start()
+        logger.info("Started worker %d (pid %d)", index, proc.pid)
+
+    def _restart_dead(self) -> None:
+        for index, proc in enumerate(self._procs):
+            if proc is not None and not proc.is_alive():
+                logger.warning("Worker %d (pid %d) exited with %s", index, proc.pid, proc.exitcode)
+                with self._send_lock:
+                    self._conns[index].close()
+                    self._conns[index] = None
+                # Its report thread sees the pipe close and exits
+                self._reports[index].close()
+                self._spawn(index)
+
+    def _stop_workers(self) -> None:
+        for proc in self._procs:
+            if proc is not None and proc.is_alive():
+                proc.terminate()
+        for index, proc in enumerate(self._procs):
+            if proc is not None:
+                proc.join(timeout=10)
+                if proc.is_alive():
+                    proc.kill()
+            if self._conns[index] is not None:
+                self._conns[index].close()
+            if self._reports[index] is not None:
+                self._reports[index].close()
+
+    def _serve_reports(self, conn: Connection) -> None:
+        """Apply one worker's reports and answer its questions until its pipe closes."""
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == "report":
+                self._loop.call_soon_threadsafe(self._apply_reports, message[1])
+                continue
+            _, name, kwargs = message
+            answer: concurrent.futures.Future = concurrent.futures.Future()
+
+            def run(name=name, kwargs=kwargs, answer=answer) -> None:
+                try:
+                    answer.set_result(self.hub.queries[name](**kwargs))
+                except Exception as exc:
+                    answer.set_exception(exc)
+
+            # Queued behind the reports that came before it, so the answer includes them
+            self._loop.call_soon_threadsafe(run)
+            try:
+                result = answer.result()
+            except Exception:
+                logger.exception("Failed to answer a worker's %s query", name)
+                result = None
+            try:
+                conn.send(result)
+            except OSError:
+                return
+
+    def _apply_reports(self, batch: list[tuple[str, tuple]]) -> None:
+        for kind, args in batch:
+            try:
+                self.hub.reports[kind](*args)
+            except Exception:
+                logger.exception("Failed to apply a worker's %s report", kind)